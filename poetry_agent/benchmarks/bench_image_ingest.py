@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+图片处理I/O基准测试
+
+按推荐流程中处理一张上传图片的顺序（验证、保存、查找图片描述、缓存键、图片识别和推荐请求的编码、保存图片描述），
+对比两种方式每个请求的文件I/O：
+    path      按路径处理：各步骤分别打开和读取文件（验证在执行入口和保存时各做一次）
+    handle    ImageProcessor.ingest：读取一次得到ImageHandle，之后的步骤都使用内存中的数据
+场景:
+    new       每次上传不同的图片
+    repeat    重复上传同一张图片（图片已在存储中，编码结果已缓存）
+
+读系统调用次数和字节数取自 /proc/self/io（syscr、rchar、wchar，仅Linux），
+打开文件和其他文件操作（mkdir、utime、rename、link、remove）的次数通过审计钩子统计。
+不访问数据库和AI接口，只需要Pillow。
+
+用法:
+    python benchmarks/bench_image_ingest.py [--runs 20] [--width 1600 --height 1200] [--json result.json]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Callable
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+MODES = ('path', 'handle')
+SCENARIOS = ('new', 'repeat')
+
+# 统计的审计事件
+FILE_EVENTS = ('os.mkdir', 'os.utime', 'os.rename', 'os.link', 'os.remove')
+
+# 统计的/proc/self/io字段
+IO_FIELDS = ('syscr', 'rchar', 'syscw', 'wchar')
+
+
+class IOCounter:
+    """统计一段代码的文件操作和读写"""
+    
+    def __init__(self):
+        self.events = {'open': 0, 'other': 0}
+        self.active = False
+        sys.addaudithook(self._hook)
+        # 读取/proc/self/io本身的读写，从每次的结果中扣除
+        self.overhead = dict.fromkeys(IO_FIELDS, 0)
+        self.overhead = self.measure(lambda: None)
+    
+    def _hook(self, event: str, args):
+        if not self.active:
+            return
+        if event == 'open':
+            self.events['open'] += 1
+        elif event in FILE_EVENTS:
+            self.events['other'] += 1
+    
+    @staticmethod
+    def _read_proc() -> Dict[str, int]:
+        with open('/proc/self/io', 'r') as f:
+            values = dict(line.split(': ') for line in f.read().splitlines())
+        return {field: int(values[field]) for field in IO_FIELDS}
+    
+    def measure(self, func: Callable[[], Any]) -> Dict[str, float]:
+        self.events = {'open': 0, 'other': 0}
+        before = self._read_proc()
+        self.active = True
+        start = time.perf_counter()
+        try:
+            func()
+        finally:
+            elapsed = time.perf_counter() - start
+            self.active = False
+        after = self._read_proc()
+        counts = {field: after[field] - before[field] - self.overhead[field] for field in IO_FIELDS}
+        counts.update({'opens': self.events['open'], 'file_ops': self.events['other'], 'ms': elapsed * 1000})
+        return counts
+
+
+def make_image(path: Path, rng: random.Random, size):
+    """生成一张带噪点的JPEG图片（每张内容不同）"""
+    from PIL import Image, ImageDraw
+    
+    image = Image.merge('RGB', [Image.effect_noise(size, rng.randrange(20, 60)) for _ in range(3)])
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + 300, y + 300), fill=tuple(rng.randrange(256) for _ in range(3)))
+    image.save(path, 'JPEG', quality=90)
+
+
+def path_request(image_path: str, store):
+    """按路径处理一张图片（各步骤分别读取文件）"""
+    from PIL import Image
+    from utils.image_processor import ImageProcessor, hash_file
+    
+    def _validate():
+        # 本次改动之前的验证方式：exists、getsize、Pillow verify
+        if not os.path.exists(image_path) or os.path.getsize(image_path) > processor.max_size:
+            raise ValueError(image_path)
+        with Image.open(image_path) as img:
+            img.verify()
+    
+    processor = ImageProcessor()
+    processor.upload_dir.mkdir(parents=True, exist_ok=True)
+    _validate()                                        # PoetryAgent.run
+    _validate()                                        # save_image
+    store.put(image_path)
+    hash_file(image_path)                              # 查找图片描述
+    processor.compute_perceptual_hash(image_path)
+    hash_file(image_path)                              # 推荐结果缓存键
+    for _ in range(2):                                 # 图片识别请求、推荐请求（各自创建ImageProcessor）
+        ImageProcessor().upload_dir.mkdir(parents=True, exist_ok=True)
+        processor.encode_image_to_data_url(image_path)
+    hash_file(image_path)                              # 保存图片描述
+    processor.compute_perceptual_hash(image_path)
+
+
+def handle_request(image_path: str, store):
+    """读取一次得到ImageHandle，之后都使用内存中的数据（save_image使用ImageProcessor自己的存储）"""
+    from utils.image_processor import get_image_processor, hash_file
+    
+    processor = get_image_processor()
+    image = processor.ingest(image_path)
+    processor.save_image(image)
+    hash_file(image)
+    processor.compute_perceptual_hash(image)
+    hash_file(image)
+    for _ in range(2):
+        get_image_processor().encode_image_to_data_url(image)
+    hash_file(image)
+    processor.compute_perceptual_hash(image)
+
+
+def run_mode(mode: str, scenario: str, images: List[Path], counter: IOCounter, workdir: Path) -> Dict[str, Any]:
+    from utils import image_processor
+    from utils.image_store import ImageStore
+    
+    upload_dir = workdir / f"uploads_{mode}_{scenario}"
+    os.environ['IMAGE_UPLOAD_DIR'] = str(upload_dir)
+    image_processor._image_processor = None
+    image_processor._payload_cache.clear()
+    # path模式直接调用存储（save_image已改为先读入图片）
+    store = ImageStore(str(upload_dir))
+    request = path_request if mode == 'path' else handle_request
+    
+    if scenario == 'repeat':
+        request(str(images[0]), store)
+        sources = [images[0]] * len(images)
+    else:
+        sources = images
+    samples = [counter.measure(lambda: request(str(path), store)) for path in sources]
+    
+    summary = {field: statistics.mean(sample[field] for sample in samples)
+               for field in ('opens', 'file_ops', 'syscr', 'rchar', 'syscw', 'wchar')}
+    summary['p50_ms'] = statistics.median(sample['ms'] for sample in samples)
+    stored = sum(path.stat().st_size for path in upload_dir.rglob('*') if path.is_file())
+    summary['stored_bytes'] = stored
+    return {key: round(value, 1) for key, value in summary.items()}
+
+
+def print_results(results: Dict[str, Dict[str, Any]], image_bytes: int, runs: int):
+    print(f"\n图片平均大小 {image_bytes} 字节，每种方式 {runs} 个请求，数值为每个请求的平均值")
+    header = f"{'场景':<8}{'方式':<8}{'打开':>6}{'其他操作':>8}{'读调用':>8}{'读取字节':>12}{'写调用':>8}" \
+             f"{'写入字节':>12}{'p50 ms':>9}{'存储字节':>12}"
+    print(header)
+    for scenario in SCENARIOS:
+        for mode in MODES:
+            row = results[scenario][mode]
+            print(f"{scenario:<10}{mode:<10}{row['opens']:>6}{row['file_ops']:>10}{row['syscr']:>10}{row['rchar']:>14}"
+                  f"{row['syscw']:>10}{row['wchar']:>14}{row['p50_ms']:>9}{row['stored_bytes']:>14}")
+        path, handle = results[scenario]['path'], results[scenario]['handle']
+        if path['rchar']:
+            print(f"  {scenario}: 读取字节减少 {100 * (1 - handle['rchar'] / path['rchar']):.0f}%，"
+                  f"读调用 {path['syscr']} -> {handle['syscr']}，打开文件 {path['opens']} -> {handle['opens']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='图片处理I/O基准测试')
+    parser.add_argument('--runs', type=int, default=20, help='每种方式的请求数（默认20）')
+    parser.add_argument('--width', type=int, default=1600, help='图片宽度（默认1600）')
+    parser.add_argument('--height', type=int, default=1200, help='图片高度（默认1200）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（默认1）')
+    parser.add_argument('--json', type=str, help='将结果写入JSON文件')
+    args = parser.parse_args()
+    
+    if not os.path.exists('/proc/self/io'):
+        print("需要Linux的/proc/self/io统计读写")
+        return 1
+    logging.disable(logging.ERROR)
+    counter = IOCounter()
+    rng = random.Random(args.seed)
+    
+    with tempfile.TemporaryDirectory(prefix='bench_ingest_') as tmp:
+        workdir = Path(tmp)
+        image_dir = workdir / 'images'
+        image_dir.mkdir()
+        images = []
+        for index in range(args.runs):
+            path = image_dir / f"image_{index}.jpg"
+            make_image(path, rng, (args.width, args.height))
+            images.append(path)
+        image_bytes = int(statistics.mean(path.stat().st_size for path in images))
+        
+        results = {}
+        for scenario in SCENARIOS:
+            results[scenario] = {}
+            for mode in MODES:
+                results[scenario][mode] = run_mode(mode, scenario, images, counter, workdir)
+        print_results(results, image_bytes, args.runs)
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'image_bytes': image_bytes, 'runs': args.runs, 'results': results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
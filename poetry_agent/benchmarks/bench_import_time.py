@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+命令行冷启动耗时基准测试
+
+在全新的子进程中反复执行命令行的几种快速返回路径（查看帮助、参数校验失败等），
+统计总耗时，并用 python -X importtime 找出导入耗时最多的模块。
+这些路径不应导入 SQLAlchemy、Pillow、openai 等重量级模块，导入时会报告为失败。
+
+用法:
+    python benchmarks/bench_import_time.py [--runs 20] [--max-ms 300] [--json result.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# 场景名称 -> 命令行参数
+SCENARIOS = {
+    'help': ['poetry_agent.py', '--help'],
+    'missing-args': ['poetry_agent.py'],
+    'missing-image': ['poetry_agent.py', '--prompt', '春天', '--image', '/nonexistent/image.jpg'],
+    'worker-help': ['poetry_agent.py', 'worker', '--help'],
+}
+
+# 快速返回路径上不应出现的重量级模块
+HEAVY_MODULES = ('sqlalchemy', 'PIL', 'openai', 'asyncio')
+
+
+def run_once(args: List[str]) -> Tuple[float, int]:
+    """执行一次命令，返回(耗时毫秒, 返回码)"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *args],
+        cwd=PROJECT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    return (time.perf_counter() - start) * 1000, result.returncode
+
+
+def profile_imports(args: List[str]) -> Tuple[Dict[str, int], List[str]]:
+    """
+    用 -X importtime 执行一次命令
+    
+    Returns:
+        (顶层模块 -> 累计导入耗时（微秒）, 导入的全部模块名)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        cwd=PROJECT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    modules = {}
+    imported = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.append(name.strip())
+        # 只统计顶层导入（缩进为一个空格），子模块的耗时已计入其父模块
+        if name.startswith(' ') and not name.startswith('  '):
+            modules[name.strip()] = int(cumulative)
+    return modules, imported
+
+
+def bench_scenario(name: str, args: List[str], runs: int, top: int) -> Dict[str, Any]:
+    """测试单个场景"""
+    run_once(args)  # 预热文件系统缓存和字节码
+    timings = []
+    returncode = None
+    for _ in range(runs):
+        elapsed, returncode = run_once(args)
+        timings.append(elapsed)
+    
+    modules, imported = profile_imports(args)
+    heavy = sorted({
+        module.split('.')[0] for module in imported if module.split('.')[0] in HEAVY_MODULES
+    })
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    
+    timings.sort()
+    return {
+        'scenario': name,
+        'args': args[1:],
+        'returncode': returncode,
+        'runs': runs,
+        'min_ms': round(timings[0], 1),
+        'median_ms': round(statistics.median(timings), 1),
+        'p90_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.9))], 1),
+        'import_total_ms': round(sum(modules.values()) / 1000, 1),
+        'heavy_modules': heavy,
+        'slowest_imports': [{'module': module, 'ms': round(us / 1000, 1)} for module, us in slowest],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='命令行冷启动耗时基准测试')
+    parser.add_argument('--runs', type=int, default=20, help='每个场景的执行次数（默认20）')
+    parser.add_argument('--top', type=int, default=8, help='列出导入耗时最多的前N个模块（默认8）')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='只测试指定场景（可重复）')
+    parser.add_argument('--max-ms', type=float, help='中位耗时超过该值时返回非零状态码')
+    parser.add_argument('--json', type=str, help='将结果写入JSON文件')
+    args = parser.parse_args()
+    
+    results = []
+    failed = False
+    for name in args.scenario or SCENARIOS:
+        result = bench_scenario(name, SCENARIOS[name], args.runs, args.top)
+        results.append(result)
+        
+        print(f"[{name}] 返回码 {result['returncode']}  "
+              f"min {result['min_ms']}ms  median {result['median_ms']}ms  p90 {result['p90_ms']}ms  "
+              f"导入合计 {result['import_total_ms']}ms")
+        for item in result['slowest_imports']:
+            print(f"    {item['ms']:>8.1f}ms  {item['module']}")
+        if result['heavy_modules']:
+            print(f"    ✗ 导入了重量级模块: {', '.join(result['heavy_modules'])}")
+            failed = True
+        if args.max_ms is not None and result['median_ms'] > args.max_ms:
+            print(f"    ✗ 中位耗时超过 {args.max_ms}ms")
+            failed = True
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, ensure_ascii=False, indent=2)
+    
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+推荐流程分阶段基准测试（离线）
+
+启动模拟的OpenAI兼容接口（benchmarks/mock_openai_server.py），用临时的SQLite数据库代替MySQL，
+完整执行 PoetryAgent.execute / run_batch，并统计每个阶段的耗时：
+    image_validate  读取和验证图片    image_save   保存上传图片
+    image_encode    图片预处理和base64编码
+    prompt_build    构建请求消息（不含图片编码）
+    api_describe    图片描述请求      api_call     推荐请求（均为单次HTTP请求，重试时每次单独计时）
+    parse           解析AI响应        db_write     保存推荐记录
+各阶段只统计自身耗时（嵌套阶段的耗时从外层扣除），total为单个任务的总耗时。
+
+场景:
+    single   单首推荐（纯文字）
+    multi    一次推荐多首（--count，超过单个请求的容量时会拆分为并行的子请求）
+    image    带图片的推荐（每次使用不同的图片，包含图片识别请求）
+    batch    批量模式（run_batch，--batch-size 个任务，--concurrency 并发）
+
+结果可以写入JSON文件，并用 --compare 与之前版本的结果对比各阶段的p50耗时，
+本地阶段（不含接口延迟）变慢超过 --max-regression 时返回非零状态码。
+运行需要安装项目依赖（openai、SQLAlchemy、Pillow）。
+
+用法:
+    python benchmarks/bench_pipeline.py [--runs 20] [--latency lognormal:0.3,0.4] [--error-rate 0.02]
+        [--scenarios single,multi,image,batch] [--json result.json] [--compare baseline.json]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+from benchmarks.mock_openai_server import MockOpenAIServer  # noqa: E402
+
+SCENARIOS = ('single', 'multi', 'image', 'batch')
+
+# 各阶段的输出顺序
+STAGES = ('image_validate', 'image_save', 'image_encode', 'prompt_build',
+          'api_describe', 'api_call', 'parse', 'db_write', 'total')
+
+# 耗时受模拟接口延迟影响的阶段，对比时不计入回归
+REMOTE_STAGES = ('api_describe', 'api_call', 'total')
+
+# 对比时忽略p50低于此值（毫秒）的阶段，避免计时噪声误报
+MIN_COMPARE_MS = 1.0
+
+PROMPTS = ['春天的花', '思念故乡', '秋天的落叶', '边塞征战', '山水田园', '离别送友', '月夜', '雪景']
+
+
+class StageTimer:
+    """
+    记录各阶段的耗时
+    
+    每个线程维护一个计时栈，嵌套阶段的耗时从外层阶段中扣除，各阶段只统计自身耗时。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+    
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(list)
+    
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+    
+    def wrap(self, stage: Any, func: Callable, exclusive: bool = True) -> Callable:
+        """
+        包装函数，每次调用记录一个样本
+        
+        Args:
+            stage: 阶段名称，或根据调用参数返回阶段名称的函数
+            exclusive: 是否扣除嵌套阶段的耗时（total记录包含全部阶段的总耗时）
+        """
+        timer = self
+        
+        @functools.wraps(func)
+        def _timed(*args, **kwargs):
+            stack = getattr(timer._local, 'stack', None)
+            if stack is None:
+                stack = timer._local.stack = []
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                name = stage(*args, **kwargs) if callable(stage) else stage
+                timer.record(name, elapsed - nested if exclusive else elapsed)
+        
+        return _timed
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """各阶段的样本数和耗时统计（毫秒）"""
+        result = {}
+        with self._lock:
+            samples = dict(self.samples)
+        for stage in STAGES:
+            values = sorted(samples.get(stage, []))
+            if not values:
+                continue
+            result[stage] = {
+                'count': len(values),
+                'mean_ms': round(statistics.fmean(values) * 1000, 2),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'total_ms': round(sum(values) * 1000, 1),
+            }
+        return result
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """线性插值的百分位数（输入已排序）"""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def configure_environment(workdir: Path, base_url: str, retry_backoff: float):
+    """把项目配置指向模拟接口和临时目录（需在创建客户端和数据库引擎之前调用）"""
+    os.environ.update({
+        'OPENAI_BASE_URL': base_url,
+        'OPENAI_API_KEY': 'mock',
+        'DEFAULT_MODEL': 'gpt-4',
+        'DB_URL': f"sqlite:///{workdir / 'bench.db'}",
+        'IMAGE_UPLOAD_DIR': str(workdir / 'uploads'),
+        'API_RETRY_BACKOFF': str(retry_backoff),
+        'RETRIEVAL_MODE': 'llm',
+        # 每个任务都要经过完整流程：不使用推荐结果缓存和已存储的图片描述
+        'CACHE_ENABLED': 'false',
+        'SEMANTIC_CACHE_ENABLED': 'false',
+        'IMAGE_DESCRIPTION_STORE': 'false',
+    })
+
+
+def instrument(timer: StageTimer) -> Callable[[], None]:
+    """
+    为各阶段的函数加上计时，返回恢复原函数的回调
+    
+    只包装函数，不改变其行为。
+    """
+    from openai.resources.chat.completions import Completions
+    from poetry_agent import PoetryAgent
+    from utils.ai_client import OpenAIChatMixin
+    from utils.image_processor import ImageProcessor
+    
+    def _api_stage(self, *args, **kwargs) -> str:
+        messages = kwargs.get('messages') or []
+        if any(message.get('role') == 'system' for message in messages):
+            return 'api_call'
+        return 'api_describe'
+    
+    targets = [
+        (ImageProcessor, 'ingest', 'image_validate'),
+        (ImageProcessor, 'save_image', 'image_save'),
+        (ImageProcessor, 'encode_image_to_data_url', 'image_encode'),
+        (OpenAIChatMixin, '_build_messages', 'prompt_build'),
+        (OpenAIChatMixin, '_build_describe_messages', 'prompt_build'),
+        (Completions, 'create', _api_stage),
+        (OpenAIChatMixin, '_build_result', 'parse'),
+        (PoetryAgent, '_save_recommendations', 'db_write'),
+    ]
+    originals = []
+    for owner, name, stage in targets:
+        original = owner.__dict__[name]
+        originals.append((owner, name, original))
+        setattr(owner, name, timer.wrap(stage, original))
+    originals.append((PoetryAgent, 'execute', PoetryAgent.__dict__['execute']))
+    PoetryAgent.execute = timer.wrap('total', PoetryAgent.execute, exclusive=False)
+    
+    def _restore():
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+    
+    return _restore
+
+
+def make_image(path: Path, rng: random.Random, size=(1600, 1200)):
+    """生成一张带噪点的渐变JPEG图片（每张图片内容不同，避免命中图片编码缓存）"""
+    from PIL import Image, ImageDraw
+    
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)), fill=color)
+    image.save(path, 'JPEG', quality=90)
+
+
+def run_tasks(agent, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """依次执行任务，返回总耗时和失败数"""
+    failures = 0
+    start = time.perf_counter()
+    for task in tasks:
+        outcome = agent.execute(**task)
+        if outcome['exit_code'] != 0:
+            failures += 1
+            logging.getLogger(__name__).warning(f"任务失败: {outcome['error']}")
+    return {'tasks': len(tasks), 'failures': failures, 'wall_s': round(time.perf_counter() - start, 3)}
+
+
+def run_batch(agent, tasks: List[Dict[str, Any]], workdir: Path, concurrency: int) -> Dict[str, Any]:
+    """通过run_batch执行批量任务，返回总耗时、吞吐量和失败数"""
+    batch_file = workdir / 'batch.jsonl'
+    report_file = workdir / 'batch_report.jsonl'
+    fields = {'positive_prompt': 'prompt', 'count': 'count'}
+    with open(batch_file, 'w', encoding='utf-8') as f:
+        for task in tasks:
+            f.write(json.dumps({fields[key]: value for key, value in task.items()}, ensure_ascii=False) + '\n')
+    
+    start = time.perf_counter()
+    agent.run_batch(str(batch_file), concurrency=concurrency, report_file=str(report_file))
+    wall = time.perf_counter() - start
+    with open(report_file, 'r', encoding='utf-8') as f:
+        failures = sum(1 for line in f if json.loads(line)['exit_code'] != 0)
+    return {
+        'tasks': len(tasks),
+        'failures': failures,
+        'wall_s': round(wall, 3),
+        'throughput_per_s': round(len(tasks) / wall, 2) if wall > 0 else None,
+        'concurrency': concurrency,
+    }
+
+
+def run_scenario(name: str, args: argparse.Namespace, agent, timer: StageTimer, workdir: Path) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(args.runs)]
+    timer.reset()
+    
+    if name == 'single':
+        result = run_tasks(agent, [{'positive_prompt': prompt} for prompt in prompts])
+    elif name == 'multi':
+        result = run_tasks(agent, [{'positive_prompt': prompt, 'count': args.count} for prompt in prompts])
+        result['count'] = args.count
+    elif name == 'image':
+        image_dir = workdir / 'images'
+        image_dir.mkdir(exist_ok=True)
+        tasks = []
+        for index, prompt in enumerate(prompts):
+            path = image_dir / f"image_{index}.jpg"
+            make_image(path, rng)
+            tasks.append({'positive_prompt': prompt, 'image_path': str(path)})
+        result = run_tasks(agent, tasks)
+    else:
+        tasks = [{'positive_prompt': PROMPTS[i % len(PROMPTS)], 'count': 1} for i in range(args.batch_size)]
+        result = run_batch(agent, tasks, workdir, args.concurrency)
+    
+    result['stages'] = timer.summary()
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        output = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=PROJECT_DIR, capture_output=True, text=True, timeout=5
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def print_scenario(name: str, result: Dict[str, Any]):
+    extra = f"，吞吐量 {result['throughput_per_s']}/s" if result.get('throughput_per_s') else ''
+    print(f"\n[{name}] {result['tasks']} 个任务，失败 {result['failures']} 个，总耗时 {result['wall_s']}s{extra}")
+    print(f"    {'阶段':<16}{'次数':>6}{'平均ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, stats in result['stages'].items():
+        print(f"    {stage:<16}{stats['count']:>6}{stats['mean_ms']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> bool:
+    """
+    与之前的结果对比各阶段的p50耗时
+    
+    Returns:
+        本地阶段是否有超过max_regression的回归
+    """
+    regressed = False
+    print(f"\n对比基准: {baseline.get('revision') or '?'} -> {current.get('revision') or '?'}")
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for stage, stats in result['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if not base_stats or base_stats['p50_ms'] <= 0:
+                continue
+            change = stats['p50_ms'] / base_stats['p50_ms'] - 1
+            flagged = (stage not in REMOTE_STAGES and change > max_regression
+                       and max(stats['p50_ms'], base_stats['p50_ms']) >= MIN_COMPARE_MS)
+            mark = '✗' if flagged else ' '
+            print(f"  {mark} [{name}] {stage:<16}{base_stats['p50_ms']:>10} -> {stats['p50_ms']:<10}({change:+.1%})")
+            regressed = regressed or flagged
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='推荐流程分阶段基准测试（离线）')
+    parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS),
+                        help=f"要运行的场景，逗号分隔（默认 {','.join(SCENARIOS)}）")
+    parser.add_argument('--runs', type=int, default=20, help='single/multi/image场景的任务数（默认20）')
+    parser.add_argument('--count', type=int, default=5, help='multi场景每个任务的推荐数量（默认5）')
+    parser.add_argument('--batch-size', type=int, default=100, help='batch场景的任务数（默认100）')
+    parser.add_argument('--concurrency', type=int, default=8, help='batch场景的并发数（默认8）')
+    parser.add_argument('--latency', type=str, default='lognormal:0.3,0.4',
+                        help='模拟接口的延迟分布（默认lognormal:0.3,0.4，格式见mock_openai_server.py）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟接口返回500错误的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='模拟接口返回429限流的比例')
+    parser.add_argument('--poems-per-response', type=int, default=3, help='模拟接口每个响应的诗词数（默认3）')
+    parser.add_argument('--retry-backoff', type=float, default=0.1, help='重试退避的基础时间（秒，默认0.1）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（默认1）')
+    parser.add_argument('--json', type=str, help='将结果写入JSON文件')
+    parser.add_argument('--compare', type=str, help='与之前写入的JSON结果对比')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='本地阶段p50耗时允许的最大增幅（默认0.2，即20%%）')
+    parser.add_argument('--verbose', action='store_true', help='输出项目日志')
+    args = parser.parse_args()
+    
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}（可选 {', '.join(SCENARIOS)}）")
+    
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        # 注入错误时的重试和失败日志在这里是预期内的
+        logging.disable(logging.ERROR)
+    
+    server = MockOpenAIServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        poems_per_response=args.poems_per_response,
+        seed=args.seed
+    )
+    with tempfile.TemporaryDirectory(prefix='bench_pipeline_') as tmp, server:
+        workdir = Path(tmp)
+        configure_environment(workdir, server.base_url, args.retry_backoff)
+        
+        from models.database import init_db
+        from poetry_agent import PoetryAgent
+        from utils.ai_client import AIClientFactory
+        
+        init_db()
+        timer = StageTimer()
+        restore = instrument(timer)
+        agent = PoetryAgent()
+        results = {}
+        try:
+            for name in scenarios:
+                results[name] = run_scenario(name, args, agent, timer, workdir)
+                print_scenario(name, results[name])
+        finally:
+            restore()
+            AIClientFactory.close_all()
+    
+    output = {
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mock': {
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'throttle_rate': args.throttle_rate,
+            'poems_per_response': args.poems_per_response,
+            'stats': server.stats,
+        },
+        'scenarios': results,
+    }
+    print(f"\n模拟接口: 请求 {server.stats['requests']} 次，注入错误 {server.stats['errors']} 次，"
+          f"限流 {server.stats['throttled']} 次")
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    
+    failed = False
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            failed = compare(output, json.load(f), args.max_regression)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
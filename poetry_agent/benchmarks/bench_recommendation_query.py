@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+推荐列表查询基准测试
+
+生成数百万条合成的推荐记录（用户分布不均、同一秒内有多条记录、部分记录带图片描述等大字段），
+对比两种分页方式在不同翻页深度下的耗时：
+    offset    旧的查询方式：ORDER BY created_at + OFFSET，加载完整的推荐记录和诗词（含正文、赏析）
+              分别在只有原有索引（主键、user_id、poem_id）和加上组合索引后各测一次
+    keyset    models/recommendation_query.py：游标分页，只查询列表字段
+同时检查：游标分页每页的结果与OFFSET分页一致；游标分页的执行计划不需要额外排序
+（SQLite: USE TEMP B-TREE FOR ORDER BY，MySQL: Using filesort），任一检查失败时返回非零状态码。
+
+默认使用临时的SQLite数据库；--db-url 可以指定MySQL等数据库（会清空其中的推荐记录和诗词表）。
+--db 指定SQLite文件时，文件已存在且行数相同则直接复用数据。
+
+用法:
+    python benchmarks/bench_recommendation_query.py [--rows 2000000] [--depths 0,2000,200000]
+        [--repeat 3] [--db /tmp/bench_query.db] [--json result.json]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+# 原有的索引，offset的基线在只有这些索引时测量
+LEGACY_INDEXES = ('ix_recommendations_user_id', 'ix_recommendations_poem_id')
+
+DYNASTIES = ('唐', '宋', '元', '明', '清', '魏晋')
+MODELS = ('gpt-4o', 'gpt-4o-mini', 'qwen-vl-max')
+AUTHORS = ('李白', '杜甫', '王维', '苏轼', '李清照', '辛弃疾', '白居易', '孟浩然', '陆游', '纳兰性德')
+
+# 每种筛选条件：名称 -> list_recommendations的参数
+FILTERS = {
+    'all': {},
+    'user': {'user_id': 1},
+    'model': {'model_name': 'qwen-vl-max'},
+    'dynasty': {'dynasty': '元'},
+    'author': {'author': '李白'},
+    'recent_week': {'since_days': 7},
+}
+
+
+def configure_environment(db_url: str):
+    """导入项目模块前设置环境变量"""
+    os.environ['DB_URL'] = db_url
+
+
+def generate_data(engine, rows: int, poems: int, seed: int, chunk: int = 50000):
+    """生成合成数据：先写入数据再创建索引"""
+    from sqlalchemy import insert
+    from models.database import Base
+    from models.poem import Poem, poem_hash
+    from models.recommendation import Recommendation
+    
+    rng = random.Random(seed)
+    Base.metadata.drop_all(engine, tables=[Recommendation.__table__, Poem.__table__])
+    Base.metadata.create_all(engine, tables=[Poem.__table__, Recommendation.__table__])
+    with engine.begin() as conn:
+        for index in Recommendation.__table__.indexes:
+            index.drop(conn)
+    
+    poem_rows = []
+    for poem_id in range(1, poems + 1):
+        title = f"合成诗词{poem_id}"
+        author = AUTHORS[poem_id % len(AUTHORS)]
+        content = '，'.join('春眠不觉晓处处闻啼鸟'[rng.randrange(5):][:5] for _ in range(8)) + '。'
+        poem_rows.append({
+            'id': poem_id,
+            'content_hash': poem_hash(title, author, content),
+            'title': title,
+            'author': author,
+            'dynasty': DYNASTIES[poem_id % len(DYNASTIES)],
+            'content': content,
+            'appreciation': '此诗描写了春日清晨的景色，语言平淡自然而意境深远。' * 12,
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(Poem.__table__), poem_rows)
+    
+    image_description = '一幅描绘江南春色的水墨画，远处青山隐约，近处小桥流水，岸边杨柳依依，' * 3
+    created_at = datetime(2025, 1, 1)
+    inserted = 0
+    start = time.perf_counter()
+    while inserted < rows:
+        batch = []
+        for _ in range(min(chunk, rows - inserted)):
+            # 平均每15秒一条，约1/15的记录与前一条在同一秒内
+            created_at += timedelta(seconds=int(rng.expovariate(1 / 15)))
+            has_image = rng.random() < 0.2
+            success = rng.random() < 0.95
+            batch.append({
+                # 用户ID按对数均匀分布：ID越小的用户记录越多，20%为匿名用户
+                'user_id': int(10000 ** rng.random()) if rng.random() < 0.8 else None,
+                'positive_prompt': '推荐一首关于春天的诗',
+                'negative_prompt': None,
+                'image_path': f"uploads/{inserted}.jpg" if has_image else None,
+                'image_description': image_description if has_image else None,
+                'context': None,
+                'poem_id': rng.randint(1, poems) if success else None,
+                'model_name': MODELS[0] if rng.random() < 0.7 else rng.choice(MODELS[1:]),
+                'status': 1 if success else 0,
+                'error_message': None if success else 'AI接口请求超时',
+                'created_at': created_at,
+                'updated_at': created_at,
+            })
+            inserted += 1
+        with engine.begin() as conn:
+            conn.execute(insert(Recommendation.__table__), batch)
+        print(f"\r  已生成 {inserted}/{rows} 条推荐记录", end='', flush=True)
+    print(f"，耗时 {time.perf_counter() - start:.1f}s")
+
+
+def create_indexes(engine, names: Optional[tuple] = None):
+    """创建推荐记录表的索引（names为空时创建全部）"""
+    from sqlalchemy import inspect
+    from models.recommendation import Recommendation
+    
+    existing = {index['name'] for index in inspect(engine).get_indexes(Recommendation.__tablename__)}
+    with engine.begin() as conn:
+        for index in Recommendation.__table__.indexes:
+            if index.name not in existing and (names is None or index.name in names):
+                start = time.perf_counter()
+                index.create(conn)
+                print(f"  创建索引 {index.name}: {time.perf_counter() - start:.1f}s")
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+
+
+def drop_indexes(engine, keep: tuple):
+    from sqlalchemy import inspect
+    from models.recommendation import Recommendation
+    
+    existing = {index['name'] for index in inspect(engine).get_indexes(Recommendation.__tablename__)}
+    with engine.begin() as conn:
+        for index in Recommendation.__table__.indexes:
+            if index.name in existing and index.name not in keep:
+                index.drop(conn)
+
+
+def resolve_filters(name: str, latest: datetime) -> Dict[str, Any]:
+    filters = dict(FILTERS[name])
+    days = filters.pop('since_days', None)
+    if days:
+        filters['since'] = latest - timedelta(days=days)
+    return filters
+
+
+def _offset_statement(filters: Dict[str, Any], *columns):
+    """旧的查询方式（ORDER BY created_at + OFFSET），columns为空时查询完整的推荐记录"""
+    from sqlalchemy import func, select
+    from models.poem import Poem
+    from models.recommendation import Recommendation
+    
+    conditions = [Recommendation.status == 1]
+    if filters.get('user_id') is not None:
+        conditions.append(Recommendation.user_id == filters['user_id'])
+    if filters.get('model_name'):
+        conditions.append(Recommendation.model_name == filters['model_name'])
+    if filters.get('dynasty'):
+        conditions.append(func.coalesce(Poem.dynasty, Recommendation.dynasty) == filters['dynasty'])
+    if filters.get('author'):
+        conditions.append(func.coalesce(Poem.author, Recommendation.author) == filters['author'])
+    if filters.get('since') is not None:
+        conditions.append(Recommendation.created_at >= filters['since'])
+    return (
+        select(*(columns or (Recommendation,)))
+        .outerjoin(Poem, Poem.id == Recommendation.poem_id)
+        .where(*conditions)
+        .order_by(Recommendation.created_at.desc(), Recommendation.id.desc())
+    )
+
+
+def offset_page(db, filters: Dict[str, Any], offset: int, page_size: int) -> List[Dict[str, Any]]:
+    """旧的查询方式：OFFSET翻页，加载完整的推荐记录和诗词"""
+    stmt = _offset_statement(filters).offset(offset).limit(page_size)
+    return [recommendation.to_dict() for recommendation in db.scalars(stmt)]
+
+
+def keyset_page(db, filters: Dict[str, Any], cursor: Optional[str], page_size: int) -> Dict[str, Any]:
+    from models.recommendation_query import list_recommendations
+    
+    return list_recommendations(db, page_size=page_size, cursor=cursor, **filters)
+
+
+def cursor_at(db, filters: Dict[str, Any], offset: int) -> Optional[str]:
+    """
+    第offset条记录之后的游标（不计时；offset为0时为None，即第一页）
+    
+    Returns:
+        游标；记录数不足offset时返回False
+    """
+    from models.recommendation import Recommendation
+    from models.recommendation_query import encode_cursor
+    
+    if offset == 0:
+        return None
+    stmt = _offset_statement(filters, Recommendation.created_at, Recommendation.id).offset(offset - 1).limit(1)
+    row = db.execute(stmt).first()
+    if row is None:
+        return False
+    return encode_cursor(row.created_at, row.id)
+
+
+def explain(engine, run: Callable[[Any], Any]) -> List[str]:
+    """执行run(db)，返回其中每条查询的执行计划（每条查询一行）"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        with Session(engine) as db:
+            run(db)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            if engine.dialect.name == 'sqlite':
+                rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+                plans.append('; '.join(str(row[-1]) for row in rows))
+            else:
+                result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+                plans.append('; '.join(str(dict(row._mapping)) for row in result))
+    return plans
+
+
+def needs_sort(plan: str) -> bool:
+    """执行计划中是否需要额外排序"""
+    return 'TEMP B-TREE FOR ORDER BY' in plan or 'Using filesort' in plan
+
+
+def measure(run: Callable[[], Any], repeat: int) -> float:
+    """重复执行，返回耗时的中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run_offset(engine, filter_names: List[str], depths: List[int], page_size: int, repeat: int,
+               latest: datetime) -> Dict[str, Dict[int, Optional[float]]]:
+    """测量OFFSET翻页的耗时：筛选条件 -> 翻页深度 -> 毫秒（记录数不足时为None）"""
+    from sqlalchemy.orm import Session
+    
+    results = {}
+    with Session(engine) as db:
+        for name in filter_names:
+            filters = resolve_filters(name, latest)
+            results[name] = {}
+            for depth in depths:
+                if cursor_at(db, filters, depth) is False:
+                    results[name][depth] = None
+                    continue
+                results[name][depth] = measure(lambda: offset_page(db, filters, depth, page_size), repeat)
+    return results
+
+
+def run_keyset(engine, filter_names: List[str], depths: List[int], page_size: int, repeat: int,
+               latest: datetime) -> Dict[str, Any]:
+    """测量游标分页的耗时，并检查结果与OFFSET分页一致、执行计划不需要额外排序"""
+    from sqlalchemy.orm import Session
+    
+    timings, errors, plans = {}, [], {}
+    with Session(engine) as db:
+        for name in filter_names:
+            filters = resolve_filters(name, latest)
+            timings[name] = {}
+            for depth in depths:
+                cursor = cursor_at(db, filters, depth)
+                if cursor is False:
+                    timings[name][depth] = None
+                    continue
+                timings[name][depth] = measure(lambda: keyset_page(db, filters, cursor, page_size), repeat)
+                
+                expected = [item['id'] for item in offset_page(db, filters, depth, page_size)]
+                page = keyset_page(db, filters, cursor, page_size)
+                actual = [item['id'] for item in page['items']]
+                if actual != expected:
+                    errors.append(f"{name} 深度{depth}: 游标分页结果与OFFSET分页不一致")
+                # 再翻一页，检查游标的衔接
+                if page['next_cursor']:
+                    expected = [item['id'] for item in offset_page(db, filters, depth + page_size, page_size)]
+                    actual = [item['id'] for item in keyset_page(db, filters, page['next_cursor'], page_size)['items']]
+                    if actual != expected:
+                        errors.append(f"{name} 深度{depth + page_size}: 下一页游标的结果与OFFSET分页不一致")
+            
+            cursor = cursor_at(db, filters, depths[-1]) or cursor_at(db, filters, 1) or None
+            plan = explain(engine, lambda session: keyset_page(session, filters, cursor, page_size))[0]
+            plans[name] = plan
+            if needs_sort(plan):
+                errors.append(f"{name}: 游标分页需要额外排序（{plan}）")
+    return {'timings': timings, 'plans': plans, 'errors': errors}
+
+
+def print_results(depths: List[int], columns: Dict[str, Dict[str, Dict[int, Optional[float]]]]):
+    names = list(columns)
+    header = f"  {'筛选条件':<12}{'深度':>8}" + ''.join(f"{name:>18}" for name in names)
+    print(header)
+    for filter_name in next(iter(columns.values())):
+        for depth in depths:
+            values = [columns[name][filter_name][depth] for name in names]
+            if all(value is None for value in values):
+                continue
+            cells = ''.join(f"{value:>16.2f}ms" if value is not None else f"{'-':>18}" for value in values)
+            print(f"  {filter_name:<12}{depth:>10}{cells}")
+
+
+def count_rows(engine) -> int:
+    from sqlalchemy import func, inspect, select
+    from models.recommendation import Recommendation
+    
+    if not inspect(engine).has_table(Recommendation.__tablename__):
+        return 0
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(Recommendation.__table__)).scalar()
+
+
+def latest_created_at(engine) -> datetime:
+    from sqlalchemy import func, select
+    from models.recommendation import Recommendation
+    
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(Recommendation.created_at))).scalar()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='推荐列表查询基准测试')
+    parser.add_argument('--rows', type=int, default=2000000, help='推荐记录数（默认2000000）')
+    parser.add_argument('--poems', type=int, default=5000, help='诗词数（默认5000）')
+    parser.add_argument('--depths', type=str, default='0,2000,200000', help='翻页深度（跳过的记录数），逗号分隔')
+    parser.add_argument('--page-size', type=int, default=20, help='每页数量（默认20）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个查询的重复次数，取中位数（默认3）')
+    parser.add_argument('--filters', type=str, default=','.join(FILTERS),
+                        help=f"要测试的筛选条件，逗号分隔（默认 {','.join(FILTERS)}）")
+    parser.add_argument('--db', type=str, help='SQLite数据库文件（已有相同行数的数据时直接复用）')
+    parser.add_argument('--db-url', type=str, help='数据库连接URL（如MySQL，会清空推荐记录和诗词表）')
+    parser.add_argument('--skip-baseline', action='store_true', help='不测量只有原有索引时的OFFSET翻页（最慢的部分）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（默认1）')
+    parser.add_argument('--json', type=str, help='将结果写入JSON文件')
+    args = parser.parse_args()
+    
+    filter_names = [name.strip() for name in args.filters.split(',') if name.strip()]
+    unknown = set(filter_names) - set(FILTERS)
+    if unknown:
+        parser.error(f"未知的筛选条件: {', '.join(sorted(unknown))}（可选 {', '.join(FILTERS)}）")
+    depths = sorted(int(depth) for depth in args.depths.split(','))
+    logging.disable(logging.ERROR)
+    
+    with tempfile.TemporaryDirectory(prefix='bench_query_') as tmp:
+        db_url = args.db_url or f"sqlite:///{args.db or os.path.join(tmp, 'bench.db')}"
+        configure_environment(db_url)
+        from models.database import get_engine
+        
+        engine = get_engine()
+        if count_rows(engine) != args.rows or args.db_url:
+            print(f"生成数据（{args.rows} 条推荐记录，{args.poems} 首诗词）")
+            generate_data(engine, args.rows, args.poems, args.seed)
+        else:
+            print(f"复用已有数据（{args.rows} 条推荐记录）")
+        latest = latest_created_at(engine)
+        
+        columns, result = {}, {'rows': args.rows, 'page_size': args.page_size, 'dialect': engine.dialect.name}
+        if not args.skip_baseline:
+            print("只有原有索引时测量OFFSET翻页")
+            drop_indexes(engine, keep=LEGACY_INDEXES)
+            create_indexes(engine, LEGACY_INDEXES)
+            columns['offset(原有索引)'] = run_offset(engine, filter_names, depths, args.page_size, args.repeat, latest)
+        
+        print("创建组合索引")
+        create_indexes(engine)
+        columns['offset(组合索引)'] = run_offset(engine, filter_names, depths, args.page_size, args.repeat, latest)
+        keyset = run_keyset(engine, filter_names, depths, args.page_size, args.repeat, latest)
+        columns['keyset'] = keyset['timings']
+        
+        print(f"\n每页 {args.page_size} 条，耗时为 {args.repeat} 次的中位数")
+        print_results(depths, columns)
+        print("\n游标分页的执行计划:")
+        for name, plan in keyset['plans'].items():
+            print(f"  {name:<12}{plan}")
+        engine.dispose()
+    
+    result.update({'timings': columns, 'plans': keyset['plans'], 'errors': keyset['errors']})
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    if keyset['errors']:
+        print("\n检查失败:")
+        for error in keyset['errors']:
+            print(f"  ✗ {error}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+AI响应解析基准测试
+
+1. 语料校验：benchmarks/data/response_corpus.jsonl 中每条响应都标注了应解析出的诗词数（0表示应报错），
+   同时统计旧的贪婪正则解析（re.search(r'\\{.*\\}') + 整段文本作为"未知"诗词）的结果作对比。
+2. 模糊测试：对语料中的有效响应随机加入说明文字、代码块标记、尾逗号、多余括号并随机截断，
+   检查解析结果只可能是语料中完整的诗词或ResponseParseError，不会抛出其他异常或返回残缺的诗词。
+3. 性能：统计每条响应的平均解析耗时，并把说明文字放大到10倍、100倍检查耗时是否线性增长。
+   任一检查失败时返回非零状态码。
+
+用法:
+    python benchmarks/bench_response_parser.py [--fuzz 2000] [--seed 1] [--json result.json]
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Callable
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+from utils.json_extract import ResponseParseError, parse_poems  # noqa: E402
+
+CORPUS_PATH = PROJECT_DIR / 'benchmarks' / 'data' / 'response_corpus.jsonl'
+
+# 模糊测试中插入的说明文字
+PROSE = [
+    '好的，以下是为您推荐的诗词：',
+    '希望这些诗词符合您的要求！',
+    '返回格式为 {"poems": [...]}。',
+    '注：[1] 出自《全唐诗》}',
+    '```json',
+    '```',
+    '{',
+    ']',
+]
+
+
+def load_corpus() -> List[Dict[str, Any]]:
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def legacy_parse(content: str) -> List[Dict[str, Any]]:
+    """旧的解析方式：贪婪正则提取JSON，失败时把整段文本作为一首"未知"诗词"""
+    try:
+        match = re.search(r'\{.*\}', content, re.DOTALL)
+        if match:
+            return json.loads(match.group()).get('poems', [])
+    except Exception:
+        pass
+    return [{'title': '未知', 'content': content, 'author': '未知', 'dynasty': '未知', 'appreciation': ''}]
+
+
+def count_poems(parse: Callable[[str], List[Dict[str, Any]]], content: str) -> int:
+    try:
+        return len(parse(content))
+    except (ResponseParseError, ValueError):
+        return 0
+
+
+def check_corpus(corpus: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """逐条校验语料，返回新旧两种解析方式与标注一致的条数"""
+    mismatches = []
+    legacy_correct = 0
+    legacy_garbage = 0
+    for case in corpus:
+        parsed = count_poems(parse_poems, case['content'])
+        if parsed != case['poems']:
+            mismatches.append({'name': case['name'], 'expected': case['poems'], 'parsed': parsed})
+        legacy = legacy_parse(case['content'])
+        if any(poem.get('title') == '未知' for poem in legacy):
+            legacy_garbage += 1
+        elif len(legacy) == case['poems']:
+            legacy_correct += 1
+    return {
+        'cases': len(corpus),
+        'correct': len(corpus) - len(mismatches),
+        'mismatches': mismatches,
+        'legacy_correct': legacy_correct,
+        'legacy_garbage_rows': legacy_garbage,
+    }
+
+
+def mutate(content: str, rng: random.Random) -> str:
+    """随机变换一条有效响应"""
+    if rng.random() < 0.5:
+        content = rng.choice(PROSE) + '\n' + content
+    if rng.random() < 0.5:
+        content = content + '\n' + rng.choice(PROSE)
+    # 尾逗号只加在诗词数组和诗词对象的末尾，不改动字符串内容
+    if rng.random() < 0.3:
+        content = re.sub(r'\}(\s*)\](\s*)\}', r'},\1]\2}', content, count=1)
+    if rng.random() < 0.3:
+        content = re.sub(r'"\n(\s*)\}', r'",\n\1}', content)
+    if rng.random() < 0.5:
+        content = content[:rng.randrange(len(content) + 1)]
+    return content
+
+
+def fuzz(corpus: List[Dict[str, Any]], iterations: int, seed: int) -> Dict[str, Any]:
+    """模糊测试：解析结果必须是完整的原始诗词，或抛出ResponseParseError"""
+    rng = random.Random(seed)
+    seeds = [case for case in corpus if case['poems'] > 0]
+    known = set()
+    for case in seeds:
+        for poem in parse_poems(case['content']):
+            known.add(poem['content'])
+    
+    failures = []
+    parsed = 0
+    for _ in range(iterations):
+        content = mutate(rng.choice(seeds)['content'], rng)
+        try:
+            poems = parse_poems(content)
+        except ResponseParseError:
+            continue
+        except Exception as e:
+            failures.append({'content': content, 'error': f"{type(e).__name__}: {e}"})
+            continue
+        parsed += 1
+        for poem in poems:
+            if poem['content'] not in known:
+                failures.append({'content': content, 'error': f"残缺的诗词: {poem['content']!r}"})
+                break
+    return {'iterations': iterations, 'parsed': parsed, 'failures': failures[:10], 'failure_count': len(failures)}
+
+
+def bench_speed(corpus: List[Dict[str, Any]], runs: int) -> Dict[str, Any]:
+    """平均解析耗时，以及说明文字放大后的耗时增长倍数"""
+    def _timed(contents: List[str], parse: Callable) -> float:
+        start = time.perf_counter()
+        for _ in range(runs):
+            for content in contents:
+                count_poems(parse, content)
+        return (time.perf_counter() - start) / (runs * len(contents)) * 1e6
+    
+    contents = [case['content'] for case in corpus]
+    base = next(case['content'] for case in corpus if case['name'] == 'prose_before_after')
+    scaling = {}
+    for factor in (1, 10, 100):
+        padded = ('说明文字{示例}[注]。' * 20 * factor) + base + ('附注}' * 20 * factor)
+        scaling[factor] = _timed([padded], parse_poems)
+    return {
+        'avg_us': round(_timed(contents, parse_poems), 1),
+        'legacy_avg_us': round(_timed(contents, legacy_parse), 1),
+        'scaling_us': {str(factor): round(us, 1) for factor, us in scaling.items()},
+        'scaling_ratio_100x': round(scaling[100] / scaling[1], 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='AI响应解析基准测试')
+    parser.add_argument('--fuzz', type=int, default=2000, help='模糊测试次数（默认2000）')
+    parser.add_argument('--seed', type=int, default=1, help='模糊测试随机种子（默认1）')
+    parser.add_argument('--runs', type=int, default=50, help='测速时语料的重复次数（默认50）')
+    parser.add_argument('--json', type=str, help='将结果写入JSON文件')
+    args = parser.parse_args()
+    
+    # 解析失败的警告日志在这里是预期内的
+    logging.disable(logging.WARNING)
+    corpus = load_corpus()
+    failed = False
+    
+    corpus_result = check_corpus(corpus)
+    print(f"[语料] {corpus_result['correct']}/{corpus_result['cases']} 条与标注一致；"
+          f"旧解析方式 {corpus_result['legacy_correct']} 条一致，"
+          f"{corpus_result['legacy_garbage_rows']} 条保存为\"未知\"诗词")
+    for item in corpus_result['mismatches']:
+        print(f"    ✗ {item['name']}: 应为 {item['expected']} 首，解析出 {item['parsed']} 首")
+        failed = True
+    
+    fuzz_result = fuzz(corpus, args.fuzz, args.seed)
+    print(f"[模糊测试] {fuzz_result['iterations']} 次，解析成功 {fuzz_result['parsed']} 次，"
+          f"异常 {fuzz_result['failure_count']} 次")
+    for item in fuzz_result['failures']:
+        print(f"    ✗ {item['error']}\n      {item['content'][:120]!r}")
+        failed = True
+    
+    speed = bench_speed(corpus, args.runs)
+    print(f"[耗时] 平均 {speed['avg_us']}us/条（旧解析方式 {speed['legacy_avg_us']}us/条）；"
+          f"说明文字放大1/10/100倍: {' / '.join(f'{us}us' for us in speed['scaling_us'].values())}")
+    # 线性算法放大100倍的耗时应远小于100的平方
+    if speed['scaling_ratio_100x'] > 200:
+        print(f"    ✗ 耗时增长 {speed['scaling_ratio_100x']} 倍，不是线性的")
+        failed = True
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'corpus': corpus_result,
+                'fuzz': fuzz_result,
+                'speed': speed,
+            }, f, ensure_ascii=False, indent=2)
+    
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+模拟的OpenAI兼容接口服务
+
+实现 POST /v1/chat/completions（含流式响应），按配置的延迟分布等待后返回预置的诗词JSON，
+并按比例注入服务端错误（500）和限流（429），用于离线基准测试，不需要真实的API密钥和网络。
+带系统提示词的请求视为推荐请求，返回诗词；没有系统提示词的请求视为图片描述请求，返回图片描述。
+
+延迟分布（秒）:
+    fixed:0.5            固定延迟
+    uniform:0.2,0.8      均匀分布
+    normal:0.5,0.1       正态分布（均值, 标准差），小于0时取0
+    lognormal:0.5,0.4    对数正态分布（中位数, 对数标准差），长尾，接近真实接口
+
+用法:
+    python benchmarks/mock_openai_server.py [--port 8000] [--latency lognormal:0.8,0.4] [--error-rate 0.05]
+    然后设置 OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Callable
+
+# 预置的诗词，推荐请求按顺序轮流取用
+POEMS = [
+    {'title': '静夜思', 'author': '李白', 'dynasty': '唐',
+     'content': '床前明月光，疑是地上霜。\n举头望明月，低头思故乡。',
+     'appreciation': '以明月寄托思乡之情，语言浅白而意味深长。'},
+    {'title': '春晓', 'author': '孟浩然', 'dynasty': '唐',
+     'content': '春眠不觉晓，处处闻啼鸟。\n夜来风雨声，花落知多少。',
+     'appreciation': '从听觉写春晨，喜春与惜春之情交织。'},
+    {'title': '登鹳雀楼', 'author': '王之涣', 'dynasty': '唐',
+     'content': '白日依山尽，黄河入海流。\n欲穷千里目，更上一层楼。',
+     'appreciation': '前两句写景壮阔，后两句寓含登高望远的哲理。'},
+    {'title': '相思', 'author': '王维', 'dynasty': '唐',
+     'content': '红豆生南国，春来发几枝。\n愿君多采撷，此物最相思。',
+     'appreciation': '借红豆寄托相思，含蓄而深情。'},
+    {'title': '江雪', 'author': '柳宗元', 'dynasty': '唐',
+     'content': '千山鸟飞绝，万径人踪灭。\n孤舟蓑笠翁，独钓寒江雪。',
+     'appreciation': '以空寂的雪景衬托渔翁的孤高，寄托诗人的清冷心境。'},
+    {'title': '鹿柴', 'author': '王维', 'dynasty': '唐',
+     'content': '空山不见人，但闻人语响。\n返景入深林，复照青苔上。',
+     'appreciation': '以声衬静、以光写幽，描绘山林的空寂。'},
+    {'title': '登乐游原', 'author': '李商隐', 'dynasty': '唐',
+     'content': '向晚意不适，驱车登古原。\n夕阳无限好，只是近黄昏。',
+     'appreciation': '赞美夕阳之美，同时流露美好易逝的感慨。'},
+    {'title': '寻隐者不遇', 'author': '贾岛', 'dynasty': '唐',
+     'content': '松下问童子，言师采药去。\n只在此山中，云深不知处。',
+     'appreciation': '寓问于答，以白云深山烘托隐者的高洁。'},
+    {'title': '悯农', 'author': '李绅', 'dynasty': '唐',
+     'content': '锄禾日当午，汗滴禾下土。\n谁知盘中餐，粒粒皆辛苦。',
+     'appreciation': '以朴素的语言写农人的辛劳，劝人珍惜粮食。'},
+    {'title': '咏鹅', 'author': '骆宾王', 'dynasty': '唐',
+     'content': '鹅，鹅，鹅，曲项向天歌。\n白毛浮绿水，红掌拨清波。',
+     'appreciation': '色彩鲜明、动静相宜，写出白鹅的神态。'},
+    {'title': '山行', 'author': '杜牧', 'dynasty': '唐',
+     'content': '远上寒山石径斜，白云生处有人家。\n停车坐爱枫林晚，霜叶红于二月花。',
+     'appreciation': '描绘深秋山林景色，霜叶胜于春花，格调明朗。'},
+    {'title': '望庐山瀑布', 'author': '李白', 'dynasty': '唐',
+     'content': '日照香炉生紫烟，遥看瀑布挂前川。\n飞流直下三千尺，疑是银河落九天。',
+     'appreciation': '以奇特的夸张和比喻写出瀑布的雄奇壮丽。'},
+    {'title': '绝句', 'author': '杜甫', 'dynasty': '唐',
+     'content': '两个黄鹂鸣翠柳，一行白鹭上青天。\n窗含西岭千秋雪，门泊东吴万里船。',
+     'appreciation': '四句各写一景，色彩明丽，对仗工整。'},
+    {'title': '饮湖上初晴后雨', 'author': '苏轼', 'dynasty': '宋',
+     'content': '水光潋滟晴方好，山色空蒙雨亦奇。\n欲把西湖比西子，淡妆浓抹总相宜。',
+     'appreciation': '以西子比西湖，写出西湖晴雨皆美的神韵。'},
+    {'title': '小池', 'author': '杨万里', 'dynasty': '宋',
+     'content': '泉眼无声惜细流，树阴照水爱晴柔。\n小荷才露尖尖角，早有蜻蜓立上头。',
+     'appreciation': '捕捉初夏小池的细微景物，清新活泼。'},
+    {'title': '乡村四月', 'author': '翁卷', 'dynasty': '宋',
+     'content': '绿遍山原白满川，子规声里雨如烟。\n乡村四月闲人少，才了蚕桑又插田。',
+     'appreciation': '前写江南初夏景色，后写农忙，景中有人。'},
+]
+
+IMAGE_DESCRIPTION = '画面中远山连绵，近处湖水平静，岸边柳枝低垂，天色将晚，意境清幽宁静。'
+
+# 流式响应每个分片的字符数
+STREAM_CHUNK_CHARS = 24
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    解析延迟分布描述，返回采样函数
+    
+    Raises:
+        ValueError: 分布描述无效
+    """
+    name, _, params = spec.partition(':')
+    if not params:
+        # 只写数字时为固定延迟
+        name, params = 'fixed', name
+    try:
+        values = [float(value) for value in params.split(',')]
+    except ValueError:
+        raise ValueError(f"无效的延迟分布参数: {spec}")
+    
+    if name == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if name == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if name == 'lognormal' and len(values) == 2:
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, values[1]) if values[0] > 0 else 0.0
+    raise ValueError(f"无效的延迟分布: {spec}（可选 fixed:S、uniform:A,B、normal:MEAN,STD、lognormal:MEDIAN,SIGMA）")
+
+
+class MockOpenAIServer:
+    """在后台线程中运行的模拟接口服务"""
+    
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: str = 'fixed:0',
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        poems_per_response: int = 3,
+        poems: Optional[List[Dict[str, Any]]] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            port: 监听端口（0表示自动分配）
+            latency: 每个请求的延迟分布（流式请求为首个分片前的延迟）
+            error_rate: 返回500错误的请求比例
+            throttle_rate: 返回429限流的请求比例
+            poems_per_response: 每个推荐响应包含的诗词数
+            poems: 预置的诗词（默认使用内置的POEMS）
+            seed: 随机种子（延迟采样和错误注入）
+        """
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.poems_per_response = poems_per_response
+        self.poems = poems or POEMS
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cursor = itertools.count()
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0, 'stream': 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def start(self) -> 'MockOpenAIServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-openai', daemon=True)
+        self._thread.start()
+        return self
+    
+    def serve_forever(self):
+        """在当前线程中运行，直到被中断（命令行使用）"""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self) -> 'MockOpenAIServer':
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+    
+    def _draw(self) -> Dict[str, Any]:
+        """为一个请求采样延迟和注入的错误"""
+        with self._lock:
+            self.stats['requests'] += 1
+            latency = self.sample_latency(self._rng)
+            roll = self._rng.random()
+            if roll < self.error_rate:
+                self.stats['errors'] += 1
+                return {'latency': latency, 'status': 500}
+            if roll < self.error_rate + self.throttle_rate:
+                self.stats['throttled'] += 1
+                return {'latency': 0.0, 'status': 429}
+            return {'latency': latency, 'status': 200}
+    
+    def _next_poems(self) -> List[Dict[str, Any]]:
+        return [self.poems[next(self._cursor) % len(self.poems)] for _ in range(self.poems_per_response)]
+    
+    def _completion_text(self, request: Dict[str, Any]) -> str:
+        """推荐请求返回诗词JSON，图片描述请求返回描述文字"""
+        messages = request.get('messages') or []
+        if not any(message.get('role') == 'system' for message in messages):
+            return IMAGE_DESCRIPTION
+        return json.dumps({'poems': self._next_poems()}, ensure_ascii=False, indent=2)
+    
+    def _handler_class(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分开写入，不关闭Nagle算法时每个请求会多出约40ms的延迟确认等待
+            disable_nagle_algorithm = True
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': f'Unknown path: {self.path}', 'type': 'invalid_request_error'}})
+                    return
+                try:
+                    request = json.loads(body or b'{}')
+                except json.JSONDecodeError:
+                    self._send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+                    return
+                
+                draw = server._draw()
+                time.sleep(draw['latency'])
+                if draw['status'] == 429:
+                    self._send_json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}},
+                                    {'retry-after-ms': '100'})
+                    return
+                if draw['status'] != 200:
+                    self._send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+                    return
+                
+                text = server._completion_text(request)
+                if request.get('stream'):
+                    with server._lock:
+                        server.stats['stream'] += 1
+                    self._send_stream(request, text)
+                else:
+                    self._send_json(200, self._completion(request, text))
+            
+            def _completion(self, request: Dict[str, Any], text: str) -> Dict[str, Any]:
+                prompt_chars = sum(len(json.dumps(m.get('content'), ensure_ascii=False)) for m in request.get('messages') or [])
+                completion_tokens = len(text)
+                return {
+                    'id': f"chatcmpl-{uuid.uuid4().hex}",
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'mock'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': text},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': {
+                        'prompt_tokens': prompt_chars,
+                        'completion_tokens': completion_tokens,
+                        'total_tokens': prompt_chars + completion_tokens,
+                    },
+                }
+            
+            def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _send_stream(self, request: Dict[str, Any], text: str):
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                
+                def _event(delta: Dict[str, Any], finish_reason: Optional[str] = None):
+                    chunk = {
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': request.get('model', 'mock'),
+                        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                
+                try:
+                    _event({'role': 'assistant', 'content': ''})
+                    for start in range(0, len(text), STREAM_CHUNK_CHARS):
+                        _event({'content': text[start:start + STREAM_CHUNK_CHARS]})
+                    _event({}, 'stop')
+                    self._write_chunk('data: [DONE]\n\n')
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端取得足够的诗词后会提前关闭连接
+                    self.close_connection = True
+            
+            def _write_chunk(self, text: str):
+                data = text.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟的OpenAI兼容接口服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址（默认127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口（默认8000）')
+    parser.add_argument('--latency', type=str, default='lognormal:0.8,0.4', help='延迟分布（默认lognormal:0.8,0.4）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500错误的请求比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回429限流的请求比例')
+    parser.add_argument('--poems-per-response', type=int, default=3, help='每个推荐响应包含的诗词数（默认3）')
+    parser.add_argument('--poems', type=str, help='预置诗词的JSON文件（诗词对象数组）')
+    parser.add_argument('--seed', type=int, help='随机种子')
+    args = parser.parse_args()
+    
+    poems = None
+    if args.poems:
+        with open(args.poems, 'r', encoding='utf-8') as f:
+            poems = json.load(f)
+    
+    server = MockOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        poems_per_response=args.poems_per_response,
+        poems=poems,
+        seed=args.seed
+    )
+    print(f"模拟接口已启动: {server.base_url}（Ctrl+C 停止）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
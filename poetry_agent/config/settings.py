@@ -21,12 +21,24 @@ class Settings:
         Args:
             config_file: 配置文件路径（可选）
         """
-        self.config_file = config_file
+        self.config_file = None
         self.config_data = {}
+        self.load(config_file)
+    
+    def load(self, config_file: Optional[str]):
+        """
+        加载配置文件，替换已加载的配置
+        
+        命令行入口在启动时把 -f 指定的配置文件加载到全局配置实例settings中，
+        各模块读取的都是这个实例；应在创建数据库连接、AI客户端等之前调用。
         
+        Args:
+            config_file: 配置文件路径（为空或文件不存在时不做修改）
+        """
         if config_file and os.path.exists(config_file):
             with open(config_file, 'r', encoding='utf-8') as f:
                 self.config_data = json.load(f)
+            self.config_file = config_file
     
     # 数据库配置
     @property
@@ -51,7 +63,10 @@ class Settings:
     
     @property
     def db_url(self) -> str:
-        """构建数据库连接URL"""
+        """数据库连接URL：配置了database.url（或DB_URL）时直接使用，否则按MySQL连接参数构建"""
+        url = self.config_data.get('database', {}).get('url') or os.getenv('DB_URL')
+        if url:
+            return url
         return f"mysql+pymysql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}?charset=utf8mb4"
     
     # AI模型配置
@@ -79,11 +94,68 @@ class Settings:
     def ali_api_key(self) -> Optional[str]:
         return self.config_data.get('ai', {}).get('ali_api_key') or os.getenv('ALI_API_KEY')
     
+    @property
+    def qianfan_base_url(self) -> str:
+        """百度千帆OpenAI兼容接口地址"""
+        return self.config_data.get('ai', {}).get('qianfan_base_url') or os.getenv('QIANFAN_BASE_URL', 'https://qianfan.baidubce.com/v2')
+    
+    @property
+    def dashscope_base_url(self) -> str:
+        """阿里云百炼（DashScope）OpenAI兼容接口地址"""
+        return self.config_data.get('ai', {}).get('dashscope_base_url') or os.getenv('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
+    
+    @property
+    def response_format(self) -> str:
+        """推荐请求的输出格式：text（只在提示词中要求JSON）、json_object（JSON模式）、json_schema（结构化输出）"""
+        return self.config_data.get('ai', {}).get('response_format') or os.getenv('RESPONSE_FORMAT', 'text')
+    
+    # 多服务商路由配置（模型名为 router 时使用）
+    @property
+    def router_backends(self) -> list:
+        """参与路由的模型列表"""
+        backends = self.config_data.get('router', {}).get('backends')
+        if not backends:
+            backends = [b.strip() for b in os.getenv('ROUTER_BACKENDS', 'gpt-4').split(',') if b.strip()]
+        return backends
+    
+    @property
+    def router_hedge(self) -> bool:
+        """主后端响应慢于其p95延迟时，是否向次优后端发送对冲请求"""
+        hedge = self.config_data.get('router', {}).get('hedge')
+        if hedge is None:
+            hedge = os.getenv('ROUTER_HEDGE', 'true').lower() in ('1', 'true', 'yes')
+        return bool(hedge)
+    
+    @property
+    def router_hedge_delay(self) -> float:
+        """主后端延迟样本不足时，发送对冲请求前的等待时间（秒）"""
+        return self.config_data.get('router', {}).get('hedge_delay') or float(os.getenv('ROUTER_HEDGE_DELAY', '3'))
+    
+    @property
+    def router_window(self) -> int:
+        """统计延迟和错误率时保留的最近请求数"""
+        return self.config_data.get('router', {}).get('window') or int(os.getenv('ROUTER_WINDOW', '100'))
+    
+    @property
+    def router_error_threshold(self) -> float:
+        """错误率超过该值的后端视为不健康，暂停使用"""
+        return self.config_data.get('router', {}).get('error_threshold') or float(os.getenv('ROUTER_ERROR_THRESHOLD', '0.5'))
+    
+    @property
+    def router_cooldown(self) -> float:
+        """不健康的后端暂停使用的时间（秒），之后重新尝试"""
+        return self.config_data.get('router', {}).get('cooldown') or float(os.getenv('ROUTER_COOLDOWN', '30'))
+    
     # 图片配置
     @property
     def image_upload_dir(self) -> str:
         return self.config_data.get('image', {}).get('upload_dir') or os.getenv('IMAGE_UPLOAD_DIR', './uploads/images')
     
+    @property
+    def image_gc_grace_hours(self) -> float:
+        """未被推荐记录引用的图片保留的时间（小时），之后由 manage.py gc-images 删除"""
+        return self.config_data.get('image', {}).get('gc_grace_hours') or float(os.getenv('IMAGE_GC_GRACE_HOURS', '24'))
+    
     @property
     def max_image_size(self) -> int:
         """最大图片大小（字节）"""
@@ -93,6 +165,63 @@ class Settings:
     def allowed_image_formats(self) -> list:
         return self.config_data.get('image', {}).get('allowed_formats') or ['jpg', 'jpeg', 'png', 'webp']
     
+    @property
+    def image_upload_max_edge(self) -> int:
+        """上传给AI接口前图片长边的最大像素数"""
+        return self.config_data.get('image', {}).get('upload_max_edge') or int(os.getenv('IMAGE_UPLOAD_MAX_EDGE', '1568'))
+    
+    @property
+    def image_upload_format(self) -> str:
+        """上传给AI接口前图片重新压缩的格式（JPEG/PNG/WEBP）"""
+        return self.config_data.get('image', {}).get('upload_format') or os.getenv('IMAGE_UPLOAD_FORMAT', 'JPEG')
+    
+    @property
+    def image_upload_quality(self) -> int:
+        """上传图片的压缩质量（JPEG/WEBP，1-95）"""
+        return self.config_data.get('image', {}).get('upload_quality') or int(os.getenv('IMAGE_UPLOAD_QUALITY', '85'))
+    
+    @property
+    def image_payload_cache_size(self) -> int:
+        """进程内缓存的已编码上传图片数量"""
+        return self.config_data.get('image', {}).get('payload_cache_size') or int(os.getenv('IMAGE_PAYLOAD_CACHE_SIZE', '32'))
+    
+    @property
+    def image_derivatives(self) -> dict:
+        """衍生图片规格：名称 -> {'max_edge': 长边像素数, 'format': 格式, 'quality': 压缩质量}"""
+        return self.config_data.get('image', {}).get('derivatives') or {
+            'thumb': {'max_edge': 256, 'format': 'WEBP', 'quality': 80},
+            'medium': {'max_edge': 1024, 'format': 'WEBP', 'quality': 82},
+        }
+    
+    @property
+    def image_derivative_workers(self) -> int:
+        """批量生成衍生图片的进程数（0表示CPU核数）"""
+        return self.config_data.get('image', {}).get('derivative_workers') or int(os.getenv('IMAGE_DERIVATIVE_WORKERS', '0'))
+    
+    @property
+    def image_description_store_enabled(self) -> bool:
+        """是否复用已存储的图片描述（按内容哈希和感知哈希匹配）"""
+        enabled = self.config_data.get('image', {}).get('description_store')
+        if enabled is None:
+            enabled = os.getenv('IMAGE_DESCRIPTION_STORE', 'true').lower() in ('1', 'true', 'yes')
+        return bool(enabled)
+    
+    @property
+    def image_phash_threshold(self) -> int:
+        """判定为近似重复图片的最大感知哈希汉明距离（0表示只复用完全相同的图片）"""
+        threshold = self.config_data.get('image', {}).get('phash_threshold')
+        if threshold is None:
+            threshold = int(os.getenv('IMAGE_PHASH_THRESHOLD', '6'))
+        return threshold
+    
+    @property
+    def image_trust_stored_description(self) -> bool:
+        """复用已存储的图片描述时，推荐请求是否只发送文字（不再上传图片）"""
+        trusted = self.config_data.get('image', {}).get('trust_stored_description')
+        if trusted is None:
+            trusted = os.getenv('IMAGE_TRUST_STORED_DESCRIPTION', 'true').lower() in ('1', 'true', 'yes')
+        return bool(trusted)
+    
     # API配置
     @property
     def api_timeout(self) -> int:
@@ -104,6 +233,257 @@ class Settings:
         """API重试次数"""
         return self.config_data.get('api', {}).get('retry_times') or int(os.getenv('API_RETRY_TIMES', '3'))
     
+    @property
+    def api_retry_backoff(self) -> float:
+        """重试退避的基数（秒），第n次重试前最多等待 基数 * 2^n 秒"""
+        return self.config_data.get('api', {}).get('retry_backoff') or float(os.getenv('API_RETRY_BACKOFF', '1'))
+    
+    @property
+    def api_retry_backoff_max(self) -> float:
+        """重试退避的最长等待时间（秒）"""
+        return self.config_data.get('api', {}).get('retry_backoff_max') or float(os.getenv('API_RETRY_BACKOFF_MAX', '30'))
+    
+    @property
+    def api_connect_timeout(self) -> float:
+        """建立连接的超时时间（秒）"""
+        return self.config_data.get('api', {}).get('connect_timeout') or float(os.getenv('API_CONNECT_TIMEOUT', '10'))
+    
+    @property
+    def api_max_connections(self) -> int:
+        """每个AI客户端连接池的最大连接数"""
+        return self.config_data.get('api', {}).get('max_connections') or int(os.getenv('API_MAX_CONNECTIONS', '100'))
+    
+    @property
+    def api_max_keepalive_connections(self) -> int:
+        """每个AI客户端连接池保持的最大空闲连接数"""
+        return self.config_data.get('api', {}).get('max_keepalive_connections') or int(os.getenv('API_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    
+    @property
+    def api_keepalive_expiry(self) -> float:
+        """空闲连接的保持时间（秒）"""
+        return self.config_data.get('api', {}).get('keepalive_expiry') or float(os.getenv('API_KEEPALIVE_EXPIRY', '30'))
+    
+    @property
+    def api_max_output_tokens(self) -> int:
+        """单次推荐请求的max_tokens上限（模型允许的最大输出令牌数）"""
+        return self.config_data.get('api', {}).get('max_output_tokens') or int(os.getenv('API_MAX_OUTPUT_TOKENS', '4096'))
+    
+    @property
+    def api_tokens_per_poem(self) -> int:
+        """每首诗词（含赏析）输出令牌数的初始估计，之后按实际返回的诗词长度修正"""
+        return self.config_data.get('api', {}).get('tokens_per_poem') or int(os.getenv('API_TOKENS_PER_POEM', '600'))
+    
+    # 拆分请求配置
+    @property
+    def fanout_enabled(self) -> bool:
+        """推荐数量较多时，是否拆分为多个并行的子请求"""
+        enabled = self.config_data.get('fanout', {}).get('enabled')
+        if enabled is None:
+            enabled = os.getenv('FANOUT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        return bool(enabled)
+    
+    @property
+    def fanout_batch_size(self) -> int:
+        """
+        每个子请求最多推荐的诗词数：数量超过时拆分为并行的子请求，耗时接近一个小请求
+        （输出令牌上限放不下时自动减少；0表示只在输出令牌上限放不下时拆分）
+        """
+        batch_size = self.config_data.get('fanout', {}).get('batch_size')
+        if batch_size is None:
+            batch_size = int(os.getenv('FANOUT_BATCH_SIZE', '3'))
+        return batch_size
+    
+    @property
+    def fanout_max_parallel(self) -> int:
+        """同时执行的子请求数上限"""
+        return self.config_data.get('fanout', {}).get('max_parallel') or int(os.getenv('FANOUT_MAX_PARALLEL', '8'))
+    
+    # 限流配置
+    @property
+    def rate_limit_default(self) -> dict:
+        """未单独配置的模型使用的限流设置：rpm、tpm（0表示不限制）和max_concurrency"""
+        default = {
+            'rpm': int(os.getenv('RATE_LIMIT_RPM', '0')),
+            'tpm': int(os.getenv('RATE_LIMIT_TPM', '0')),
+            'max_concurrency': int(os.getenv('RATE_LIMIT_MAX_CONCURRENCY', '16')),
+        }
+        default.update(self.rate_limits.get('default', {}))
+        return default
+    
+    @property
+    def rate_limits(self) -> dict:
+        """按模型配置的限流设置，如 {"gpt-4": {"rpm": 500, "tpm": 30000, "max_concurrency": 16}}（环境变量RATE_LIMITS为JSON）"""
+        limits = self.config_data.get('rate_limits')
+        if limits is None:
+            limits = json.loads(os.getenv('RATE_LIMITS') or '{}')
+        return limits
+    
+    # 缓存配置
+    @property
+    def cache_enabled(self) -> bool:
+        """是否启用AI推荐结果缓存"""
+        enabled = self.config_data.get('cache', {}).get('enabled')
+        if enabled is None:
+            enabled = os.getenv('CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        return bool(enabled)
+    
+    @property
+    def cache_path(self) -> str:
+        """磁盘缓存文件路径"""
+        return self.config_data.get('cache', {}).get('path') or os.getenv('CACHE_PATH', './cache/responses.db')
+    
+    @property
+    def cache_memory_size(self) -> int:
+        """进程内缓存最大条数"""
+        return self.config_data.get('cache', {}).get('memory_size') or int(os.getenv('CACHE_MEMORY_SIZE', '256'))
+    
+    @property
+    def cache_max_entries(self) -> int:
+        """磁盘缓存最大条数"""
+        return self.config_data.get('cache', {}).get('max_entries') or int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+    
+    @property
+    def cache_ttl(self) -> int:
+        """缓存过期时间（秒），0表示不过期"""
+        ttl = self.config_data.get('cache', {}).get('ttl')
+        if ttl is None:
+            ttl = int(os.getenv('CACHE_TTL', '604800'))  # 7天
+        return ttl
+    
+    @property
+    def semantic_cache_enabled(self) -> bool:
+        """精确缓存未命中时，是否复用相似请求的缓存结果"""
+        enabled = self.config_data.get('cache', {}).get('semantic_enabled')
+        if enabled is None:
+            enabled = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        return bool(enabled)
+    
+    @property
+    def semantic_cache_threshold(self) -> float:
+        """判定为相似请求的最低余弦相似度（0~1）"""
+        threshold = self.config_data.get('cache', {}).get('semantic_threshold')
+        if threshold is None:
+            threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9'))
+        return threshold
+    
+    # 检索配置
+    @property
+    def retrieval_mode(self) -> str:
+        """推荐方式：llm（总是调用AI）、retrieve（只从诗词索引检索）、hybrid（索引匹配足够时不调用AI）"""
+        return self.config_data.get('retrieval', {}).get('mode') or os.getenv('RETRIEVAL_MODE', 'llm')
+    
+    @property
+    def retrieval_min_score(self) -> float:
+        """检索结果的最低匹配分（0~1），低于该值的诗词不直接返回"""
+        min_score = self.config_data.get('retrieval', {}).get('min_score')
+        if min_score is None:
+            min_score = float(os.getenv('RETRIEVAL_MIN_SCORE', '0.6'))
+        return min_score
+    
+    @property
+    def poem_index_path(self) -> str:
+        """诗词索引快照文件路径"""
+        return self.config_data.get('retrieval', {}).get('index_path') or os.getenv('POEM_INDEX_PATH', './cache/poem_index.pkl')
+    
+    @property
+    def poem_index_refresh_interval(self) -> float:
+        """常驻进程从推荐记录表追赶新记录的间隔（秒）"""
+        return self.config_data.get('retrieval', {}).get('refresh_interval') or float(os.getenv('POEM_INDEX_REFRESH_INTERVAL', '60'))
+    
+    # 批量任务配置
+    @property
+    def batch_concurrency(self) -> int:
+        """批量模式下的最大并发任务数"""
+        return self.config_data.get('batch', {}).get('concurrency') or int(os.getenv('BATCH_CONCURRENCY', '4'))
+    
+    @property
+    def batch_write_size(self) -> int:
+        """批量模式下单个数据库事务最多写入的记录数"""
+        return self.config_data.get('batch', {}).get('write_size') or int(os.getenv('BATCH_WRITE_SIZE', '200'))
+    
+    @property
+    def batch_write_delay(self) -> float:
+        """批量模式下记录等待合并写入的最长时间（秒）"""
+        return self.config_data.get('batch', {}).get('write_delay') or float(os.getenv('BATCH_WRITE_DELAY', '0.05'))
+    
+    # worker配置
+    @property
+    def worker_concurrency(self) -> int:
+        """worker同时执行的最大任务数"""
+        return self.config_data.get('worker', {}).get('concurrency') or int(os.getenv('WORKER_CONCURRENCY', '4'))
+    
+    @property
+    def worker_lease_seconds(self) -> int:
+        """worker领取任务的租约时长（秒），超过该时间未续约的任务会被其他worker重新领取"""
+        return self.config_data.get('worker', {}).get('lease_seconds') or int(os.getenv('WORKER_LEASE_SECONDS', '60'))
+    
+    @property
+    def worker_poll_interval(self) -> float:
+        """队列为空时worker的轮询间隔（秒）"""
+        return self.config_data.get('worker', {}).get('poll_interval') or float(os.getenv('WORKER_POLL_INTERVAL', '2'))
+    
+    @property
+    def worker_max_attempts(self) -> int:
+        """单个任务最多执行的次数（含失败重试和worker崩溃后的重新领取）"""
+        return self.config_data.get('worker', {}).get('max_attempts') or int(os.getenv('WORKER_MAX_ATTEMPTS', '3'))
+    
+    # 推荐池配置（为活跃用户预先生成的个性化推荐）
+    @property
+    def pool_target_size(self) -> int:
+        """补充后每个用户可用的推荐数"""
+        return self.config_data.get('pool', {}).get('target_size') or int(os.getenv('POOL_TARGET_SIZE', '10'))
+    
+    @property
+    def pool_low_water(self) -> int:
+        """可用推荐数低于此值时补充"""
+        return self.config_data.get('pool', {}).get('low_water') or int(os.getenv('POOL_LOW_WATER', '3'))
+    
+    @property
+    def pool_ttl_hours(self) -> float:
+        """预生成推荐的有效期（小时）"""
+        return self.config_data.get('pool', {}).get('ttl_hours') or float(os.getenv('POOL_TTL_HOURS', '72'))
+    
+    @property
+    def pool_active_days(self) -> int:
+        """最近多少天内有推荐记录的用户算作活跃用户"""
+        return self.config_data.get('pool', {}).get('active_days') or int(os.getenv('POOL_ACTIVE_DAYS', '7'))
+    
+    @property
+    def pool_max_users(self) -> int:
+        """每次补充最多处理的用户数（按推荐数从多到少）"""
+        return self.config_data.get('pool', {}).get('max_users') or int(os.getenv('POOL_MAX_USERS', '200'))
+    
+    @property
+    def pool_history_size(self) -> int:
+        """生成推荐时参考的最近推荐记录数"""
+        return self.config_data.get('pool', {}).get('history_size') or int(os.getenv('POOL_HISTORY_SIZE', '20'))
+    
+    @property
+    def pool_off_peak(self) -> Optional[str]:
+        """允许补充的时间段（如 01:00-06:00，为空时不限制）"""
+        return self.config_data.get('pool', {}).get('off_peak') or os.getenv('POOL_OFF_PEAK') or None
+    
+    # 监控指标配置（批量模式和worker）
+    @property
+    def metrics_file(self) -> Optional[str]:
+        """Prometheus文本格式指标文件路径（供node_exporter的textfile收集器读取），为空时不写入"""
+        return self.config_data.get('metrics', {}).get('file') or os.getenv('METRICS_FILE')
+    
+    @property
+    def metrics_port(self) -> int:
+        """本地HTTP指标接口（/metrics）的端口，0表示不启动"""
+        return self.config_data.get('metrics', {}).get('port') or int(os.getenv('METRICS_PORT', '0'))
+    
+    @property
+    def metrics_host(self) -> str:
+        """本地HTTP指标接口的监听地址"""
+        return self.config_data.get('metrics', {}).get('host') or os.getenv('METRICS_HOST', '127.0.0.1')
+    
+    @property
+    def metrics_interval(self) -> float:
+        """写入指标文件的间隔（秒）"""
+        return self.config_data.get('metrics', {}).get('interval') or float(os.getenv('METRICS_INTERVAL', '15'))
+    
     # 日志配置
     @property
     def log_level(self) -> str:
@@ -8,8 +8,11 @@ from pathlib import Path
 # 添加项目根目录到路径
 sys.path.insert(0, str(Path(__file__).parent))
 
-from models.database import init_db, engine
+from models.database import init_db
+from models.poem import Poem
 from models.recommendation import Recommendation
+from models.image_description import ImageDescription
+from models.task_log import TaskLog
 from utils.logger import setup_logger
 
 logger = setup_logger()
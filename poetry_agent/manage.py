@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+维护命令行工具
+
+用法:
+    python manage.py [-f 配置文件] <命令> [参数]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+
+def date_arg(value: str):
+    """解析 YYYY-MM-DD 格式的日期参数"""
+    from datetime import date
+    
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式应为YYYY-MM-DD: {value}")
+
+
+def seed_image_descriptions(args) -> int:
+    """从推荐记录导入图片描述"""
+    from utils.description_store import ImageDescriptionStore
+    
+    store = ImageDescriptionStore()
+    imported = store.seed_from_recommendations(batch_size=args.batch_size)
+    print(f"已导入 {imported} 条图片描述")
+    return 0
+
+
+def migrate(args) -> int:
+    """升级数据库结构并把推荐记录中的诗词迁移到poems表"""
+    from models.migrations import migrate as run_migrations
+    
+    linked = run_migrations(
+        batch_size=args.batch_size,
+        clear_text=not args.keep_text,
+        optimize=args.optimize
+    )
+    print(f"数据库升级完成，已关联 {linked} 条推荐记录到poems表")
+    return 0
+
+
+def build_poem_index(args) -> int:
+    """从推荐记录表重新建立诗词索引"""
+    from utils.poem_index import PoemIndex
+    
+    index = PoemIndex()
+    total = index.rebuild(keep_corpus=not args.reset)
+    index.save()
+    print(f"诗词索引已建立，共 {total} 首")
+    return 0
+
+
+def import_poems(args) -> int:
+    """导入古诗词语料到诗词索引"""
+    from utils.poem_index import PoemIndex, load_corpus
+    
+    index = PoemIndex()
+    index.ensure_loaded()
+    imported = 0
+    for path in args.files:
+        count = index.add_poems(load_corpus(path, dynasty=args.dynasty))
+        print(f"{path}: 导入 {count} 首")
+        imported += count
+    index.save()
+    print(f"共导入 {imported} 首，索引中共 {len(index)} 首")
+    return 0
+
+
+def search_poems(args) -> int:
+    """在诗词索引中搜索"""
+    from utils.poem_index import get_poem_index
+    
+    result = get_poem_index().search(
+        args.query,
+        page=args.page,
+        page_size=args.page_size,
+        dynasty=args.dynasty,
+        author=args.author
+    )
+    print(f"共 {result['total']} 首，第 {result['page']} 页")
+    for poem in result['items']:
+        print(f"[{poem['score']:.2f}] {poem['title']} - {poem['author']} ({poem['dynasty']})")
+    return 0
+
+
+def list_recommendations(args) -> int:
+    """分页查询推荐记录"""
+    from models.database import get_db
+    from models.recommendation_query import InvalidCursorError, list_recommendations as query
+    
+    try:
+        with get_db() as db:
+            result = query(
+                db,
+                user_id=args.user_id,
+                status=None if args.all else 1,
+                model_name=args.model,
+                dynasty=args.dynasty,
+                author=args.author,
+                sort=args.sort,
+                page_size=args.page_size,
+                cursor=args.cursor
+            )
+    except InvalidCursorError as e:
+        print(e)
+        return 1
+    for item in result['items']:
+        print(f"[{item['id']}] {item['created_at']} {item['poem_title']} - {item['author']} ({item['dynasty']})")
+    if result['next_cursor']:
+        print(f"下一页: --cursor {result['next_cursor']}")
+    return 0
+
+
+def rebuild_stats(args) -> int:
+    """从推荐记录重新计算统计汇总表"""
+    from models.database import init_db
+    from models.recommendation_stats import rebuild_stats as rebuild
+    
+    init_db()
+    total = rebuild(since=args.since, until=args.until)
+    print(f"统计汇总已重新计算，共 {total} 条推荐记录")
+    return 0
+
+
+def show_stats(args) -> int:
+    """输出推荐统计"""
+    from datetime import date, timedelta
+    from models.database import get_db
+    from models.recommendation_stats import active_users, count_by, get_summary
+    
+    since = date.today() - timedelta(days=args.days - 1) if args.days else None
+    
+    def _format(figures) -> str:
+        success_rate = f"{figures['success_rate']:.1%}" if figures['success_rate'] is not None else '-'
+        latency = f"{figures['avg_latency_ms']:.0f}ms" if figures['avg_latency_ms'] is not None else '-'
+        return f"{figures['total']} 条，成功率 {success_rate}，平均耗时 {latency}"
+    
+    with get_db() as db:
+        print(f"推荐: {_format(get_summary(db, since=since, user_id=args.user_id))}")
+        if args.user_id is None:
+            print(f"活跃用户: {active_users(db, since=since)}")
+            for dimension, title in (('model', '模型'), ('dynasty', '朝代'), ('author', '作者')):
+                print(f"{title}:")
+                for item in count_by(db, dimension, since=since, limit=args.top):
+                    print(f"  {item['value']}: {_format(item)}")
+    return 0
+
+
+def refill_pools(args) -> int:
+    """为活跃用户补充个性化推荐池"""
+    from config.settings import settings
+    from utils.pool_refiller import PoolRefiller, in_window
+    
+    if not args.force and not in_window(settings.pool_off_peak):
+        print(f"当前不在允许补充的时间段（{settings.pool_off_peak}）内，未执行（--force 强制执行）")
+        return 0
+    
+    from poetry_agent import PoetryAgent
+    
+    # 关闭推荐结果缓存：同一用户的请求不变时，缓存会返回相同的诗词
+    agent = PoetryAgent(use_cache=False)
+    refiller = PoolRefiller(agent)
+    summary = refiller.run(user_ids=args.user_id or None, concurrency=args.concurrency)
+    print(
+        f"检查了 {summary['users']} 个用户，为 {summary['refilled']} 个用户补充了 {summary['added']} 条推荐，"
+        f"{summary['failed']} 个用户生成失败"
+    )
+    return 0 if not summary['failed'] else 2
+
+
+def take_pooled(args) -> int:
+    """从用户的推荐池中取出一条推荐"""
+    from models.recommendation_pool import RecommendationPool
+    
+    item = RecommendationPool().take_next(args.user_id)
+    if item is None:
+        print(f"用户 {args.user_id} 的推荐池中没有可用的推荐")
+        return 1
+    print(f"{item['poem_title']} - {item['author']} ({item['dynasty']})")
+    print(item['poem_content'])
+    return 0
+
+
+def migrate_images(args) -> int:
+    """把旧版本按用户目录保存的图片迁移到内容寻址的图片存储"""
+    from utils.image_store import ImageStore
+    
+    summary = ImageStore().migrate_legacy(batch_size=args.batch_size, dry_run=args.dry_run)
+    print(
+        f"{'（预演）' if args.dry_run else ''}迁移了 {summary['files']} 个图片文件，其中 {summary['duplicates']} 个内容重复，"
+        f"更新了 {summary['records']} 条推荐记录，{summary['kept']} 个仍被引用的原文件未删除，释放 {summary['freed_bytes']} 字节"
+    )
+    return 0
+
+
+def gc_images(args) -> int:
+    """删除不再被推荐记录引用的图片"""
+    from utils.image_store import ImageStore
+    
+    summary = ImageStore().collect_garbage(grace_hours=args.grace_hours, dry_run=args.dry_run)
+    print(
+        f"{'（预演）' if args.dry_run else ''}共 {summary['blobs']} 张图片，{summary['referenced']} 张被引用，"
+        f"删除了 {summary['deleted']} 张和 {summary['derivatives_deleted']} 张衍生图片，释放 {summary['freed_bytes']} 字节"
+    )
+    return 0
+
+
+def build_derivatives(args) -> int:
+    """为存储中的图片批量生成缩略图等衍生图片"""
+    from utils.image_processor import ImageProcessor
+    
+    summary = ImageProcessor().build_derivatives(names=args.name, workers=args.workers, force=args.force)
+    print(
+        f"共 {summary['images']} 张图片，生成了 {summary['generated']} 张衍生图片，"
+        f"{summary['existing']} 张已存在，{summary['failed']} 张失败"
+    )
+    return 0 if not summary['failed'] else 2
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='AI诗词推荐Agent - 维护工具')
+    parser.add_argument('-f', '--config', type=str, help='配置文件路径（可选，需写在命令之前）')
+    subparsers = parser.add_subparsers(dest='command', metavar='<命令>')
+    subparsers.required = True
+    
+    seed_parser = subparsers.add_parser(
+        'seed-image-descriptions',
+        help='从推荐记录表导入已有的图片描述，供相同或近似的图片复用'
+    )
+    seed_parser.add_argument('--batch-size', type=int, default=500, help='每批读取的记录数（默认500）')
+    seed_parser.set_defaults(handler=seed_image_descriptions)
+    
+    migrate_parser = subparsers.add_parser(
+        'migrate',
+        help='升级数据库结构（创建新表、补充新列和索引），并把推荐记录中的诗词迁移到poems表'
+    )
+    migrate_parser.add_argument('--batch-size', type=int, default=500, help='每批处理的记录数（默认500）')
+    migrate_parser.add_argument('--keep-text', action='store_true', help='保留推荐记录中已迁移的诗词字段（默认清空）')
+    migrate_parser.add_argument('--optimize', action='store_true', help='完成后重建recommendations表回收空间（仅MySQL）')
+    migrate_parser.set_defaults(handler=migrate)
+    
+    build_parser = subparsers.add_parser('build-poem-index', help='从推荐记录表重新建立诗词检索索引')
+    build_parser.add_argument('--reset', action='store_true', help='同时清空已导入的古诗词语料')
+    build_parser.set_defaults(handler=build_poem_index)
+    
+    import_parser = subparsers.add_parser(
+        'import-poems',
+        help='导入古诗词语料（JSON数组或JSONL，支持chinese-poetry数据集格式）到诗词检索索引'
+    )
+    import_parser.add_argument('files', nargs='+', help='语料文件路径')
+    import_parser.add_argument('--dynasty', type=str, help='语料中没有朝代字段时使用的朝代')
+    import_parser.set_defaults(handler=import_poems)
+    
+    search_parser = subparsers.add_parser('search-poems', help='在诗词检索索引中搜索诗词')
+    search_parser.add_argument('query', help='搜索关键词')
+    search_parser.add_argument('--page', type=int, default=1, help='页码（默认1）')
+    search_parser.add_argument('--page-size', type=int, default=20, help='每页数量（默认20）')
+    search_parser.add_argument('--dynasty', type=str, help='限定朝代')
+    search_parser.add_argument('--author', type=str, help='限定作者')
+    search_parser.set_defaults(handler=search_poems)
+    
+    list_parser = subparsers.add_parser('list-recommendations', help='按游标分页查询推荐记录')
+    list_parser.add_argument('--user-id', type=int, help='限定用户')
+    list_parser.add_argument('--model', type=str, help='限定AI模型')
+    list_parser.add_argument('--dynasty', type=str, help='限定朝代')
+    list_parser.add_argument('--author', type=str, help='限定作者')
+    list_parser.add_argument('--all', action='store_true', help='包括失败的记录（默认只查询成功的记录）')
+    list_parser.add_argument(
+        '--sort', choices=['created_at_desc', 'created_at_asc'], default='created_at_desc', help='排序方式（默认从新到旧）'
+    )
+    list_parser.add_argument('--page-size', type=int, default=20, help='每页数量（默认20，最大100）')
+    list_parser.add_argument('--cursor', type=str, help='上一页输出的游标')
+    list_parser.set_defaults(handler=list_recommendations)
+    
+    rebuild_stats_parser = subparsers.add_parser(
+        'rebuild-stats',
+        help='从推荐记录重新计算统计汇总表（升级后首次使用或汇总与推荐记录不一致时）'
+    )
+    rebuild_stats_parser.add_argument('--since', type=date_arg, help='起始日期（YYYY-MM-DD，默认最早的记录）')
+    rebuild_stats_parser.add_argument('--until', type=date_arg, help='结束日期（YYYY-MM-DD，包含，默认最新的记录）')
+    rebuild_stats_parser.set_defaults(handler=rebuild_stats)
+    
+    stats_parser = subparsers.add_parser('stats', help='输出推荐统计（读取统计汇总表）')
+    stats_parser.add_argument('--days', type=int, help='只统计最近N天（默认全部）')
+    stats_parser.add_argument('--user-id', type=int, help='只统计该用户')
+    stats_parser.add_argument('--top', type=int, default=10, help='各维度输出的数量（默认10）')
+    stats_parser.set_defaults(handler=show_stats)
+    
+    refill_parser = subparsers.add_parser(
+        'refill-pools',
+        help='为活跃用户补充个性化推荐池（建议由cron在访问低谷时段执行）'
+    )
+    refill_parser.add_argument('--user-id', type=int, action='append', help='只补充指定用户（可重复）')
+    refill_parser.add_argument('--concurrency', type=int, default=4, help='同时为多少个用户生成（默认4）')
+    refill_parser.add_argument('--force', action='store_true', help='不在pool.off_peak时间段内也执行')
+    refill_parser.set_defaults(handler=refill_pools)
+    
+    take_parser = subparsers.add_parser('take-pooled', help='从用户的推荐池中取出一条推荐')
+    take_parser.add_argument('--user-id', type=int, required=True, help='用户ID')
+    take_parser.set_defaults(handler=take_pooled)
+    
+    migrate_images_parser = subparsers.add_parser(
+        'migrate-images',
+        help='把旧版本按用户目录保存的图片迁移到内容寻址的图片存储（需在服务的工作目录下执行）'
+    )
+    migrate_images_parser.add_argument('--batch-size', type=int, default=500, help='每批处理的推荐记录数（默认500）')
+    migrate_images_parser.add_argument('--dry-run', action='store_true', help='只统计，不做修改')
+    migrate_images_parser.set_defaults(handler=migrate_images)
+    
+    gc_parser = subparsers.add_parser('gc-images', help='删除不再被推荐记录引用的图片')
+    gc_parser.add_argument(
+        '--grace-hours', type=float,
+        help='保留最近N小时内保存或复用过的图片（默认为image.gc_grace_hours）'
+    )
+    gc_parser.add_argument('--dry-run', action='store_true', help='只统计，不删除')
+    gc_parser.set_defaults(handler=gc_images)
+    
+    derivatives_parser = subparsers.add_parser('build-derivatives', help='为已保存的图片批量生成缩略图等衍生图片')
+    derivatives_parser.add_argument(
+        '--name', type=str, action='append',
+        help='只生成指定规格（可重复，默认为image.derivatives中的全部规格）'
+    )
+    derivatives_parser.add_argument('--workers', type=int, help='进程数（默认为image.derivative_workers，0表示CPU核数）')
+    derivatives_parser.add_argument('--force', action='store_true', help='重新生成已存在的衍生图片')
+    derivatives_parser.set_defaults(handler=build_derivatives)
+    
+    args = parser.parse_args()
+    
+    from config.settings import settings
+    settings.load(args.config)
+    
+    try:
+        sys.exit(args.handler(args))
+    except Exception as e:
+        logger.error(f"执行失败: {e}", exc_info=True)
+        sys.exit(4)
+
+
+if __name__ == '__main__':
+    main()
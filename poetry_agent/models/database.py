@@ -1,31 +1,66 @@
 """
 数据库连接和会话管理
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert, BigInteger, Integer, DateTime, Table
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import Engine
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, Optional, Dict, Any, List
+import threading
 import logging
 
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
 
-# 创建数据库引擎
-engine = create_engine(
-    settings.db_url,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    echo=False
-)
+# 数据库引擎在首次使用时创建（加载数据库驱动、初始化连接池），
+# 只导入模型定义的代码不需要承担这部分开销
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
 
-# 创建会话工厂
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 创建会话工厂（引擎创建后绑定）
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 # 声明基类
 Base = declarative_base()
 
+# 自增主键类型：MySQL中为BIGINT；SQLite只有INTEGER PRIMARY KEY才会自增
+# （基准测试等离线场景使用SQLite代替MySQL）
+BigIntegerPK = BigInteger().with_variant(Integer, 'sqlite')
+
+# 精确到秒的时间类型：SQLite中默认值func.now()（CURRENT_TIMESTAMP）保存为'YYYY-MM-DD HH:MM:SS'，
+# 而DateTime默认按带微秒的格式绑定参数，按字符串比较时同一时间不相等（翻页游标会重复读到同一条记录）；
+# 与MySQL的DATETIME一样只保存到秒
+DateTimeSeconds = DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    'sqlite'
+)
+
+
+def get_engine() -> Engine:
+    """获取数据库引擎（首次调用时创建）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    settings.db_url,
+                    pool_pre_ping=True,
+                    pool_recycle=3600,
+                    echo=False
+                )
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def __getattr__(name: str):
+    # 兼容 from models.database import engine
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 @contextmanager
 def get_db() -> Generator[Session, None, None]:
@@ -37,6 +72,7 @@ def get_db() -> Generator[Session, None, None]:
             # 使用db进行数据库操作
             pass
     """
+    get_engine()
     db = SessionLocal()
     try:
         yield db
@@ -49,8 +85,40 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def insert_ignore(db: Session, table: Table, values: List[Dict[str, Any]], key: str):
+    """
+    插入多行，唯一键已存在（包括并发写入）的行忽略
+    
+    Args:
+        db: 数据库会话（由调用方负责提交事务）
+        table: 表
+        values: 各行字段字典列表
+        key: 唯一键列名
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = insert(table).prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(table).on_conflict_do_nothing(index_elements=[key])
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=[key])
+    else:
+        stmt = insert(table)
+    db.execute(stmt, values)
+
+
 def init_db():
     """初始化数据库表"""
-    Base.metadata.create_all(bind=engine)
+    # 导入所有模型，确保其表结构已注册到Base.metadata
+    import models.poem  # noqa: F401
+    import models.recommendation  # noqa: F401
+    import models.recommendation_stats  # noqa: F401
+    import models.recommendation_pool  # noqa: F401
+    import models.image_description  # noqa: F401
+    import models.task_log  # noqa: F401
+    
+    Base.metadata.create_all(bind=get_engine())
     logger.info("Database tables created successfully")
 
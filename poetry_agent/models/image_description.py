@@ -0,0 +1,23 @@
+"""
+图片描述数据模型
+"""
+from sqlalchemy import Column, Text, String, Integer, DateTime, func
+
+from models.database import Base, BigIntegerPK
+
+
+class ImageDescription(Base):
+    """图片描述表（按图片内容哈希和感知哈希复用AI识别结果）"""
+    __tablename__ = 'image_descriptions'
+    
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment='主键，自增')
+    content_hash = Column(String(64), nullable=False, unique=True, comment='图片内容SHA-256哈希')
+    perceptual_hash = Column(String(16), nullable=False, comment='图片感知哈希（64位dHash，十六进制）')
+    description = Column(Text, nullable=False, comment='图片内容描述')
+    source = Column(String(20), nullable=False, default='vision', comment='描述来源（vision:AI识别 seed:历史记录导入）')
+    hit_count = Column(Integer, nullable=False, default=0, comment='复用次数')
+    created_at = Column(DateTime, default=func.now(), comment='创建时间')
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
+    
+    def __repr__(self):
+        return f"<ImageDescription(id={self.id}, content_hash={self.content_hash[:12]}, source={self.source})>"
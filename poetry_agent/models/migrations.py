@@ -0,0 +1,163 @@
+"""
+数据库结构升级
+
+create_all只创建不存在的表，不会为已有的表增加新列和索引；这里补充新增的列和索引，
+并把旧推荐记录中的诗词内容迁移到poems表。
+"""
+import logging
+from typing import List
+
+from sqlalchemy import inspect, select, text, update
+
+from models.database import Base, get_db, get_engine, init_db
+from models.poem import upsert_poems
+from models.recommendation import Recommendation
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns() -> List[str]:
+    """
+    为已存在的表补充模型中新增的列（按可空列添加）及其索引
+    
+    Returns:
+        新增的列（表名.列名）
+    """
+    engine = get_engine()
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        index.create(conn)
+            added.append(f"{table.name}.{column.name}")
+            logger.info(f"已添加列 {table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes() -> List[str]:
+    """
+    为已存在的表创建模型中新增的索引（如推荐列表查询使用的组合索引）
+    
+    大表上创建索引需要较长时间，MySQL会在线执行，期间不阻塞读写。
+    
+    Returns:
+        新建的索引名称
+    """
+    engine = get_engine()
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            logger.info(f"正在创建索引 {index.name}")
+            with engine.begin() as conn:
+                index.create(conn)
+            created.append(index.name)
+            logger.info(f"已创建索引 {index.name}")
+    return created
+
+
+def backfill_poems(batch_size: int = 500, clear_text: bool = True) -> int:
+    """
+    将旧推荐记录中的诗词写入poems表并关联poem_id
+    
+    每批在一个事务中完成，中断后重新执行会从尚未关联的记录继续。
+    
+    Args:
+        batch_size: 每批处理的记录数
+        clear_text: 关联后是否清空推荐记录中重复保存的诗词字段
+    
+    Returns:
+        关联的记录数
+    """
+    linked = 0
+    last_id = 0
+    cleared = dict.fromkeys(('poem_title', 'poem_content', 'author', 'dynasty', 'appreciation')) if clear_text else {}
+    
+    while True:
+        with get_db() as db:
+            rows = db.execute(
+                select(
+                    Recommendation.id,
+                    Recommendation.poem_title,
+                    Recommendation.poem_content,
+                    Recommendation.author,
+                    Recommendation.dynasty,
+                    Recommendation.appreciation
+                )
+                .where(
+                    Recommendation.id > last_id,
+                    Recommendation.poem_id.is_(None),
+                    Recommendation.poem_content.isnot(None)
+                )
+                .order_by(Recommendation.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            rows = [row for row in rows if row.poem_content.strip()]
+            poem_ids = upsert_poems(db, [
+                {
+                    'title': row.poem_title,
+                    'content': row.poem_content,
+                    'author': row.author,
+                    'dynasty': row.dynasty,
+                    'appreciation': row.appreciation,
+                }
+                for row in rows
+            ])
+            if rows:
+                db.execute(update(Recommendation), [
+                    {'id': row.id, 'poem_id': poem_id, **cleared}
+                    for row, poem_id in zip(rows, poem_ids)
+                ])
+            linked += len(rows)
+        logger.info(f"已关联 {linked} 条推荐记录（至ID {last_id}）")
+    
+    return linked
+
+
+def migrate(batch_size: int = 500, clear_text: bool = True, optimize: bool = False) -> int:
+    """
+    升级数据库结构：创建新表、补充新列和索引，并回填poems表
+    
+    Args:
+        batch_size: 回填时每批处理的记录数
+        clear_text: 是否清空推荐记录中已迁移的诗词字段
+        optimize: 完成后是否执行 OPTIMIZE TABLE 回收空间（仅MySQL）
+    
+    Returns:
+        回填关联的记录数
+    """
+    init_db()
+    add_missing_columns()
+    add_missing_indexes()
+    linked = backfill_poems(batch_size=batch_size, clear_text=clear_text)
+    
+    engine = get_engine()
+    if optimize and engine.dialect.name == 'mysql':
+        # 清空的大字段占用的空间要重建表后才会释放
+        with engine.begin() as conn:
+            conn.execute(text(f"OPTIMIZE TABLE {Recommendation.__tablename__}"))
+        logger.info("已重建recommendations表并回收空间")
+    return linked
@@ -0,0 +1,105 @@
+"""
+诗词数据模型
+
+同一首诗词（如静夜思、春晓）在推荐记录中会出现成千上万次，正文和赏析只在poems表中保存一份，
+推荐记录通过poem_id引用。诗词按规范化后的标题、作者、正文计算的哈希去重。
+"""
+import hashlib
+import unicodedata
+from typing import Optional, Dict, Any, List, Set
+
+from sqlalchemy import Column, Text, String, DateTime, func, select
+from sqlalchemy.orm import Session
+
+from models.database import Base, BigIntegerPK, insert_ignore
+
+
+class Poem(Base):
+    """诗词表"""
+    __tablename__ = 'poems'
+    
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment='主键，自增')
+    content_hash = Column(String(64), nullable=False, unique=True, comment='规范化的标题、作者、正文的SHA-256哈希')
+    title = Column(String(200), nullable=True, comment='诗词标题')
+    author = Column(String(100), nullable=True, comment='作者')
+    dynasty = Column(String(50), nullable=True, comment='朝代')
+    content = Column(Text, nullable=False, comment='诗词内容')
+    appreciation = Column(Text, nullable=True, comment='赏析内容（首次写入的赏析）')
+    created_at = Column(DateTime, default=func.now(), comment='创建时间')
+    
+    def __repr__(self):
+        return f"<Poem(id={self.id}, title={self.title}, author={self.author})>"
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'author': self.author,
+            'dynasty': self.dynasty,
+            'content': self.content,
+            'appreciation': self.appreciation,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+def _normalize(text: Optional[str]) -> str:
+    """规范化文本：统一全角/半角（NFKC），去除空白和标点"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text)
+    return ''.join(ch for ch in text if unicodedata.category(ch)[0] not in ('P', 'Z', 'C'))
+
+
+def poem_hash(title: Optional[str], author: Optional[str], content: Optional[str]) -> str:
+    """诗词去重哈希：标点、空白、全角半角的差异不影响结果"""
+    raw = '\n'.join((_normalize(title), _normalize(author), _normalize(content)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _select_ids(db: Session, hashes: Set[str], lock: bool = False) -> Dict[str, int]:
+    stmt = select(Poem.content_hash, Poem.id).where(Poem.content_hash.in_(hashes))
+    if lock:
+        # 加锁读取最新提交的数据：MySQL可重复读隔离级别下，普通查询看不到事务开始后其他事务插入的行
+        stmt = stmt.with_for_update(read=True)
+    return {content_hash: poem_id for content_hash, poem_id in db.execute(stmt)}
+
+
+def upsert_poems(db: Session, poems: List[Dict[str, Any]]) -> List[int]:
+    """
+    查找或创建诗词，返回诗词ID
+    
+    已存在的诗词保持不变（包括赏析），不存在的用一条多行INSERT写入。
+    
+    Args:
+        db: 数据库会话（由调用方负责提交事务）
+        poems: 诗词字典列表（title、author、dynasty、content、appreciation）
+    
+    Returns:
+        按poems顺序排列的诗词ID列表
+    """
+    if not poems:
+        return []
+    
+    hashes = [poem_hash(poem.get('title'), poem.get('author'), poem.get('content')) for poem in poems]
+    ids = _select_ids(db, set(hashes))
+    
+    missing: Dict[str, Dict[str, Any]] = {}
+    for content_hash, poem in zip(hashes, poems):
+        if content_hash in ids or content_hash in missing:
+            continue
+        missing[content_hash] = {
+            'content_hash': content_hash,
+            'title': poem.get('title'),
+            'author': poem.get('author'),
+            'dynasty': poem.get('dynasty'),
+            'content': poem.get('content'),
+            'appreciation': poem.get('appreciation'),
+        }
+    
+    if missing:
+        # content_hash已存在（包括并发写入）的行忽略
+        insert_ignore(db, Poem.__table__, list(missing.values()), 'content_hash')
+        ids.update(_select_ids(db, set(missing), lock=True))
+    
+    return [ids[content_hash] for content_hash in hashes]
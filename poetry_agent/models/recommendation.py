@@ -1,24 +1,39 @@
 """
 推荐记录数据模型
 """
-from sqlalchemy import Column, BigInteger, Text, String, Integer, DateTime, func
+from sqlalchemy import Column, BigInteger, Text, String, Integer, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
-from models.database import Base
+from models.database import Base, BigIntegerPK, DateTimeSeconds
+from models.poem import Poem
+
+# 为推荐池预生成、尚未被取出的推荐记录的状态（见models/recommendation_pool.py）。
+# 这类记录不计入统计、推荐列表和诗词索引，取出时改为成功状态
+STATUS_POOLED = 2
 
 
 class Recommendation(Base):
     """推荐记录表"""
     __tablename__ = 'recommendations'
+    # 列表查询（models/recommendation_query.py）按 created_at, id 排序翻页，每种筛选条件都有以created_at结尾的索引，
+    # 不需要额外排序；InnoDB二级索引隐含主键，id不需要写入索引
+    __table_args__ = (
+        Index('ix_recommendations_created_at', 'created_at'),
+        Index('ix_recommendations_status_created_at', 'status', 'created_at'),
+        Index('ix_recommendations_user_status_created_at', 'user_id', 'status', 'created_at'),
+        Index('ix_recommendations_model_status_created_at', 'model_name', 'status', 'created_at'),
+    )
     
-    id = Column(BigInteger, primary_key=True, autoincrement=True, comment='主键，自增')
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment='主键，自增')
     user_id = Column(BigInteger, nullable=True, index=True, comment='用户ID（外键，关联users表）')
     positive_prompt = Column(Text, nullable=True, comment='正向提示词（用户期望的诗词特征）')
     negative_prompt = Column(Text, nullable=True, comment='负向提示词（需要排除的诗词特征）')
     image_path = Column(String(500), nullable=True, comment='图片文件路径（如适用）')
     image_description = Column(Text, nullable=True, comment='图片内容描述（AI识别结果）')
     context = Column(Text, nullable=True, comment='上下文信息')
+    poem_id = Column(BigInteger, ForeignKey('poems.id'), nullable=True, index=True, comment='诗词ID（关联poems表）')
+    # 以下诗词字段仅保留给迁移前的旧记录，新记录的诗词内容保存在poems表中
     poem_title = Column(String(200), nullable=True, comment='诗词标题')
     poem_content = Column(Text, nullable=True, comment='诗词内容')
     author = Column(String(100), nullable=True, comment='作者')
@@ -26,16 +41,25 @@ class Recommendation(Base):
     appreciation = Column(Text, nullable=True, comment='赏析内容')
     model_name = Column(String(100), nullable=True, comment='使用的AI模型')
     model_version = Column(String(50), nullable=True, comment='模型版本')
-    status = Column(Integer, default=0, comment='状态（1:成功 0:失败）')
+    status = Column(Integer, default=0, comment='状态（1:成功 0:失败 2:预生成未取出）')
     error_message = Column(Text, nullable=True, comment='错误信息（如有）')
-    created_at = Column(DateTime, default=func.now(), comment='创建时间')
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
+    latency_ms = Column(Integer, nullable=True, comment='请求耗时（毫秒，从开始处理到保存）')
+    retry_count = Column(Integer, nullable=True, comment='AI接口请求的重试次数')
+    prompt_tokens = Column(Integer, nullable=True, comment='本次请求的输入令牌数（同一请求的多条记录相同）')
+    completion_tokens = Column(Integer, nullable=True, comment='本次请求的输出令牌数（同一请求的多条记录相同）')
+    cache_status = Column(String(20), nullable=True, comment='推荐结果缓存（命中的存储：memory/disk/semantic，未命中：miss）')
+    task_id = Column(BigInteger, nullable=True, index=True, comment='生成该记录的队列任务ID（关联task_logs表，非队列任务为空）')
+    created_at = Column(DateTimeSeconds, default=func.now(), comment='创建时间')
+    updated_at = Column(DateTimeSeconds, default=func.now(), onupdate=func.now(), comment='更新时间')
+    
+    poem = relationship(Poem, lazy='selectin')
     
     def __repr__(self):
         return f"<Recommendation(id={self.id}, user_id={self.user_id}, status={self.status})>"
     
     def to_dict(self):
-        """转换为字典"""
+        """转换为字典（诗词字段优先取自关联的poems记录）"""
+        poem = self.poem
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -44,15 +68,21 @@ class Recommendation(Base):
             'image_path': self.image_path,
             'image_description': self.image_description,
             'context': self.context,
-            'poem_title': self.poem_title,
-            'poem_content': self.poem_content,
-            'author': self.author,
-            'dynasty': self.dynasty,
-            'appreciation': self.appreciation,
+            'poem_title': poem.title if poem else self.poem_title,
+            'poem_content': poem.content if poem else self.poem_content,
+            'author': poem.author if poem else self.author,
+            'dynasty': poem.dynasty if poem else self.dynasty,
+            'appreciation': poem.appreciation if poem else self.appreciation,
             'model_name': self.model_name,
             'model_version': self.model_version,
             'status': self.status,
             'error_message': self.error_message,
+            'latency_ms': self.latency_ms,
+            'retry_count': self.retry_count,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cache_status': self.cache_status,
+            'task_id': self.task_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
@@ -0,0 +1,255 @@
+"""
+个性化推荐池
+
+为活跃用户预先生成推荐（见utils/pool_refiller.py），用户请求个性化推荐时直接从推荐池中取出一条，
+不需要等待AI生成。推荐池记录引用已保存的推荐记录；预生成的推荐记录不关联用户（user_id为空），
+状态为STATUS_POOLED，不计入统计、推荐列表和诗词索引。取出时在同一事务中把推荐记录改为该用户的成功记录
+（创建时间改为取出时间）并累加到统计汇总表，未取出就过期的推荐不会被统计，
+其推荐记录在删除过期的推荐池记录时一并删除。
+
+取出时先用 SELECT ... FOR UPDATE SKIP LOCKED 选出即将过期的一条可用记录，再用带条件的UPDATE标记为已取用，
+同一条推荐只会被取出一次；取用的记录保留到过期，补充时用于排除已推荐过的诗词。
+"""
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Iterable
+
+from sqlalchemy import (
+    Column, BigInteger, Integer, DateTime, ForeignKey, Index, func, select, update, delete, insert
+)
+
+from models.database import Base, BigIntegerPK, get_db
+from models.poem import Poem
+from models.recommendation import Recommendation, STATUS_POOLED
+from models.recommendation_stats import add_to_stats
+
+logger = logging.getLogger(__name__)
+
+# 推荐池记录状态
+POOL_AVAILABLE = 0  # 可用
+POOL_TAKEN = 1      # 已取用
+
+
+class PoolEntry(Base):
+    """个性化推荐池表"""
+    __tablename__ = 'recommendation_pool'
+    __table_args__ = (
+        Index('ix_recommendation_pool_user_status_expires', 'user_id', 'status', 'expires_at'),
+    )
+    
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment='主键，自增')
+    user_id = Column(BigInteger, nullable=False, comment='用户ID（外键，关联users表）')
+    recommendation_id = Column(BigInteger, ForeignKey('recommendations.id'), nullable=False, comment='预生成的推荐记录ID')
+    poem_id = Column(BigInteger, nullable=True, comment='诗词ID（关联poems表）')
+    status = Column(Integer, nullable=False, default=POOL_AVAILABLE, comment='状态（0:可用 1:已取用）')
+    expires_at = Column(DateTime, nullable=False, index=True, comment='过期时间')
+    taken_at = Column(DateTime, nullable=True, comment='取用时间')
+    created_at = Column(DateTime, default=func.now(), comment='创建时间')
+    
+    def __repr__(self):
+        return f"<PoolEntry(id={self.id}, user_id={self.user_id}, status={self.status})>"
+
+
+class RecommendationPool:
+    """个性化推荐池"""
+    
+    def take_next(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        取出用户的下一条可用推荐（最先过期的一条）
+        
+        Returns:
+            推荐内容（pool_id、recommendation_id、poem_id、poem_title、poem_content、author、dynasty、
+            appreciation、model_name、created_at），没有可用的推荐时返回None
+        """
+        with get_db() as db:
+            now = self._now(db)
+            available = (
+                PoolEntry.user_id == user_id,
+                PoolEntry.status == POOL_AVAILABLE,
+                PoolEntry.expires_at > now
+            )
+            # 并发取用时候选记录可能刚被其他请求抢占，换下一条重试
+            for _ in range(3):
+                entry_id = db.execute(
+                    select(PoolEntry.id)
+                    .where(*available)
+                    .order_by(PoolEntry.expires_at, PoolEntry.id)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                ).scalar()
+                if entry_id is None:
+                    return None
+                result = db.execute(
+                    update(PoolEntry)
+                    .where(PoolEntry.id == entry_id, PoolEntry.status == POOL_AVAILABLE)
+                    .values(status=POOL_TAKEN, taken_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    break
+            else:
+                return None
+            
+            row = db.execute(
+                select(
+                    PoolEntry.id.label('pool_id'),
+                    PoolEntry.recommendation_id,
+                    PoolEntry.poem_id,
+                    Poem.title.label('poem_title'),
+                    Poem.content.label('poem_content'),
+                    Poem.author,
+                    Poem.dynasty,
+                    Poem.appreciation,
+                    Recommendation.model_name,
+                    Recommendation.created_at,
+                    Recommendation.latency_ms,
+                    Recommendation.prompt_tokens,
+                    Recommendation.completion_tokens,
+                    Recommendation.cache_status,
+                )
+                .join(Recommendation, Recommendation.id == PoolEntry.recommendation_id)
+                .outerjoin(Poem, Poem.id == PoolEntry.poem_id)
+                .where(PoolEntry.id == entry_id)
+            ).one()
+            record = dict(row._mapping, id=row.recommendation_id, user_id=user_id, status=1)
+            # 预生成的推荐记录在取出时才成为用户的推荐，此时计入统计
+            activated = db.execute(
+                update(Recommendation)
+                .where(Recommendation.id == row.recommendation_id, Recommendation.status == STATUS_POOLED)
+                .values(status=1, user_id=user_id, created_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount == 1
+            if activated:
+                record['created_at'] = now
+                add_to_stats(db, [record], day=now.date())
+        
+        # 本进程已加载诗词索引时加入索引（其他进程在重建索引时读到）
+        if activated and 'utils.poem_index' in sys.modules:
+            from utils.poem_index import peek_poem_index
+            index = peek_poem_index()
+            if index is not None:
+                index.add_recommendations([record])
+        
+        item = {
+            key: record[key]
+            for key in (
+                'pool_id', 'recommendation_id', 'poem_id', 'poem_title', 'poem_content', 'author', 'dynasty',
+                'appreciation', 'model_name', 'created_at'
+            )
+        }
+        item['created_at'] = item['created_at'].isoformat() if item['created_at'] else None
+        return item
+    
+    def add(self, user_id: int, entries: List[Dict[str, Any]], ttl_hours: float) -> int:
+        """
+        加入预生成的推荐
+        
+        Args:
+            user_id: 用户ID
+            entries: 推荐记录列表（recommendation_id、poem_id）
+            ttl_hours: 有效期（小时）
+        
+        Returns:
+            加入的数量
+        """
+        if not entries:
+            return 0
+        with get_db() as db:
+            expires_at = self._now(db) + timedelta(hours=ttl_hours)
+            db.execute(insert(PoolEntry), [
+                {
+                    'user_id': user_id,
+                    'recommendation_id': entry['recommendation_id'],
+                    'poem_id': entry.get('poem_id'),
+                    'status': POOL_AVAILABLE,
+                    'expires_at': expires_at,
+                }
+                for entry in entries
+            ])
+        return len(entries)
+    
+    def available_counts(self, user_ids: Iterable[int]) -> Dict[int, int]:
+        """各用户可用（未取用、未过期）的推荐数"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        with get_db() as db:
+            now = self._now(db)
+            rows = db.execute(
+                select(PoolEntry.user_id, func.count())
+                .where(
+                    PoolEntry.user_id.in_(user_ids),
+                    PoolEntry.status == POOL_AVAILABLE,
+                    PoolEntry.expires_at > now
+                )
+                .group_by(PoolEntry.user_id)
+            ).all()
+        counts = dict.fromkeys(user_ids, 0)
+        counts.update({user_id: count for user_id, count in rows})
+        return counts
+    
+    def pooled_poems(self, user_id: int) -> List[Dict[str, Any]]:
+        """用户推荐池中未过期的诗词（含已取用的），补充时用于排除"""
+        with get_db() as db:
+            now = self._now(db)
+            rows = db.execute(
+                select(Poem.id, Poem.title, Poem.author)
+                .join(PoolEntry, PoolEntry.poem_id == Poem.id)
+                .where(PoolEntry.user_id == user_id, PoolEntry.expires_at > now)
+                .order_by(PoolEntry.id)
+            ).all()
+        return [{'poem_id': row.id, 'title': row.title, 'author': row.author} for row in rows]
+    
+    def discard(self, recommendation_ids: List[int]) -> int:
+        """
+        删除没有加入推荐池的预生成推荐记录（如重复的诗词），已取出的记录不受影响
+        
+        Returns:
+            删除的推荐记录数
+        """
+        if not recommendation_ids:
+            return 0
+        with get_db() as db:
+            return self._delete_pooled(db, recommendation_ids)
+    
+    def purge_expired(self, batch_size: int = 1000) -> int:
+        """
+        删除已过期的推荐池记录，以及其中未取出的预生成推荐记录（已取出的推荐记录保留）
+        
+        Returns:
+            删除的推荐池记录数
+        """
+        purged = 0
+        discarded = 0
+        while True:
+            with get_db() as db:
+                now = self._now(db)
+                rows = db.execute(
+                    select(PoolEntry.id, PoolEntry.recommendation_id)
+                    .where(PoolEntry.expires_at <= now)
+                    .limit(batch_size)
+                ).all()
+                if rows:
+                    db.execute(delete(PoolEntry).where(PoolEntry.id.in_([row.id for row in rows])))
+                    discarded += self._delete_pooled(db, [row.recommendation_id for row in rows])
+            purged += len(rows)
+            if len(rows) < batch_size:
+                break
+        if purged:
+            logger.info(f"已删除 {purged} 条过期的推荐池记录，{discarded} 条未取出的推荐记录")
+        return purged
+    
+    @staticmethod
+    def _delete_pooled(db, recommendation_ids: List[int]) -> int:
+        """删除仍为预生成状态的推荐记录（在同一事务中先删除引用它们的推荐池记录）"""
+        return db.execute(
+            delete(Recommendation)
+            .where(Recommendation.id.in_(recommendation_ids), Recommendation.status == STATUS_POOLED)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    
+    @staticmethod
+    def _now(db) -> datetime:
+        """使用数据库时间计算有效期，避免各主机时钟不一致"""
+        return db.execute(select(func.now(type_=DateTime))).scalar()
@@ -0,0 +1,203 @@
+"""
+推荐记录查询（推荐列表和推荐详情接口）
+
+列表按 created_at, id 排序，用游标（上一页最后一条记录的位置）翻页：每页都从索引中的位置直接开始读取，
+翻到多深都只读取page_size条记录，不会像OFFSET那样先扫描并丢弃前面的所有记录。
+同一批写入的记录created_at相同，排序和游标都带上id，保证翻页时不重复也不遗漏。
+
+列表只查询标题、作者、朝代等短字段，不读取诗词正文和赏析等大字段；完整内容通过推荐详情获取。
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from models.poem import Poem
+from models.recommendation import Recommendation
+
+# 支持的排序方式
+SORT_DESC = 'created_at_desc'
+SORT_ASC = 'created_at_asc'
+
+# 每页最大数量
+MAX_PAGE_SIZE = 100
+
+# 成功的推荐记录（列表默认只返回成功的记录）
+STATUS_SUCCESS = 1
+
+# 列表返回的字段：诗词字段优先取自关联的poems记录，未迁移的旧记录取自推荐记录
+LIST_COLUMNS = (
+    Recommendation.id,
+    Recommendation.user_id,
+    Recommendation.poem_id,
+    func.coalesce(Poem.title, Recommendation.poem_title).label('poem_title'),
+    func.coalesce(Poem.author, Recommendation.author).label('author'),
+    func.coalesce(Poem.dynasty, Recommendation.dynasty).label('dynasty'),
+    Recommendation.image_path,
+    Recommendation.model_name,
+    Recommendation.status,
+    Recommendation.created_at,
+)
+
+
+class InvalidCursorError(ValueError):
+    """游标格式错误，或与排序方式不匹配"""
+
+
+def encode_cursor(created_at: datetime, record_id: int, sort: str = SORT_DESC) -> str:
+    """把记录位置编码为游标字符串（调用方不需要解析其内容）"""
+    raw = json.dumps([sort, created_at.isoformat(), record_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str = SORT_DESC) -> Tuple[datetime, int]:
+    """
+    解析游标
+    
+    Returns:
+        (created_at, id)
+    
+    Raises:
+        InvalidCursorError: 游标无效或不是按sort排序时生成的
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, created_at, record_id = json.loads(raw.decode('utf-8'))
+        position = (datetime.fromisoformat(created_at), int(record_id))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise InvalidCursorError(f"无效的游标: {cursor}") from e
+    if cursor_sort != sort:
+        raise InvalidCursorError(f"游标的排序方式 {cursor_sort} 与请求的排序方式 {sort} 不一致")
+    return position
+
+
+def list_recommendations(
+    db: Session,
+    user_id: Optional[int] = None,
+    status: Optional[int] = STATUS_SUCCESS,
+    model_name: Optional[str] = None,
+    dynasty: Optional[str] = None,
+    author: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    sort: str = SORT_DESC,
+    page_size: int = 10,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    分页查询推荐列表
+    
+    Args:
+        db: 数据库会话
+        user_id: 限定用户
+        status: 限定状态（默认只返回成功的记录，None表示不限）
+        model_name: 限定AI模型
+        dynasty: 限定朝代
+        author: 限定作者
+        since: 创建时间下限（包含）
+        until: 创建时间上限（不包含）
+        sort: 排序方式（created_at_desc/created_at_asc）
+        page_size: 每页数量（最大100）
+        cursor: 上一页返回的next_cursor，为空时返回第一页
+    
+    Returns:
+        {'page_size': 每页数量, 'items': 推荐列表, 'next_cursor': 下一页的游标（没有下一页时为None）}
+    
+    Raises:
+        ValueError: 排序方式不支持
+        InvalidCursorError: 游标无效
+    """
+    if sort not in (SORT_DESC, SORT_ASC):
+        raise ValueError(f"不支持的排序方式: {sort}")
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    descending = sort == SORT_DESC
+    
+    conditions = [Recommendation.created_at.isnot(None)]
+    if user_id is not None:
+        conditions.append(Recommendation.user_id == user_id)
+    if status is not None:
+        conditions.append(Recommendation.status == status)
+    if model_name:
+        conditions.append(Recommendation.model_name == model_name)
+    if dynasty:
+        conditions.append(func.coalesce(Poem.dynasty, Recommendation.dynasty) == dynasty)
+    if author:
+        conditions.append(func.coalesce(Poem.author, Recommendation.author) == author)
+    if since is not None:
+        conditions.append(Recommendation.created_at >= since)
+    if until is not None:
+        conditions.append(Recommendation.created_at < until)
+    if cursor:
+        created_at, record_id = decode_cursor(cursor, sort)
+        # 展开为 created_at 的范围条件加上同一时间内按id比较，MySQL可以直接用作索引范围扫描
+        if descending:
+            conditions.append(and_(
+                Recommendation.created_at <= created_at,
+                or_(Recommendation.created_at < created_at, Recommendation.id < record_id)
+            ))
+        else:
+            conditions.append(and_(
+                Recommendation.created_at >= created_at,
+                or_(Recommendation.created_at > created_at, Recommendation.id > record_id)
+            ))
+    
+    order = (Recommendation.created_at.desc(), Recommendation.id.desc()) if descending \
+        else (Recommendation.created_at.asc(), Recommendation.id.asc())
+    stmt = (
+        select(*LIST_COLUMNS)
+        .outerjoin(Poem, Poem.id == Recommendation.poem_id)
+        .where(*conditions)
+        .order_by(*order)
+        .limit(page_size + 1)
+    )
+    rows = db.execute(stmt).all()
+    
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id, sort)
+    
+    return {
+        'page_size': page_size,
+        'items': [_list_item(row) for row in rows],
+        'next_cursor': next_cursor,
+    }
+
+
+def get_recommendation(db: Session, recommendation_id: int) -> Optional[Dict[str, Any]]:
+    """查询推荐详情（含诗词正文和赏析），记录不存在时返回None"""
+    recommendation = db.get(Recommendation, recommendation_id)
+    return recommendation.to_dict() if recommendation else None
+
+
+def recent_history(db: Session, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    用户最近的成功推荐（提示词、上下文和诗词的标题、作者、朝代），按时间从新到旧排列
+    
+    用于推断用户的阅读偏好，不读取诗词正文和赏析。
+    """
+    stmt = (
+        select(
+            Recommendation.positive_prompt,
+            Recommendation.context,
+            Recommendation.poem_id,
+            func.coalesce(Poem.title, Recommendation.poem_title).label('poem_title'),
+            func.coalesce(Poem.author, Recommendation.author).label('author'),
+            func.coalesce(Poem.dynasty, Recommendation.dynasty).label('dynasty'),
+        )
+        .outerjoin(Poem, Poem.id == Recommendation.poem_id)
+        .where(Recommendation.user_id == user_id, Recommendation.status == STATUS_SUCCESS)
+        .order_by(Recommendation.created_at.desc(), Recommendation.id.desc())
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in db.execute(stmt)]
+
+
+def _list_item(row) -> Dict[str, Any]:
+    item = dict(row._mapping)
+    item['created_at'] = item['created_at'].isoformat() if item['created_at'] else None
+    return item
@@ -0,0 +1,333 @@
+"""
+推荐统计汇总
+
+统计接口和管理后台仪表盘需要按日期、模型、状态、朝代、作者和用户统计推荐数量。每次都对recommendations表
+COUNT/GROUP BY 的耗时随记录数增长，这里改为维护汇总表：写入推荐记录时在同一事务中把各维度的计数累加到
+recommendation_stats表（每天、每个维度值、每个状态一行），统计查询只读取汇总表，耗时只与汇总行数有关。
+汇总表缺失或与推荐记录不一致时（如升级前的旧数据、手工修改过推荐记录）用 rebuild_stats 重新计算。
+
+统计按推荐记录计数：一次请求推荐多首诗词时每首计一次，失败的请求计一次。
+推荐池预生成的记录在取出时才计入（取出时创建时间改为取出时间），未取出的不计入。
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import Column, String, Integer, BigInteger, Date, func, insert, select, delete
+from sqlalchemy.orm import Session
+
+from models.database import Base, get_db
+from models.poem import Poem
+from models.recommendation import Recommendation, STATUS_POOLED
+
+logger = logging.getLogger(__name__)
+
+# 统计维度：全部记录、AI模型、朝代、作者、用户（匿名用户和没有朝代、作者的记录不计入对应维度）
+DIMENSIONS = ('all', 'model', 'dynasty', 'author', 'user')
+
+# 累加的统计列
+SUM_COLUMNS = (
+    'count',
+    'latency_ms_sum',
+    'latency_count',
+    'prompt_tokens_sum',
+    'completion_tokens_sum',
+    'cache_hits',
+)
+
+
+class RecommendationStat(Base):
+    """推荐统计汇总表"""
+    __tablename__ = 'recommendation_stats'
+    
+    day = Column(Date, primary_key=True, comment='日期（推荐记录的创建日期）')
+    dimension = Column(String(20), primary_key=True, comment='统计维度（all/model/dynasty/author/user）')
+    value = Column(String(100), primary_key=True, comment='维度值（模型名称、朝代、作者、用户ID，all维度为空字符串）')
+    status = Column(Integer, primary_key=True, comment='状态（1:成功 0:失败）')
+    count = Column(BigInteger, nullable=False, default=0, comment='推荐记录数')
+    latency_ms_sum = Column(BigInteger, nullable=False, default=0, comment='请求耗时之和（毫秒）')
+    latency_count = Column(BigInteger, nullable=False, default=0, comment='记录了请求耗时的记录数')
+    prompt_tokens_sum = Column(BigInteger, nullable=False, default=0, comment='输入令牌数之和')
+    completion_tokens_sum = Column(BigInteger, nullable=False, default=0, comment='输出令牌数之和')
+    cache_hits = Column(BigInteger, nullable=False, default=0, comment='命中推荐结果缓存的记录数')
+    
+    def __repr__(self):
+        return f"<RecommendationStat(day={self.day}, dimension={self.dimension}, value={self.value}, count={self.count})>"
+
+
+def _dimension_values(row: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """一条推荐记录计入的 (维度, 维度值)"""
+    values = [('all', '')]
+    if row.get('model_name'):
+        values.append(('model', row['model_name'][:100]))
+    if row.get('dynasty'):
+        values.append(('dynasty', row['dynasty'][:100]))
+    if row.get('author'):
+        values.append(('author', row['author'][:100]))
+    if row.get('user_id') is not None:
+        values.append(('user', str(row['user_id'])))
+    return values
+
+
+def _row_sums(row: Dict[str, Any]) -> Tuple[int, ...]:
+    latency_ms = row.get('latency_ms')
+    cache_status = row.get('cache_status')
+    return (
+        1,
+        latency_ms or 0,
+        1 if latency_ms is not None else 0,
+        row.get('prompt_tokens') or 0,
+        row.get('completion_tokens') or 0,
+        1 if cache_status and cache_status != 'miss' else 0,
+    )
+
+
+def aggregate_rows(rows: List[Dict[str, Any]]) -> Dict[Tuple[str, str, int], List[int]]:
+    """按 (维度, 维度值, 状态) 汇总推荐记录，返回各汇总行的累加值（顺序同SUM_COLUMNS）"""
+    buckets: Dict[Tuple[str, str, int], List[int]] = defaultdict(lambda: [0] * len(SUM_COLUMNS))
+    for row in rows:
+        sums = _row_sums(row)
+        status = row.get('status') or 0
+        for dimension, value in _dimension_values(row):
+            bucket = buckets[(dimension, value, status)]
+            for i, amount in enumerate(sums):
+                bucket[i] += amount
+    return buckets
+
+
+def _upsert(db: Session, values: List[Dict[str, Any]]):
+    """插入汇总行，已存在的行累加各统计列"""
+    table = RecommendationStat.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(values)
+        stmt = stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in SUM_COLUMNS})
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key.columns],
+            set_={name: table.c[name] + stmt.excluded[name] for name in SUM_COLUMNS}
+        )
+    else:
+        # 其他数据库逐行查找后插入或累加（并发写入同一汇总行时可能冲突）
+        today = None
+        for row in values:
+            if not isinstance(row['day'], date):
+                today = today or db.execute(select(func.current_date())).scalar()
+                row = dict(row, day=today)
+            existing = db.get(RecommendationStat, (row['day'], row['dimension'], row['value'], row['status']))
+            if existing is None:
+                db.execute(insert(table).values(row))
+            else:
+                for name in SUM_COLUMNS:
+                    setattr(existing, name, getattr(existing, name) + row[name])
+        return
+    db.execute(stmt)
+
+
+def add_to_stats(db: Session, rows: List[Dict[str, Any]], day: Optional[date] = None):
+    """
+    把新写入的推荐记录累加到汇总表
+    
+    Args:
+        db: 写入推荐记录的数据库会话（在同一事务中更新汇总表，由调用方提交）
+        rows: 推荐记录字段字典列表（含诗词的朝代和作者）
+        day: 统计日期，默认为数据库的当前日期（与推荐记录created_at的默认值一致）
+    """
+    if not rows:
+        return
+    buckets = aggregate_rows(rows)
+    day_value = day if day is not None else func.current_date()
+    # 按主键顺序写入：并发事务以相同的顺序加锁，避免死锁
+    values = [
+        {'day': day_value, 'dimension': dimension, 'value': value, 'status': status,
+         **dict(zip(SUM_COLUMNS, sums))}
+        for (dimension, value, status), sums in sorted(buckets.items())
+    ]
+    _upsert(db, values)
+
+
+def _day_rows(db: Session, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """读取一天内各维度汇总所需的字段（不读取诗词正文等大字段）"""
+    stmt = (
+        select(
+            Recommendation.user_id,
+            Recommendation.model_name,
+            Recommendation.status,
+            func.coalesce(Poem.dynasty, Recommendation.dynasty).label('dynasty'),
+            func.coalesce(Poem.author, Recommendation.author).label('author'),
+            Recommendation.latency_ms,
+            Recommendation.prompt_tokens,
+            Recommendation.completion_tokens,
+            Recommendation.cache_status,
+        )
+        .outerjoin(Poem, Poem.id == Recommendation.poem_id)
+        .where(
+            Recommendation.created_at >= start,
+            Recommendation.created_at < end,
+            Recommendation.status != STATUS_POOLED
+        )
+    )
+    return [dict(row._mapping) for row in db.execute(stmt)]
+
+
+def rebuild_stats(since: Optional[date] = None, until: Optional[date] = None) -> int:
+    """
+    从推荐记录重新计算汇总表
+    
+    按天处理，每天在一个事务中删除当天的汇总行并重新写入，中断后重新执行即可。
+    
+    Args:
+        since: 起始日期（包含），默认为最早的推荐记录的日期
+        until: 结束日期（包含），默认为最新的推荐记录的日期
+    
+    Returns:
+        重新计算的推荐记录数
+    """
+    with get_db() as db:
+        first, last = db.execute(select(func.min(Recommendation.created_at), func.max(Recommendation.created_at))).one()
+    if since is None and until is None:
+        # 全部重新计算时，同时删除已没有推荐记录的日期的汇总行
+        with get_db() as db:
+            stmt = delete(RecommendationStat)
+            if first is not None:
+                stmt = stmt.where((RecommendationStat.day < first.date()) | (RecommendationStat.day > last.date()))
+            db.execute(stmt)
+    if first is None:
+        logger.info("没有推荐记录")
+        return 0
+    day = since or first.date()
+    until = until or last.date()
+    
+    total = 0
+    while day <= until:
+        start = datetime.combine(day, datetime.min.time())
+        with get_db() as db:
+            db.execute(delete(RecommendationStat).where(RecommendationStat.day == day))
+            rows = _day_rows(db, start, start + timedelta(days=1))
+            add_to_stats(db, rows, day=day)
+        if rows:
+            logger.info(f"{day}: {len(rows)} 条推荐记录")
+        total += len(rows)
+        day += timedelta(days=1)
+    return total
+
+
+def _range_conditions(since: Optional[date], until: Optional[date]) -> list:
+    conditions = []
+    if since is not None:
+        conditions.append(RecommendationStat.day >= since)
+    if until is not None:
+        conditions.append(RecommendationStat.day < until)
+    return conditions
+
+
+def _sum_columns():
+    return [func.sum(RecommendationStat.__table__.c[name]).label(name) for name in SUM_COLUMNS]
+
+
+def _to_figures(totals: Dict[int, Any]) -> Dict[str, Any]:
+    """把按状态汇总的行转换为统计数字"""
+    empty = dict.fromkeys(SUM_COLUMNS, 0)
+    success = totals.get(1, empty)
+    failed = totals.get(0, empty)
+    sums = {name: int(success[name] or 0) + int(failed[name] or 0) for name in SUM_COLUMNS}
+    total = sums['count']
+    return {
+        'total': total,
+        'success': int(success['count'] or 0),
+        'failed': int(failed['count'] or 0),
+        'success_rate': round(int(success['count'] or 0) / total, 4) if total else None,
+        'avg_latency_ms': round(sums['latency_ms_sum'] / sums['latency_count'], 1) if sums['latency_count'] else None,
+        'prompt_tokens': sums['prompt_tokens_sum'],
+        'completion_tokens': sums['completion_tokens_sum'],
+        'cache_hit_rate': round(sums['cache_hits'] / total, 4) if total else None,
+    }
+
+
+def get_summary(
+    db: Session,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    user_id: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    推荐总数、成功率、平均耗时、令牌用量和缓存命中率
+    
+    Args:
+        db: 数据库会话
+        since: 起始日期（包含）
+        until: 结束日期（不包含）
+        user_id: 只统计该用户的推荐
+    
+    Returns:
+        {'total', 'success', 'failed', 'success_rate', 'avg_latency_ms', 'prompt_tokens', 'completion_tokens', 'cache_hit_rate'}
+    """
+    dimension, value = ('user', str(user_id)) if user_id is not None else ('all', '')
+    stmt = (
+        select(RecommendationStat.status, *_sum_columns())
+        .where(RecommendationStat.dimension == dimension, RecommendationStat.value == value,
+               *_range_conditions(since, until))
+        .group_by(RecommendationStat.status)
+    )
+    return _to_figures({row.status: row._mapping for row in db.execute(stmt)})
+
+
+def count_by(
+    db: Session,
+    dimension: str,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    按维度（model/dynasty/author/user）统计，按推荐数从多到少排列
+    
+    Returns:
+        每个维度值的统计（字段同get_summary，另加value）
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"不支持的统计维度: {dimension}（可选 {', '.join(DIMENSIONS)}）")
+    stmt = (
+        select(RecommendationStat.value, RecommendationStat.status, *_sum_columns())
+        .where(RecommendationStat.dimension == dimension, *_range_conditions(since, until))
+        .group_by(RecommendationStat.value, RecommendationStat.status)
+    )
+    grouped: Dict[str, Dict[int, Any]] = defaultdict(dict)
+    for row in db.execute(stmt):
+        grouped[row.value][row.status] = row._mapping
+    items = [{'value': value, **_to_figures(totals)} for value, totals in grouped.items()]
+    items.sort(key=lambda item: (-item['total'], item['value']))
+    return items[:limit] if limit else items
+
+
+def daily_counts(
+    db: Session,
+    since: Optional[date] = None,
+    until: Optional[date] = None
+) -> List[Dict[str, Any]]:
+    """每天的推荐数、成功数和成功率，按日期排列"""
+    stmt = (
+        select(RecommendationStat.day, RecommendationStat.status, *_sum_columns())
+        .where(RecommendationStat.dimension == 'all', *_range_conditions(since, until))
+        .group_by(RecommendationStat.day, RecommendationStat.status)
+    )
+    grouped: Dict[date, Dict[int, Any]] = defaultdict(dict)
+    for row in db.execute(stmt):
+        grouped[row.day][row.status] = row._mapping
+    return [{'day': day.isoformat(), **_to_figures(grouped[day])} for day in sorted(grouped)]
+
+
+def active_users(db: Session, since: Optional[date] = None, until: Optional[date] = None) -> int:
+    """时间范围内有推荐记录的用户数"""
+    stmt = (
+        select(func.count(func.distinct(RecommendationStat.value)))
+        .where(RecommendationStat.dimension == 'user', *_range_conditions(since, until))
+    )
+    return db.execute(stmt).scalar() or 0
@@ -0,0 +1,287 @@
+"""
+推荐记录批量写入
+
+一次请求生成的多首诗词（批量模式下还包括多个请求）在同一个事务中用一条多行INSERT写入，
+并返回生成的记录ID：支持RETURNING的数据库直接返回，MySQL根据LAST_INSERT_ID()推算连续的自增ID
+（只有自增配置不保证ID连续时才改为逐行INSERT，见_has_consecutive_ids）。
+诗词内容在同一事务中写入poems表（已存在的直接复用），推荐记录只保存poem_id；
+统计汇总表（models/recommendation_stats.py）也在同一事务中更新。
+"""
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from models.database import get_db
+from models.poem import upsert_poems
+from models.recommendation import Recommendation, STATUS_POOLED
+from models.recommendation_stats import add_to_stats
+from models.task_queue import check_leases
+
+logger = logging.getLogger(__name__)
+
+# 可写入的字段，每行都补齐为相同的字段集合，才能合并成一条多行INSERT
+RECOMMENDATION_FIELDS = (
+    'user_id',
+    'positive_prompt',
+    'negative_prompt',
+    'image_path',
+    'image_description',
+    'context',
+    'poem_id',
+    'poem_title',
+    'poem_content',
+    'author',
+    'dynasty',
+    'appreciation',
+    'model_name',
+    'model_version',
+    'status',
+    'error_message',
+    'latency_ms',
+    'retry_count',
+    'prompt_tokens',
+    'completion_tokens',
+    'cache_status',
+    'task_id',
+)
+
+# 各数据库的单条多行INSERT是否生成连续的自增ID（数据库URL -> 是否连续），首次写入时查询
+_consecutive_ids: Dict[str, bool] = {}
+
+# 推荐记录字段 -> poems表字段
+POEM_FIELDS = {
+    'poem_title': 'title',
+    'poem_content': 'content',
+    'author': 'author',
+    'dynasty': 'dynasty',
+    'appreciation': 'appreciation',
+}
+
+
+def link_poems(db: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    将记录中的诗词写入poems表，返回以poem_id代替诗词字段的新记录列表（不修改rows）
+    
+    没有诗词内容的记录（如失败记录）原样返回。
+    """
+    positions = [i for i, row in enumerate(rows) if row.get('poem_content') and not row.get('poem_id')]
+    if not positions:
+        return rows
+    
+    poem_ids = upsert_poems(db, [
+        {poem_field: rows[i].get(field) for field, poem_field in POEM_FIELDS.items()}
+        for i in positions
+    ])
+    linked = list(rows)
+    for i, poem_id in zip(positions, poem_ids):
+        row = {field: value for field, value in rows[i].items() if field not in POEM_FIELDS}
+        row['poem_id'] = poem_id
+        linked[i] = row
+    return linked
+
+
+def _has_consecutive_ids(db: Session) -> bool:
+    """
+    MySQL的单条多行INSERT是否生成连续的自增ID
+    
+    行数已知的多行INSERT在auto_increment_increment为1、innodb_autoinc_lock_mode为0或1时一次分配连续的ID，
+    LAST_INSERT_ID()为第一行的ID；innodb_autoinc_lock_mode=2时与并发写入交错分配，ID可能不连续。
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != 'mysql':
+        return False
+    key = str(bind.engine.url)
+    if key not in _consecutive_ids:
+        increment, lock_mode = db.execute(
+            text('SELECT @@auto_increment_increment, @@innodb_autoinc_lock_mode')
+        ).one()
+        _consecutive_ids[key] = int(increment) == 1 and int(lock_mode) <= 1
+        if not _consecutive_ids[key]:
+            logger.warning(
+                f"auto_increment_increment={increment}、innodb_autoinc_lock_mode={lock_mode}，"
+                f"多行INSERT的自增ID可能不连续，推荐记录改为逐行写入"
+            )
+    return _consecutive_ids[key]
+
+
+def insert_recommendations(db: Session, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    用一条多行INSERT写入推荐记录，并累加到统计汇总表（推荐池预生成的记录除外）
+    
+    Args:
+        db: 数据库会话（由调用方负责提交事务）
+        rows: 记录字段字典列表（队列任务的记录带有task_id和lease_owner）
+    
+    Returns:
+        按rows顺序排列的记录ID列表
+    
+    Raises:
+        LeaseLostError: 队列任务的租约已不属于lease_owner
+    """
+    if not rows:
+        return []
+    
+    # 队列任务的记录只在租约仍有效时写入（与写入在同一事务中检查），
+    # 租约过期后被其他worker接管的任务不会写入两份结果
+    check_leases(db, rows)
+    
+    table = Recommendation.__table__
+    linked = link_poems(db, rows)
+    values = [{field: row.get(field) for field in RECOMMENDATION_FIELDS} for row in linked]
+    dialect = db.get_bind().dialect
+    
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        # 支持RETURNING的数据库（SQLite、PostgreSQL、MariaDB）直接返回ID
+        result = db.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), values)
+        ids = [row[0] for row in result]
+    elif _has_consecutive_ids(db):
+        # MySQL：单条多行INSERT生成的自增ID是连续的，LAST_INSERT_ID()为第一行的ID
+        first_id = db.execute(insert(table).values(values)).lastrowid
+        ids = list(range(first_id, first_id + len(values)))
+    else:
+        # 自增ID可能不连续时无法从第一行的ID推算，逐行INSERT并取各自的ID
+        ids = [db.execute(insert(table).values(value)).lastrowid for value in values]
+    
+    # 汇总表的行被所有写入共用，最后更新以缩短持有行锁的时间；
+    # 推荐池预生成的记录在取出时才计入（RecommendationPool.take_next）
+    add_to_stats(db, [row for row in rows if row.get('status') != STATUS_POOLED])
+    return ids
+
+
+class RecommendationWriter:
+    """推荐记录写入器：每次调用在一个事务中写入一组记录"""
+    
+    def write(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        写入一组推荐记录
+        
+        Args:
+            rows: 记录字段字典列表
+        
+        Returns:
+            按rows顺序排列的记录ID列表
+        """
+        if not rows:
+            return []
+        with get_db() as db:
+            return insert_recommendations(db, rows)
+    
+    def close(self):
+        pass
+
+
+class BufferedRecommendationWriter(RecommendationWriter):
+    """
+    缓冲写入器：汇总多个调用方提交的记录，在后台线程中合并为一个事务写入
+    
+    缓冲区达到max_rows条记录，或最早的记录已等待max_delay秒时写入。
+    write()会阻塞到所属的记录写入完成，并返回这些记录的ID。
+    """
+    
+    def __init__(self, max_rows: int = 200, max_delay: float = 0.05):
+        """
+        Args:
+            max_rows: 单个事务最多写入的记录数
+            max_delay: 记录在缓冲区中的最长等待时间（秒）
+        """
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._pending: List[Tuple[List[Dict[str, Any]], Future]] = []
+        self._pending_rows = 0
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='recommendation-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, rows: List[Dict[str, Any]]) -> Future:
+        """
+        提交一组记录，返回在写入完成后得到记录ID列表的Future
+        """
+        future = Future()
+        if not rows:
+            future.set_result([])
+            return future
+        
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("写入器已关闭")
+            self._pending.append((rows, future))
+            self._pending_rows += len(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._condition.notify()
+        return future
+    
+    def write(self, rows: List[Dict[str, Any]]) -> List[int]:
+        return self.submit(rows).result()
+    
+    def flush(self):
+        """立即写入缓冲区中的全部记录"""
+        with self._condition:
+            batch = self._take()
+        self._write_batch(batch)
+    
+    def close(self):
+        """写入剩余记录并停止后台线程"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending_rows >= self.max_rows or (self._closed and self._pending):
+                        break
+                    if self._closed:
+                        return
+                    if self._oldest is None:
+                        self._condition.wait()
+                        continue
+                    remaining = self._oldest + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take()
+            self._write_batch(batch)
+    
+    def _take(self) -> List[Tuple[List[Dict[str, Any]], Future]]:
+        """取出缓冲区中的记录（调用方需持有锁）"""
+        batch = self._pending
+        self._pending = []
+        self._pending_rows = 0
+        self._oldest = None
+        return batch
+    
+    def _write_batch(self, batch: List[Tuple[List[Dict[str, Any]], Future]]):
+        """在一个事务中写入一批记录；失败时逐组重试，避免一组坏数据拖累其他请求"""
+        if not batch:
+            return
+        
+        rows = [row for group, _ in batch for row in group]
+        try:
+            ids = super().write(rows)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            logger.warning(f"批量写入 {len(rows)} 条推荐记录失败，改为逐组写入: {e}")
+            for group, future in batch:
+                try:
+                    future.set_result(super().write(group))
+                except Exception as group_error:
+                    future.set_exception(group_error)
+            return
+        
+        offset = 0
+        for group, future in batch:
+            future.set_result(ids[offset:offset + len(group)])
+            offset += len(group)
+        logger.debug(f"已在一个事务中写入 {len(rows)} 条推荐记录（{len(batch)} 组）")
@@ -0,0 +1,70 @@
+"""
+任务执行记录数据模型
+"""
+from sqlalchemy import Column, BigInteger, Text, String, Integer, DateTime, Index, func
+
+from models.database import Base, BigIntegerPK
+
+# 任务状态
+TASK_PENDING = 0    # 等待执行
+TASK_RUNNING = 1    # 执行中（已被worker领取）
+TASK_SUCCESS = 2    # 执行成功
+TASK_FAILED = 3     # 执行失败
+
+
+class TaskLog(Base):
+    """任务执行记录表（同时作为worker的任务队列）"""
+    __tablename__ = 'task_logs'
+    __table_args__ = (
+        Index('idx_task_logs_status_lease', 'status', 'lease_expires_at'),
+    )
+    
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment='主键，自增')
+    user_id = Column(BigInteger, nullable=True, index=True, comment='用户ID（外键，关联users表）')
+    task_type = Column(String(50), nullable=False, default='推荐', comment='任务类型')
+    positive_prompt = Column(Text, nullable=True, comment='正向提示词')
+    negative_prompt = Column(Text, nullable=True, comment='负向提示词')
+    image_path = Column(String(500), nullable=True, comment='图片文件路径（如适用）')
+    context = Column(Text, nullable=True, comment='上下文信息')
+    model_name = Column(String(100), nullable=True, comment='使用的AI模型（为空时使用默认模型）')
+    count = Column(Integer, nullable=False, default=1, comment='推荐诗词数量')
+    status = Column(Integer, nullable=False, default=TASK_PENDING, index=True, comment='执行状态（0:等待 1:执行中 2:成功 3:失败）')
+    result_id = Column(BigInteger, nullable=True, comment='结果记录ID（多首诗词时为第一条）')
+    result_ids = Column(Text, nullable=True, comment='全部结果记录ID（逗号分隔）')
+    exit_code = Column(Integer, nullable=True, comment='执行状态码（同命令行返回值）')
+    error_message = Column(Text, nullable=True, comment='错误信息')
+    execution_time = Column(Integer, nullable=True, comment='执行时间（毫秒）')
+    attempts = Column(Integer, nullable=False, default=0, comment='已领取执行的次数')
+    lease_owner = Column(String(100), nullable=True, comment='持有租约的worker标识')
+    lease_expires_at = Column(DateTime, nullable=True, comment='租约到期时间')
+    started_at = Column(DateTime, nullable=True, comment='最近一次开始执行的时间')
+    finished_at = Column(DateTime, nullable=True, comment='完成时间')
+    created_at = Column(DateTime, default=func.now(), index=True, comment='创建时间')
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
+    
+    def __repr__(self):
+        return f"<TaskLog(id={self.id}, status={self.status}, lease_owner={self.lease_owner})>"
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'task_type': self.task_type,
+            'positive_prompt': self.positive_prompt,
+            'negative_prompt': self.negative_prompt,
+            'image_path': self.image_path,
+            'context': self.context,
+            'model_name': self.model_name,
+            'count': self.count,
+            'status': self.status,
+            'result_id': self.result_id,
+            'result_ids': [int(i) for i in self.result_ids.split(',')] if self.result_ids else [],
+            'exit_code': self.exit_code,
+            'error_message': self.error_message,
+            'execution_time': self.execution_time,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,354 @@
+"""
+基于数据库的任务队列
+
+任务保存在task_logs表中。worker领取任务时获得一个有时限的租约，执行期间定期续约；
+worker崩溃后租约过期，任务会被其他worker重新领取。多个主机上的worker可以同时消费同一个队列。
+
+任务生成的推荐记录带有task_id，写入时在同一事务中检查租约（见check_leases）；
+重新领取的任务如果已有推荐记录（上次执行已写入结果，但未能标记完成），直接使用已有的记录。
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import select, update, func, or_, and_, DateTime
+
+from models.database import get_db
+from models.recommendation import Recommendation
+from models.task_log import TaskLog, TASK_PENDING, TASK_RUNNING, TASK_SUCCESS, TASK_FAILED
+
+logger = logging.getLogger(__name__)
+
+# 可入队的任务字段
+TASK_FIELDS = (
+    'user_id',
+    'task_type',
+    'positive_prompt',
+    'negative_prompt',
+    'image_path',
+    'context',
+    'model_name',
+    'count',
+)
+
+
+class LeaseLostError(RuntimeError):
+    """任务的租约已丢失（已过期或被其他worker接管）"""
+
+
+def check_leases(db, rows: List[Dict[str, Any]]):
+    """
+    检查推荐记录所属任务的租约，在写入推荐记录的事务中调用
+    
+    锁定任务行直到事务结束：租约检查和记录写入之间，任务不会被其他worker领取。
+    不属于队列任务（没有task_id或lease_owner）的记录不检查。
+    
+    Args:
+        db: 写入推荐记录的数据库会话
+        rows: 推荐记录字段字典列表
+    
+    Raises:
+        LeaseLostError: 租约已过期或不属于lease_owner
+    """
+    leases = {(row['task_id'], row['lease_owner']) for row in rows
+              if row.get('task_id') and row.get('lease_owner')}
+    if not leases:
+        return
+    now = TaskQueue._now(db)
+    for task_id, worker_id in sorted(leases):
+        held = db.execute(
+            select(TaskLog.id)
+            .where(
+                TaskLog.id == task_id,
+                TaskLog.lease_owner == worker_id,
+                TaskLog.status == TASK_RUNNING,
+                TaskLog.lease_expires_at >= now
+            )
+            .with_for_update()
+        ).scalar()
+        if held is None:
+            raise LeaseLostError(f"任务 {task_id} 的租约已不属于 {worker_id}，不写入推荐记录")
+
+
+class TaskQueue:
+    """
+    任务队列
+    
+    领取任务时先用 SELECT ... FOR UPDATE SKIP LOCKED 选出候选任务（并发的worker会跳过彼此锁定的行），
+    再用带条件的UPDATE逐条抢占：只有状态仍为等待、或租约已过期的任务才会被更新。
+    即使数据库不支持SKIP LOCKED，同一个任务也只会被一个worker领取成功。
+    完成和失败的状态更新都要求租约仍属于当前worker，过期后被接管的任务不会被原worker覆盖结果。
+    """
+    
+    def __init__(self, lease_seconds: int = 60, max_attempts: int = 3):
+        """
+        Args:
+            lease_seconds: 租约时长（秒），worker需要在租约到期前续约
+            max_attempts: 单个任务最多被领取执行的次数
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+    
+    def enqueue(self, **fields) -> int:
+        """
+        添加任务
+        
+        Args:
+            fields: 任务字段（见TASK_FIELDS）
+        
+        Returns:
+            任务ID
+        """
+        unknown = set(fields) - set(TASK_FIELDS)
+        if unknown:
+            raise ValueError(f"未知的任务字段: {', '.join(sorted(unknown))}")
+        
+        with get_db() as db:
+            task = TaskLog(status=TASK_PENDING, attempts=0, **fields)
+            db.add(task)
+            db.flush()
+            return task.id
+    
+    def claim(self, worker_id: str, limit: int = 1) -> List[Dict[str, Any]]:
+        """
+        领取待执行的任务
+        
+        Args:
+            worker_id: worker标识
+            limit: 最多领取的任务数
+        
+        Returns:
+            已领取任务的字典列表（字段同TaskLog.to_dict）
+        """
+        if limit <= 0:
+            return []
+        
+        with get_db() as db:
+            now = self._now(db)
+            expires_at = now + timedelta(seconds=self.lease_seconds)
+            claimable = or_(
+                TaskLog.status == TASK_PENDING,
+                and_(TaskLog.status == TASK_RUNNING, TaskLog.lease_expires_at < now)
+            )
+            
+            candidate_ids = db.execute(
+                select(TaskLog.id)
+                .where(claimable)
+                .order_by(TaskLog.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            ).scalars().all()
+            
+            claimed_ids = []
+            for task_id in candidate_ids:
+                result = db.execute(
+                    update(TaskLog)
+                    .where(TaskLog.id == task_id, claimable)
+                    .values(
+                        status=TASK_RUNNING,
+                        lease_owner=worker_id,
+                        lease_expires_at=expires_at,
+                        attempts=TaskLog.attempts + 1,
+                        started_at=now
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    claimed_ids.append(task_id)
+            
+            if not claimed_ids:
+                return []
+            
+            tasks = db.execute(
+                select(TaskLog).where(TaskLog.id.in_(claimed_ids)).order_by(TaskLog.id)
+            ).scalars().all()
+            
+            claimed = []
+            for task in tasks:
+                if task.attempts > self.max_attempts:
+                    # 多次领取后仍未完成（通常是worker反复崩溃），不再重试；
+                    # 上次执行已写入结果、只是没来得及标记完成的任务按成功结束
+                    record_ids = self._task_records(db, task.id)
+                    task.lease_owner = None
+                    task.lease_expires_at = None
+                    task.finished_at = now
+                    if record_ids:
+                        task.status = TASK_SUCCESS
+                        task.exit_code = 0
+                        task.result_id = record_ids[0]
+                        task.result_ids = ','.join(str(record_id) for record_id in record_ids)
+                        logger.info(f"任务 {task.id} 超过最大执行次数，但已写入 {len(record_ids)} 条推荐记录，标记为成功")
+                    else:
+                        task.status = TASK_FAILED
+                        task.error_message = f"任务已被领取 {task.attempts - 1} 次仍未完成，放弃执行"
+                        logger.warning(f"任务 {task.id} 超过最大执行次数，标记为失败")
+                    continue
+                claimed.append(task.to_dict())
+        
+        if claimed:
+            logger.info(f"worker {worker_id} 领取了 {len(claimed)} 个任务")
+        return claimed
+    
+    def heartbeat(self, worker_id: str, task_ids: List[int]) -> List[int]:
+        """
+        为执行中的任务续约
+        
+        Args:
+            worker_id: worker标识
+            task_ids: 需要续约的任务ID
+        
+        Returns:
+            续约成功的任务ID；不在其中的任务租约已丢失（已被其他worker接管）
+        """
+        if not task_ids:
+            return []
+        
+        with get_db() as db:
+            now = self._now(db)
+            db.execute(
+                update(TaskLog)
+                .where(
+                    TaskLog.id.in_(task_ids),
+                    TaskLog.lease_owner == worker_id,
+                    TaskLog.status == TASK_RUNNING
+                )
+                .values(lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+                .execution_options(synchronize_session=False)
+            )
+            return db.execute(
+                select(TaskLog.id).where(
+                    TaskLog.id.in_(task_ids),
+                    TaskLog.lease_owner == worker_id,
+                    TaskLog.status == TASK_RUNNING
+                )
+            ).scalars().all()
+    
+    def complete(
+        self,
+        worker_id: str,
+        task_id: int,
+        record_ids: List[int],
+        execution_time: int
+    ) -> bool:
+        """
+        标记任务执行成功
+        
+        Args:
+            worker_id: worker标识
+            task_id: 任务ID
+            record_ids: 生成的推荐记录ID
+            execution_time: 执行时间（毫秒）
+        
+        Returns:
+            是否更新成功（租约已丢失时返回False）
+        """
+        return self._finish(
+            worker_id,
+            task_id,
+            status=TASK_SUCCESS,
+            exit_code=0,
+            result_id=record_ids[0] if record_ids else None,
+            result_ids=','.join(str(record_id) for record_id in record_ids) or None,
+            error_message=None,
+            execution_time=execution_time
+        )
+    
+    def fail(
+        self,
+        worker_id: str,
+        task_id: int,
+        exit_code: int,
+        error: Optional[str],
+        execution_time: int,
+        retry: bool = False
+    ) -> bool:
+        """
+        标记任务执行失败
+        
+        Args:
+            worker_id: worker标识
+            task_id: 任务ID
+            exit_code: 执行状态码
+            error: 错误信息
+            execution_time: 执行时间（毫秒）
+            retry: 是否放回队列重试（已达到最大执行次数时不再重试）
+        
+        Returns:
+            是否更新成功（租约已丢失时返回False）
+        """
+        values = dict(
+            exit_code=exit_code,
+            error_message=error,
+            execution_time=execution_time
+        )
+        if retry:
+            # 放回队列；attempts已在领取时累加，达到上限后按失败处理
+            with get_db() as db:
+                result = db.execute(
+                    update(TaskLog)
+                    .where(
+                        TaskLog.id == task_id,
+                        TaskLog.lease_owner == worker_id,
+                        TaskLog.status == TASK_RUNNING,
+                        TaskLog.attempts < self.max_attempts
+                    )
+                    .values(status=TASK_PENDING, lease_owner=None, lease_expires_at=None, **values)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    logger.info(f"任务 {task_id} 执行失败，已放回队列等待重试")
+                    return True
+        
+        return self._finish(worker_id, task_id, status=TASK_FAILED, **values)
+    
+    def find_records(self, task_id: int) -> List[int]:
+        """
+        查询任务已写入的推荐记录
+        
+        Returns:
+            成功记录的ID（按ID排序）；上次执行已写入结果时不需要重新执行
+        """
+        with get_db() as db:
+            return self._task_records(db, task_id)
+    
+    @staticmethod
+    def _task_records(db, task_id: int) -> List[int]:
+        return db.execute(
+            select(Recommendation.id)
+            .where(Recommendation.task_id == task_id, Recommendation.status == 1)
+            .order_by(Recommendation.id)
+        ).scalars().all()
+    
+    def get(self, task_id: int) -> Optional[Dict[str, Any]]:
+        """查询任务状态，任务不存在时返回None"""
+        with get_db() as db:
+            task = db.get(TaskLog, task_id)
+            return task.to_dict() if task else None
+    
+    def _finish(self, worker_id: str, task_id: int, **values) -> bool:
+        """在租约仍属于当前worker时写入最终状态"""
+        with get_db() as db:
+            result = db.execute(
+                update(TaskLog)
+                .where(
+                    TaskLog.id == task_id,
+                    TaskLog.lease_owner == worker_id,
+                    TaskLog.status == TASK_RUNNING
+                )
+                .values(
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    finished_at=self._now(db),
+                    **values
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                logger.warning(f"任务 {task_id} 的租约已不属于 {worker_id}，忽略本次执行结果")
+                return False
+            return True
+    
+    @staticmethod
+    def _now(db) -> datetime:
+        """使用数据库时间计算租约，避免各主机时钟不一致"""
+        return db.execute(select(func.now(type_=DateTime))).scalar()
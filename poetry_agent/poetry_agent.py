@@ -3,33 +3,80 @@
 AI诗词推荐Agent主程序
 """
 import argparse
+import functools
+import json
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Any, List, Callable, TYPE_CHECKING
 
 from utils.logger import setup_logger
-from utils.ai_client import AIClientFactory
-from utils.image_processor import ImageProcessor
-from models.database import get_db, init_db
-from models.recommendation import Recommendation
-from config.settings import Settings
+from config.settings import settings
+
+if TYPE_CHECKING:
+    from utils.ai_client import PoemStream
+
+# AI客户端、图片处理（Pillow）和数据库（SQLAlchemy）模块都在首次使用时才导入，
+# 查看帮助、参数校验失败等不需要它们的调用可以快速返回
 
 logger = setup_logger()
 
+# 批量任务文件字段 -> execute参数
+BATCH_FIELDS = {
+    'prompt': 'positive_prompt',
+    'negative_prompt': 'negative_prompt',
+    'image': 'image_path',
+    'user_id': 'user_id',
+    'context': 'context',
+    'model': 'model',
+    'count': 'count',
+    'type': 'type',
+    'mode': 'mode',
+}
+
+# 推荐方式：llm（调用AI）、retrieve（只从诗词索引检索）、hybrid（索引匹配足够时不调用AI）
+RETRIEVAL_MODES = ('llm', 'retrieve', 'hybrid')
+# 从诗词索引检索得到的推荐记录的模型名称
+RETRIEVAL_MODEL_NAME = 'poem-index'
+
 
 class PoetryAgent:
     """诗词推荐Agent"""
     
-    def __init__(self, config_file: Optional[str] = None):
+    def __init__(self, config_file: Optional[str] = None, use_cache: Optional[bool] = None):
         """
         初始化Agent
         
         Args:
-            config_file: 配置文件路径
+            config_file: 配置文件路径（加载到全局配置实例settings，各模块共用）
+            use_cache: 是否启用推荐结果缓存（默认使用配置中的cache_enabled）
         """
-        self.settings = Settings(config_file)
-        self.image_processor = ImageProcessor()
+        settings.load(config_file)
+        self.settings = settings
+        self.use_cache = self.settings.cache_enabled if use_cache is None else use_cache
+        self._image_processor = None
+        self._writer = None
+    
+    @property
+    def image_processor(self):
+        """图片处理器（首次使用时创建）"""
+        if self._image_processor is None:
+            from utils.image_processor import get_image_processor
+            self._image_processor = get_image_processor()
+        return self._image_processor
+    
+    @property
+    def writer(self):
+        """推荐记录写入器（首次使用时创建）"""
+        if self._writer is None:
+            from models.recommendation_writer import RecommendationWriter
+            self._writer = RecommendationWriter()
+        return self._writer
+    
+    @writer.setter
+    def writer(self, writer):
+        self._writer = writer
     
     def run(
         self,
@@ -41,144 +88,830 @@ class PoetryAgent:
         model: str = None,
         count: int = 1,
         type: str = '推荐',
-        verbose: bool = False
+        verbose: bool = False,
+        stream: bool = False,
+        mode: Optional[str] = None
     ) -> int:
         """
         执行推荐任务
         
+        Args:
+            stream: 是否流式生成（每首诗词生成后立即保存并输出）
+            mode: 推荐方式（llm/retrieve/hybrid，默认使用配置中的retrieval_mode）
+        
         Returns:
             状态码：0-成功，1-参数错误，2-API调用失败，3-数据库操作失败，4-其他错误
         """
+        # 设置日志级别
+        if verbose:
+            logger.setLevel(logging.DEBUG)
+        
+        on_poem = None
+        if stream:
+            on_poem = functools.partial(self._print_poem, verbose=verbose)
+        
+        outcome = self.execute(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            user_id=user_id,
+            context=context,
+            model=model,
+            count=count,
+            type=type,
+            mode=mode,
+            on_poem=on_poem
+        )
+        
+        if outcome['exit_code'] == 0:
+            if stream:
+                print(f"成功！已保存 {len(outcome['record_ids'])} 条推荐记录")
+            else:
+                self._print_result(outcome, verbose)
+        
+        return outcome['exit_code']
+    
+    def execute(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        user_id: Optional[int] = None,
+        context: Optional[str] = None,
+        model: str = None,
+        count: int = 1,
+        type: str = '推荐',
+        mode: Optional[str] = None,
+        on_poem: Optional[Callable[[Dict[str, Any], int], None]] = None,
+        task_id: Optional[int] = None,
+        lease_owner: Optional[str] = None,
+        save_failure: bool = True,
+        pooled: bool = False
+    ) -> Dict[str, Any]:
+        """
+        执行推荐任务（不输出结果，供单次调用、批量模式和队列worker共用）
+        
+        Args:
+            mode: 推荐方式（llm/retrieve/hybrid，默认使用配置中的retrieval_mode）
+            on_poem: 流式模式回调；提供时以流式方式调用AI，每首诗词保存后立即以(诗词, 记录ID)调用
+            task_id: 队列任务ID，写入推荐记录；与lease_owner一起提供时，租约丢失后不再写入
+            lease_owner: 持有任务租约的worker标识
+            save_failure: AI调用失败时是否保存失败记录（队列任务只在最后一次执行时保存）
+            pooled: 为推荐池预生成（记录保存为预生成状态，取出时才计入统计和诗词索引）
+        
+        Returns:
+            执行结果字典：exit_code（状态码，含义同run）、record_ids（已保存的记录ID）、
+            result（AI返回结果）、error（错误信息）
+        """
+        from utils.tracing import request_trace
+        
+        # 记录各阶段耗时、重试次数、令牌用量和缓存命中情况，写入推荐记录并汇总到监控指标
+        with request_trace() as trace:
+            outcome = self._execute(
+                positive_prompt=positive_prompt,
+                negative_prompt=negative_prompt,
+                image_path=image_path,
+                user_id=user_id,
+                context=context,
+                model=model,
+                count=count,
+                type=type,
+                mode=mode,
+                on_poem=on_poem,
+                task_id=task_id,
+                lease_owner=lease_owner,
+                save_failure=save_failure,
+                pooled=pooled
+            )
+            self._finish_trace(trace, outcome, mode)
+        return outcome
+    
+    def _execute(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        user_id: Optional[int] = None,
+        context: Optional[str] = None,
+        model: str = None,
+        count: int = 1,
+        type: str = '推荐',
+        mode: Optional[str] = None,
+        on_poem: Optional[Callable[[Dict[str, Any], int], None]] = None,
+        task_id: Optional[int] = None,
+        lease_owner: Optional[str] = None,
+        save_failure: bool = True,
+        pooled: bool = False
+    ) -> Dict[str, Any]:
+        """执行推荐任务（execute的实现）"""
+        from utils.tracing import span
+        
+        outcome = self._new_outcome()
+        
         try:
-            # 参数验证
-            if not positive_prompt and not image_path:
-                logger.error("错误：至少需要提供正向提示词(--prompt)或图片(--image)")
-                return 1
+            task = self._prepare_task(
+                outcome,
+                positive_prompt=positive_prompt,
+                negative_prompt=negative_prompt,
+                image_path=image_path,
+                user_id=user_id,
+                context=context,
+                model=model,
+                count=count,
+                mode=mode
+            )
+            if task is None:
+                return outcome
+            task.update(task_id=task_id, lease_owner=lease_owner, save_failure=save_failure, pooled=pooled)
             
-            # 设置日志级别
-            if verbose:
-                logger.setLevel(logging.DEBUG)
+            # 诗词索引中有匹配的诗词时直接返回，不调用AI
+            if task['mode'] != 'llm':
+                with span('retrieve'):
+                    result = self._retrieve(task)
+                if result is not None:
+                    if on_poem is None:
+                        self._persist_result(outcome, task, result)
+                    else:
+                        from utils.ai_client import PoemStream, result_to_poems
+                        poem_stream = PoemStream(iter(result_to_poems(result)), result.get('image_description'))
+                        self._persist_stream(outcome, task, poem_stream, on_poem)
+                    return outcome
+                if task['mode'] == 'retrieve':
+                    return self._fail(outcome, 2, "检索模式下未在诗词索引中找到匹配的诗词")
             
-            logger.info("开始执行诗词推荐任务...")
-            logger.debug(f"参数: prompt={positive_prompt}, negative_prompt={negative_prompt}, "
-                        f"image={image_path}, user_id={user_id}, model={model}, count={count}")
+            try:
+                from utils.ai_client import AIClientFactory
+                ai_client = AIClientFactory.create_client(task['model_name'], use_cache=self.use_cache)
+            except Exception as e:
+                return self._fail(outcome, 2, f"创建AI客户端失败: {e}")
             
-            # 处理图片
-            saved_image_path = None
-            image_description = None
+            # 调用AI生成推荐
+            try:
+                logger.info("正在调用AI生成推荐...")
+                with span('ai_request'):
+                    if on_poem is None:
+                        result = ai_client.generate_poetry_recommendation(**task['request'])
+                        logger.info("AI推荐生成成功")
+                    else:
+                        poem_stream = ai_client.stream_poetry_recommendation(**task['request'])
+            except Exception as e:
+                self._handle_ai_failure(outcome, task, e)
+                return outcome
             
-            if image_path:
-                # 验证图片
-                is_valid, error = self.image_processor.validate_image(image_path)
-                if not is_valid:
-                    logger.error(f"图片验证失败: {error}")
-                    return 1
-                
-                # 保存图片
-                saved_image_path = self.image_processor.save_image(image_path, user_id)
-                logger.info(f"图片已保存: {saved_image_path}")
+            if on_poem is None:
+                self._persist_result(outcome, task, result)
+            else:
+                self._persist_stream(outcome, task, poem_stream, on_poem)
+            return outcome
+        
+        except Exception as e:
+            outcome['error'] = f"执行失败: {e}"
+            logger.error(outcome['error'], exc_info=True)
+            outcome['exit_code'] = 4
+            return outcome
+    
+    async def execute_async(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        user_id: Optional[int] = None,
+        context: Optional[str] = None,
+        model: str = None,
+        count: int = 1,
+        type: str = '推荐',
+        mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        异步执行推荐任务
+        
+        使用异步AI客户端等待API响应，图片处理和数据库写入放到线程池中执行，
+        参数和返回值与execute完全一致。AI客户端在同一事件循环内共享，
+        全部任务完成后调用 AIClientFactory.close_async_clients() 释放连接。
+        """
+        from utils.tracing import request_trace
+        
+        with request_trace() as trace:
+            outcome = await self._execute_async(
+                positive_prompt=positive_prompt,
+                negative_prompt=negative_prompt,
+                image_path=image_path,
+                user_id=user_id,
+                context=context,
+                model=model,
+                count=count,
+                type=type,
+                mode=mode
+            )
+            self._finish_trace(trace, outcome, mode)
+        return outcome
+    
+    async def _execute_async(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        user_id: Optional[int] = None,
+        context: Optional[str] = None,
+        model: str = None,
+        count: int = 1,
+        type: str = '推荐',
+        mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """异步执行推荐任务（execute_async的实现；线程池中的函数绑定当前上下文，阶段耗时记录到同一任务）"""
+        import asyncio
+        from utils.tracing import in_context, span
+        
+        loop = asyncio.get_running_loop()
+        outcome = self._new_outcome()
+        
+        try:
+            task = await loop.run_in_executor(None, in_context(functools.partial(
+                self._prepare_task,
+                outcome,
+                positive_prompt=positive_prompt,
+                negative_prompt=negative_prompt,
+                image_path=image_path,
+                user_id=user_id,
+                context=context,
+                model=model,
+                count=count,
+                mode=mode
+            )))
+            if task is None:
+                return outcome
             
-            # 创建AI客户端
-            model_name = model or self.settings.default_model
-            logger.info(f"使用AI模型: {model_name}")
+            if task['mode'] != 'llm':
+                result = await loop.run_in_executor(None, in_context(self._retrieve), task)
+                if result is not None:
+                    await loop.run_in_executor(None, in_context(self._persist_result), outcome, task, result)
+                    return outcome
+                if task['mode'] == 'retrieve':
+                    return self._fail(outcome, 2, "检索模式下未在诗词索引中找到匹配的诗词")
             
             try:
-                ai_client = AIClientFactory.create_client(model_name)
+                from utils.ai_client import AIClientFactory
+                ai_client = AIClientFactory.create_async_client(task['model_name'], use_cache=self.use_cache)
             except Exception as e:
-                logger.error(f"创建AI客户端失败: {e}")
-                return 2
+                return self._fail(outcome, 2, f"创建AI客户端失败: {e}")
             
             # 调用AI生成推荐
             try:
                 logger.info("正在调用AI生成推荐...")
-                result = ai_client.generate_poetry_recommendation(
-                    positive_prompt=positive_prompt,
-                    negative_prompt=negative_prompt,
-                    image_path=image_path,
-                    image_description=image_description,
-                    context=context,
-                    count=count
-                )
+                with span('ai_request'):
+                    result = await ai_client.generate_poetry_recommendation(**task['request'])
                 logger.info("AI推荐生成成功")
             except Exception as e:
-                logger.error(f"AI API调用失败: {e}")
-                # 保存失败记录到数据库
-                self._save_failed_record(
-                    user_id=user_id,
-                    positive_prompt=positive_prompt,
-                    negative_prompt=negative_prompt,
-                    image_path=saved_image_path,
-                    error_message=str(e),
-                    model_name=model_name
-                )
-                return 2
+                await loop.run_in_executor(None, in_context(self._handle_ai_failure), outcome, task, e)
+                return outcome
             
-            # 保存结果到数据库
+            await loop.run_in_executor(None, in_context(self._persist_result), outcome, task, result)
+            return outcome
+        
+        except Exception as e:
+            outcome['error'] = f"执行失败: {e}"
+            logger.error(outcome['error'], exc_info=True)
+            outcome['exit_code'] = 4
+            return outcome
+    
+    def _finish_trace(self, trace, outcome: Dict[str, Any], mode: Optional[str]):
+        """任务结束时输出各阶段耗时并汇总到监控指标"""
+        from utils.tracing import record_request
+        record_request(trace, mode or self.settings.retrieval_mode, outcome['exit_code'])
+        logger.info(f"推荐任务结束（状态码 {outcome['exit_code']}），{trace.summary()}")
+    
+    @staticmethod
+    def _new_outcome() -> Dict[str, Any]:
+        """创建空的执行结果字典"""
+        return {'exit_code': 4, 'record_ids': [], 'result': None, 'error': None}
+    
+    @staticmethod
+    def _fail(outcome: Dict[str, Any], exit_code: int, error: str) -> Dict[str, Any]:
+        """记录错误信息并设置状态码"""
+        outcome['error'] = error
+        outcome['exit_code'] = exit_code
+        logger.error(error)
+        return outcome
+    
+    def _prepare_task(
+        self,
+        outcome: Dict[str, Any],
+        positive_prompt: Optional[str],
+        negative_prompt: Optional[str],
+        image_path: Optional[str],
+        user_id: Optional[int],
+        context: Optional[str],
+        model: Optional[str],
+        count: int,
+        mode: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        验证参数并处理图片
+        
+        Returns:
+            任务信息字典；参数或图片无效时返回None（错误已写入outcome）
+        """
+        # 参数验证
+        if not positive_prompt and not image_path:
+            self._fail(outcome, 1, "错误：至少需要提供正向提示词(--prompt)或图片(--image)")
+            return None
+        
+        mode = mode or self.settings.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            self._fail(outcome, 1, f"错误：不支持的推荐方式: {mode}（可选 {', '.join(RETRIEVAL_MODES)}）")
+            return None
+        
+        logger.info("开始执行诗词推荐任务...")
+        logger.debug(f"参数: prompt={positive_prompt}, negative_prompt={negative_prompt}, "
+                    f"image={image_path}, user_id={user_id}, model={model}, count={count}")
+        
+        # 处理图片
+        saved_image_path = None
+        image_description = None
+        
+        if image_path:
+            # 读取并验证图片，之后的保存、哈希和编码都使用读入的数据，不再读取文件
             try:
-                if count == 1:
-                    # 单个推荐
-                    record_id = self._save_recommendation(
-                        user_id=user_id,
-                        positive_prompt=positive_prompt,
-                        negative_prompt=negative_prompt,
-                        image_path=saved_image_path,
-                        image_description=result.get('image_description'),
-                        context=context,
-                        poem_title=result.get('poem_title'),
-                        poem_content=result.get('poem_content'),
-                        author=result.get('author'),
-                        dynasty=result.get('dynasty'),
-                        appreciation=result.get('appreciation'),
-                        model_name=model_name,
-                        status=1
-                    )
-                    logger.info(f"推荐记录已保存，ID: {record_id}")
-                    
-                    # 输出结果
-                    if verbose:
-                        print("\n" + "="*50)
-                        print("推荐结果:")
-                        print("="*50)
-                        print(f"标题: {result.get('poem_title')}")
-                        print(f"作者: {result.get('author')} ({result.get('dynasty')})")
-                        print(f"\n内容:\n{result.get('poem_content')}")
-                        print(f"\n赏析:\n{result.get('appreciation')}")
-                        print("="*50)
-                    else:
-                        print(f"成功！推荐记录ID: {record_id}")
-                        print(f"标题: {result.get('poem_title')} - {result.get('author')} ({result.get('dynasty')})")
+                image_path = self.image_processor.ingest(image_path)
+            except ValueError as e:
+                self._fail(outcome, 1, f"图片验证失败: {e}")
+                return None
+            
+            # 保存图片
+            saved_image_path = self.image_processor.save_image(image_path, user_id)
+            
+            # 复用已存储的图片描述，省去图片识别请求
+            image_description = self._lookup_image_description(image_path)
+        
+        model_name = model or self.settings.default_model
+        logger.info(f"使用AI模型: {model_name}")
+        
+        # 已有可信的图片描述时，推荐请求只发送文字
+        request_image_path = image_path
+        if image_description and self.settings.image_trust_stored_description:
+            request_image_path = None
+        
+        return {
+            'user_id': user_id,
+            'positive_prompt': positive_prompt,
+            'negative_prompt': negative_prompt,
+            'context': context,
+            'count': count,
+            'image_path': image_path,
+            'saved_image_path': saved_image_path,
+            'stored_description': image_description,
+            'model_name': model_name,
+            'mode': mode,
+            # 队列任务和推荐池预生成的信息（由execute设置）
+            'task_id': None,
+            'lease_owner': None,
+            'save_failure': True,
+            'pooled': False,
+            'request': {
+                'positive_prompt': positive_prompt,
+                'negative_prompt': negative_prompt,
+                'image_path': request_image_path,
+                'image_description': image_description,
+                'context': context,
+                'count': count
+            }
+        }
+    
+    def _retrieve(self, task: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        从诗词索引检索推荐结果
+        
+        以正向提示词（没有时使用已存储的图片描述）检索，并按负向提示词排除。
+        hybrid模式下匹配的诗词不足count首时返回None，改为调用AI；retrieve模式下有匹配即返回。
+        """
+        query = task['positive_prompt'] or task['stored_description']
+        if not query:
+            return None
+        try:
+            from utils.poem_index import get_poem_index
+            poems = get_poem_index().match(query, task['negative_prompt'], limit=task['count'])
+        except Exception as e:
+            logger.warning(f"检索诗词索引失败: {e}")
+            return None
+        
+        if not poems or (task['mode'] == 'hybrid' and len(poems) < task['count']):
+            logger.info(f"诗词索引中匹配的诗词不足（{len(poems)}/{task['count']}）")
+            return None
+        
+        logger.info(f"从诗词索引检索到 {len(poems)} 首诗词，不调用AI接口")
+        task['model_name'] = RETRIEVAL_MODEL_NAME
+        from utils.ai_client import poems_to_result
+        fields = ('title', 'content', 'author', 'dynasty', 'appreciation')
+        return poems_to_result(
+            [{field: poem[field] for field in fields} for poem in poems],
+            task['count'],
+            task['stored_description']
+        )
+    
+    def _lookup_image_description(self, image_path: str) -> Optional[str]:
+        """查找已存储的图片描述，未启用或未找到时返回None"""
+        if not self.settings.image_description_store_enabled:
+            return None
+        try:
+            from utils.description_store import get_description_store
+            match = get_description_store().lookup(image_path)
+        except Exception as e:
+            logger.warning(f"查找图片描述失败: {e}")
+            return None
+        return match[0] if match else None
+    
+    def _store_image_description(self, task: Dict[str, Any], result: Dict[str, Any]):
+        """保存本次AI识别得到的图片描述，供后续相同或近似的图片复用"""
+        description = result.get('image_description')
+        if not task['image_path'] or task['stored_description'] or not description:
+            return
+        if not self.settings.image_description_store_enabled:
+            return
+        try:
+            from utils.description_store import get_description_store
+            get_description_store().save(task['image_path'], description)
+        except Exception as e:
+            logger.warning(f"保存图片描述失败: {e}")
+    
+    def _handle_ai_failure(self, outcome: Dict[str, Any], task: Dict[str, Any], error: Exception):
+        """记录AI调用失败并保存失败记录"""
+        self._fail(outcome, 2, f"AI API调用失败: {error}")
+        if not task['save_failure']:
+            return
+        # 保存失败记录到数据库
+        self._save_failed_record(
+            user_id=task['user_id'],
+            positive_prompt=task['positive_prompt'],
+            negative_prompt=task['negative_prompt'],
+            image_path=task['saved_image_path'],
+            error_message=str(error),
+            model_name=task['model_name'],
+            task_id=task['task_id'],
+            lease_owner=task['lease_owner']
+        )
+    
+    def _persist_result(self, outcome: Dict[str, Any], task: Dict[str, Any], result: Dict[str, Any]):
+        """保存AI推荐结果到数据库"""
+        outcome['result'] = result
+        
+        try:
+            if task['count'] == 1:
+                # 单个推荐
+                poems = [{
+                    'title': result.get('poem_title'),
+                    'content': result.get('poem_content'),
+                    'author': result.get('author'),
+                    'dynasty': result.get('dynasty'),
+                    'appreciation': result.get('appreciation')
+                }]
+            else:
+                # 多个推荐
+                poems = result.get('poems', [])
+            
+            # 同一请求的所有诗词在一个事务中写入
+            rows = [
+                self._build_record(
+                    task,
+                    image_description=result.get('image_description'),
+                    poem_title=poem.get('title'),
+                    poem_content=poem.get('content'),
+                    author=poem.get('author'),
+                    dynasty=poem.get('dynasty'),
+                    appreciation=poem.get('appreciation'),
+                    status=1
+                )
+                for poem in poems
+            ]
+            outcome['record_ids'].extend(self._save_recommendations(rows))
+            
+            if task['count'] == 1:
+                logger.info(f"推荐记录已保存，ID: {outcome['record_ids'][0]}")
+            else:
+                logger.info(f"已保存 {len(outcome['record_ids'])} 条推荐记录，IDs: {outcome['record_ids']}")
+            outcome['exit_code'] = 0
+        except Exception as e:
+            self._fail(outcome, 3, f"数据库操作失败: {e}")
+            return
+        
+        self._store_image_description(task, result)
+    
+    def _persist_stream(
+        self,
+        outcome: Dict[str, Any],
+        task: Dict[str, Any],
+        poem_stream: 'PoemStream',
+        on_poem: Callable[[Dict[str, Any], int], None]
+    ):
+        """逐首接收流式结果，每首诗词到达后立即保存并回调"""
+        poems = []
+        
+        try:
+            for poem in poem_stream:
+                record = self._build_record(
+                    task,
+                    image_description=poem_stream.image_description,
+                    poem_title=poem.get('title'),
+                    poem_content=poem.get('content'),
+                    author=poem.get('author'),
+                    dynasty=poem.get('dynasty'),
+                    appreciation=poem.get('appreciation'),
+                    status=1
+                )
+                try:
+                    record_id = self._save_recommendations([record])[0]
+                except Exception as e:
+                    self._fail(outcome, 3, f"数据库操作失败: {e}")
+                    return
+                poems.append(poem)
+                outcome['record_ids'].append(record_id)
+                logger.info(f"推荐记录已保存，ID: {record_id}")
+                on_poem(poem, record_id)
+        except Exception as e:
+            if not poems:
+                self._handle_ai_failure(outcome, task, e)
+            else:
+                # 已保存的诗词保留，本次任务仍视为API调用失败
+                self._fail(outcome, 2, f"AI API调用中断（已保存 {len(poems)} 首）: {e}")
+            return
+        
+        if not poems:
+            self._handle_ai_failure(outcome, task, ValueError("AI返回结果中没有找到诗词"))
+            return
+        
+        logger.info(f"AI推荐生成成功，共 {len(poems)} 首")
+        from utils.ai_client import poems_to_result
+        result = poems_to_result(poems, task['count'], poem_stream.image_description)
+        outcome['result'] = result
+        outcome['exit_code'] = 0
+        self._store_image_description(task, result)
+    
+    def run_batch(
+        self,
+        batch_file: str,
+        concurrency: Optional[int] = None,
+        report_file: Optional[str] = None,
+        use_async: bool = False
+    ) -> int:
+        """
+        批量执行推荐任务
+        
+        批量文件为JSONL格式，每行一个任务，字段与命令行参数一致：
+        prompt、negative_prompt、image、user_id、context、model、count、type。
+        同时进行的任务不超过concurrency个，每个任务完成后立即写入数据库，
+        并向报告输出一行JSON结果。
+        
+        Args:
+            batch_file: JSONL批量任务文件路径
+            concurrency: 最大并发任务数（默认使用配置中的batch_concurrency）
+            report_file: 结果报告文件路径（默认输出到标准输出）
+            use_async: 是否使用异步AI客户端（单个事件循环承载全部并发请求，适合高并发）
+            
+        Returns:
+            状态码：全部成功返回0；文件无法读取返回1；否则返回首个失败行（按行号）的状态码
+        """
+        concurrency = concurrency or self.settings.batch_concurrency
+        if concurrency < 1:
+            logger.error(f"错误：并发数必须大于0: {concurrency}")
+            return 1
+        
+        try:
+            source = open(batch_file, 'r', encoding='utf-8')
+        except OSError as e:
+            logger.error(f"无法读取批量任务文件: {e}")
+            return 1
+        
+        report = open(report_file, 'w', encoding='utf-8') if report_file else sys.stdout
+        failures = {}
+        reported = []
+        
+        def _write_report(line_no: int, outcome: Dict[str, Any]):
+            record = {
+                'line': line_no,
+                'exit_code': outcome['exit_code'],
+                'record_ids': outcome['record_ids'],
+                'error': outcome['error']
+            }
+            report.write(json.dumps(record, ensure_ascii=False) + "\n")
+            report.flush()
+            reported.append(line_no)
+            if outcome['exit_code'] != 0:
+                failures[line_no] = outcome['exit_code']
+        
+        logger.info(f"开始执行批量任务: {batch_file} (并发数: {concurrency})")
+        # 配置了metrics.file或metrics.port时导出监控指标
+        from utils.metrics import MetricsExporter
+        exporter = MetricsExporter(
+            path=self.settings.metrics_file,
+            port=self.settings.metrics_port,
+            host=self.settings.metrics_host,
+            interval=self.settings.metrics_interval
+        ).start()
+        # 批量模式下多个请求的记录合并到同一个事务中写入
+        from models.recommendation_writer import BufferedRecommendationWriter
+        direct_writer = self._writer
+        self.writer = BufferedRecommendationWriter(
+            max_rows=self.settings.batch_write_size,
+            max_delay=self.settings.batch_write_delay
+        )
+        try:
+            with source:
+                tasks = self._iter_batch_tasks(source, _write_report)
+                if use_async:
+                    import asyncio
+                    asyncio.run(self._drain_batch_async(tasks, concurrency, _write_report))
                 else:
-                    # 多个推荐
-                    poems = result.get('poems', [])
-                    record_ids = []
-                    for poem in poems:
-                        record_id = self._save_recommendation(
-                            user_id=user_id,
-                            positive_prompt=positive_prompt,
-                            negative_prompt=negative_prompt,
-                            image_path=saved_image_path,
-                            image_description=result.get('image_description'),
-                            context=context,
-                            poem_title=poem.get('title'),
-                            poem_content=poem.get('content'),
-                            author=poem.get('author'),
-                            dynasty=poem.get('dynasty'),
-                            appreciation=poem.get('appreciation'),
-                            model_name=model_name,
-                            status=1
-                        )
-                        record_ids.append(record_id)
-                    logger.info(f"已保存 {len(record_ids)} 条推荐记录，IDs: {record_ids}")
-                    print(f"成功！已保存 {len(record_ids)} 条推荐记录")
+                    self._drain_batch(tasks, concurrency, _write_report)
+        finally:
+            self.writer.close()
+            self.writer = direct_writer
+            exporter.stop()
+            if report_file:
+                report.close()
+        
+        total = len(reported)
+        logger.info(f"批量任务完成: 共 {total} 条，成功 {total - len(failures)} 条，失败 {len(failures)} 条")
+        if self.use_cache:
+            from utils.response_cache import get_response_cache
+            stats = get_response_cache().stats()
+            logger.info(f"推荐结果缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+                        f"命中率 {stats['hit_rate']:.1%}")
+            if 'semantic' in stats:
+                semantic = stats['semantic']
+                logger.info(f"语义缓存: {semantic['entries']} 条，查找 {semantic['lookups']} 次，"
+                            f"命中率 {semantic['hit_rate']:.1%}")
+        from utils.rate_limiter import rate_limiter_stats
+        for model, stats in rate_limiter_stats().items():
+            logger.info(f"限流 [{model}]: 请求 {stats['requests']} 次，被限流 {stats['throttled']} 次，"
+                        f"并发上限 {stats['concurrency_limit']}")
+        if 'utils.router_client' in sys.modules:
+            from utils.router_client import router_stats
+            for backend, stats in router_stats().items():
+                p50 = f"{stats['p50']:.2f}s" if stats['p50'] is not None else '-'
+                logger.info(f"路由 [{backend}]: 最近 {stats['samples']} 次请求，错误率 {stats['error_rate']:.1%}，p50 {p50}")
+        if failures:
+            return failures[min(failures)]
+        return 0
+    
+    def _iter_batch_tasks(self, source, write_report):
+        """逐行读取批量任务，无效行直接写入报告，有效行返回(行号, 任务参数)"""
+        for line_no, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, self._parse_batch_line(line)
+            except ValueError as e:
+                logger.error(f"第{line_no}行参数错误: {e}")
+                write_report(line_no, {'exit_code': 1, 'record_ids': [], 'error': str(e)})
+    
+    def _drain_batch(self, tasks, concurrency: int, write_report):
+        """在有界线程池中执行批量任务"""
+        pending = {}
+        
+        def _collect(done):
+            for future in done:
+                write_report(pending.pop(future), future.result())
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for line_no, task in tasks:
+                # 控制读取进度，避免一次性把整个文件读入任务队列
+                while len(pending) >= concurrency * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done)
                 
-                return 0
-            except Exception as e:
-                logger.error(f"数据库操作失败: {e}")
-                return 3
+                pending[executor.submit(self.execute, **task)] = line_no
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+    
+    async def _drain_batch_async(self, tasks, concurrency: int, write_report):
+        """在单个事件循环中执行批量任务，同时进行的任务不超过concurrency个"""
+        import asyncio
         
-        except Exception as e:
-            logger.error(f"执行失败: {e}", exc_info=True)
-            return 4
+        semaphore = asyncio.Semaphore(concurrency)
+        running = set()
+        
+        async def _run(line_no: int, task: Dict[str, Any]):
+            try:
+                outcome = await self.execute_async(**task)
+            finally:
+                semaphore.release()
+            write_report(line_no, outcome)
+        
+        for line_no, task in tasks:
+            await semaphore.acquire()
+            future = asyncio.ensure_future(_run(line_no, task))
+            running.add(future)
+            future.add_done_callback(running.discard)
+        
+        if running:
+            await asyncio.gather(*running)
+        
+        # 本事件循环内共享的AI客户端随事件循环一起释放
+        from utils.ai_client import AIClientFactory
+        await AIClientFactory.close_async_clients()
+    
+    @staticmethod
+    def _parse_batch_line(line: str) -> Dict[str, Any]:
+        """解析批量任务文件中的一行，返回execute的参数"""
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON格式错误: {e}")
+        
+        if not isinstance(data, dict):
+            raise ValueError("每行必须是一个JSON对象")
+        
+        unknown = set(data) - set(BATCH_FIELDS)
+        if unknown:
+            raise ValueError(f"不支持的字段: {', '.join(sorted(unknown))}")
+        
+        task = {BATCH_FIELDS[key]: value for key, value in data.items() if value is not None}
+        
+        if 'count' in task and (not isinstance(task['count'], int) or task['count'] < 1):
+            raise ValueError(f"count必须是正整数: {task['count']}")
+        if 'mode' in task and task['mode'] not in RETRIEVAL_MODES:
+            raise ValueError(f"mode必须是 {'/'.join(RETRIEVAL_MODES)} 之一: {task['mode']}")
+        if 'user_id' in task and not isinstance(task['user_id'], int):
+            raise ValueError(f"user_id必须是整数: {task['user_id']}")
+        
+        return task
+    
+    def _print_poem(self, poem: Dict[str, Any], record_id: int, verbose: bool = False):
+        """输出流式模式下生成的单首诗词"""
+        if verbose:
+            print("\n" + "="*50)
+            print(f"标题: {poem.get('title')}")
+            print(f"作者: {poem.get('author')} ({poem.get('dynasty')})")
+            print(f"\n内容:\n{poem.get('content')}")
+            print(f"\n赏析:\n{poem.get('appreciation')}")
+            print(f"\n推荐记录ID: {record_id}")
+            print("="*50, flush=True)
+        else:
+            print(f"[{record_id}] {poem.get('title')} - {poem.get('author')} ({poem.get('dynasty')})", flush=True)
+    
+    def _print_result(self, outcome: Dict[str, Any], verbose: bool = False):
+        """输出推荐结果"""
+        result = outcome['result']
+        record_ids = outcome['record_ids']
+        
+        if 'poems' not in result:
+            # 单个推荐
+            if verbose:
+                print("\n" + "="*50)
+                print("推荐结果:")
+                print("="*50)
+                print(f"标题: {result.get('poem_title')}")
+                print(f"作者: {result.get('author')} ({result.get('dynasty')})")
+                print(f"\n内容:\n{result.get('poem_content')}")
+                print(f"\n赏析:\n{result.get('appreciation')}")
+                print("="*50)
+            else:
+                print(f"成功！推荐记录ID: {record_ids[0]}")
+                print(f"标题: {result.get('poem_title')} - {result.get('author')} ({result.get('dynasty')})")
+        else:
+            # 多个推荐
+            print(f"成功！已保存 {len(record_ids)} 条推荐记录")
+    
+    @staticmethod
+    def _build_record(task: Dict[str, Any], **fields) -> Dict[str, Any]:
+        """根据任务信息构建推荐记录字段"""
+        record = {
+            'user_id': task['user_id'],
+            'positive_prompt': task['positive_prompt'],
+            'negative_prompt': task['negative_prompt'],
+            'image_path': task['saved_image_path'],
+            'context': task['context'],
+            'model_name': task['model_name'],
+            'task_id': task['task_id'],
+            'lease_owner': task['lease_owner'],
+        }
+        record.update(PoetryAgent._trace_fields())
+        record.update(fields)
+        if task['pooled'] and record.get('status') == 1:
+            from models.recommendation import STATUS_POOLED
+            record['status'] = STATUS_POOLED
+        return record
+    
+    @staticmethod
+    def _trace_fields() -> Dict[str, Any]:
+        """当前任务的耗时、重试次数、令牌用量和缓存命中情况（不在任务中时为空）"""
+        from utils.tracing import current_trace
+        trace = current_trace()
+        return trace.record_fields() if trace is not None else {}
+    
+    def _save_recommendations(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """在一个事务中保存多条推荐记录，返回按顺序排列的记录ID"""
+        from utils.tracing import span
+        with span('db_write'):
+            record_ids = self.writer.write(rows)
+        # 本进程已加载诗词索引时，新记录即时加入索引
+        if 'utils.poem_index' in sys.modules:
+            from utils.poem_index import peek_poem_index
+            index = peek_poem_index()
+            if index is not None:
+                index.add_recommendations([dict(row, id=record_id) for row, record_id in zip(rows, record_ids)])
+        return record_ids
     
     def _save_recommendation(
         self,
@@ -197,26 +930,21 @@ class PoetryAgent:
         status: int
     ) -> int:
         """保存推荐记录到数据库"""
-        with get_db() as db:
-            recommendation = Recommendation(
-                user_id=user_id,
-                positive_prompt=positive_prompt,
-                negative_prompt=negative_prompt,
-                image_path=image_path,
-                image_description=image_description,
-                context=context,
-                poem_title=poem_title,
-                poem_content=poem_content,
-                author=author,
-                dynasty=dynasty,
-                appreciation=appreciation,
-                model_name=model_name,
-                status=status
-            )
-            db.add(recommendation)
-            db.flush()
-            record_id = recommendation.id
-            return record_id
+        return self._save_recommendations([{
+            'user_id': user_id,
+            'positive_prompt': positive_prompt,
+            'negative_prompt': negative_prompt,
+            'image_path': image_path,
+            'image_description': image_description,
+            'context': context,
+            'poem_title': poem_title,
+            'poem_content': poem_content,
+            'author': author,
+            'dynasty': dynasty,
+            'appreciation': appreciation,
+            'model_name': model_name,
+            'status': status
+        }])[0]
     
     def _save_failed_record(
         self,
@@ -225,27 +953,35 @@ class PoetryAgent:
         negative_prompt: Optional[str],
         image_path: Optional[str],
         error_message: str,
-        model_name: str
+        model_name: str,
+        task_id: Optional[int] = None,
+        lease_owner: Optional[str] = None
     ):
         """保存失败记录到数据库"""
         try:
-            with get_db() as db:
-                recommendation = Recommendation(
-                    user_id=user_id,
-                    positive_prompt=positive_prompt,
-                    negative_prompt=negative_prompt,
-                    image_path=image_path,
-                    model_name=model_name,
-                    status=0,
-                    error_message=error_message
-                )
-                db.add(recommendation)
+            self._save_recommendations([{
+                'user_id': user_id,
+                'positive_prompt': positive_prompt,
+                'negative_prompt': negative_prompt,
+                'image_path': image_path,
+                'model_name': model_name,
+                'status': 0,
+                'error_message': error_message,
+                'task_id': task_id,
+                'lease_owner': lease_owner,
+                **self._trace_fields()
+            }])
         except Exception as e:
             logger.error(f"保存失败记录时出错: {e}")
 
 
 def main():
     """主函数"""
+    # worker模式：python poetry_agent.py worker [参数]
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        import worker
+        sys.exit(worker.main(sys.argv[2:]))
+    
     parser = argparse.ArgumentParser(
         description='AI诗词推荐Agent - 根据提示词或图片推荐古诗词',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -267,6 +1003,13 @@ def main():
   python poetry_agent.py --user-id 1001 --prompt "推荐一首关于春天的诗" \\
       --negative-prompt "不要包含悲伤情绪" --image /path/to/image.jpg \\
       --context "用户喜欢唐诗" --model "gpt-4" --count 1 --verbose
+  
+  # 批量模式 - JSONL文件每行一个任务，字段与命令行参数一致
+  python poetry_agent.py --batch tasks.jsonl --concurrency 8 --report report.jsonl
+  
+  # 队列模式 - 将任务加入task_logs队列，由worker进程执行
+  python poetry_agent.py --prompt "推荐一首关于春天的诗" --enqueue
+  python poetry_agent.py worker --concurrency 8
         """
     )
     
@@ -303,7 +1046,7 @@ def main():
     parser.add_argument(
         '-m', '--model',
         type=str,
-        help='指定使用的AI模型（可选，有默认值）'
+        help='指定使用的AI模型（可选，有默认值；router 表示在配置的多个模型之间路由）'
     )
     
     parser.add_argument(
@@ -321,6 +1064,13 @@ def main():
         help='推荐类型（可选，默认：推荐）'
     )
     
+    parser.add_argument(
+        '--mode',
+        type=str,
+        choices=RETRIEVAL_MODES,
+        help='推荐方式：llm调用AI，retrieve只从诗词索引检索，hybrid索引匹配足够时不调用AI（可选，默认llm）'
+    )
+    
     parser.add_argument(
         '-f', '--config',
         type=str,
@@ -333,10 +1083,105 @@ def main():
         help='详细输出模式（可选）'
     )
     
+    parser.add_argument(
+        '-s', '--stream',
+        action='store_true',
+        help='流式生成，每首诗词生成后立即保存并输出（可选）'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='不使用推荐结果缓存，总是调用AI接口（可选）'
+    )
+    
+    parser.add_argument(
+        '-b', '--batch',
+        type=str,
+        help='批量任务文件路径（JSONL格式，每行字段：prompt、negative_prompt、image、user_id、context、model、count、type、mode）'
+    )
+    
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='批量模式下的最大并发任务数（可选，有默认值）'
+    )
+    
+    parser.add_argument(
+        '--report',
+        type=str,
+        help='批量模式的结果报告文件路径（可选，默认输出到标准输出）'
+    )
+    
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='批量模式下使用异步AI客户端，单个事件循环承载全部并发请求（可选）'
+    )
+    
+    parser.add_argument(
+        '--enqueue',
+        action='store_true',
+        help='不直接执行，将任务加入队列由worker执行，输出任务ID（可选）'
+    )
+    
     args = parser.parse_args()
     
+    # 其他模块读取全局配置，先加载配置文件再访问数据库和AI接口
+    settings.load(args.config)
+    
+    # 加入任务队列
+    if args.enqueue:
+        if args.batch:
+            logger.error("错误：--enqueue不能与--batch同时使用")
+            sys.exit(1)
+        if not args.prompt and not args.image:
+            logger.error("错误：必须提供正向提示词或图片路径之一")
+            sys.exit(1)
+        from models.task_queue import TaskQueue
+        image_path = None
+        if args.image:
+            # 先保存到图片存储，worker可能运行在其他主机上，不能读取本地路径
+            from utils.image_processor import get_image_processor
+            try:
+                image_path = get_image_processor().save_image(args.image, args.user_id)
+            except ValueError as e:
+                logger.error(f"图片验证失败: {e}")
+                sys.exit(1)
+        try:
+            task_id = TaskQueue().enqueue(
+                user_id=args.user_id,
+                task_type=args.type,
+                positive_prompt=args.prompt,
+                negative_prompt=args.negative_prompt,
+                image_path=image_path,
+                context=args.context,
+                model_name=args.model,
+                count=args.count
+            )
+        except Exception as e:
+            logger.error(f"任务入队失败: {e}")
+            sys.exit(3)
+        print(task_id)
+        sys.exit(0)
+    
     # 创建Agent实例
-    agent = PoetryAgent(config_file=args.config)
+    agent = PoetryAgent(config_file=args.config, use_cache=False if args.no_cache else None)
+    
+    # 批量模式
+    if args.batch:
+        if args.prompt or args.image:
+            logger.error("错误：批量模式(--batch)不能与--prompt或--image同时使用")
+            sys.exit(1)
+        if args.verbose:
+            logger.setLevel(logging.DEBUG)
+        sys.exit(agent.run_batch(
+            args.batch,
+            concurrency=args.concurrency,
+            report_file=args.report,
+            use_async=args.use_async
+        ))
     
     # 执行推荐任务
     exit_code = agent.run(
@@ -348,7 +1193,9 @@ def main():
         model=args.model,
         count=args.count,
         type=args.type,
-        verbose=args.verbose
+        verbose=args.verbose,
+        stream=args.stream,
+        mode=args.mode
     )
     
     sys.exit(exit_code)
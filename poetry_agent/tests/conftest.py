@@ -0,0 +1,34 @@
+"""
+测试公共配置
+
+测试使用临时的SQLite数据库，不需要MySQL和API密钥。
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+
+@pytest.fixture
+def restore_settings():
+    """测试结束后恢复全局配置"""
+    from config.settings import settings
+    
+    config_file, config_data = settings.config_file, settings.config_data
+    yield settings
+    settings.config_file, settings.config_data = config_file, config_data
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """使用临时的SQLite数据库并创建全部表"""
+    from models import database
+    
+    monkeypatch.setenv('DB_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(database, '_engine', None)
+    database.init_db()
+    yield database
+    database.get_engine().dispose()
@@ -0,0 +1,63 @@
+"""
+AI客户端测试：流式响应的令牌用量
+"""
+import json
+from types import SimpleNamespace
+
+from utils.ai_client import OpenAIClient
+from utils.tracing import request_trace
+
+
+class FakeStream:
+    """按分片返回 {"poems": [...]}，最后一个分片只含用量"""
+    
+    def __init__(self, poems):
+        text = json.dumps({'poems': poems}, ensure_ascii=False)
+        self.chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 20]))], usage=None)
+            for i in range(0, len(text), 20)
+        ]
+        self.chunks.append(SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=120, completion_tokens=80)))
+        self.closed = False
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if not self.chunks:
+            raise StopIteration
+        return self.chunks.pop(0)
+    
+    def close(self):
+        self.closed = True
+
+
+def _client(stream):
+    requests = []
+    
+    def create(**kwargs):
+        requests.append(kwargs)
+        return stream
+    
+    client = OpenAIClient.__new__(OpenAIClient)
+    client.api_key, client.base_url = 'key', 'http://localhost'
+    client.timeout, client.retry_times = 10, 1
+    client.model = client.vision_model = 'gpt-4'
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return client, requests
+
+
+def test_stream_records_usage_before_last_poem():
+    poems = [{'title': f'诗{i}', 'content': f'第{i}首，' * 5, 'author': '佚名', 'dynasty': '唐'} for i in range(2)]
+    stream = FakeStream(poems)
+    client, requests = _client(stream)
+    
+    with request_trace() as trace:
+        usage = []
+        for _ in client.stream_poetry_recommendation(positive_prompt='春天', count=2):
+            usage.append(trace.record_fields()['prompt_tokens'])
+    
+    assert requests[0]['stream_options'] == {'include_usage': True}
+    # 保存最后一首诗词时已记录用量
+    assert usage == [None, 120]
+    assert stream.closed
@@ -0,0 +1,38 @@
+"""
+图片描述存储测试：重复保存不报错，复用次数批量写入
+"""
+from PIL import Image, ImageDraw
+from sqlalchemy import select
+
+from models.image_description import ImageDescription
+from utils.description_store import ImageDescriptionStore
+
+
+def _image(path):
+    image = Image.new('RGB', (64, 64), 'white')
+    draw = ImageDraw.Draw(image)
+    for i in range(0, 64, 8):
+        draw.rectangle((i, 0, i + 3, 64), fill=(i * 4, 0, 255 - i * 4))
+    image.save(path)
+    return str(path)
+
+
+def _hit_count(db_module):
+    with db_module.get_db() as db:
+        return db.execute(select(ImageDescription.hit_count)).scalar_one()
+
+
+def test_save_ignores_existing_and_hits_are_batched(sqlite_db, tmp_path):
+    image_path = _image(tmp_path / 'a.png')
+    store = ImageDescriptionStore(threshold=0)
+    store.save(image_path, '蓝紫色的竖条纹')
+    store.save(image_path, '另一条描述')
+    
+    assert store.lookup(image_path) == ('蓝紫色的竖条纹', True)
+    assert store.lookup(image_path) == ('蓝紫色的竖条纹', True)
+    assert _hit_count(sqlite_db) == 0
+    
+    store.flush_hits()
+    assert _hit_count(sqlite_db) == 2
+    store.flush_hits()
+    assert _hit_count(sqlite_db) == 2
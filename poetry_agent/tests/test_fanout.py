@@ -0,0 +1,57 @@
+"""
+推荐请求拆分测试
+"""
+import threading
+
+from utils.ai_client import AIClient, get_poem_token_estimator
+from utils.fanout_client import FanOutClient, plan_batches
+from utils.tracing import FANOUT_FAILURES
+
+
+class FakeClient(AIClient):
+    """按请求的数量返回不同的诗词；第fail_call次调用失败"""
+    
+    def __init__(self, fail_call=None):
+        super().__init__('key', 'http://localhost')
+        self.counts = []
+        self.fail_call = fail_call
+        self._lock = threading.Lock()
+    
+    def generate_poetry_recommendation(self, count=1, **kwargs):
+        with self._lock:
+            self.counts.append(count)
+            call = len(self.counts)
+        if call == self.fail_call:
+            raise RuntimeError('接口超时')
+        poems = [{'title': f'诗{call}-{i}', 'content': f'第{call}次第{i}首', 'author': '佚名'} for i in range(count)]
+        return {'poems': poems, 'image_description': None}
+
+
+def test_default_plan_splits_large_counts_for_latency(restore_settings):
+    per_request = get_poem_token_estimator().poems_per_request(restore_settings.api_max_output_tokens)
+    batch_size = restore_settings.fanout_batch_size
+    assert plan_batches(10, batch_size, per_request) == [3, 3, 2, 2]
+    assert plan_batches(3, batch_size, per_request) == [3]
+    # 输出令牌上限是每个子请求数量的上限
+    assert plan_batches(7, 3, 2) == [2, 2, 2, 1]
+
+
+def test_zero_batch_size_splits_only_when_output_budget_is_exceeded(restore_settings, monkeypatch):
+    monkeypatch.setitem(restore_settings.config_data, 'fanout', {'batch_size': 0})
+    assert restore_settings.fanout_batch_size == 0
+    per_request = get_poem_token_estimator().poems_per_request(restore_settings.api_max_output_tokens)
+    assert plan_batches(per_request, 0, per_request) == [per_request]
+    assert len(plan_batches(per_request + 1, 0, per_request)) == 2
+
+
+def test_partial_failure_is_counted_and_topped_up(restore_settings, monkeypatch):
+    monkeypatch.setitem(restore_settings.config_data, 'fanout', {'batch_size': 2, 'max_parallel': 1})
+    client = FakeClient(fail_call=2)
+    failures = FANOUT_FAILURES.value()
+    
+    result = FanOutClient(client).generate_poetry_recommendation(positive_prompt='春天', count=6)
+    
+    assert len(result['poems']) == 6
+    # 3个子请求中1个失败，补充请求补齐缺少的2首
+    assert client.counts == [2, 2, 2, 2]
+    assert FANOUT_FAILURES.value() == failures + 1
@@ -0,0 +1,71 @@
+"""
+图片存储测试：迁移旧版本按用户目录保存的图片
+"""
+from PIL import Image
+from sqlalchemy import insert, select
+
+from models.recommendation import Recommendation
+from utils.image_store import ImageStore
+
+
+def _legacy_image(path, color):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGB', (20, 20), color).save(path)
+
+
+def _add_records(db_module, *image_paths):
+    with db_module.get_db() as db:
+        db.execute(insert(Recommendation), [{'image_path': path, 'status': 1} for path in image_paths])
+
+
+def _image_paths(db_module):
+    with db_module.get_db() as db:
+        return db.execute(select(Recommendation.image_path).order_by(Recommendation.id)).scalars().all()
+
+
+def test_migrate_legacy_rewrites_records(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _legacy_image(tmp_path / 'up' / '1' / 'a.jpg', 'red')
+    _legacy_image(tmp_path / 'up' / 'default' / 'b.jpg', 'red')
+    _legacy_image(tmp_path / 'up' / '1' / 'c.png', 'blue')
+    # 旧版本按配置的上传目录拼接路径（相对路径的写法不一定相同）
+    _add_records(sqlite_db, 'up/1/a.jpg', './up/default/b.jpg', str(tmp_path / 'up' / '1' / 'c.png'))
+    
+    summary = ImageStore('./up').migrate_legacy(batch_size=2)
+    
+    assert summary['records'] == 3
+    assert summary['duplicates'] == 1
+    assert summary['kept'] == 0
+    paths = _image_paths(sqlite_db)
+    assert paths[0] == paths[1]
+    assert all('/objects/' in path for path in paths)
+    assert not (tmp_path / 'up' / '1').exists()
+
+
+def test_migrate_legacy_keeps_files_still_referenced(sqlite_db, tmp_path, monkeypatch):
+    root = tmp_path / 'up'
+    _legacy_image(root / '1' / 'a.jpg', 'red')
+    _legacy_image(root / '1' / 'b.jpg', 'blue')
+    _add_records(sqlite_db, str(root / '1' / 'a.jpg'), str(root / '1' / 'b.jpg'))
+    store = ImageStore(str(root))
+    
+    # 更新推荐记录之后、删除原文件之前，旧版本程序又写入了引用原文件的记录
+    scans = []
+    iter_image_paths = store._iter_image_paths
+    
+    def _iter_with_concurrent_write(batch_size):
+        scans.append(batch_size)
+        if len(scans) == 2:
+            _add_records(sqlite_db, str(root / '1' / 'b.jpg'))
+        return iter_image_paths(batch_size)
+    
+    monkeypatch.setattr(store, '_iter_image_paths', _iter_with_concurrent_write)
+    summary = store.migrate_legacy()
+    
+    assert summary['kept'] == 1
+    assert not (root / '1' / 'a.jpg').exists()
+    assert (root / '1' / 'b.jpg').exists()
+    
+    # 再次执行时迁移剩余的记录并删除原文件
+    assert ImageStore(str(root)).migrate_legacy()['records'] == 1
+    assert not (root / '1' / 'b.jpg').exists()
@@ -0,0 +1,25 @@
+"""
+诗词索引增量追赶测试
+"""
+from sqlalchemy import insert
+
+from models.recommendation import Recommendation
+from utils.poem_index import PoemIndex
+
+
+def _write(db_module, **fields):
+    with db_module.get_db() as db:
+        db.execute(insert(Recommendation), [dict(status=1, **fields)])
+
+
+def test_sync_picks_up_records_committed_out_of_id_order(sqlite_db, tmp_path):
+    index = PoemIndex(str(tmp_path / 'poem_index.pkl'))
+    index.ensure_loaded()
+    _write(sqlite_db, id=5, poem_title='静夜思', poem_content='床前明月光，疑是地上霜。', author='李白')
+    assert index.sync() == 1
+    
+    # ID较小的记录在追赶之后才提交
+    _write(sqlite_db, id=3, poem_title='春晓', poem_content='春眠不觉晓，处处闻啼鸟。', author='孟浩然')
+    assert index.sync() == 1
+    assert len(index) == 2
+    assert index.sync() == 0
@@ -0,0 +1,37 @@
+"""
+重试判断测试：只重试限流、服务端错误、超时和网络错误
+"""
+import openai
+import pytest
+
+from utils.rate_limiter import is_retryable_error
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize('error', [
+    StatusError(429),
+    StatusError(500),
+    StatusError(503),
+    openai.APITimeoutError(request=None),
+    TimeoutError(),
+    ConnectionResetError(),
+])
+def test_transient_errors_are_retried(error):
+    assert is_retryable_error(error)
+
+
+@pytest.mark.parametrize('error', [
+    StatusError(400),
+    StatusError(401),
+    StatusError(409),
+    TypeError('参数错误'),
+    KeyError('poems'),
+    ValueError('无法解析'),
+])
+def test_other_errors_are_raised(error):
+    assert not is_retryable_error(error)
@@ -0,0 +1,62 @@
+"""
+推荐池测试：预生成的推荐记录在取出前不计入统计和推荐列表，取出时才计入；未取出的记录随过期删除
+"""
+from sqlalchemy import select
+
+from models.recommendation import Recommendation, STATUS_POOLED
+from models.recommendation_pool import RecommendationPool
+from models.recommendation_query import list_recommendations
+from models.recommendation_stats import get_summary, rebuild_stats
+from models.recommendation_writer import insert_recommendations
+
+
+def _pregenerate(db_module, count=3):
+    with db_module.get_db() as db:
+        ids = insert_recommendations(db, [
+            {'poem_title': f'诗{i}', 'poem_content': f'内容{i}', 'author': '李白', 'model_name': 'test',
+             'status': STATUS_POOLED}
+            for i in range(count)
+        ])
+    return ids
+
+
+def test_pooled_records_counted_when_taken(sqlite_db):
+    ids = _pregenerate(sqlite_db)
+    pool = RecommendationPool()
+    with sqlite_db.get_db() as db:
+        pooled = list_recommendations(db, status=STATUS_POOLED)['items']
+    pool.add(1001, [{'recommendation_id': item['id'], 'poem_id': item['poem_id']} for item in pooled], 24)
+    
+    with sqlite_db.get_db() as db:
+        assert get_summary(db)['total'] == 0
+        assert list_recommendations(db)['items'] == []
+    
+    item = pool.take_next(1001)
+    assert item['recommendation_id'] in ids
+    
+    with sqlite_db.get_db() as db:
+        assert get_summary(db)['success'] == 1
+        assert get_summary(db, user_id=1001)['success'] == 1
+        assert [row['id'] for row in list_recommendations(db, user_id=1001)['items']] == [item['recommendation_id']]
+    
+    # 重新计算汇总表得到相同的结果
+    rebuild_stats()
+    with sqlite_db.get_db() as db:
+        assert get_summary(db)['success'] == 1
+        assert get_summary(db, user_id=1001)['success'] == 1
+
+
+def test_purge_and_discard_delete_untaken_records(sqlite_db):
+    taken, expired, rejected = _pregenerate(sqlite_db)
+    pool = RecommendationPool()
+    pool.add(1001, [{'recommendation_id': taken}], 24)
+    pool.add(1001, [{'recommendation_id': expired}], -1)
+    pool.take_next(1001)
+    pool.add(1001, [{'recommendation_id': taken}], -1)
+    
+    assert pool.discard([rejected, taken]) == 1
+    assert pool.purge_expired() == 2
+    
+    with sqlite_db.get_db() as db:
+        remaining = db.execute(select(Recommendation.id)).scalars().all()
+    assert remaining == [taken]
@@ -0,0 +1,36 @@
+"""
+推荐列表分页测试：翻页基于程序写入的记录（created_at为数据库默认值，同一秒内有多条记录）
+"""
+import pytest
+
+from models.recommendation_query import list_recommendations, SORT_ASC, SORT_DESC
+from models.recommendation_writer import insert_recommendations
+
+
+def _write_batches(db_module, batches=3, size=4):
+    ids = []
+    for batch in range(batches):
+        with db_module.get_db() as db:
+            ids.extend(insert_recommendations(db, [
+                {'user_id': 1, 'poem_title': f'诗{batch}-{i}', 'poem_content': f'内容{batch}-{i}', 'status': 1}
+                for i in range(size)
+            ]))
+    return ids
+
+
+@pytest.mark.parametrize('sort', [SORT_DESC, SORT_ASC])
+def test_cursor_pages_cover_all_records(sqlite_db, sort):
+    ids = _write_batches(sqlite_db)
+    
+    seen = []
+    cursor = None
+    for _ in range(len(ids)):
+        with sqlite_db.get_db() as db:
+            page = list_recommendations(db, user_id=1, sort=sort, page_size=5, cursor=cursor)
+        seen.extend(item['id'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    
+    assert cursor is None
+    assert seen == sorted(ids, reverse=sort == SORT_DESC)
@@ -0,0 +1,43 @@
+"""
+推荐记录写入测试：返回的ID按顺序与各行对应（自增ID可能不连续的数据库逐行写入）
+"""
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from models import recommendation_writer
+from models.recommendation import Recommendation
+from models.recommendation_writer import insert_recommendations
+
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_ids_match_rows(sqlite_db, monkeypatch, returning):
+    dialect = sqlite_db.get_engine().dialect
+    monkeypatch.setattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', returning)
+    with sqlite_db.get_db() as db:
+        ids = insert_recommendations(db, [{'positive_prompt': f'p{i}', 'status': 0} for i in range(5)])
+    
+    with sqlite_db.get_db() as db:
+        prompts = dict(db.execute(select(Recommendation.id, Recommendation.positive_prompt)).all())
+    assert [prompts[record_id] for record_id in ids] == [f'p{i}' for i in range(5)]
+
+
+@pytest.mark.parametrize('increment, lock_mode, consecutive', [(1, 1, True), (1, 0, True), (1, 2, False), (2, 1, False)])
+def test_mysql_consecutive_ids(monkeypatch, increment, lock_mode, consecutive):
+    monkeypatch.setattr(recommendation_writer, '_consecutive_ids', {})
+    bind = SimpleNamespace(dialect=SimpleNamespace(name='mysql'), engine=SimpleNamespace(url='mysql://db/poetry'))
+    queries = []
+    
+    class FakeSession:
+        def get_bind(self):
+            return bind
+        
+        def execute(self, stmt):
+            queries.append(str(stmt))
+            return SimpleNamespace(one=lambda: (increment, lock_mode))
+    
+    db = FakeSession()
+    assert recommendation_writer._has_consecutive_ids(db) is consecutive
+    assert recommendation_writer._has_consecutive_ids(db) is consecutive
+    assert len(queries) == 1
@@ -0,0 +1,72 @@
+"""
+推荐结果缓存测试：诗词数不足的结果不缓存
+"""
+import asyncio
+
+from utils.ai_client import AIClient, PoemStream
+from utils.async_ai_client import AsyncCachedAIClient
+from utils.response_cache import CachedAIClient, MemoryCache, ResponseCache
+
+
+class ShortClient(AIClient):
+    """只返回shortfall之外的诗词（模拟输出被截断）"""
+    
+    def __init__(self, shortfall=0):
+        super().__init__('key', 'http://localhost')
+        self.shortfall = shortfall
+        self.calls = 0
+    
+    def _poems(self, count):
+        self.calls += 1
+        return [{'title': f'诗{i}', 'content': f'第{i}首'} for i in range(count - self.shortfall)]
+    
+    def generate_poetry_recommendation(self, count=1, **kwargs):
+        return {'poems': self._poems(count), 'image_description': None}
+    
+    def stream_poetry_recommendation(self, count=1, **kwargs):
+        return PoemStream(iter(self._poems(count)), None)
+
+
+def _cache():
+    return ResponseCache([MemoryCache()])
+
+
+def test_short_result_not_cached():
+    client = ShortClient(shortfall=3)
+    cached = CachedAIClient(client, 'test', _cache())
+    for _ in range(2):
+        assert len(cached.generate_poetry_recommendation(positive_prompt='春天', count=5)['poems']) == 2
+    assert client.calls == 2
+    
+    for _ in range(2):
+        assert len(list(cached.stream_poetry_recommendation(positive_prompt='秋天', count=5))) == 2
+    assert client.calls == 4
+
+
+def test_complete_result_cached():
+    client = ShortClient()
+    cached = CachedAIClient(client, 'test', _cache())
+    for _ in range(2):
+        cached.generate_poetry_recommendation(positive_prompt='春天', count=5)
+        list(cached.stream_poetry_recommendation(positive_prompt='秋天', count=5))
+    assert client.calls == 2
+
+
+def test_async_short_result_not_cached():
+    class AsyncShortClient:
+        api_key, base_url = 'key', 'http://localhost'
+        calls = 0
+        
+        async def generate_poetry_recommendation(self, count=1, **kwargs):
+            self.calls += 1
+            return {'poems': [{'title': '诗', 'content': '第一首'}], 'image_description': None}
+    
+    client = AsyncShortClient()
+    cached = AsyncCachedAIClient(client, 'test', _cache())
+    
+    async def run():
+        for _ in range(2):
+            await cached.generate_poetry_recommendation(positive_prompt='春天', count=3)
+    
+    asyncio.run(run())
+    assert client.calls == 2
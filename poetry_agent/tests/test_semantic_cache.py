@@ -0,0 +1,12 @@
+"""
+语义缓存测试：体裁不同的请求不相互匹配
+"""
+from utils.semantic_cache import SemanticCache
+
+
+def test_form_is_part_of_partition(tmp_path):
+    cache = SemanticCache(str(tmp_path / 'cache.db'), threshold=0.5)
+    cache.add('shi', 'test', {'positive_prompt': '推荐一首关于春天的诗', 'count': 1})
+    
+    assert cache.lookup('test', {'positive_prompt': '推荐一首关于春天的词', 'count': 1}) is None
+    assert cache.lookup('test', {'positive_prompt': '来首春天的古诗', 'count': 1})[0] == 'shi'
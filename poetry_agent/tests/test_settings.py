@@ -0,0 +1,66 @@
+"""
+配置文件加载测试：-f 指定的配置文件需要对全局配置生效
+"""
+import json
+
+import pytest
+
+from utils import rate_limiter
+from utils.router_client import BackendStats
+
+
+@pytest.fixture
+def config_file(tmp_path, restore_settings, monkeypatch):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({
+        'rate_limits': {'test-model': {'rpm': 7, 'max_concurrency': 3}},
+        'router': {'error_threshold': 0.1, 'cooldown': 60}
+    }), encoding='utf-8')
+    monkeypatch.delenv('RATE_LIMITS', raising=False)
+    monkeypatch.setattr(rate_limiter, '_rate_limiters', {})
+    return path
+
+
+def _degrade(stats: BackendStats):
+    """5次请求中1次失败（错误率20%）"""
+    for ok in (True, True, True, True, False):
+        stats.record(0.1, ok)
+
+
+def test_rate_limits_from_config_file(config_file, restore_settings):
+    default = rate_limiter.get_rate_limiter('test-model')
+    assert default.concurrency.max_limit != 3
+    
+    restore_settings.load(str(config_file))
+    rate_limiter._rate_limiters.clear()
+    limiter = rate_limiter.get_rate_limiter('test-model')
+    assert limiter.requests.capacity == 7
+    assert limiter.requests.rate == pytest.approx(7 / 60)
+    assert limiter.concurrency.max_limit == 3
+
+
+def test_rate_limits_from_env(restore_settings, monkeypatch):
+    monkeypatch.setattr(restore_settings, 'config_data', {})
+    monkeypatch.setattr(rate_limiter, '_rate_limiters', {})
+    monkeypatch.setenv('RATE_LIMITS', json.dumps({'env-model': {'rpm': 11}}))
+    assert rate_limiter.get_rate_limiter('env-model').requests.capacity == 11
+
+
+def test_router_thresholds_from_config_file(config_file, restore_settings):
+    stats = BackendStats('primary', window=20)
+    _degrade(stats)
+    assert stats.healthy()
+    
+    restore_settings.load(str(config_file))
+    stats = BackendStats('primary', window=20)
+    _degrade(stats)
+    assert not stats.healthy()
+
+
+def test_agent_loads_config_into_shared_settings(config_file, restore_settings):
+    from config.settings import settings
+    from poetry_agent import PoetryAgent
+    
+    agent = PoetryAgent(config_file=str(config_file))
+    assert agent.settings is settings
+    assert settings.router_error_threshold == 0.1
@@ -0,0 +1,130 @@
+"""
+队列worker测试：租约丢失后不写入推荐记录，重新领取的任务不重复写入
+"""
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select, update, func
+
+from models.recommendation import Recommendation
+from models.recommendation_writer import RecommendationWriter
+from models.task_log import TaskLog, TASK_SUCCESS, TASK_FAILED
+from models.task_queue import TaskQueue, LeaseLostError
+from worker import Worker
+
+
+class FakeAgent:
+    """按预设的结果执行任务，成功时像PoetryAgent一样写入带task_id的推荐记录"""
+    
+    def __init__(self, *exit_codes):
+        self.exit_codes = list(exit_codes)
+        self.calls = []
+        self.writer = RecommendationWriter()
+    
+    def execute(self, **kwargs):
+        self.calls.append(kwargs)
+        exit_code = self.exit_codes.pop(0)
+        record_ids = []
+        if exit_code == 0:
+            record_ids = self.writer.write([{
+                'poem_title': '春晓',
+                'poem_content': '春眠不觉晓，处处闻啼鸟。',
+                'status': 1,
+                'task_id': kwargs['task_id'],
+                'lease_owner': kwargs['lease_owner'],
+            }])
+        return {'exit_code': exit_code, 'record_ids': record_ids, 'error': None if exit_code == 0 else '失败'}
+
+
+def _expire_lease(db_module, task_id):
+    with db_module.get_db() as db:
+        db.execute(
+            update(TaskLog)
+            .where(TaskLog.id == task_id)
+            .values(lease_expires_at=TaskQueue._now(db) - timedelta(seconds=1))
+        )
+
+
+def _recommendation_count(db_module):
+    with db_module.get_db() as db:
+        return db.execute(select(func.count()).select_from(Recommendation)).scalar()
+
+
+def test_write_rejected_after_lease_lost(sqlite_db):
+    queue = TaskQueue()
+    task_id = queue.enqueue(positive_prompt='春天')
+    queue.claim('worker-a')
+    _expire_lease(sqlite_db, task_id)
+    
+    with pytest.raises(LeaseLostError):
+        RecommendationWriter().write([{'poem_content': '春眠不觉晓', 'status': 1,
+                                       'task_id': task_id, 'lease_owner': 'worker-a'}])
+    assert _recommendation_count(sqlite_db) == 0
+
+
+def test_reclaimed_task_reuses_persisted_records(sqlite_db):
+    queue = TaskQueue()
+    task_id = queue.enqueue(positive_prompt='春天')
+    
+    # 第一次执行写入了推荐记录，但在标记完成之前租约丢失
+    [task] = queue.claim('worker-a')
+    first = FakeAgent(0)
+    outcome = first.execute(task_id=task_id, lease_owner='worker-a')
+    _expire_lease(sqlite_db, task_id)
+    
+    agent = FakeAgent(0)
+    worker = Worker(agent, queue, worker_id='worker-b')
+    [task] = queue.claim('worker-b')
+    worker._process(task)
+    
+    assert agent.calls == []
+    assert _recommendation_count(sqlite_db) == 1
+    result = queue.get(task_id)
+    assert result['status'] == TASK_SUCCESS
+    assert result['result_id'] == outcome['record_ids'][0]
+
+
+def test_failure_record_saved_only_on_last_attempt(sqlite_db):
+    queue = TaskQueue(max_attempts=2)
+    task_id = queue.enqueue(positive_prompt='春天')
+    agent = FakeAgent(2, 2)
+    worker = Worker(agent, queue, worker_id='worker-a')
+    
+    for _ in range(2):
+        [task] = queue.claim('worker-a')
+        worker._process(task)
+    
+    assert [call['save_failure'] for call in agent.calls] == [False, True]
+    assert queue.get(task_id)['status'] == TASK_FAILED
+
+
+def test_partial_result_not_retried(sqlite_db):
+    queue = TaskQueue()
+    task_id = queue.enqueue(positive_prompt='春天')
+    
+    class PartialAgent(FakeAgent):
+        def execute(self, **kwargs):
+            outcome = super().execute(**kwargs)
+            outcome.update(exit_code=2, error='AI API调用中断（已保存 1 首）')
+            return outcome
+    
+    [task] = queue.claim('worker-a')
+    Worker(PartialAgent(0), queue, worker_id='worker-a')._process(task)
+    
+    assert queue.get(task_id)['status'] == TASK_FAILED
+    assert queue.claim('worker-a') == []
+
+
+def test_exhausted_task_with_persisted_records_succeeds(sqlite_db):
+    queue = TaskQueue(max_attempts=1)
+    task_id = queue.enqueue(positive_prompt='春天')
+    
+    # 唯一一次执行写入了推荐记录，worker在标记完成之前崩溃
+    queue.claim('worker-a')
+    outcome = FakeAgent(0).execute(task_id=task_id, lease_owner='worker-a')
+    _expire_lease(sqlite_db, task_id)
+    
+    assert queue.claim('worker-b') == []
+    result = queue.get(task_id)
+    assert result['status'] == TASK_SUCCESS
+    assert result['result_ids'] == outcome['record_ids']
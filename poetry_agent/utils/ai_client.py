@@ -1,16 +1,180 @@
 """
 AI大模型客户端模块
 """
-import json
 import time
+import functools
 import logging
-from typing import Optional, Dict, Any, List
+import threading
+from typing import Optional, Dict, Any, List, Iterator, Tuple
 from abc import ABC, abstractmethod
 
 from config.settings import settings
+from utils.json_extract import POEMS_SCHEMA, parse_poems
+from utils.rate_limiter import count_text_tokens, estimate_tokens, get_rate_limiter, is_retryable_error, retry_delay
+from utils.tracing import record_retry, record_usage, span
 
 logger = logging.getLogger(__name__)
 
+# 路由模型名：在配置的多个后端之间按延迟和健康状况选择
+ROUTER_MODEL = 'router'
+
+# 推荐请求的输出格式：只在提示词中要求JSON、JSON模式、按JSON Schema约束输出
+RESPONSE_FORMATS = ('text', 'json_object', 'json_schema')
+
+# 推荐结果中JSON结构等与诗词数量无关的输出令牌数
+RESPONSE_OVERHEAD_TOKENS = 100
+# 每首诗词的JSON键名、引号等结构占用的令牌数
+POEM_OVERHEAD_TOKENS = 30
+# 按估计值设置max_tokens时预留的余量倍数，避免赏析较长时输出被截断
+MAX_TOKENS_MARGIN = 1.5
+# 推荐请求max_tokens的下限
+MIN_MAX_TOKENS = 2000
+
+# 兼容OpenAI接口的服务商：模型名前缀、默认模型、图片识别模型，
+# 以及是否支持stream_options（流式响应在最后一个分片中返回令牌用量）
+PROVIDERS = {
+    'openai': {
+        'prefixes': ('gpt', 'o1', 'o3', 'o4'),
+        'default_model': 'gpt-4',
+        'vision_model': 'gpt-4-vision-preview',
+        'stream_usage': True,
+    },
+    # 百度千帆（文心一言）
+    'qianfan': {
+        'prefixes': ('ernie',),
+        'default_model': 'ernie-4.0-8k',
+        'vision_model': 'ernie-4.5-turbo-vl-32k',
+        'stream_usage': True,
+    },
+    # 阿里云百炼（通义千问）
+    'dashscope': {
+        'prefixes': ('qwen',),
+        'default_model': 'qwen-max',
+        'vision_model': 'qwen-vl-max',
+        'stream_usage': True,
+    },
+}
+
+
+def resolve_provider(model_name: str) -> str:
+    """根据模型名称确定服务商，不支持的模型抛出ValueError"""
+    for provider, config in PROVIDERS.items():
+        if model_name.startswith(config['prefixes']):
+            return provider
+    raise ValueError(f"不支持的模型: {model_name}")
+
+
+def provider_credentials(provider: str) -> Tuple[Optional[str], Optional[str]]:
+    """获取服务商的 (api_key, base_url) 配置"""
+    if provider == 'qianfan':
+        return settings.baidu_api_key, settings.qianfan_base_url
+    if provider == 'dashscope':
+        return settings.ali_api_key, settings.dashscope_base_url
+    return settings.openai_api_key, settings.openai_base_url
+
+
+def result_to_poems(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """将推荐结果字典转换为诗词列表（诗词字段：title、content、author、dynasty、appreciation）"""
+    if 'poems' in result:
+        return list(result['poems'])
+    return [{
+        'title': result.get('poem_title'),
+        'content': result.get('poem_content'),
+        'author': result.get('author'),
+        'dynasty': result.get('dynasty'),
+        'appreciation': result.get('appreciation')
+    }]
+
+
+def poems_to_result(
+    poems: List[Dict[str, Any]],
+    count: int,
+    image_description: Optional[str]
+) -> Dict[str, Any]:
+    """将诗词列表转换为推荐结果字典（count=1时为单首诗词的扁平结构）"""
+    # 只返回第一个（如果count=1）或全部
+    if count == 1:
+        poem = poems[0]
+        return {
+            'poem_title': poem.get('title', ''),
+            'poem_content': poem.get('content', ''),
+            'author': poem.get('author', ''),
+            'dynasty': poem.get('dynasty', ''),
+            'appreciation': poem.get('appreciation', ''),
+            'image_description': image_description
+        }
+    else:
+        return {
+            'poems': poems[:count],
+            'image_description': image_description
+        }
+
+
+class PoemTokenEstimator:
+    """按实际返回的诗词长度估计每首诗词占用的输出令牌数（指数加权平均）"""
+    
+    def __init__(self, initial: float, alpha: float = 0.2):
+        """
+        Args:
+            initial: 初始估计（尚未返回过诗词时使用）
+            alpha: 新样本的权重
+        """
+        self.alpha = alpha
+        self._estimate = float(initial)
+        self._lock = threading.Lock()
+    
+    def observe(self, poems: List[Dict[str, Any]]):
+        """记录一次推荐返回的诗词"""
+        for poem in poems:
+            tokens = POEM_OVERHEAD_TOKENS + sum(
+                count_text_tokens(str(value or '')) for value in poem.values()
+            )
+            with self._lock:
+                self._estimate += self.alpha * (tokens - self._estimate)
+    
+    @property
+    def tokens_per_poem(self) -> float:
+        return self._estimate
+    
+    def poems_per_request(self, max_output_tokens: int) -> int:
+        """在输出令牌上限内，一次请求最多能完整返回的诗词数"""
+        budget = max_output_tokens - RESPONSE_OVERHEAD_TOKENS
+        return max(1, int(budget // (self._estimate * MAX_TOKENS_MARGIN)))
+    
+    def max_tokens(self, count: int, max_output_tokens: int) -> int:
+        """推荐count首诗词的请求应设置的max_tokens"""
+        needed = RESPONSE_OVERHEAD_TOKENS + count * self._estimate * MAX_TOKENS_MARGIN
+        return min(max_output_tokens, max(MIN_MAX_TOKENS, int(needed)))
+
+
+_poem_token_estimator: Optional[PoemTokenEstimator] = None
+_poem_token_estimator_lock = threading.Lock()
+
+
+def get_poem_token_estimator() -> PoemTokenEstimator:
+    """获取进程内共享的诗词令牌数估计"""
+    global _poem_token_estimator
+    with _poem_token_estimator_lock:
+        if _poem_token_estimator is None:
+            _poem_token_estimator = PoemTokenEstimator(settings.api_tokens_per_poem)
+        return _poem_token_estimator
+
+
+class PoemStream:
+    """流式推荐结果：迭代时逐首返回诗词"""
+    
+    def __init__(self, poems: Iterator[Dict[str, Any]], image_description: Optional[str] = None):
+        """
+        Args:
+            poems: 诗词迭代器
+            image_description: 图片描述（如有）
+        """
+        self.image_description = image_description
+        self._poems = poems
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._poems
+
 
 class AIClient(ABC):
     """AI客户端基类"""
@@ -37,55 +201,96 @@ class AIClient(ABC):
         Args:
             positive_prompt: 正向提示词
             negative_prompt: 负向提示词
-            image_path: 图片路径
+            image_path: 图片路径或ImageHandle（ImageProcessor.ingest已读入的图片，编码时不再读取文件）
             image_description: 图片描述
             context: 上下文信息
             count: 推荐数量
-            
+        
         Returns:
             推荐结果字典
         """
         pass
     
-    def _retry_request(self, func, *args, **kwargs):
-        """重试请求"""
+    def stream_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> PoemStream:
+        """
+        流式生成诗词推荐，每首诗词生成完毕即可获取
+        
+        默认实现等待完整结果后逐首返回，支持流式接口的客户端应覆盖此方法。
+        参数与 generate_poetry_recommendation 相同。
+        
+        Returns:
+            PoemStream，迭代得到诗词字典
+        """
+        result = self.generate_poetry_recommendation(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        return PoemStream(iter(result_to_poems(result)), result.get('image_description'))
+    
+    def close(self):
+        """释放客户端持有的连接"""
+        pass
+    
+    def _retry_request(
+        self,
+        func,
+        *args,
+        rate_limit_key: Optional[str] = None,
+        estimated_tokens: int = 0,
+        **kwargs
+    ):
+        """
+        重试请求
+        
+        提供rate_limit_key（通常为API模型名）时按该模型的限流设置执行。
+        限流错误遵循服务端的Retry-After，其他可重试的错误使用带抖动的指数退避，
+        参数、鉴权等不可重试的错误直接抛出。每次尝试记录为一个api_attempt阶段。
+        
+        Args:
+            func: 发起一次请求的函数
+            rate_limit_key: 限流器名称（为空时不限流）
+            estimated_tokens: 本次请求预计消耗的令牌数（用于TPM限流）
+        """
+        limiter = get_rate_limiter(rate_limit_key) if rate_limit_key else None
+        call = functools.partial(func, *args, **kwargs)
         last_error = None
         for attempt in range(self.retry_times):
             try:
-                return func(*args, **kwargs)
+                with span('api_attempt'):
+                    if limiter is None:
+                        return call()
+                    return limiter.call(call, estimated_tokens)
             except Exception as e:
                 last_error = e
+                if not is_retryable_error(e):
+                    raise
                 logger.warning(f"请求失败 (尝试 {attempt + 1}/{self.retry_times}): {e}")
                 if attempt < self.retry_times - 1:
-                    time.sleep(2 ** attempt)  # 指数退避
+                    record_retry(rate_limit_key)
+                    time.sleep(retry_delay(e, attempt, limiter))
         raise last_error
 
 
-class OpenAIClient(AIClient):
-    """OpenAI客户端"""
+class OpenAIChatMixin:
+    """
+    OpenAI兼容接口的提示词构建与响应解析
     
-    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
-        super().__init__(api_key or settings.openai_api_key, base_url or settings.openai_base_url)
-        try:
-            import openai
-            self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
-        except ImportError:
-            raise ImportError("请安装openai库: pip install openai")
+    同步客户端和异步客户端共用，保证两条调用路径返回完全一致的结果字典。
+    """
     
-    def generate_poetry_recommendation(
-        self,
-        positive_prompt: Optional[str] = None,
-        negative_prompt: Optional[str] = None,
-        image_path: Optional[str] = None,
-        image_description: Optional[str] = None,
-        context: Optional[str] = None,
-        count: int = 1
-    ) -> Dict[str, Any]:
-        """生成诗词推荐"""
-        from utils.image_processor import ImageProcessor
-        
-        # 构建提示词
-        system_prompt = """你是一个专业的诗词推荐助手。请根据用户的需求推荐合适的古诗词，并提供详细的赏析。
+    SYSTEM_PROMPT = """你是一个专业的诗词推荐助手。请根据用户的需求推荐合适的古诗词，并提供详细的赏析。
 
 请按照以下JSON格式返回结果：
 {
@@ -99,13 +304,53 @@ class OpenAIClient(AIClient):
         }
     ]
 }"""
-        
+    
+    DESCRIBE_PROMPT = "请详细描述这张图片的内容、意境和情感，用于推荐相关的古诗词。"
+    
+    # 由客户端设置：文字请求使用的模型和带图片请求使用的模型
+    model: str
+    vision_model: str
+    
+    def _chat_model(self, image_path: Optional[str]) -> str:
+        """本次请求使用的模型（带图片时使用图片识别模型）"""
+        return self.vision_model if image_path else self.model
+    
+    @staticmethod
+    def _max_tokens(count: int) -> int:
+        """按推荐数量和每首诗词的估计长度设置max_tokens"""
+        return get_poem_token_estimator().max_tokens(count, settings.api_max_output_tokens)
+    
+    @staticmethod
+    def _check_finish_reason(choice: Any, max_tokens: int):
+        """输出因达到max_tokens而截断时记录警告（解析时会丢弃不完整的诗词）"""
+        if getattr(choice, 'finish_reason', None) == 'length':
+            logger.warning(f"AI输出达到max_tokens（{max_tokens}）被截断")
+    
+    def _response_format_kwargs(self) -> Dict[str, Any]:
+        """推荐请求的结构化输出参数（按配置的response_format）"""
+        response_format = settings.response_format
+        if response_format == 'text':
+            return {}
+        if response_format == 'json_object':
+            return {'response_format': {'type': 'json_object'}}
+        if response_format == 'json_schema':
+            return {'response_format': {
+                'type': 'json_schema',
+                'json_schema': {'name': 'poetry_recommendation', 'strict': True, 'schema': POEMS_SCHEMA},
+            }}
+        raise ValueError(f"不支持的输出格式: {response_format}（可选 {', '.join(RESPONSE_FORMATS)}）")
+    
+    def _build_messages(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """构建推荐请求的消息列表"""
         user_prompt_parts = []
         
-        # 如果有图片但没有描述，先识别图片
-        if image_path and not image_description:
-            image_description = self._describe_image(image_path)
-        
         # 添加图片描述
         if image_description:
             user_prompt_parts.append(f"图片描述：{image_description}")
@@ -128,133 +373,382 @@ class OpenAIClient(AIClient):
         
         # 构建消息
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": self.SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt if user_prompt else "请根据图片推荐相关的古诗词"}
         ]
         
         # 如果有图片，添加图片到消息中
         if image_path:
-            from utils.image_processor import ImageProcessor
-            processor = ImageProcessor()
-            base64_image = processor.encode_image_to_base64(image_path)
+            from utils.image_processor import get_image_processor
+            processor = get_image_processor()
             messages[-1]["content"] = [
                 {"type": "text", "text": user_prompt if user_prompt else "请根据图片推荐相关的古诗词"},
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
+                        "url": processor.encode_image_to_data_url(image_path)
                     }
                 }
             ]
         
-        # 调用API
-        def _call_api():
-            response = self.client.chat.completions.create(
-                model="gpt-4-vision-preview" if image_path else "gpt-4",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2000
-            )
-            return response.choices[0].message.content
-        
-        content = self._retry_request(_call_api)
-        
-        # 解析响应
-        try:
-            # 尝试提取JSON
-            import re
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
-                # 如果无法解析JSON，尝试手动解析
-                result = self._parse_text_response(content)
-        except Exception as e:
-            logger.warning(f"JSON解析失败，使用文本解析: {e}")
-            result = self._parse_text_response(content)
-        
-        # 返回结果
-        poems = result.get('poems', [])
-        if not poems:
-            raise ValueError("AI返回结果中没有找到诗词")
-        
-        # 只返回第一个（如果count=1）或全部
-        if count == 1:
-            poem = poems[0]
-            return {
-                'poem_title': poem.get('title', ''),
-                'poem_content': poem.get('content', ''),
-                'author': poem.get('author', ''),
-                'dynasty': poem.get('dynasty', ''),
-                'appreciation': poem.get('appreciation', ''),
-                'image_description': image_description
-            }
-        else:
-            return {
-                'poems': poems[:count],
-                'image_description': image_description
-            }
+        return messages
     
-    def _describe_image(self, image_path: str) -> str:
-        """描述图片内容"""
-        from utils.image_processor import ImageProcessor
-        processor = ImageProcessor()
-        base64_image = processor.encode_image_to_base64(image_path)
+    def _build_describe_messages(self, image_path: str) -> List[Dict[str, Any]]:
+        """构建图片描述请求的消息列表"""
+        from utils.image_processor import get_image_processor
+        processor = get_image_processor()
         
-        messages = [
+        return [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": "请详细描述这张图片的内容、意境和情感，用于推荐相关的古诗词。"},
+                    {"type": "text", "text": self.DESCRIBE_PROMPT},
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": processor.encode_image_to_data_url(image_path)
                         }
                     }
                 ]
             }
         ]
+    
+    def _build_result(
+        self,
+        content: str,
+        count: int,
+        image_description: Optional[str]
+    ) -> Dict[str, Any]:
+        """
+        解析AI响应文本并构建推荐结果字典
         
-        response = self.client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=messages,
-            max_tokens=500
+        Raises:
+            ResponseParseError: 响应中没有可解析的诗词
+        """
+        poems = parse_poems(content)
+        get_poem_token_estimator().observe(poems)
+        return poems_to_result(poems, count, image_description)
+
+
+class OpenAIClient(OpenAIChatMixin, AIClient):
+    """
+    OpenAI客户端（也用于其他兼容OpenAI接口的服务商）
+    
+    底层SDK客户端按 (服务商, base_url, api_key) 在进程内共享，创建本客户端的开销很小。
+    """
+    
+    provider = 'openai'
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None
+    ):
+        """
+        Args:
+            api_key: API密钥（默认使用该服务商的配置）
+            base_url: 接口地址（默认使用该服务商的配置）
+            model: 文字请求使用的模型（默认使用该服务商的默认模型）
+        """
+        default_api_key, default_base_url = provider_credentials(self.provider)
+        super().__init__(api_key or default_api_key, base_url or default_base_url)
+        self.model = model or PROVIDERS[self.provider]['default_model']
+        self.vision_model = PROVIDERS[self.provider]['vision_model']
+        try:
+            import openai  # noqa: F401
+        except ImportError:
+            raise ImportError("请安装openai库: pip install openai")
+        
+        from utils.client_registry import shared_openai_client
+        self.client = shared_openai_client(self.provider, self.api_key, self.base_url)
+    
+    def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐"""
+        # 如果有图片但没有描述，先识别图片
+        if image_path and not image_description:
+            image_description = self._describe_image(image_path)
+        
+        messages = self._build_messages(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context
+        )
+        
+        model = self._chat_model(image_path)
+        response_format = self._response_format_kwargs()
+        max_tokens = self._max_tokens(count)
+        
+        # 调用API
+        def _call_api():
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                **response_format
+            )
+            record_usage(getattr(response, 'usage', None), model)
+            self._check_finish_reason(response.choices[0], max_tokens)
+            return response.choices[0].message.content
+        
+        content = self._retry_request(
+            _call_api,
+            rate_limit_key=model,
+            estimated_tokens=estimate_tokens(messages, max_tokens)
         )
         
-        return response.choices[0].message.content
+        return self._build_result(content, count, image_description)
     
-    def _parse_text_response(self, content: str) -> Dict[str, Any]:
-        """解析文本响应"""
-        # 简单的文本解析逻辑
-        # 这里可以根据实际返回格式进行优化
-        return {
-            'poems': [{
-                'title': '未知',
-                'content': content,
-                'author': '未知',
-                'dynasty': '未知',
-                'appreciation': ''
-            }]
-        }
+    def stream_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> PoemStream:
+        """流式生成诗词推荐，"poems" 数组中的每个对象闭合时立即返回"""
+        # 如果有图片但没有描述，先识别图片
+        if image_path and not image_description:
+            image_description = self._describe_image(image_path)
+        
+        messages = self._build_messages(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context
+        )
+        
+        model = self._chat_model(image_path)
+        request_kwargs = self._response_format_kwargs()
+        max_tokens = self._max_tokens(count)
+        
+        # 要求服务商在流的最后一个分片中返回令牌用量
+        if PROVIDERS[self.provider].get('stream_usage'):
+            request_kwargs['stream_options'] = {'include_usage': True}
+        
+        # 建立流式连接（失败时重试；开始接收内容后不再重试）
+        def _open_stream():
+            return self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                stream=True,
+                **request_kwargs
+            )
+        
+        stream = self._retry_request(
+            _open_stream,
+            rate_limit_key=model,
+            estimated_tokens=estimate_tokens(messages, max_tokens)
+        )
+        return PoemStream(self._iter_stream(stream, count, image_description, model), image_description)
+    
+    def _iter_stream(
+        self,
+        stream,
+        count: int,
+        image_description: Optional[str],
+        model: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        从流式响应中逐首解析诗词
+        
+        服务商在只含用量的最后一个分片中返回令牌用量，因此总是读到流结束：第count首诗词在读完剩余分片、
+        记录用量之后才返回，保存这首诗词的推荐记录时带有本次请求的令牌用量。
+        """
+        from utils.json_stream import PoemStreamParser
+        
+        model = model or self.model
+        parser = PoemStreamParser()
+        content_parts = []
+        emitted = 0
+        
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    record_usage(chunk.usage, model)
+                if not chunk.choices or parser.done:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                content_parts.append(delta)
+                for poem in parser.feed(delta):
+                    get_poem_token_estimator().observe([poem])
+                    emitted += 1
+                    if emitted >= count:
+                        self._drain_stream(stream, model)
+                        yield poem
+                        return
+                    yield poem
+        finally:
+            stream.close()
+        
+        if emitted == 0:
+            # 流中没有解析出完整的诗词对象，按完整文本解析
+            result = self._build_result(''.join(content_parts), count, image_description)
+            for poem in result_to_poems(result):
+                yield poem
+    
+    @staticmethod
+    def _drain_stream(stream, model: str):
+        """读完流的剩余分片（已不需要其中的内容），记录最后一个分片中的令牌用量"""
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                record_usage(chunk.usage, model)
+    
+    def _describe_image(self, image_path: str) -> str:
+        """描述图片内容"""
+        model = self.vision_model
+        messages = self._build_describe_messages(image_path)
+        
+        def _call_api():
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=500
+            )
+            record_usage(getattr(response, 'usage', None), model)
+            return response.choices[0].message.content
+        
+        return self._retry_request(
+            _call_api,
+            rate_limit_key=model,
+            estimated_tokens=estimate_tokens(messages, 500)
+        )
+
+
+class QianfanClient(OpenAIClient):
+    """百度千帆（文心一言）客户端，使用千帆的OpenAI兼容接口（v2），以baidu_api_key鉴权"""
+    
+    provider = 'qianfan'
+
+
+class DashScopeClient(OpenAIClient):
+    """阿里云百炼（通义千问）客户端，使用DashScope的OpenAI兼容模式"""
+    
+    provider = 'dashscope'
+
+
+# 服务商 -> 同步客户端类
+PROVIDER_CLIENTS = {
+    'openai': OpenAIClient,
+    'qianfan': QianfanClient,
+    'dashscope': DashScopeClient,
+}
 
 
 class AIClientFactory:
-    """AI客户端工厂"""
+    """
+    AI客户端工厂
+    
+    相同服务商、base_url和api_key的客户端共享底层连接池（异步客户端在同一事件循环内共享），
+    连接只在首次使用时建立一次。推荐数量较多时，请求会被拆分为并行的子请求（见utils/fanout_client.py）。
+    """
     
     @staticmethod
-    def create_client(model_name: str) -> AIClient:
+    def create_client(model_name: str, use_cache: Optional[bool] = None) -> AIClient:
         """
         创建AI客户端
         
         Args:
-            model_name: 模型名称（如 'gpt-4', 'gpt-3.5-turbo' 等）
-            
+            model_name: 模型名称（如 'gpt-4'、'ernie-4.0-8k'、'qwen-max'；
+                        'router' 表示在配置的多个后端之间路由）
+            use_cache: 是否启用推荐结果缓存（默认使用配置中的cache_enabled）
+        
         Returns:
             AI客户端实例
         """
-        if model_name.startswith('gpt'):
-            return OpenAIClient()
+        if model_name == ROUTER_MODEL:
+            from utils.router_client import RouterClient
+            client = RouterClient({
+                backend: AIClientFactory._create_backend(backend) for backend in settings.router_backends
+            })
         else:
-            raise ValueError(f"不支持的模型: {model_name}")
-
+            client = AIClientFactory._create_backend(model_name)
+        
+        if settings.fanout_enabled:
+            from utils.fanout_client import FanOutClient
+            client = FanOutClient(client)
+        
+        if settings.cache_enabled if use_cache is None else use_cache:
+            from utils.response_cache import CachedAIClient
+            client = CachedAIClient(client, model_name)
+        return client
+    
+    @staticmethod
+    def create_async_client(model_name: str, use_cache: Optional[bool] = None) -> 'AsyncAIClient':
+        """
+        创建异步AI客户端
+        
+        Args:
+            model_name: 模型名称（同create_client）
+            use_cache: 是否启用推荐结果缓存（默认使用配置中的cache_enabled）
+        
+        Returns:
+            异步AI客户端实例，返回结果与同步客户端完全一致。
+            在事件循环中调用时，底层连接在该事件循环内共享，由close_async_clients()统一关闭；
+            否则使用独立的连接，使用完毕后需调用客户端的close()
+        """
+        from utils.async_ai_client import AsyncCachedAIClient
+        
+        if model_name == ROUTER_MODEL:
+            from utils.router_client import AsyncRouterClient
+            client = AsyncRouterClient({
+                backend: AIClientFactory._create_async_backend(backend) for backend in settings.router_backends
+            })
+        else:
+            client = AIClientFactory._create_async_backend(model_name)
+        
+        if settings.fanout_enabled:
+            from utils.fanout_client import AsyncFanOutClient
+            client = AsyncFanOutClient(client)
+        
+        if settings.cache_enabled if use_cache is None else use_cache:
+            client = AsyncCachedAIClient(client, model_name)
+        return client
+    
+    @staticmethod
+    def _create_backend(model_name: str) -> AIClient:
+        """创建单个模型的同步客户端"""
+        if model_name == ROUTER_MODEL:
+            raise ValueError("路由后端中不能再包含router")
+        return PROVIDER_CLIENTS[resolve_provider(model_name)](model=model_name)
+    
+    @staticmethod
+    def _create_async_backend(model_name: str) -> 'AsyncAIClient':
+        """创建单个模型的异步客户端"""
+        from utils.async_ai_client import ASYNC_PROVIDER_CLIENTS
+        
+        if model_name == ROUTER_MODEL:
+            raise ValueError("路由后端中不能再包含router")
+        return ASYNC_PROVIDER_CLIENTS[resolve_provider(model_name)](model=model_name)
+    
+    @staticmethod
+    def close_all():
+        """关闭进程内共享的同步客户端（进程退出时也会自动调用）"""
+        from utils.client_registry import get_client_registry
+        get_client_registry().close_all()
+    
+    @staticmethod
+    async def close_async_clients():
+        """关闭当前事件循环内共享的异步客户端"""
+        from utils.client_registry import get_async_client_registry
+        registry = get_async_client_registry()
+        if registry is not None:
+            await registry.aclose_all()
@@ -0,0 +1,273 @@
+"""
+异步AI大模型客户端模块
+
+基于asyncio的客户端实现，等待API响应和重试退避时不阻塞事件循环，
+单个事件循环即可同时保持大量进行中的请求。
+"""
+import asyncio
+import functools
+import logging
+from typing import Optional, Dict, Any, List
+from abc import ABC, abstractmethod
+
+from config.settings import settings
+from utils.ai_client import OpenAIChatMixin, PROVIDERS, provider_credentials
+from utils.rate_limiter import estimate_tokens, get_rate_limiter, is_retryable_error, retry_delay
+from utils.response_cache import ResponseCache, build_cache_key, build_cache_request, get_response_cache, is_complete
+from utils.tracing import in_context, record_retry, record_usage, span
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAIClient(ABC):
+    """异步AI客户端基类"""
+    
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = settings.api_timeout
+        self.retry_times = settings.api_retry_times
+    
+    @abstractmethod
+    async def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """
+        生成诗词推荐
+        
+        参数和返回值与 AIClient.generate_poetry_recommendation 完全一致。
+        """
+        pass
+    
+    async def close(self):
+        """释放客户端持有的连接"""
+        pass
+    
+    async def _retry_request(
+        self,
+        func,
+        *args,
+        rate_limit_key: Optional[str] = None,
+        estimated_tokens: int = 0,
+        **kwargs
+    ):
+        """
+        重试请求（限流和退避等待期间不阻塞事件循环）
+        
+        参数和重试策略与 AIClient._retry_request 一致，与同步客户端共用同一模型的限流状态。
+        """
+        limiter = get_rate_limiter(rate_limit_key) if rate_limit_key else None
+        call = functools.partial(func, *args, **kwargs)
+        last_error = None
+        for attempt in range(self.retry_times):
+            try:
+                with span('api_attempt'):
+                    if limiter is None:
+                        return await call()
+                    return await limiter.call_async(call, estimated_tokens)
+            except Exception as e:
+                last_error = e
+                if not is_retryable_error(e):
+                    raise
+                logger.warning(f"请求失败 (尝试 {attempt + 1}/{self.retry_times}): {e}")
+                if attempt < self.retry_times - 1:
+                    record_retry(rate_limit_key)
+                    await asyncio.sleep(retry_delay(e, attempt, limiter))
+        raise last_error
+
+
+class AsyncOpenAIClient(OpenAIChatMixin, AsyncAIClient):
+    """OpenAI异步客户端（也用于其他兼容OpenAI接口的服务商）"""
+    
+    provider = 'openai'
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None
+    ):
+        """
+        Args:
+            api_key: API密钥（默认使用该服务商的配置）
+            base_url: 接口地址（默认使用该服务商的配置）
+            model: 文字请求使用的模型（默认使用该服务商的默认模型）
+        """
+        default_api_key, default_base_url = provider_credentials(self.provider)
+        super().__init__(api_key or default_api_key, base_url or default_base_url)
+        self.model = model or PROVIDERS[self.provider]['default_model']
+        self.vision_model = PROVIDERS[self.provider]['vision_model']
+        try:
+            import openai  # noqa: F401
+        except ImportError:
+            raise ImportError("请安装openai库: pip install openai")
+        
+        from utils.client_registry import shared_async_openai_client
+        self.client, self._shared = shared_async_openai_client(self.provider, self.api_key, self.base_url)
+    
+    async def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐"""
+        loop = asyncio.get_running_loop()
+        
+        # 如果有图片但没有描述，先识别图片
+        if image_path and not image_description:
+            image_description = await self._describe_image(image_path)
+        
+        # 图片读取和编码是阻塞的文件操作，放到线程池中执行
+        messages = await loop.run_in_executor(
+            None,
+            in_context(lambda: self._build_messages(
+                positive_prompt=positive_prompt,
+                negative_prompt=negative_prompt,
+                image_path=image_path,
+                image_description=image_description,
+                context=context
+            ))
+        )
+        
+        model = self._chat_model(image_path)
+        response_format = self._response_format_kwargs()
+        max_tokens = self._max_tokens(count)
+        
+        # 调用API
+        async def _call_api():
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                **response_format
+            )
+            record_usage(getattr(response, 'usage', None), model)
+            self._check_finish_reason(response.choices[0], max_tokens)
+            return response.choices[0].message.content
+        
+        content = await self._retry_request(
+            _call_api,
+            rate_limit_key=model,
+            estimated_tokens=estimate_tokens(messages, max_tokens)
+        )
+        
+        return self._build_result(content, count, image_description)
+    
+    async def _describe_image(self, image_path: str) -> str:
+        """描述图片内容"""
+        loop = asyncio.get_running_loop()
+        messages: List[Dict[str, Any]] = await loop.run_in_executor(
+            None, in_context(self._build_describe_messages), image_path
+        )
+        
+        model = self.vision_model
+        
+        async def _call_api():
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=500
+            )
+            record_usage(getattr(response, 'usage', None), model)
+            return response.choices[0].message.content
+        
+        return await self._retry_request(
+            _call_api,
+            rate_limit_key=model,
+            estimated_tokens=estimate_tokens(messages, 500)
+        )
+    
+    async def close(self):
+        """关闭底层HTTP连接（共享连接由 AIClientFactory.close_async_clients() 统一关闭）"""
+        if not self._shared:
+            await self.client.close()
+
+
+class AsyncQianfanClient(AsyncOpenAIClient):
+    """百度千帆（文心一言）异步客户端"""
+    
+    provider = 'qianfan'
+
+
+class AsyncDashScopeClient(AsyncOpenAIClient):
+    """阿里云百炼（通义千问）异步客户端"""
+    
+    provider = 'dashscope'
+
+
+# 服务商 -> 异步客户端类
+ASYNC_PROVIDER_CLIENTS = {
+    'openai': AsyncOpenAIClient,
+    'qianfan': AsyncQianfanClient,
+    'dashscope': AsyncDashScopeClient,
+}
+
+
+class AsyncCachedAIClient(AsyncAIClient):
+    """带结果缓存的异步AI客户端，与CachedAIClient共用同一缓存"""
+    
+    def __init__(self, client: AsyncAIClient, model_name: str, cache: Optional[ResponseCache] = None):
+        """
+        Args:
+            client: 实际调用AI接口的异步客户端
+            model_name: 模型名称（参与缓存键计算）
+            cache: 缓存实例（默认使用进程内共享缓存）
+        """
+        super().__init__(client.api_key, client.base_url)
+        self.client = client
+        self.model_name = model_name
+        self.cache = cache or get_response_cache()
+    
+    async def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐，命中缓存时直接返回缓存结果"""
+        loop = asyncio.get_running_loop()
+        
+        # 图片哈希、磁盘缓存读取和语义缓存查找是阻塞操作，放到线程池中执行
+        request = build_cache_request(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        key = await loop.run_in_executor(None, lambda: build_cache_key(self.model_name, **request))
+        
+        result = await loop.run_in_executor(None, in_context(self.cache.get), key, self.model_name, request)
+        if result is not None:
+            logger.info(f"命中推荐结果缓存: {key[:12]}")
+            return result
+        
+        result = await self.client.generate_poetry_recommendation(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        if is_complete(result, count):
+            await loop.run_in_executor(None, self.cache.set, key, result, self.model_name, request)
+        return result
+    
+    async def close(self):
+        await self.client.close()
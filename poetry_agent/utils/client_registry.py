@@ -0,0 +1,174 @@
+"""
+AI客户端注册表
+
+按 (服务商, base_url, api_key) 共享openai SDK客户端及其HTTP连接池，同一进程内的多次推荐
+（包括同一服务商的不同模型）复用已建立的TCP/TLS连接，不再每次请求都重新创建客户端。
+"""
+import atexit
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _http_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=settings.api_max_connections,
+        max_keepalive_connections=settings.api_max_keepalive_connections,
+        keepalive_expiry=settings.api_keepalive_expiry
+    )
+
+
+def http_timeout():
+    """AI接口请求超时（总超时为api_timeout，建立连接的超时单独配置）"""
+    import httpx
+    return httpx.Timeout(settings.api_timeout, connect=settings.api_connect_timeout)
+
+
+def build_http_client():
+    """创建带连接池配置的同步HTTP客户端，供openai SDK使用"""
+    import openai
+    return openai.DefaultHttpxClient(limits=_http_limits(), timeout=http_timeout())
+
+
+def build_async_http_client():
+    """创建带连接池配置的异步HTTP客户端，供openai SDK使用"""
+    import openai
+    return openai.DefaultAsyncHttpxClient(limits=_http_limits(), timeout=http_timeout())
+
+
+class ClientRegistry:
+    """客户端注册表：相同键只创建一个客户端"""
+    
+    def __init__(self):
+        self._clients: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+    
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        获取共享客户端，不存在时调用factory创建
+        
+        Args:
+            key: 客户端键，通常为 (服务商, base_url, api_key)
+            factory: 创建客户端的函数
+        
+        Returns:
+            共享的客户端实例
+        """
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+                logger.debug(f"已创建共享AI客户端: {key[0] if isinstance(key, tuple) else key}")
+            return client
+    
+    def close_all(self):
+        """关闭并移除全部客户端（同步客户端）"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"关闭AI客户端失败: {e}")
+    
+    async def aclose_all(self):
+        """关闭并移除全部客户端（异步客户端）"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"关闭AI客户端失败: {e}")
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+
+_client_registry: Optional[ClientRegistry] = None
+# 异步HTTP连接绑定在创建它的事件循环上，每个事件循环使用单独的注册表
+_async_registries: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ClientRegistry]' = weakref.WeakKeyDictionary()
+_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> ClientRegistry:
+    """获取进程内共享的同步客户端注册表（进程退出时自动关闭其中的客户端）"""
+    global _client_registry
+    with _registry_lock:
+        if _client_registry is None:
+            _client_registry = ClientRegistry()
+            atexit.register(_client_registry.close_all)
+        return _client_registry
+
+
+def get_async_client_registry() -> Optional[ClientRegistry]:
+    """获取当前事件循环的异步客户端注册表，不在事件循环中调用时返回None"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    with _registry_lock:
+        registry = _async_registries.get(loop)
+        if registry is None:
+            registry = ClientRegistry()
+            _async_registries[loop] = registry
+        return registry
+
+
+def _new_openai_client(api_key: Optional[str], base_url: Optional[str]):
+    import openai
+    # 重试由AIClient._retry_request统一处理，关闭SDK自带的重试
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=http_timeout(),
+        max_retries=0,
+        http_client=build_http_client()
+    )
+
+
+def _new_async_openai_client(api_key: Optional[str], base_url: Optional[str]):
+    import openai
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=http_timeout(),
+        max_retries=0,
+        http_client=build_async_http_client()
+    )
+
+
+def shared_openai_client(provider: str, api_key: Optional[str], base_url: Optional[str]):
+    """获取进程内共享的openai SDK同步客户端（兼容OpenAI接口的服务商共用）"""
+    return get_client_registry().get_or_create(
+        (provider, base_url, api_key),
+        lambda: _new_openai_client(api_key, base_url)
+    )
+
+
+def shared_async_openai_client(provider: str, api_key: Optional[str], base_url: Optional[str]) -> Tuple[Any, bool]:
+    """
+    获取当前事件循环内共享的openai SDK异步客户端
+
+    Returns:
+        (客户端, 是否为共享客户端)；不在事件循环中调用时返回独立的客户端，由调用方负责关闭
+    """
+    registry = get_async_client_registry()
+    if registry is None:
+        return _new_async_openai_client(api_key, base_url), False
+    client = registry.get_or_create(
+        (provider, base_url, api_key),
+        lambda: _new_async_openai_client(api_key, base_url)
+    )
+    return client, True
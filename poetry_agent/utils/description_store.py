@@ -0,0 +1,266 @@
+"""
+图片描述存储模块
+
+按图片内容哈希（完全相同）和感知哈希（近似重复）复用已有的图片描述，
+避免同一张图片反复调用AI图片识别接口。
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Optional, Dict, List, Set, Tuple
+
+from sqlalchemy import select, update
+
+from config.settings import settings
+from models.database import get_db, insert_ignore
+from models.image_description import ImageDescription
+from models.recommendation import Recommendation
+from utils.image_processor import get_image_processor, hash_file
+
+logger = logging.getLogger(__name__)
+
+# 感知哈希分段数：汉明距离不超过 BANDS-1 的两个哈希至少有一段完全相同
+BANDS = 8
+BAND_BITS = 64 // BANDS
+
+# 纯色、低细节图片的dHash几乎全0或全1，彼此之间汉明距离很小却并不相似，
+# 置位数不在该范围内的哈希只按内容哈希匹配
+MIN_HASH_BITS = 8
+MAX_HASH_BITS = 64 - MIN_HASH_BITS
+
+# 复用次数在内存中累计，达到该数量或距上次写入超过HIT_FLUSH_INTERVAL秒时合并写入（进程退出时写入剩余的计数），
+# 查找本身只读数据库
+HIT_FLUSH_THRESHOLD = 100
+HIT_FLUSH_INTERVAL = 60
+
+
+class ImageDescriptionStore:
+    """
+    图片描述存储
+    
+    完全相同的图片直接按内容哈希查询数据库；近似重复的图片通过进程内的感知哈希分段索引查找，
+    索引在首次使用时从数据库加载，之后随本进程的写入增量更新。
+    复用次数（hit_count）按内容哈希在内存中累计后批量写入。
+    """
+    
+    def __init__(self, threshold: Optional[int] = None):
+        """
+        Args:
+            threshold: 判定为近似重复图片的最大汉明距离（默认使用配置中的image_phash_threshold）
+        """
+        self.threshold = settings.image_phash_threshold if threshold is None else threshold
+        self.image_processor = get_image_processor()
+        self._lock = threading.Lock()
+        self._loaded = False
+        # 感知哈希 -> 内容哈希
+        self._hashes: Dict[int, str] = {}
+        # 每段的取值 -> 感知哈希集合
+        self._bands: List[Dict[int, Set[int]]] = [{} for _ in range(BANDS)]
+        # 尚未写入的复用次数：内容哈希 -> 次数
+        self._hits: Counter = Counter()
+        self._hits_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+    
+    def lookup(self, image_path: str) -> Optional[Tuple[str, bool]]:
+        """
+        查找图片描述
+        
+        Args:
+            image_path: 图片文件路径或ImageHandle
+        
+        Returns:
+            (图片描述, 是否为完全相同的图片)；未找到返回None
+        """
+        content_hash = hash_file(image_path)
+        
+        with get_db() as db:
+            description = self._get_description(db, content_hash)
+            match, exact = content_hash, True
+            if description is None:
+                if self.threshold <= 0:
+                    return None
+                phash = self.image_processor.compute_perceptual_hash(image_path)
+                if not self._is_distinctive(phash):
+                    return None
+                match, exact = self._find_similar(db, phash), False
+                if match is None:
+                    return None
+                description = self._get_description(db, match)
+                if description is None:
+                    return None
+        
+        if exact:
+            logger.info(f"复用图片描述（内容相同）: {content_hash[:12]}")
+        else:
+            logger.info(f"复用图片描述（近似图片）: {content_hash[:12]} -> {match[:12]}")
+        self._record_hit(match)
+        return description, exact
+    
+    def save(self, image_path: str, description: str, source: str = 'vision'):
+        """
+        保存图片描述（已存在相同内容的图片时忽略）
+        
+        Args:
+            image_path: 图片文件路径或ImageHandle
+            description: 图片描述
+            source: 描述来源
+        """
+        content_hash = hash_file(image_path)
+        phash = self.image_processor.compute_perceptual_hash(image_path)
+        
+        with get_db() as db:
+            insert_ignore(db, ImageDescription.__table__, [{
+                'content_hash': content_hash,
+                'perceptual_hash': f"{phash:016x}",
+                'description': description,
+                'source': source,
+                'hit_count': 0,
+            }], 'content_hash')
+        
+        with self._lock:
+            if self._loaded:
+                self._index(phash, content_hash)
+    
+    def flush_hits(self):
+        """写入内存中累计的复用次数（按内容哈希排序更新，并发的进程以相同的顺序加锁）"""
+        with self._hits_lock:
+            hits, self._hits = self._hits, Counter()
+            self._last_flush = time.monotonic()
+        if not hits:
+            return
+        # 次数相同的图片合并为一条UPDATE
+        groups: Dict[int, List[str]] = {}
+        for content_hash in sorted(hits):
+            groups.setdefault(hits[content_hash], []).append(content_hash)
+        try:
+            with get_db() as db:
+                for count, content_hashes in groups.items():
+                    db.execute(
+                        update(ImageDescription)
+                        .where(ImageDescription.content_hash.in_(content_hashes))
+                        .values(hit_count=ImageDescription.hit_count + count)
+                        .execution_options(synchronize_session=False)
+                    )
+        except Exception as e:
+            logger.warning(f"写入图片描述复用次数失败: {e}")
+    
+    def seed_from_recommendations(self, batch_size: int = 500) -> int:
+        """
+        从推荐记录表中导入已有的图片描述
+        
+        仅导入图片文件仍然存在的成功记录，同一张图片只导入一次。
+        
+        Args:
+            batch_size: 每批读取的记录数
+        
+        Returns:
+            导入的描述数量
+        """
+        imported = 0
+        last_id = 0
+        seen = set()
+        
+        while True:
+            with get_db() as db:
+                rows = db.execute(
+                    select(Recommendation.id, Recommendation.image_path, Recommendation.image_description)
+                    .where(
+                        Recommendation.id > last_id,
+                        Recommendation.status == 1,
+                        Recommendation.image_path.isnot(None),
+                        Recommendation.image_description.isnot(None)
+                    )
+                    .order_by(Recommendation.id)
+                    .limit(batch_size)
+                ).all()
+            if not rows:
+                break
+            
+            for record_id, image_path, description in rows:
+                last_id = record_id
+                if image_path in seen or not description.strip():
+                    continue
+                seen.add(image_path)
+                try:
+                    self.save(image_path, description, source='seed')
+                    imported += 1
+                except OSError as e:
+                    logger.debug(f"跳过无法读取的图片 {image_path}: {e}")
+                except Exception as e:
+                    logger.warning(f"导入图片描述失败 {image_path}: {e}")
+        
+        logger.info(f"已从推荐记录导入 {imported} 条图片描述")
+        return imported
+    
+    @staticmethod
+    def _get_description(db, content_hash: str) -> Optional[str]:
+        return db.execute(
+            select(ImageDescription.description).where(ImageDescription.content_hash == content_hash)
+        ).scalar_one_or_none()
+    
+    def _record_hit(self, content_hash: str):
+        """累计一次复用，达到数量或时间间隔时写入数据库"""
+        with self._hits_lock:
+            self._hits[content_hash] += 1
+            due = sum(self._hits.values()) >= HIT_FLUSH_THRESHOLD \
+                or time.monotonic() - self._last_flush >= HIT_FLUSH_INTERVAL
+        if due:
+            self.flush_hits()
+    
+    def _find_similar(self, db, phash: int) -> Optional[str]:
+        """在感知哈希索引中查找汉明距离最小且不超过阈值的图片，返回其内容哈希"""
+        with self._lock:
+            if not self._loaded:
+                for content_hash, perceptual_hash in db.execute(
+                    select(ImageDescription.content_hash, ImageDescription.perceptual_hash)
+                ):
+                    self._index(int(perceptual_hash, 16), content_hash)
+                self._loaded = True
+            
+            if self.threshold < BANDS:
+                # 分段索引：只比较至少有一段完全相同的候选哈希
+                candidates = set()
+                for band, table in enumerate(self._bands):
+                    candidates |= table.get(self._band_value(phash, band), set())
+            else:
+                candidates = self._hashes.keys()
+            
+            best, best_distance = None, self.threshold + 1
+            for candidate in candidates:
+                distance = bin(candidate ^ phash).count('1')
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+            return self._hashes[best] if best is not None else None
+    
+    def _index(self, phash: int, content_hash: str):
+        """将感知哈希加入分段索引（调用方需持有锁）"""
+        if not self._is_distinctive(phash):
+            return
+        self._hashes.setdefault(phash, content_hash)
+        for band, table in enumerate(self._bands):
+            table.setdefault(self._band_value(phash, band), set()).add(phash)
+    
+    @staticmethod
+    def _is_distinctive(phash: int) -> bool:
+        """感知哈希是否包含足够的细节信息，可用于近似匹配"""
+        return MIN_HASH_BITS <= bin(phash).count('1') <= MAX_HASH_BITS
+    
+    @staticmethod
+    def _band_value(phash: int, band: int) -> int:
+        return (phash >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)
+
+
+_description_store: Optional[ImageDescriptionStore] = None
+_description_store_lock = threading.Lock()
+
+
+def get_description_store() -> ImageDescriptionStore:
+    """获取进程内共享的图片描述存储"""
+    global _description_store
+    with _description_store_lock:
+        if _description_store is None:
+            _description_store = ImageDescriptionStore()
+            atexit.register(_description_store.flush_hits)
+        return _description_store
@@ -0,0 +1,343 @@
+"""
+推荐请求拆分模块
+
+一次请求推荐很多首诗词时，输出容易超过max_tokens被截断，单个长请求的耗时也最长。
+FanOutClient把数量超过fanout.batch_size的请求拆分为多个并行的子请求（每个子请求的数量同时受输出令牌上限约束），
+合并结果并去除重复的诗词；去重后数量不足（包括部分子请求失败）时，带上已选诗词作为排除要求补充请求。
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, List, Iterator, AsyncIterator
+
+from config.settings import settings
+from utils.ai_client import AIClient, PoemStream, get_poem_token_estimator, poems_to_result, result_to_poems
+from utils.poem_index import poem_key
+from utils.tracing import in_context, record_fanout_failure
+
+logger = logging.getLogger(__name__)
+
+# 去重后数量不足时补充请求的最多轮数
+FOLLOW_UP_ROUNDS = 2
+
+# 排除要求中最多列出的已选诗词数
+MAX_EXCLUDED_POEMS = 30
+
+
+def plan_batches(count: int, batch_size: int, per_request: int) -> List[int]:
+    """
+    把count首诗词拆分为数量尽量均匀的子请求
+    
+    Args:
+        count: 推荐数量
+        batch_size: 配置的每个子请求最多推荐的诗词数，按耗时设置（0表示只按per_request拆分）
+        per_request: 输出令牌上限内一次请求最多能完整返回的诗词数
+    
+    Returns:
+        各子请求的推荐数量
+    """
+    size = max(1, min(batch_size, per_request) if batch_size > 0 else per_request)
+    batches = -(-count // size)
+    base, extra = divmod(count, batches)
+    return [base + 1 if index < extra else base for index in range(batches)]
+
+
+def exclusion_prompt(negative_prompt: Optional[str], poems: List[Dict[str, Any]]) -> Optional[str]:
+    """在负向提示词后追加已选诗词，补充请求不再推荐这些诗词"""
+    titles = []
+    for poem in poems[-MAX_EXCLUDED_POEMS:]:
+        if poem.get('title'):
+            author = f"（{poem['author']}）" if poem.get('author') else ''
+            titles.append(f"《{poem['title']}》{author}")
+    if not titles:
+        return negative_prompt
+    clause = f"不要推荐以下已选的诗词：{'、'.join(titles)}"
+    return f"{negative_prompt}；{clause}" if negative_prompt else clause
+
+
+class PoemMerger:
+    """合并子请求返回的诗词，按正文以及标题和作者去重，最多保留count首"""
+    
+    def __init__(self, count: int):
+        self.count = count
+        self.poems: List[Dict[str, Any]] = []
+        self._keys = set()
+    
+    def add(self, poems: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """加入一批诗词，返回其中新加入的诗词"""
+        added = []
+        for poem in poems:
+            if len(self.poems) >= self.count:
+                break
+            keys = {'content:' + poem_key(None, poem.get('content'))}
+            if poem.get('title'):
+                keys.add('title:' + poem_key(f"{poem['title']}{poem.get('author') or ''}", None))
+            if keys & self._keys:
+                continue
+            self._keys.update(keys)
+            self.poems.append(poem)
+            added.append(poem)
+        return added
+    
+    @property
+    def shortfall(self) -> int:
+        return self.count - len(self.poems)
+
+
+_fanout_executor: Optional[ThreadPoolExecutor] = None
+_fanout_executor_lock = threading.Lock()
+
+
+def _get_fanout_executor() -> ThreadPoolExecutor:
+    """执行子请求的共享线程池（每次推荐同时执行的子请求数由fanout.max_parallel限制）"""
+    global _fanout_executor
+    with _fanout_executor_lock:
+        if _fanout_executor is None:
+            _fanout_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix='fanout')
+        return _fanout_executor
+
+
+class _FanOutPolicy:
+    """同步和异步拆分客户端共用的拆分策略"""
+    
+    @staticmethod
+    def _plan(count: int) -> List[int]:
+        """按当前的每首诗词令牌数估计拆分请求"""
+        per_request = get_poem_token_estimator().poems_per_request(settings.api_max_output_tokens)
+        return plan_batches(count, settings.fanout_batch_size, per_request)
+    
+    @staticmethod
+    def _log_failures(errors: List[Exception], batches: List[int]):
+        """部分子请求失败时记录（缺少的诗词由补充请求补齐）"""
+        if errors:
+            logger.warning(f"{len(errors)}/{len(batches)} 个子请求失败，合并其余子请求的结果: {errors[-1]}")
+    
+    @staticmethod
+    def _follow_up(request: Dict[str, Any], negative_prompt: Optional[str], merger: PoemMerger) -> Dict[str, Any]:
+        """构建补充请求：排除已选的诗词"""
+        logger.info(f"去重后还差 {merger.shortfall} 首诗词，补充请求")
+        return dict(request, negative_prompt=exclusion_prompt(negative_prompt, merger.poems))
+
+
+class FanOutClient(_FanOutPolicy, AIClient):
+    """拆分请求的AI客户端，包装任意AIClient（包括路由客户端）"""
+    
+    def __init__(self, client: AIClient):
+        """
+        Args:
+            client: 执行子请求的客户端
+        """
+        super().__init__(client.api_key, client.base_url)
+        self.client = client
+    
+    def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐：数量超过单个请求的容量时拆分为并行的子请求"""
+        request = dict(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        batches = self._plan(count)
+        if len(batches) == 1:
+            return self.client.generate_poetry_recommendation(**request)
+        
+        merger = PoemMerger(count)
+        first = self._prepare(request, batches, merger)
+        for _ in self._iter_poems(request, batches, merger, first):
+            pass
+        return poems_to_result(merger.poems, count, request['image_description'])
+    
+    def stream_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> PoemStream:
+        """流式生成诗词推荐：拆分时每个子请求完成后立即返回其中的诗词"""
+        request = dict(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        batches = self._plan(count)
+        if len(batches) == 1:
+            return self.client.stream_poetry_recommendation(**request)
+        
+        merger = PoemMerger(count)
+        first = self._prepare(request, batches, merger)
+        return PoemStream(self._iter_poems(request, batches, merger, first), request['image_description'])
+    
+    def close(self):
+        self.client.close()
+    
+    def _prepare(self, request: Dict[str, Any], batches: List[int], merger: PoemMerger) -> List[Dict[str, Any]]:
+        """
+        需要识别图片时只识别一次，子请求共用图片描述
+        
+        客户端不能单独识别图片（如路由客户端）时，先执行第一个子请求并从其结果中取得图片描述。
+        
+        Returns:
+            已执行的第一个子请求中新加入的诗词
+        """
+        if not request['image_path'] or request['image_description']:
+            return []
+        describe = getattr(self.client, '_describe_image', None)
+        if describe is not None:
+            request['image_description'] = describe(request['image_path'])
+            return []
+        result = self.client.generate_poetry_recommendation(**dict(request, count=batches.pop(0)))
+        request['image_description'] = result.get('image_description')
+        return merger.add(result_to_poems(result))
+    
+    def _iter_poems(
+        self,
+        request: Dict[str, Any],
+        batches: List[int],
+        merger: PoemMerger,
+        first: List[Dict[str, Any]]
+    ) -> Iterator[Dict[str, Any]]:
+        """并行执行子请求，逐批返回去重后的新诗词；数量不足时补充请求"""
+        yield from first
+        negative_prompt = request['negative_prompt']
+        for round_index in range(FOLLOW_UP_ROUNDS + 1):
+            if round_index > 0:
+                if merger.shortfall <= 0:
+                    return
+                request = self._follow_up(request, negative_prompt, merger)
+                batches = self._plan(merger.shortfall)
+            errors = []
+            for result in self._run_batches(request, batches):
+                if isinstance(result, Exception):
+                    errors.append(result)
+                    continue
+                yield from merger.add(result_to_poems(result))
+            if errors and not merger.poems:
+                raise errors[-1]
+            self._log_failures(errors, batches)
+        if merger.shortfall > 0:
+            logger.warning(f"补充请求后仍只有 {len(merger.poems)}/{merger.count} 首不重复的诗词")
+    
+    def _run_batches(self, request: Dict[str, Any], batches: List[int]) -> Iterator[Any]:
+        """并行执行子请求（同时最多fanout.max_parallel个），按完成顺序返回结果或异常"""
+        executor = _get_fanout_executor()
+        queue = list(batches)
+        pending = set()
+        while queue or pending:
+            while queue and len(pending) < settings.fanout_max_parallel:
+                sub_request = dict(request, count=queue.pop(0))
+                pending.add(executor.submit(in_context(self.client.generate_poetry_recommendation), **sub_request))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.warning(f"子请求失败: {e}")
+                    record_fanout_failure()
+                    yield e
+
+
+class AsyncFanOutClient(_FanOutPolicy):
+    """拆分请求的异步AI客户端（策略同FanOutClient）"""
+    
+    def __init__(self, client):
+        """
+        Args:
+            client: 执行子请求的异步客户端
+        """
+        self.api_key = client.api_key
+        self.base_url = client.base_url
+        self.client = client
+    
+    async def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐：数量超过单个请求的容量时拆分为并发的子请求"""
+        request = dict(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        batches = self._plan(count)
+        if len(batches) == 1:
+            return await self.client.generate_poetry_recommendation(**request)
+        
+        merger = PoemMerger(count)
+        if request['image_path'] and not request['image_description']:
+            describe = getattr(self.client, '_describe_image', None)
+            if describe is not None:
+                request['image_description'] = await describe(request['image_path'])
+            else:
+                result = await self.client.generate_poetry_recommendation(**dict(request, count=batches.pop(0)))
+                request['image_description'] = result.get('image_description')
+                merger.add(result_to_poems(result))
+        
+        negative_prompt = request['negative_prompt']
+        for round_index in range(FOLLOW_UP_ROUNDS + 1):
+            if round_index > 0:
+                if merger.shortfall <= 0:
+                    break
+                request = self._follow_up(request, negative_prompt, merger)
+                batches = self._plan(merger.shortfall)
+            errors = []
+            async for result in self._run_batches(request, batches):
+                if isinstance(result, Exception):
+                    errors.append(result)
+                    continue
+                merger.add(result_to_poems(result))
+            if errors and not merger.poems:
+                raise errors[-1]
+            self._log_failures(errors, batches)
+        if merger.shortfall > 0:
+            logger.warning(f"补充请求后仍只有 {len(merger.poems)}/{merger.count} 首不重复的诗词")
+        return poems_to_result(merger.poems, count, request['image_description'])
+    
+    async def close(self):
+        await self.client.close()
+    
+    async def _run_batches(self, request: Dict[str, Any], batches: List[int]) -> AsyncIterator[Any]:
+        """并发执行子请求（同时最多fanout.max_parallel个），按完成顺序返回结果或异常"""
+        semaphore = asyncio.Semaphore(settings.fanout_max_parallel)
+        
+        async def _call(size: int):
+            async with semaphore:
+                try:
+                    return await self.client.generate_poetry_recommendation(**dict(request, count=size))
+                except Exception as e:
+                    logger.warning(f"子请求失败: {e}")
+                    record_fanout_failure()
+                    return e
+        
+        tasks = [asyncio.ensure_future(_call(size)) for size in batches]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
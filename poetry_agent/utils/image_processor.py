@@ -1,93 +1,249 @@
 """
 图片处理工具模块
 """
+import io
 import os
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Tuple
-from PIL import Image
+from typing import Optional, Dict, Any, Iterable, Tuple
 import logging
 
 from config.settings import settings
+from utils.tracing import traced
 
 logger = logging.getLogger(__name__)
 
+# Pillow格式名 -> MIME类型
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+
+
+class ImageHandle:
+    """
+    已读入内存并验证过的图片（由ImageProcessor.ingest创建）
+    
+    图片文件只读取一次，内容哈希在读取时计算；之后的保存、哈希、感知哈希和编码都直接使用内存中的数据。
+    实现了os.PathLike（指向原始文件），可以传给接受图片路径的接口。
+    """
+    
+    def __init__(self, path: str, data: bytes, image_format: str):
+        self.path = str(path)
+        self.data = data
+        self.format = image_format
+        self.digest = hashlib.sha256(data).hexdigest()
+    
+    @property
+    def size(self) -> int:
+        return len(self.data)
+    
+    @property
+    def suffix(self) -> str:
+        return Path(self.path).suffix
+    
+    def open(self):
+        """用Pillow打开图片（使用内存中的数据，不读取文件）"""
+        from PIL import Image
+        return Image.open(io.BytesIO(self.data))
+    
+    def __fspath__(self) -> str:
+        return self.path
+    
+    def __str__(self) -> str:
+        return self.path
+    
+    def __repr__(self):
+        return f"<ImageHandle(path={self.path}, size={self.size}, digest={self.digest[:12]})>"
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256哈希（ImageHandle直接返回读取时计算的哈希）"""
+    if isinstance(file_path, ImageHandle):
+        return file_path.digest
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _flatten_alpha(image):
+    """合成到白色背景上（JPEG不支持透明通道）"""
+    from PIL import Image
+    
+    if image.mode in ('RGB', 'L'):
+        return image
+    rgba = image.convert('RGBA')
+    flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+    flattened.paste(rgba, mask=rgba.split()[-1])
+    return flattened
+
+
+def render_derivative(source, target_path: str, max_edge: int, image_format: str, quality: int) -> int:
+    """
+    生成一张衍生图片（缩略图等），先写临时文件再原子替换为target_path
+    
+    参数都可以序列化，ImageProcessor.build_derivatives在进程池中调用。
+    
+    Args:
+        source: 原图路径或原图数据
+        target_path: 衍生图片路径
+        max_edge: 长边的最大像素数（不放大）
+        image_format: 格式（JPEG/PNG/WEBP）
+        quality: 压缩质量（JPEG/WEBP）
+    
+    Returns:
+        衍生图片的大小（字节）
+    """
+    from PIL import Image, ImageOps
+    
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        # JPEG解码时直接按1/2、1/4、1/8缩小，生成缩略图只需解码很少的像素
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(img)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image_format == 'JPEG':
+            image = _flatten_alpha(image)
+        output = io.BytesIO()
+        save_kwargs = {'optimize': True}
+        if image_format in ('JPEG', 'WEBP'):
+            save_kwargs['quality'] = quality
+        image.save(output, format=image_format, **save_kwargs)
+    data = output.getvalue()
+    
+    target = Path(target_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, target)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+    return len(data)
+
+
+# 已编码的上传数据缓存：(内容哈希, 预处理参数) -> (MIME类型, base64字符串)
+_payload_cache: OrderedDict = OrderedDict()
+_payload_cache_lock = threading.Lock()
+
 
 class ImageProcessor:
     """图片处理器"""
     
     def __init__(self):
         self.max_size = settings.max_image_size
-        self.allowed_formats = settings.allowed_formats
+        self.allowed_formats = settings.allowed_image_formats
         self.upload_dir = Path(settings.image_upload_dir)
-        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.upload_max_edge = settings.image_upload_max_edge
+        self.upload_format = settings.image_upload_format.upper()
+        if self.upload_format not in MIME_TYPES:
+            raise ValueError(f"不支持的上传图片格式: {self.upload_format} (支持的格式: {', '.join(MIME_TYPES)})")
+        self.upload_quality = settings.image_upload_quality
+        self.payload_cache_size = settings.image_payload_cache_size
+        self.derivatives = settings.image_derivatives
+        self._store = None
     
-    def validate_image(self, image_path: str) -> Tuple[bool, Optional[str]]:
+    @property
+    def store(self):
+        """内容寻址的图片存储（首次使用时创建）"""
+        if self._store is None:
+            from utils.image_store import ImageStore
+            self._store = ImageStore(str(self.upload_dir))
+        return self._store
+    
+    @traced('image_validate')
+    def ingest(self, image_path: str) -> ImageHandle:
         """
-        验证图片文件
+        读取并验证图片
+        
+        文件只打开和读取一次：大小取自已打开文件的fstat，Pillow验证使用读入的数据。
+        允许的图片不超过max_size，整个读入内存即可。
         
         Args:
-            image_path: 图片文件路径
-            
+            image_path: 图片文件路径（已经是ImageHandle时直接返回）
+        
         Returns:
-            (是否有效, 错误信息)
-        """
-        if not os.path.exists(image_path):
-            return False, f"图片文件不存在: {image_path}"
+            ImageHandle
         
-        # 检查文件大小
-        file_size = os.path.getsize(image_path)
-        if file_size > self.max_size:
-            return False, f"图片文件过大: {file_size} bytes (最大: {self.max_size} bytes)"
+        Raises:
+            ValueError: 图片不存在、过大、格式不支持或已损坏
+        """
+        if isinstance(image_path, ImageHandle):
+            return image_path
         
         # 检查文件格式
         file_ext = Path(image_path).suffix[1:].lower()
         if file_ext not in self.allowed_formats:
-            return False, f"不支持的图片格式: {file_ext} (支持的格式: {', '.join(self.allowed_formats)})"
+            raise ValueError(f"不支持的图片格式: {file_ext} (支持的格式: {', '.join(self.allowed_formats)})")
+        
+        try:
+            with open(image_path, 'rb', buffering=0) as f:
+                # 检查文件大小
+                file_size = os.fstat(f.fileno()).st_size
+                if file_size > self.max_size:
+                    raise ValueError(f"图片文件过大: {file_size} bytes (最大: {self.max_size} bytes)")
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise ValueError(f"图片文件不存在: {image_path}")
         
         # 尝试打开图片验证
+        from PIL import Image, UnidentifiedImageError
         try:
-            with Image.open(image_path) as img:
+            with Image.open(io.BytesIO(data)) as img:
+                image_format = img.format
                 img.verify()
+        except UnidentifiedImageError:
+            raise ValueError(f"图片文件损坏或格式错误: 无法识别的图片文件 {image_path}")
         except Exception as e:
-            return False, f"图片文件损坏或格式错误: {str(e)}"
+            raise ValueError(f"图片文件损坏或格式错误: {str(e)}")
         
+        return ImageHandle(image_path, data, image_format)
+    
+    def validate_image(self, image_path: str) -> Tuple[bool, Optional[str]]:
+        """
+        验证图片文件
+        
+        Args:
+            image_path: 图片文件路径
+        
+        Returns:
+            (是否有效, 错误信息)
+        """
+        try:
+            self.ingest(image_path)
+        except ValueError as e:
+            return False, str(e)
         return True, None
     
+    @traced('image_save')
     def save_image(self, image_path: str, user_id: Optional[int] = None) -> str:
         """
-        保存图片到指定目录
+        保存图片到内容寻址的图片存储（见utils/image_store.py），相同内容的图片只保存一份
         
         Args:
-            image_path: 原始图片路径
-            user_id: 用户ID（可选，用于组织目录结构）
-            
+            image_path: 原始图片路径或ImageHandle（已读入的图片不再重新读取和验证）
+            user_id: 用户ID（可选，图片与用户的关联由推荐记录保存，不影响存储路径）
+        
         Returns:
             保存后的图片路径
         """
-        # 验证图片
-        is_valid, error = self.validate_image(image_path)
-        if not is_valid:
-            raise ValueError(error)
-        
-        # 创建保存目录
-        if user_id:
-            save_dir = self.upload_dir / str(user_id)
-        else:
-            save_dir = self.upload_dir / 'default'
-        save_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 生成新文件名
-        original_name = Path(image_path).name
-        timestamp = int(os.path.getmtime(image_path))
-        new_name = f"{timestamp}_{original_name}"
-        save_path = save_dir / new_name
+        image = image_path if isinstance(image_path, ImageHandle) else self.ingest(image_path)
         
-        # 复制文件
-        import shutil
-        shutil.copy2(image_path, save_path)
+        save_path, created = self.store.put(image)
         
-        logger.info(f"图片已保存: {save_path}")
+        if created:
+            logger.info(f"图片已保存: {save_path}")
+        else:
+            logger.info(f"图片已存在，复用: {save_path}")
         return str(save_path)
     
     def encode_image_to_base64(self, image_path: str) -> str:
@@ -95,26 +251,279 @@ class ImageProcessor:
         将图片编码为base64字符串
         
         Args:
-            image_path: 图片文件路径
-            
+            image_path: 图片文件路径或ImageHandle
+        
         Returns:
             base64编码的图片字符串
         """
+        if isinstance(image_path, ImageHandle):
+            return base64.b64encode(image_path.data).decode('utf-8')
         with open(image_path, 'rb') as f:
             image_data = f.read()
             base64_str = base64.b64encode(image_data).decode('utf-8')
             return base64_str
     
+    def encode_image_to_data_url(self, image_path: str) -> str:
+        """
+        将图片预处理后编码为data URL，用于AI接口上传
+        
+        Args:
+            image_path: 图片文件路径或ImageHandle
+        
+        Returns:
+            data URL字符串（data:<MIME类型>;base64,<数据>）
+        """
+        mime_type, base64_str = self.prepare_upload_payload(image_path)
+        return f"data:{mime_type};base64,{base64_str}"
+    
+    @traced('image_encode')
+    def prepare_upload_payload(self, image_path: str) -> Tuple[str, str]:
+        """
+        预处理图片并编码为base64，结果按图片内容哈希缓存
+        
+        长边超过upload_max_edge的图片会等比缩小，并按upload_format/upload_quality重新压缩；
+        尺寸未超出且格式已是目标格式的图片直接使用原始数据。
+        
+        Args:
+            image_path: 图片文件路径或ImageHandle
+        
+        Returns:
+            (MIME类型, base64编码的图片字符串)
+        """
+        if isinstance(image_path, ImageHandle):
+            image_data, content_hash = image_path.data, image_path.digest
+        else:
+            with open(image_path, 'rb') as f:
+                image_data = f.read()
+            content_hash = hashlib.sha256(image_data).hexdigest()
+        
+        cache_key = (
+            content_hash,
+            self.upload_max_edge,
+            self.upload_format,
+            self.upload_quality
+        )
+        with _payload_cache_lock:
+            payload = _payload_cache.get(cache_key)
+            if payload is not None:
+                _payload_cache.move_to_end(cache_key)
+                return payload
+        
+        mime_type, encoded_data = self._preprocess_image(image_data)
+        payload = (mime_type, base64.b64encode(encoded_data).decode('utf-8'))
+        logger.debug(f"图片预处理完成: {image_path} ({len(image_data)} -> {len(encoded_data)} bytes, {mime_type})")
+        
+        with _payload_cache_lock:
+            _payload_cache[cache_key] = payload
+            while len(_payload_cache) > self.payload_cache_size:
+                _payload_cache.popitem(last=False)
+        return payload
+    
+    def _preprocess_image(self, image_data: bytes) -> Tuple[str, bytes]:
+        """
+        缩放并重新压缩图片
+        
+        Args:
+            image_data: 原始图片数据
+        
+        Returns:
+            (MIME类型, 处理后的图片数据)
+        """
+        from PIL import Image, ImageOps
+        
+        max_edge = self.upload_max_edge
+        
+        with Image.open(io.BytesIO(image_data)) as img:
+            source_format = img.format
+            
+            # 尺寸和格式都符合要求且无需旋转时，直接上传原始数据
+            needs_resize = max(img.size) > max_edge
+            orientation = img.getexif().get(0x0112, 1)
+            if not needs_resize and orientation == 1 and source_format == self.upload_format:
+                return MIME_TYPES[source_format], image_data
+            
+            # JPEG解码时直接按目标尺寸降采样，减少解码开销
+            if needs_resize and source_format == 'JPEG':
+                img.draft('RGB', (max_edge, max_edge))
+            
+            image = ImageOps.exif_transpose(img)
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            
+            if self.upload_format == 'JPEG':
+                image = _flatten_alpha(image)
+            
+            output = io.BytesIO()
+            save_kwargs = {'optimize': True}
+            if self.upload_format in ('JPEG', 'WEBP'):
+                save_kwargs['quality'] = self.upload_quality
+            image.save(output, format=self.upload_format, **save_kwargs)
+        
+        encoded_data = output.getvalue()
+        # 重新压缩反而更大且无需缩放时，保留原始数据
+        if not needs_resize and orientation == 1 and len(encoded_data) >= len(image_data) \
+                and source_format in MIME_TYPES:
+            return MIME_TYPES[source_format], image_data
+        return MIME_TYPES[self.upload_format], encoded_data
+    
+    def compute_perceptual_hash(self, image_path: str) -> int:
+        """
+        计算图片的感知哈希（64位dHash）
+        
+        缩放、重新压缩或轻微调色后的同一张图片哈希值相同或仅有少数位不同，
+        可用汉明距离判断近似重复图片。
+        
+        Args:
+            image_path: 图片文件路径或ImageHandle
+        
+        Returns:
+            64位整数哈希值
+        """
+        from PIL import Image
+        
+        source = image_path.open() if isinstance(image_path, ImageHandle) else Image.open(image_path)
+        with source as img:
+            if img.format == 'JPEG':
+                img.draft('L', (64, 64))
+            pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+        
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                value = (value << 1) | (1 if left > right else 0)
+        return value
+    
+    def derivative_spec(self, name: str) -> Dict[str, Any]:
+        """
+        衍生图片规格
+        
+        Returns:
+            {'max_edge': 长边像素数, 'format': 格式, 'quality': 压缩质量}
+        
+        Raises:
+            ValueError: 规格未配置或格式不支持
+        """
+        spec = self.derivatives.get(name)
+        if spec is None:
+            raise ValueError(f"未配置的衍生图片规格: {name} (可选: {', '.join(self.derivatives)})")
+        image_format = str(spec.get('format', 'WEBP')).upper()
+        if image_format not in MIME_TYPES:
+            raise ValueError(f"不支持的衍生图片格式: {image_format} (支持的格式: {', '.join(MIME_TYPES)})")
+        return {'max_edge': int(spec['max_edge']), 'format': image_format, 'quality': int(spec.get('quality', 85))}
+    
+    @traced('image_derivative')
+    def get_derivative(self, image_path: str, name: str = 'thumb') -> str:
+        """
+        获取图片的衍生图片（缩略图等），第一次请求时生成并保存，之后直接返回已生成的文件
+        
+        Args:
+            image_path: 图片路径（通常是推荐记录中保存的路径）或ImageHandle
+            name: 规格名称（image.derivatives中配置）
+        
+        Returns:
+            衍生图片路径
+        
+        Raises:
+            ValueError: 规格未配置
+        """
+        spec = self.derivative_spec(name)
+        target = self.store.derivative_path(self._content_hash(image_path), name, spec)
+        if not target.exists():
+            source = image_path.data if isinstance(image_path, ImageHandle) else os.fspath(image_path)
+            size = render_derivative(source, str(target), spec['max_edge'], spec['format'], spec['quality'])
+            logger.debug(f"衍生图片已生成: {target} ({size} bytes)")
+        return str(target)
+    
+    def build_derivatives(
+        self,
+        image_paths: Optional[Iterable[str]] = None,
+        names: Optional[Iterable[str]] = None,
+        workers: Optional[int] = None,
+        force: bool = False
+    ) -> Dict[str, int]:
+        """
+        在进程池中批量生成衍生图片（缩放和编码是CPU密集型操作，多进程才能用上多个核）
+        
+        Args:
+            image_paths: 原图路径（默认为存储中的全部图片）
+            names: 规格名称（默认为全部配置的规格）
+            workers: 进程数（默认为image.derivative_workers，0表示CPU核数）
+            force: 重新生成已存在的衍生图片
+        
+        Returns:
+            {'images': 原图数, 'generated': 生成的衍生图片数, 'existing': 已存在的衍生图片数, 'failed': 失败数}
+        """
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        
+        specs = {name: self.derivative_spec(name) for name in (names or self.derivatives)}
+        if image_paths is None:
+            image_paths = (path for path in self.store.iter_blobs() if not path.name.startswith('.'))
+        workers = workers or settings.image_derivative_workers or os.cpu_count() or 1
+        summary = {'images': 0, 'generated': 0, 'existing': 0, 'failed': 0}
+        
+        def _jobs():
+            for image_path in image_paths:
+                summary['images'] += 1
+                try:
+                    digest = self._content_hash(image_path)
+                except OSError as e:
+                    summary['failed'] += 1
+                    logger.warning(f"无法读取图片 {image_path}: {e}")
+                    continue
+                for name, spec in specs.items():
+                    target = self.store.derivative_path(digest, name, spec)
+                    if not force and target.exists():
+                        summary['existing'] += 1
+                        continue
+                    yield str(image_path), str(target), spec['max_edge'], spec['format'], spec['quality']
+        
+        pending = {}
+        
+        def _collect(done):
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    future.result()
+                    summary['generated'] += 1
+                except Exception as e:
+                    summary['failed'] += 1
+                    logger.warning(f"生成衍生图片失败 {job[0]} -> {job[1]}: {e}")
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for job in _jobs():
+                # 控制提交进度，避免一次性为全部图片创建任务
+                while len(pending) >= workers * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done)
+                pending[executor.submit(render_derivative, *job)] = job
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+        
+        logger.info(
+            f"衍生图片生成完成: {summary['images']} 张原图，生成 {summary['generated']} 张，"
+            f"已存在 {summary['existing']} 张，失败 {summary['failed']} 张"
+        )
+        return summary
+    
+    def _content_hash(self, image_path: str) -> str:
+        """图片的内容哈希（存储中的图片直接从文件名取得，不读取文件）"""
+        return self.store.parse_digest(os.fspath(image_path)) or hash_file(image_path)
+    
     def get_image_info(self, image_path: str) -> dict:
         """
         获取图片信息
         
         Args:
             image_path: 图片文件路径
-            
+        
         Returns:
             图片信息字典
         """
+        from PIL import Image
+        
         with Image.open(image_path) as img:
             return {
                 'format': img.format,
@@ -123,3 +532,15 @@ class ImageProcessor:
                 'file_size': os.path.getsize(image_path)
             }
 
+
+_image_processor: Optional[ImageProcessor] = None
+_image_processor_lock = threading.Lock()
+
+
+def get_image_processor() -> ImageProcessor:
+    """获取进程内共享的图片处理器"""
+    global _image_processor
+    with _image_processor_lock:
+        if _image_processor is None:
+            _image_processor = ImageProcessor()
+        return _image_processor
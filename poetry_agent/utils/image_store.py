@@ -0,0 +1,331 @@
+"""
+内容寻址的图片存储
+
+上传的图片按内容的SHA-256哈希命名，保存在 {upload_dir}/objects/<哈希前2位>/<哈希第3-4位>/<哈希>.<扩展名>，
+相同内容的图片只保存一份：重复上传时只计算哈希，不再复制文件。两级分目录让每个目录下的文件数保持在较小的规模。
+
+图片与用户的引用关系由推荐记录（recommendations.user_id、image_path）保存，存储本身与用户无关；
+不再被任何推荐记录（或队列中的任务）引用的图片由 manage.py gc-images 清理，旧版本按用户目录保存的图片由 manage.py migrate-images 迁移。
+
+缩略图等衍生图片（见ImageProcessor.get_derivative）按规格分目录，
+保存在 {upload_dir}/derivatives/<名称>-<长边>-q<质量>/ 下，同样按原图的内容哈希命名，随原图一起被垃圾回收。
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterator, Tuple
+
+from sqlalchemy import select, update
+
+from config.settings import settings
+from models.database import get_db
+from models.recommendation import Recommendation
+from models.task_log import TaskLog, TASK_PENDING, TASK_RUNNING
+from utils.image_processor import ImageHandle, hash_file
+
+logger = logging.getLogger(__name__)
+
+# 图片存储目录和衍生图片目录（upload_dir下的子目录）
+OBJECTS_DIR = 'objects'
+DERIVATIVES_DIR = 'derivatives'
+
+# 扩展名别名，同一格式的图片使用相同的文件名
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+
+class ImageStore:
+    """内容寻址的图片存储"""
+    
+    def __init__(self, root: Optional[str] = None):
+        """
+        Args:
+            root: 上传目录（默认为image.upload_dir）
+        """
+        self.root = Path(root or settings.image_upload_dir)
+        self.objects_dir = self.root / OBJECTS_DIR
+        self.derivatives_dir = self.root / DERIVATIVES_DIR
+    
+    def blob_path(self, digest: str, extension: str) -> Path:
+        """内容哈希对应的存储路径"""
+        extension = extension.lower().lstrip('.')
+        extension = EXTENSION_ALIASES.get(extension, extension)
+        return self.objects_dir / digest[:2] / digest[2:4] / f"{digest}.{extension}"
+    
+    def derivative_path(self, digest: str, name: str, spec: Dict[str, Any]) -> Path:
+        """
+        衍生图片的存储路径
+        
+        Args:
+            digest: 原图的内容哈希
+            name: 规格名称
+            spec: 规格（max_edge、format、quality），规格改变后使用新的目录
+        """
+        extension = spec['format'].lower()
+        extension = EXTENSION_ALIASES.get(extension, extension)
+        variant = f"{name}-{spec['max_edge']}-q{spec['quality']}"
+        return self.derivatives_dir / variant / digest[:2] / digest[2:4] / f"{digest}.{extension}"
+    
+    def put(self, image_path: str, link: bool = False) -> Tuple[Path, bool]:
+        """
+        保存图片，相同内容的图片已存在时直接复用
+        
+        Args:
+            image_path: 图片文件路径或ImageHandle（直接写入内存中的数据，不再读取文件）
+            link: 尽量以硬链接代替复制（仅用于迁移上传目录中的文件，外部文件之后可能被修改）
+        
+        Returns:
+            (存储路径, 是否新保存)
+        """
+        digest = hash_file(image_path)
+        target = self.blob_path(digest, Path(os.fspath(image_path)).suffix)
+        try:
+            # 更新修改时间，避免刚复用的图片在写入推荐记录之前被垃圾回收
+            os.utime(target)
+            return target, False
+        except FileNotFoundError:
+            pass
+        
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # 先写入临时文件再原子替换，并发保存同一张图片时不会读到不完整的文件
+        temp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            if isinstance(image_path, ImageHandle):
+                with open(temp_path, 'wb') as f:
+                    f.write(image_path.data)
+            elif link:
+                try:
+                    os.link(image_path, temp_path)
+                except OSError:
+                    shutil.copyfile(image_path, temp_path)
+            else:
+                shutil.copyfile(image_path, temp_path)
+            os.replace(temp_path, target)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        return target, True
+    
+    def iter_blobs(self) -> Iterator[Path]:
+        """遍历存储中的图片（包括未完成写入的临时文件）"""
+        if self.objects_dir.is_dir():
+            yield from (path for path in self.objects_dir.glob('*/*/*') if path.is_file())
+    
+    def iter_derivatives(self) -> Iterator[Path]:
+        """遍历衍生图片（包括未完成写入的临时文件）"""
+        if self.derivatives_dir.is_dir():
+            yield from (path for path in self.derivatives_dir.glob('*/*/*/*') if path.is_file())
+    
+    def iter_legacy_files(self) -> Iterator[Path]:
+        """遍历旧版本按用户目录保存的图片"""
+        for directory in sorted(self.root.iterdir()):
+            if directory.is_dir() and directory.name not in (OBJECTS_DIR, DERIVATIVES_DIR):
+                yield from sorted(path for path in directory.rglob('*') if path.is_file())
+    
+    def parse_digest(self, image_path: str) -> Optional[str]:
+        """从存储路径中解析内容哈希，不是存储中的路径时返回None"""
+        path = Path(image_path)
+        digest = path.stem
+        if len(digest) != 64 or path.parent.name != digest[2:4] or path.parent.parent.name != digest[:2] \
+                or path.parent.parent.parent.name != OBJECTS_DIR:
+            return None
+        return digest
+    
+    def migrate_legacy(self, batch_size: int = 500, dry_run: bool = False) -> Dict[str, int]:
+        """
+        把旧版本按用户目录保存的图片迁移到存储中，更新推荐记录的图片路径后删除原文件
+        
+        先保存图片（同一文件系统内用硬链接，不复制数据），再更新推荐记录，最后删除原文件；
+        删除前重新查询，仍被推荐记录引用的原文件（如迁移期间旧版本程序新写入的记录）保留，
+        中途中断后重新执行即可继续。
+        
+        Args:
+            batch_size: 每批处理的推荐记录数
+            dry_run: 只统计，不做修改
+        
+        Returns:
+            {'files': 旧图片数, 'stored': 新保存的图片数, 'duplicates': 内容重复的图片数,
+             'records': 更新的推荐记录数, 'kept': 仍被引用而保留的原文件数, 'freed_bytes': 释放的空间（字节）}
+        """
+        summary = {'files': 0, 'stored': 0, 'duplicates': 0, 'records': 0, 'kept': 0, 'freed_bytes': 0}
+        # 相对于上传目录的路径 -> (原文件, 存储路径, 是否新保存)
+        mapping = {}
+        planned = set()
+        for path in self.iter_legacy_files():
+            summary['files'] += 1
+            if dry_run:
+                target = self.blob_path(hash_file(str(path)), path.suffix)
+                created = target not in planned and not target.exists()
+                planned.add(target)
+            else:
+                target, created = self.put(str(path), link=True)
+            if created:
+                summary['stored'] += 1
+            else:
+                summary['duplicates'] += 1
+                summary['freed_bytes'] += path.stat().st_size
+            mapping[str(path.relative_to(self.root))] = (path, target, created)
+        if not mapping:
+            return summary
+        
+        # 按id分批扫描推荐记录，在内存中匹配旧路径（image_path没有索引，不逐个文件查询）
+        for rows in self._iter_image_paths(batch_size):
+            updates = {}
+            for record_id, image_path in rows:
+                entry = mapping.get(self._relative_path(image_path))
+                if entry is not None:
+                    updates.setdefault(str(entry[1]), []).append(record_id)
+            if updates and not dry_run:
+                with get_db() as db:
+                    for new_path, record_ids in updates.items():
+                        db.execute(
+                            update(Recommendation)
+                            .where(Recommendation.id.in_(record_ids))
+                            .values(image_path=new_path)
+                            .execution_options(synchronize_session=False)
+                        )
+            summary['records'] += sum(len(record_ids) for record_ids in updates.values())
+        
+        if not dry_run:
+            # 只删除已不被任何推荐记录引用的原文件
+            referenced = set()
+            for rows in self._iter_image_paths(batch_size):
+                referenced.update(self._relative_path(image_path) for _, image_path in rows)
+            for relative_path, (old_path, _, created) in mapping.items():
+                if relative_path in referenced:
+                    summary['kept'] += 1
+                    if not created:
+                        summary['freed_bytes'] -= old_path.stat().st_size
+                    continue
+                os.unlink(old_path)
+            self._remove_empty_dirs()
+        logger.info(
+            f"旧图片迁移{'（预演）' if dry_run else ''}完成: {summary['files']} 个文件，"
+            f"{summary['duplicates']} 个重复，更新 {summary['records']} 条推荐记录"
+            + (f"，{summary['kept']} 个仍被引用的原文件未删除" if summary['kept'] else '')
+        )
+        return summary
+    
+    def collect_garbage(
+        self,
+        grace_hours: Optional[float] = None,
+        batch_size: int = 1000,
+        dry_run: bool = False
+    ) -> Dict[str, int]:
+        """
+        删除不再被任何推荐记录或队列中的任务引用的图片及其衍生图片
+        
+        最近grace_hours小时内保存或复用过的图片即使未被引用也保留，
+        避免删除正在处理的请求刚保存、还未写入推荐记录的图片。
+        
+        Args:
+            grace_hours: 保留期（小时，默认为image.gc_grace_hours）
+            batch_size: 每批读取的推荐记录数
+            dry_run: 只统计，不删除
+        
+        Returns:
+            {'blobs': 图片数, 'referenced': 被引用的图片数, 'deleted': 删除的图片数,
+             'derivatives_deleted': 删除的衍生图片数, 'freed_bytes': 释放的空间（字节）}
+        """
+        if grace_hours is None:
+            grace_hours = settings.image_gc_grace_hours
+        # 先记录截止时间再扫描引用，扫描期间新保存的图片都在保留期内
+        cutoff = time.time() - grace_hours * 3600
+        
+        referenced = set()
+        for rows in self._iter_image_paths(batch_size):
+            for _, image_path in rows:
+                digest = self.parse_digest(image_path)
+                if digest:
+                    referenced.add(digest)
+        
+        # 队列中尚未执行的任务引用的图片（--enqueue时已保存到存储）
+        with get_db() as db:
+            task_images = db.execute(
+                select(TaskLog.image_path)
+                .where(TaskLog.status.in_((TASK_PENDING, TASK_RUNNING)), TaskLog.image_path.isnot(None))
+            ).scalars().all()
+        for image_path in task_images:
+            digest = self.parse_digest(image_path)
+            if digest:
+                referenced.add(digest)
+        
+        summary = {'blobs': 0, 'referenced': 0, 'deleted': 0, 'derivatives_deleted': 0, 'freed_bytes': 0}
+        kept = set()
+        for path in self.iter_blobs():
+            is_temp = path.name.startswith('.')
+            if not is_temp:
+                summary['blobs'] += 1
+                if path.stem in referenced:
+                    summary['referenced'] += 1
+                    kept.add(path.stem)
+                    continue
+            stat = path.stat()
+            if stat.st_mtime > cutoff:
+                kept.add(path.stem)
+                continue
+            if not dry_run:
+                path.unlink()
+            if not is_temp:
+                summary['deleted'] += 1
+            summary['freed_bytes'] += stat.st_size
+        
+        # 原图已删除（或不存在）的衍生图片
+        for path in self.iter_derivatives():
+            if not path.name.startswith('.') and path.stem in kept:
+                continue
+            stat = path.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                path.unlink()
+            if not path.name.startswith('.'):
+                summary['derivatives_deleted'] += 1
+            summary['freed_bytes'] += stat.st_size
+        
+        logger.info(
+            f"图片垃圾回收{'（预演）' if dry_run else ''}完成: {summary['blobs']} 张图片，"
+            f"删除 {summary['deleted']} 张和 {summary['derivatives_deleted']} 张衍生图片，释放 {summary['freed_bytes']} 字节"
+        )
+        return summary
+    
+    def _iter_image_paths(self, batch_size: int) -> Iterator[list]:
+        """按id分批读取推荐记录的(id, image_path)，每批使用单独的会话"""
+        last_id = 0
+        while True:
+            with get_db() as db:
+                rows = db.execute(
+                    select(Recommendation.id, Recommendation.image_path)
+                    .where(Recommendation.id > last_id, Recommendation.image_path.isnot(None))
+                    .order_by(Recommendation.id)
+                    .limit(batch_size)
+                ).all()
+            if rows:
+                yield rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+    
+    def _relative_path(self, image_path: str) -> Optional[str]:
+        """
+        推荐记录中的图片路径相对于上传目录的路径，不在上传目录下时返回None
+        
+        旧版本保存的路径由上传目录拼接而成（上传目录为相对路径时记录中也是相对路径），
+        按配置的上传目录匹配，不依赖当前工作目录；绝对路径同时按上传目录的绝对路径匹配。
+        """
+        path = os.path.normpath(image_path)
+        for root in (os.path.normpath(self.root), os.path.abspath(self.root)):
+            if path.startswith(root + os.sep):
+                return path[len(root) + 1:]
+        return None
+    
+    def _remove_empty_dirs(self):
+        """删除迁移后留下的空用户目录"""
+        for directory in sorted(self.root.rglob('*'), key=lambda path: len(path.parts), reverse=True):
+            if directory.is_dir() and directory.relative_to(self.root).parts[0] not in (OBJECTS_DIR, DERIVATIVES_DIR):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    pass
@@ -0,0 +1,219 @@
+"""
+AI响应JSON提取模块
+
+从完整的AI响应文本中提取诗词JSON：只扫描一遍文本，跟踪括号深度和字符串状态找出根层级的JSON对象，
+忽略前后的说明文字和代码块标记。解析前在本地做低成本的修复（删除多余的尾逗号、补全被截断的数组和对象），
+解析后按诗词结构校验，无法得到有效诗词时抛出ResponseParseError，不会把整段文本当作一首诗词保存。
+"""
+import json
+import logging
+import re
+from typing import Optional, Dict, Any, List, Iterator
+
+logger = logging.getLogger(__name__)
+
+# 诗词字段
+POEM_FIELDS = ('title', 'content', 'author', 'dynasty', 'appreciation')
+
+# 扁平结果结构中的字段名 -> 诗词字段
+FIELD_ALIASES = {
+    'poem_title': 'title',
+    'poem_content': 'content',
+}
+
+# 结构化输出（response_format为json_schema时）使用的JSON Schema
+POEMS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'poems': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {field: {'type': 'string'} for field in POEM_FIELDS},
+                'required': list(POEM_FIELDS),
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': ['poems'],
+    'additionalProperties': False,
+}
+
+# 扫描时关心的字符：引号、转义符、括号和逗号，其余字符整段跳过
+_TOKEN = re.compile(r'["\\{}\[\],]')
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+# 错误信息中保留的响应文本长度
+SNIPPET_LENGTH = 200
+
+
+class ResponseParseError(ValueError):
+    """AI响应中没有可用的诗词JSON"""
+    
+    def __init__(self, message: str, content: str = ''):
+        super().__init__(message)
+        self.content = content
+
+
+def iter_json_candidates(text: str) -> Iterator[str]:
+    """
+    逐个返回文本中根层级的JSON对象片段（已删除尾逗号）
+    
+    只扫描一遍文本；文本在对象闭合前结束时（输出被截断），丢弃最后一个不完整的元素并补全括号。
+    """
+    stack: List[str] = []
+    start = 0
+    in_string = False
+    skip_to = 0
+    last_comma: Optional[int] = None
+    dropped: List[int] = []
+    # 最近一个完整闭合的元素之后的位置及当时的括号深度，用于补全截断的文本
+    cut: Optional[int] = None
+    cut_depth = 0
+    
+    for match in _TOKEN.finditer(text):
+        pos = match.start()
+        if pos < skip_to:
+            continue
+        char = match.group()
+        
+        if not stack:
+            # 根对象之外只关心左花括号，说明文字中的引号和其他括号忽略
+            if char == '{':
+                stack.append(char)
+                start = pos
+                last_comma = None
+                dropped = []
+                cut = None
+            continue
+        
+        if in_string:
+            if char == '\\':
+                skip_to = pos + 2
+            elif char == '"':
+                in_string = False
+            continue
+        
+        if char == '"':
+            in_string = True
+        elif char == ',':
+            last_comma = pos
+        elif char in '{[':
+            stack.append(char)
+        else:
+            if last_comma is not None and not text[last_comma + 1:pos].strip():
+                # 右括号前的尾逗号
+                dropped.append(last_comma)
+            last_comma = None
+            if _CLOSERS[stack[-1]] != char:
+                # 括号不匹配，放弃这个对象
+                stack = []
+                continue
+            stack.pop()
+            if not stack:
+                yield _without(text, start, pos + 1, dropped)
+            else:
+                cut, cut_depth = pos + 1, len(stack)
+    
+    if stack and cut is not None:
+        closing = ''.join(_CLOSERS[char] for char in reversed(stack[:cut_depth]))
+        yield _without(text, start, cut, [pos for pos in dropped if pos < cut]) + closing
+
+
+def _without(text: str, start: int, end: int, dropped: List[int]) -> str:
+    """截取text[start:end]并删除指定位置的字符"""
+    if not dropped:
+        return text[start:end]
+    parts = []
+    for pos in dropped:
+        parts.append(text[start:pos])
+        start = pos + 1
+    parts.append(text[start:end])
+    return ''.join(parts)
+
+
+def loads(text: str) -> Any:
+    """解析JSON，允许字符串中出现未转义的换行等控制字符（诗词正文中常见）"""
+    return json.loads(text, strict=False)
+
+
+def normalize_poem(value: Any) -> Optional[Dict[str, Any]]:
+    """
+    校验并规范化单首诗词
+    
+    Returns:
+        只包含诗词字段的字典（缺少的字段为空字符串）；不是对象或没有正文时返回None
+    """
+    if not isinstance(value, dict):
+        return None
+    poem = {}
+    for key, item in value.items():
+        field = FIELD_ALIASES.get(key, key)
+        if field in POEM_FIELDS and item is not None:
+            poem[field] = item.strip() if isinstance(item, str) else str(item)
+    if not poem.get('content'):
+        return None
+    for field in POEM_FIELDS:
+        poem.setdefault(field, '')
+    return poem
+
+
+def validate_poems(data: Any) -> List[Dict[str, Any]]:
+    """
+    从解析出的JSON中取出有效的诗词
+    
+    支持 {"poems": [...]}、单首诗词对象以及扁平结果结构（poem_title、poem_content），
+    不符合结构的诗词被跳过。
+    """
+    if isinstance(data, dict) and isinstance(data.get('poems'), list):
+        items = data['poems']
+    elif isinstance(data, dict):
+        items = [data]
+    else:
+        return []
+    poems = []
+    for item in items:
+        poem = normalize_poem(item)
+        if poem is not None:
+            poems.append(poem)
+    return poems
+
+
+def parse_poems(content: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    从AI响应文本中解析诗词
+    
+    Args:
+        content: AI返回的完整文本
+    
+    Returns:
+        诗词字典列表（至少一首）
+    
+    Raises:
+        ResponseParseError: 响应中没有可解析的诗词
+    """
+    content = content or ''
+    stripped = content.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        # JSON模式下响应本身就是完整的JSON，直接解析
+        try:
+            poems = validate_poems(loads(stripped))
+        except json.JSONDecodeError:
+            poems = []
+        if poems:
+            return poems
+    
+    for candidate in iter_json_candidates(content):
+        try:
+            data = loads(candidate)
+        except json.JSONDecodeError as e:
+            logger.debug(f"跳过无法解析的JSON片段: {e}")
+            continue
+        poems = validate_poems(data)
+        if poems:
+            return poems
+    
+    snippet = content[:SNIPPET_LENGTH] + ('...' if len(content) > SNIPPET_LENGTH else '')
+    logger.warning(f"AI返回结果中没有找到诗词: {snippet!r}")
+    raise ResponseParseError("AI返回结果中没有找到诗词", content)
@@ -0,0 +1,138 @@
+"""
+流式JSON解析模块
+
+逐段接收AI流式返回的文本，在 "poems" 数组中的每个诗词对象闭合时立即解析并返回，
+无需等待完整响应。
+"""
+import json
+import logging
+from typing import Optional, Dict, Any, List
+
+from utils.json_extract import iter_json_candidates, loads, normalize_poem
+
+logger = logging.getLogger(__name__)
+
+
+class PoemStreamParser:
+    """
+    增量解析 {"poems": [{...}, {...}]} 格式的流式文本
+    
+    只跟踪括号深度和字符串状态，每个字符只扫描一次；已解析完的文本会被丢弃，
+    缓冲区中最多保留当前未闭合的诗词对象。JSON之前的说明文字和代码块标记会被忽略。
+    """
+    
+    def __init__(self, array_key: str = 'poems'):
+        """
+        Args:
+            array_key: 诗词数组在根对象中的键名
+        """
+        self.array_key = array_key
+        self._buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start: Optional[int] = None
+        self._last_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._object_start: Optional[int] = None
+        self._done = False
+    
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        输入一段文本
+        
+        Args:
+            text: 新收到的文本片段
+        
+        Returns:
+            本次新闭合的诗词对象列表
+        """
+        if self._done or not text:
+            return []
+        
+        self._buffer += text
+        poems = []
+        buffer = self._buffer
+        pos = self._pos
+        
+        while pos < len(buffer):
+            char = buffer[pos]
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._string_start is not None:
+                        # 根对象中的字符串，可能是键名
+                        self._last_key = buffer[self._string_start + 1:pos]
+                    self._string_start = None
+                pos += 1
+                continue
+            
+            if char == '"':
+                if self._depth > 0:
+                    self._in_string = True
+                    self._string_start = pos
+            elif char in '{[':
+                if self._depth == 0 and char == '[':
+                    # 根对象之外的方括号（如说明文字中的内容）忽略
+                    pos += 1
+                    continue
+                self._depth += 1
+                if char == '[' and self._depth == 2 and self._last_key == self.array_key:
+                    self._array_depth = 2
+                elif char == '{' and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._object_start = pos
+            elif char in '}]':
+                if self._depth == 0:
+                    pos += 1
+                    continue
+                if char == '}' and self._object_start is not None and self._depth == self._array_depth + 1:
+                    poem = self._decode(buffer[self._object_start:pos + 1])
+                    if poem is not None:
+                        poems.append(poem)
+                    self._object_start = None
+                elif char == ']' and self._array_depth is not None and self._depth == self._array_depth:
+                    self._array_depth = None
+                    self._done = True
+                self._depth -= 1
+                if self._depth == 1:
+                    self._last_key = None
+            pos += 1
+            
+            if self._done:
+                break
+        
+        # 丢弃已处理完的文本，只保留未闭合的对象
+        keep_from = pos
+        if self._object_start is not None:
+            keep_from = self._object_start
+        if self._string_start is not None:
+            keep_from = min(keep_from, self._string_start)
+        self._buffer = buffer[keep_from:]
+        self._pos = pos - keep_from
+        if self._object_start is not None:
+            self._object_start -= keep_from
+        if self._string_start is not None:
+            self._string_start -= keep_from
+        
+        return poems
+    
+    @property
+    def done(self) -> bool:
+        """诗词数组是否已经结束"""
+        return self._done
+    
+    @staticmethod
+    def _decode(text: str) -> Optional[Dict[str, Any]]:
+        """解析并校验诗词对象（删除尾逗号），不符合诗词结构时返回None"""
+        try:
+            poem = loads(next(iter_json_candidates(text), text))
+        except json.JSONDecodeError as e:
+            logger.warning(f"流式解析诗词对象失败: {e}")
+            return None
+        return normalize_poem(poem)
@@ -0,0 +1,607 @@
+"""
+诗词检索索引模块
+
+基于汉字n-gram（单字和双字）倒排索引，加上朝代、作者分面，对推荐记录表中已生成的诗词
+和导入的古诗词语料建立进程内索引。索引快照保存在磁盘上，加载后按推荐记录ID增量追赶
+其他进程写入的新记录，本进程写入的记录即时加入索引。
+
+检索模式（retrieve/hybrid）下匹配的诗词可以直接返回，不再调用AI接口；
+诗词搜索接口（设计文档3.2.4）也使用同一个索引。
+"""
+import atexit
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterable, Set, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+# 诗词来源
+SOURCE_RECOMMENDATION = 'recommendation'
+SOURCE_CORPUS = 'corpus'
+
+# 赏析中出现（标题、作者、正文中没有）的词项按该权重计分
+APPRECIATION_WEIGHT = 0.6
+
+# 追赶新记录时累计新增超过该数量才在进程退出时重写快照，少量新增下次加载时从数据库追赶即可
+SAVE_THRESHOLD = 500
+
+# 追赶时从已索引的最大推荐记录ID往前重新扫描的记录数：并发的事务按ID分配的顺序不一定与提交的顺序一致，
+# ID较小的记录可能在ID较大的记录之后才提交；重复读到的诗词按去重键忽略
+SYNC_OVERLAP = 1000
+
+_CJK_RUN = re.compile(r'[㐀-鿿豈-﫿]+')
+_PUNCTUATION = re.compile(r'[\s　-〿＀-￯,.;:!?\'"()\[\]{}<>/\\|-]+')
+
+# 提示词中不表达诗词特征的指令性词语（按长度从长到短匹配）
+QUERY_STOPWORDS = sorted([
+    '推荐', '来一首', '来首', '一首', '两首', '几首', '一些', '关于', '有关', '描写', '描绘', '表达', '抒发', '体现',
+    '相关', '意境', '相符', '符合', '主题', '图片', '照片', '给我', '想要', '需要', '一下', '请',
+    '我', '要', '写', '的', '与', '和', '或', '诗词', '古诗', '诗歌', '诗句', '诗人', '词人', '诗', '词',
+], key=len, reverse=True)
+
+# 负向提示词中的否定词和泛指词
+NEGATIVE_STOPWORDS = sorted([
+    '不需要', '不想要', '不包含', '不要', '不含', '包含', '含有', '带有', '避免', '排除', '没有', '不',
+    '和', '或', '及',
+    '情绪', '情感', '内容', '风格', '题材', '元素', '主题', '的', '诗词', '古诗', '诗歌', '诗', '词',
+], key=len, reverse=True)
+
+# 现代汉语常用词 -> 诗词中的用字（"春天"在诗句中多写作"春"）
+MODERN_TERMS = {
+    '春天': '春', '夏天': '夏', '秋天': '秋', '冬天': '冬', '月亮': '月', '太阳': '日', '星星': '星',
+    '花朵': '花', '鸟儿': '鸟', '小鸟': '鸟', '下雨': '雨', '下雪': '雪', '大海': '海', '河流': '河',
+    '朋友': '友', '友谊': '友', '友情': '友', '家乡': '乡', '思念': '思', '离别': '别', '夜晚': '夜',
+}
+
+# 朝代名称后缀（"唐诗"、"宋代"、"明朝"）
+DYNASTY_SUFFIXES = ('诗', '词', '代', '朝', '人')
+
+
+def normalize_dynasty(dynasty: Optional[str]) -> str:
+    """规范化朝代名称：唐代、唐朝 -> 唐"""
+    if not dynasty:
+        return ''
+    dynasty = dynasty.strip()
+    if len(dynasty) > 1 and dynasty[-1] in ('代', '朝'):
+        dynasty = dynasty[:-1]
+    return dynasty
+
+
+def _strip_words(text: str, words: List[str]) -> List[str]:
+    """去除指定词语，返回剩余的汉字片段"""
+    for word in words:
+        text = text.replace(word, ' ')
+    return [part for part in _PUNCTUATION.split(text) if part]
+
+
+def ngrams(text: Optional[str]) -> Set[str]:
+    """提取文本中汉字的单字和相邻双字（跨标点的字不组成双字）"""
+    grams = set()
+    if not text:
+        return grams
+    for run in _CJK_RUN.findall(text):
+        grams.update(run)
+        grams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return grams
+
+
+def poem_key(title: Optional[str], content: Optional[str]) -> str:
+    """诗词去重键：去除标点和空白后的正文（正文为空时使用标题）"""
+    return _PUNCTUATION.sub('', content or '') or _PUNCTUATION.sub('', title or '')
+
+
+class PoemIndex:
+    """
+    诗词检索索引
+    
+    每首诗词分配一个内部ID，倒排表记录包含某个n-gram的诗词ID（递增的array，内存占用小）。
+    标题、作者、正文中的n-gram记为完全匹配，只在赏析中出现的n-gram单独记录并降权。
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: 索引快照文件路径（默认使用配置中的poem_index_path）
+        """
+        self.path = Path(path or settings.poem_index_path)
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_sync = 0.0
+        self._pending = 0
+        self._reset()
+    
+    def _reset(self):
+        # 内部ID -> 诗词字典
+        self._docs: List[Dict[str, Any]] = []
+        # 去重键 -> 内部ID
+        self._keys: Dict[str, int] = {}
+        # n-gram -> 诗词ID数组（标题、作者、正文）
+        self._postings: Dict[str, array] = {}
+        # n-gram -> 诗词ID数组（仅出现在赏析中）
+        self._appreciation_postings: Dict[str, array] = {}
+        # 分面：朝代/作者 -> 诗词ID集合
+        self._dynasties: Dict[str, Set[int]] = defaultdict(set)
+        self._authors: Dict[str, Set[int]] = defaultdict(set)
+        # 已索引的最大推荐记录ID（用于增量追赶）
+        self._last_recommendation_id = 0
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._docs)
+    
+    # ---- 加载、保存与增量更新 ----
+    
+    def ensure_loaded(self):
+        """首次使用时加载快照并追赶数据库中的新记录；之后按refresh_interval定期追赶"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+                self.sync()
+            elif time.monotonic() - self._last_sync >= settings.poem_index_refresh_interval:
+                self.sync()
+    
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"读取诗词索引快照失败，将重新建立: {e}")
+            return
+        if data.get('version') != INDEX_VERSION:
+            logger.info("诗词索引快照版本不一致，将重新建立")
+            return
+        self._docs = data['docs']
+        self._keys = data['keys']
+        self._postings = data['postings']
+        self._appreciation_postings = data['appreciation_postings']
+        self._dynasties = defaultdict(set, data['dynasties'])
+        self._authors = defaultdict(set, data['authors'])
+        self._last_recommendation_id = data['last_recommendation_id']
+        logger.info(f"已加载诗词索引: {len(self._docs)} 首")
+    
+    def save(self):
+        """将索引快照写入磁盘（先写临时文件再替换，中途失败不会损坏已有快照）"""
+        with self._lock:
+            data = {
+                'version': INDEX_VERSION,
+                'docs': self._docs,
+                'keys': self._keys,
+                'postings': self._postings,
+                'appreciation_postings': self._appreciation_postings,
+                'dynasties': dict(self._dynasties),
+                'authors': dict(self._authors),
+                'last_recommendation_id': self._last_recommendation_id,
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._pending = 0
+            logger.info(f"诗词索引已保存: {self.path}（{len(self._docs)} 首）")
+    
+    def save_if_needed(self):
+        """追赶的新记录较多时保存快照（进程退出时调用）"""
+        with self._lock:
+            if self._pending >= SAVE_THRESHOLD:
+                try:
+                    self.save()
+                except Exception as e:
+                    logger.warning(f"保存诗词索引失败: {e}")
+    
+    def sync(self, batch_size: int = 1000) -> int:
+        """
+        从推荐记录表追赶新写入的成功记录（从已索引的最大ID之前SYNC_OVERLAP条开始读取，补上晚提交的记录）
+        
+        Args:
+            batch_size: 每批读取的记录数
+        
+        Returns:
+            新加入索引的诗词数量
+        """
+        from sqlalchemy import select, func
+        from models.database import get_db
+        from models.poem import Poem
+        from models.recommendation import Recommendation
+        
+        added = 0
+        with self._lock:
+            self._last_sync = time.monotonic()
+            last_id = max(0, self._last_recommendation_id - SYNC_OVERLAP)
+            try:
+                while True:
+                    with get_db() as db:
+                        rows = db.execute(
+                            # 诗词内容保存在poems表中，迁移前的旧记录仍在推荐记录自身的字段中
+                            select(
+                                Recommendation.id,
+                                func.coalesce(Poem.title, Recommendation.poem_title),
+                                func.coalesce(Poem.content, Recommendation.poem_content),
+                                func.coalesce(Poem.author, Recommendation.author),
+                                func.coalesce(Poem.dynasty, Recommendation.dynasty),
+                                func.coalesce(Poem.appreciation, Recommendation.appreciation)
+                            )
+                            .outerjoin(Poem, Poem.id == Recommendation.poem_id)
+                            .where(
+                                Recommendation.id > last_id,
+                                Recommendation.status == 1
+                            )
+                            .order_by(Recommendation.id)
+                            .limit(batch_size)
+                        ).all()
+                    if not rows:
+                        break
+                    for record_id, title, content, author, dynasty, appreciation in rows:
+                        if self._add(title, content, author, dynasty, appreciation, SOURCE_RECOMMENDATION, record_id):
+                            added += 1
+                    last_id = rows[-1][0]
+                    self._last_recommendation_id = max(self._last_recommendation_id, last_id)
+            except Exception as e:
+                logger.warning(f"从推荐记录更新诗词索引失败: {e}")
+            self._pending += added
+        if added:
+            logger.info(f"诗词索引新增 {added} 首（来自推荐记录）")
+        return added
+    
+    def rebuild(self, keep_corpus: bool = True) -> int:
+        """
+        从推荐记录表重新建立索引
+        
+        Args:
+            keep_corpus: 是否保留已导入的古诗词语料
+        
+        Returns:
+            重建后的诗词总数
+        """
+        with self._lock:
+            corpus = []
+            if keep_corpus:
+                if not self._loaded:
+                    self._load()
+                corpus = [doc for doc in self._docs if doc['source'] == SOURCE_CORPUS]
+            self._reset()
+            self._loaded = True
+            self.add_poems(corpus, source=SOURCE_CORPUS)
+            self.sync()
+            return len(self._docs)
+    
+    def add_poems(self, poems: Iterable[Dict[str, Any]], source: str = SOURCE_CORPUS) -> int:
+        """
+        加入一组诗词（重复的诗词忽略）
+        
+        Args:
+            poems: 诗词字典（title、content、author、dynasty、appreciation）
+            source: 来源
+        
+        Returns:
+            新加入的诗词数量
+        """
+        added = 0
+        with self._lock:
+            for poem in poems:
+                if self._add(
+                    poem.get('title'),
+                    poem.get('content'),
+                    poem.get('author'),
+                    poem.get('dynasty'),
+                    poem.get('appreciation'),
+                    source,
+                    poem.get('source_id')
+                ):
+                    added += 1
+        return added
+    
+    def add_recommendations(self, records: List[Dict[str, Any]]):
+        """
+        本进程写入推荐记录后即时加入索引（索引尚未加载时忽略，加载时会从数据库追赶）
+        
+        不推进增量追赶的位置：其他进程可能写入了ID更小的记录，下次追赶时重复读到的诗词按去重键忽略。
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            for record in records:
+                if record.get('status') != 1:
+                    continue
+                self._add(
+                    record.get('poem_title'),
+                    record.get('poem_content'),
+                    record.get('author'),
+                    record.get('dynasty'),
+                    record.get('appreciation'),
+                    SOURCE_RECOMMENDATION,
+                    record.get('id')
+                )
+    
+    def _add(
+        self,
+        title: Optional[str],
+        content: Optional[str],
+        author: Optional[str],
+        dynasty: Optional[str],
+        appreciation: Optional[str],
+        source: str,
+        source_id: Optional[int] = None
+    ) -> bool:
+        """加入一首诗词（调用方需持有锁），重复或没有正文时返回False"""
+        if not content or not content.strip():
+            return False
+        key = poem_key(title, content)
+        if key in self._keys:
+            return False
+        
+        doc_id = len(self._docs)
+        author = (author or '').strip()
+        dynasty = (dynasty or '').strip()
+        self._docs.append({
+            'title': title,
+            'content': content,
+            'author': author or None,
+            'dynasty': dynasty or None,
+            'appreciation': appreciation,
+            'source': source,
+            'source_id': source_id,
+        })
+        self._keys[key] = doc_id
+        
+        primary = ngrams(title) | ngrams(author) | ngrams(content)
+        for gram in primary:
+            self._postings.setdefault(gram, array('I')).append(doc_id)
+        for gram in ngrams(appreciation) - primary:
+            self._appreciation_postings.setdefault(gram, array('I')).append(doc_id)
+        if dynasty:
+            self._dynasties[normalize_dynasty(dynasty)].add(doc_id)
+        if author:
+            self._authors[author].add(doc_id)
+        return True
+    
+    # ---- 检索 ----
+    
+    def search(
+        self,
+        q: str,
+        page: int = 1,
+        page_size: int = 20,
+        dynasty: Optional[str] = None,
+        author: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        搜索诗词（诗词搜索接口）
+        
+        Args:
+            q: 搜索关键词（可包含作者名、朝代，如"李白 月亮"、"宋词 离别"）
+            page: 页码（从1开始）
+            page_size: 每页数量
+            dynasty: 限定朝代
+            author: 限定作者
+        
+        Returns:
+            {'total': 匹配总数, 'page': 页码, 'page_size': 每页数量, 'items': 诗词列表（含score）}
+        """
+        self.ensure_loaded()
+        page = max(1, page)
+        with self._lock:
+            ranked = self._rank(q, dynasty=dynasty, author=author)
+            start = (page - 1) * page_size
+            items = [self._to_poem(doc_id, score) for doc_id, score in ranked[start:start + page_size]]
+        return {'total': len(ranked), 'page': page, 'page_size': page_size, 'items': items}
+    
+    def match(
+        self,
+        positive_prompt: Optional[str],
+        negative_prompt: Optional[str] = None,
+        limit: int = 1,
+        min_score: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        按提示词匹配诗词（检索模式），排除负向提示词中的作者、朝代和关键词
+        
+        Args:
+            positive_prompt: 正向提示词（可附加图片描述）
+            negative_prompt: 负向提示词
+            limit: 最多返回的数量
+            min_score: 最低匹配分（0~1，默认使用配置中的retrieval_min_score）
+        
+        Returns:
+            诗词字典列表（含score），按匹配分从高到低排列
+        """
+        min_score = settings.retrieval_min_score if min_score is None else min_score
+        self.ensure_loaded()
+        with self._lock:
+            ranked = self._rank(positive_prompt or '', exclude=negative_prompt)
+            return [
+                self._to_poem(doc_id, score)
+                for doc_id, score in ranked[:limit]
+                if score >= min_score
+            ]
+    
+    def _rank(
+        self,
+        query: str,
+        dynasty: Optional[str] = None,
+        author: Optional[str] = None,
+        exclude: Optional[str] = None
+    ) -> List[Tuple[int, float]]:
+        """计算匹配的诗词及匹配分（调用方需持有锁）"""
+        facet_dynasty, facet_author, terms = self._parse_query(query)
+        dynasty = normalize_dynasty(dynasty) or facet_dynasty
+        author = author or facet_author
+        
+        allowed = None
+        if dynasty:
+            allowed = set(self._dynasties.get(dynasty, ()))
+        if author:
+            authored = self._authors.get(author, set())
+            allowed = authored if allowed is None else allowed & authored
+        
+        scores = self._score_terms(terms)
+        if scores is None:
+            # 只有分面条件：分面内的诗词全部视为完全匹配
+            if allowed is None:
+                return []
+            scores = dict.fromkeys(allowed, 1.0)
+        elif allowed is not None:
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_id in allowed}
+        
+        if exclude:
+            excluded = self._excluded(exclude, scores)
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_id not in excluded}
+        
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    
+    def _score_terms(self, terms: List[str]) -> Optional[Dict[int, float]]:
+        """
+        按n-gram计算匹配分：命中的n-gram的IDF之和 / 查询全部n-gram的IDF之和，
+        只在赏析中命中的按APPRECIATION_WEIGHT计；没有可检索的词项时返回None
+        """
+        grams = set()
+        for term in terms:
+            grams |= ngrams(term)
+        if not grams:
+            return None
+        
+        total_docs = max(1, len(self._docs))
+        scores: Dict[int, float] = defaultdict(float)
+        total_weight = 0.0
+        for gram in grams:
+            primary = self._postings.get(gram, ())
+            secondary = self._appreciation_postings.get(gram, ())
+            frequency = len(primary) + len(secondary)
+            # 未出现的n-gram也计入分母：查询中越多的特征未被满足，匹配分越低
+            idf = _idf(total_docs, frequency)
+            total_weight += idf
+            for doc_id in primary:
+                scores[doc_id] += idf
+            for doc_id in secondary:
+                scores[doc_id] += idf * APPRECIATION_WEIGHT
+        return {doc_id: score / total_weight for doc_id, score in scores.items()}
+    
+    def _parse_query(self, query: str) -> Tuple[str, str, List[str]]:
+        """
+        解析提示词：识别作者和朝代分面，去除指令性词语
+        
+        Returns:
+            (朝代, 作者, 剩余的检索词项)
+        """
+        dynasty = ''
+        author = ''
+        # 先按完整作者名匹配（较长的名字优先，避免"李白"被"白"之类的名字截断）
+        for name in sorted((name for name in self._authors if len(name) >= 2 and name in query), key=len, reverse=True):
+            author = name
+            query = query.replace(name, ' ')
+            break
+        for name in self._dynasties:
+            if not name:
+                continue
+            for suffix in DYNASTY_SUFFIXES:
+                if name + suffix in query:
+                    dynasty = name
+                    query = query.replace(name + suffix, ' ')
+                    break
+            if dynasty:
+                break
+        for modern, classical in MODERN_TERMS.items():
+            query = query.replace(modern, classical)
+        return dynasty, author, _strip_words(query, QUERY_STOPWORDS)
+    
+    def _excluded(self, negative_prompt: str, scores: Dict[int, float]) -> Set[int]:
+        """负向提示词排除的诗词：匹配的作者、朝代，或标题、正文、赏析中包含排除词"""
+        excluded = set()
+        for term in _strip_words(negative_prompt, NEGATIVE_STOPWORDS):
+            if term in self._authors:
+                excluded |= self._authors[term]
+                continue
+            dynasty = normalize_dynasty(term)
+            if dynasty in self._dynasties:
+                excluded |= self._dynasties[dynasty]
+                continue
+            for doc_id in scores:
+                doc = self._docs[doc_id]
+                if any(term in (doc[field] or '') for field in ('title', 'content', 'appreciation')):
+                    excluded.add(doc_id)
+        return excluded
+    
+    def _to_poem(self, doc_id: int, score: float) -> Dict[str, Any]:
+        doc = self._docs[doc_id]
+        return {
+            'title': doc['title'],
+            'content': doc['content'],
+            'author': doc['author'],
+            'dynasty': doc['dynasty'],
+            'appreciation': doc['appreciation'],
+            'source': doc['source'],
+            'score': round(score, 4),
+        }
+
+
+def _idf(total_docs: int, frequency: int) -> float:
+    """平滑的逆文档频率"""
+    return math.log(1 + (total_docs - frequency + 0.5) / (frequency + 0.5))
+
+
+def load_corpus(path: str, dynasty: Optional[str] = None) -> Iterable[Dict[str, Any]]:
+    """
+    读取古诗词语料文件
+    
+    支持JSON数组或JSONL，每首诗词包含 title、author、dynasty（可选）和 content
+    或 paragraphs（句子列表，chinese-poetry数据集的格式）。
+    
+    Args:
+        path: 语料文件路径
+        dynasty: 语料中没有朝代字段时使用的朝代
+    """
+    import json
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith('['):
+        items = json.loads(stripped)
+    else:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    
+    for item in items:
+        content = item.get('content')
+        if not content and item.get('paragraphs'):
+            content = '\n'.join(item['paragraphs'])
+        yield {
+            'title': item.get('title') or item.get('rhythmic'),
+            'content': content,
+            'author': item.get('author'),
+            'dynasty': item.get('dynasty') or dynasty,
+            'appreciation': item.get('appreciation'),
+        }
+
+
+_poem_index: Optional[PoemIndex] = None
+_poem_index_lock = threading.Lock()
+
+
+def get_poem_index() -> PoemIndex:
+    """获取进程内共享的诗词索引（进程退出时按需保存快照）"""
+    global _poem_index
+    with _poem_index_lock:
+        if _poem_index is None:
+            _poem_index = PoemIndex()
+            atexit.register(_poem_index.save_if_needed)
+        return _poem_index
+
+
+def peek_poem_index() -> Optional[PoemIndex]:
+    """已创建的诗词索引，尚未创建时返回None（写入记录时据此决定是否即时更新索引）"""
+    return _poem_index
@@ -0,0 +1,215 @@
+"""
+个性化推荐池补充
+
+在访问低谷时段（由cron等定时执行 manage.py refill-pools）为活跃用户补充推荐池：
+可用推荐数低于pool.low_water的用户，根据其最近的推荐记录（提示词、上下文、常读的作者和朝代）
+构建推荐请求，通过PoetryAgent一次生成所缺的数量，并排除用户最近推荐过和推荐池中已有的诗词。
+活跃用户取自统计汇总表（最近pool.active_days天内推荐数最多的pool.max_users个用户）。
+"""
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Dict, Any, List, Iterable
+
+from sqlalchemy import select
+
+from config.settings import settings
+from models.database import get_db
+from models.recommendation import Recommendation
+from models.recommendation_pool import RecommendationPool
+from models.recommendation_query import recent_history
+from models.recommendation_stats import count_by
+
+logger = logging.getLogger(__name__)
+
+# 提示词中最多引用的最近需求数、作者数和朝代数
+MAX_PROMPTS = 3
+MAX_PREFERENCES = 3
+
+# 引用的单条提示词和上下文的最大长度
+MAX_PROMPT_LENGTH = 100
+
+
+def parse_window(spec: str):
+    """解析 HH:MM-HH:MM 格式的时间段"""
+    try:
+        start, end = (time.fromisoformat(part.strip()) for part in spec.split('-'))
+    except ValueError:
+        raise ValueError(f"时间段格式应为HH:MM-HH:MM: {spec}")
+    return start, end
+
+
+def in_window(spec: Optional[str], now: Optional[datetime] = None) -> bool:
+    """当前时间是否在时间段内（支持跨零点，如 22:00-06:00；未配置时段时总是返回True）"""
+    if not spec:
+        return True
+    start, end = parse_window(spec)
+    current = (now or datetime.now()).time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def build_request(history: List[Dict[str, Any]], excluded: List[Dict[str, Any]], count: int) -> Optional[Dict[str, Any]]:
+    """
+    根据用户最近的推荐记录构建推荐请求
+    
+    Args:
+        history: 最近的推荐记录（recent_history的返回值）
+        excluded: 需要排除的诗词（title、author）
+        count: 推荐数量
+    
+    Returns:
+        PoetryAgent.execute的参数，没有可参考的记录时返回None
+    """
+    from utils.fanout_client import exclusion_prompt
+    
+    prompts = []
+    for row in history:
+        prompt = (row.get('positive_prompt') or '').strip()[:MAX_PROMPT_LENGTH]
+        if prompt and prompt not in prompts:
+            prompts.append(prompt)
+    authors = Counter(row['author'] for row in history if row.get('author'))
+    dynasties = Counter(row['dynasty'] for row in history if row.get('dynasty'))
+    if not prompts and not authors:
+        return None
+    
+    positive_prompt = '按用户的阅读偏好推荐诗词'
+    if prompts:
+        positive_prompt += f"，用户最近的需求：{'；'.join(prompts[:MAX_PROMPTS])}"
+    context_parts = []
+    if authors:
+        context_parts.append(f"用户常读的作者：{'、'.join(name for name, _ in authors.most_common(MAX_PREFERENCES))}")
+    if dynasties:
+        context_parts.append(f"常读的朝代：{'、'.join(name for name, _ in dynasties.most_common(MAX_PREFERENCES))}")
+    latest_context = next((row['context'] for row in history if row.get('context')), None)
+    if latest_context:
+        context_parts.append(latest_context.strip()[:MAX_PROMPT_LENGTH])
+    
+    return {
+        'positive_prompt': positive_prompt,
+        'negative_prompt': exclusion_prompt(None, excluded),
+        'context': '；'.join(context_parts) or None,
+        'count': count,
+    }
+
+
+class PoolRefiller:
+    """为活跃用户补充推荐池"""
+    
+    def __init__(
+        self,
+        agent,
+        pool: Optional[RecommendationPool] = None,
+        target_size: Optional[int] = None,
+        low_water: Optional[int] = None,
+        ttl_hours: Optional[float] = None,
+        history_size: Optional[int] = None
+    ):
+        """
+        Args:
+            agent: 生成推荐的PoetryAgent实例（应关闭推荐结果缓存，否则相同的请求会得到相同的诗词）
+            pool: 推荐池
+            target_size: 补充后每个用户可用的推荐数
+            low_water: 可用推荐数低于此值时补充
+            ttl_hours: 预生成推荐的有效期（小时）
+            history_size: 参考的最近推荐记录数
+        """
+        self.agent = agent
+        self.pool = pool or RecommendationPool()
+        self.target_size = target_size or settings.pool_target_size
+        self.low_water = min(low_water or settings.pool_low_water, self.target_size)
+        self.ttl_hours = ttl_hours or settings.pool_ttl_hours
+        self.history_size = history_size or settings.pool_history_size
+    
+    @staticmethod
+    def active_users(days: Optional[int] = None, limit: Optional[int] = None) -> List[int]:
+        """最近days天内推荐数最多的limit个用户"""
+        days = days or settings.pool_active_days
+        with get_db() as db:
+            items = count_by(
+                db,
+                'user',
+                since=date.today() - timedelta(days=days - 1),
+                limit=limit or settings.pool_max_users
+            )
+        return [int(item['value']) for item in items]
+    
+    def run(self, user_ids: Optional[Iterable[int]] = None, concurrency: int = 1) -> Dict[str, int]:
+        """
+        删除过期的推荐，为可用推荐数低于下限的用户补充
+        
+        Args:
+            user_ids: 要补充的用户（默认为活跃用户）
+            concurrency: 同时为多少个用户生成
+        
+        Returns:
+            {'users': 检查的用户数, 'refilled': 补充的用户数, 'added': 加入的推荐数, 'failed': 生成失败的用户数}
+        """
+        self.pool.purge_expired()
+        user_ids = list(user_ids) if user_ids is not None else self.active_users()
+        counts = self.pool.available_counts(user_ids)
+        needed = {user_id: self.target_size - count for user_id, count in counts.items() if count < self.low_water}
+        summary = {'users': len(user_ids), 'refilled': 0, 'added': 0, 'failed': 0}
+        if not needed:
+            return summary
+        logger.info(f"{len(needed)}/{len(user_ids)} 个用户的推荐池需要补充")
+        
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='pool-refill') as executor:
+            for added in executor.map(lambda item: self._refill_user(*item), needed.items()):
+                if added is None:
+                    summary['failed'] += 1
+                elif added:
+                    summary['refilled'] += 1
+                    summary['added'] += added
+        return summary
+    
+    def _refill_user(self, user_id: int, count: int) -> Optional[int]:
+        """为一个用户生成count条推荐并加入推荐池，返回加入的数量（生成失败时返回None）"""
+        try:
+            with get_db() as db:
+                history = recent_history(db, user_id, limit=self.history_size)
+            pooled = self.pool.pooled_poems(user_id)
+            excluded = [{'title': row['poem_title'], 'author': row['author']} for row in history] + pooled
+            request = build_request(history, excluded, count)
+            if request is None:
+                logger.debug(f"用户 {user_id} 没有可参考的推荐记录，跳过")
+                return 0
+            
+            # 预生成的推荐记录不关联用户，取出前不计入统计和诗词索引，见models/recommendation_pool.py；
+            # 生成失败只记录日志，不保存失败记录
+            outcome = self.agent.execute(**request, pooled=True, save_failure=False)
+            if outcome['exit_code'] != 0:
+                logger.warning(f"为用户 {user_id} 生成推荐失败: {outcome['error']}")
+                return None
+            
+            seen = {row['poem_id'] for row in history + pooled if row.get('poem_id')}
+            entries = []
+            rejected = []
+            for entry in self._load_entries(outcome['record_ids']):
+                # AI不一定遵守排除要求，重复的诗词不加入推荐池，其推荐记录直接删除
+                if entry['poem_id'] is None or entry['poem_id'] in seen:
+                    rejected.append(entry['recommendation_id'])
+                    continue
+                seen.add(entry['poem_id'])
+                entries.append(entry)
+            self.pool.discard(rejected)
+            added = self.pool.add(user_id, entries, self.ttl_hours)
+            logger.info(f"用户 {user_id} 的推荐池加入 {added} 条推荐")
+            return added
+        except Exception as e:
+            logger.error(f"补充用户 {user_id} 的推荐池失败: {e}", exc_info=True)
+            return None
+    
+    @staticmethod
+    def _load_entries(record_ids: List[int]) -> List[Dict[str, Any]]:
+        if not record_ids:
+            return []
+        with get_db() as db:
+            rows = db.execute(
+                select(Recommendation.id, Recommendation.poem_id)
+                .where(Recommendation.id.in_(record_ids))
+                .order_by(Recommendation.id)
+            ).all()
+        return [{'recommendation_id': row.id, 'poem_id': row.poem_id} for row in rows]
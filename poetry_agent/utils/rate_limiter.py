@@ -0,0 +1,417 @@
+"""
+AI接口限流模块
+
+按模型限制请求速率（RPM）、令牌速率（TPM）和并发数：
+- 令牌桶：请求前预留额度，额度不足时等待，而不是发出注定被429拒绝的请求
+- 自适应并发（AIMD）：请求成功时缓慢增加并发上限，被限流时减半
+- 服务端返回 Retry-After 时，同一模型的所有请求一起暂停到指定时间，避免同时重试造成新一轮429
+同步客户端和异步客户端共用同一套限流状态。
+"""
+import asyncio
+import email.utils
+import functools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 可重试的HTTP状态码：限流（429）和服务端错误（5xx）；其他状态码说明请求本身有问题，重试也不会成功
+THROTTLE_STATUS = 429
+
+# 图片输入按固定令牌数估算（高清模式下一张约1024像素边长图片的消耗）
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """是否为限流错误（HTTP 429）"""
+    return _status_code(error) == THROTTLE_STATUS
+
+
+@functools.lru_cache(maxsize=None)
+def _transport_errors() -> Tuple[type, ...]:
+    """超时和网络错误的异常类型（openai、httpx为可选依赖，未安装时跳过）"""
+    errors: List[type] = [TimeoutError, ConnectionError]
+    try:
+        import openai
+        errors.extend((openai.APITimeoutError, openai.APIConnectionError))
+    except ImportError:
+        pass
+    try:
+        import httpx
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    是否值得重试：只重试限流（429）、服务端错误（5xx）、超时和网络错误
+    
+    参数和鉴权错误（其他HTTP状态码）以及程序错误（TypeError、KeyError、ValueError等）重试也不会成功，直接抛出。
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status == THROTTLE_STATUS or status >= 500
+    return isinstance(error, _transport_errors())
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    从错误响应中读取服务端建议的重试等待时间
+    
+    支持 retry-after-ms、retry-after（秒数或HTTP日期）响应头，没有时返回None
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    第attempt次（从0开始）失败后的等待时间
+    
+    指数退避加全抖动：在 [0, min(上限, 基数 * 2^attempt)] 内随机取值，
+    避免大量并发请求在同一时刻重试。
+    """
+    ceiling = min(settings.api_retry_backoff_max, settings.api_retry_backoff * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def retry_delay(error: Exception, attempt: int, limiter: Optional['RateLimiter'] = None) -> float:
+    """
+    计算失败后的等待时间
+    
+    限流错误优先使用服务端给出的Retry-After，并让同一模型的其他请求一起暂停；
+    其他错误使用带抖动的指数退避。
+    """
+    if is_throttle_error(error):
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = backoff_delay(attempt)
+        if limiter is not None:
+            limiter.pause(delay)
+        return delay
+    return backoff_delay(attempt)
+
+
+def count_text_tokens(text: str) -> int:
+    """估算文本的令牌数：中文约每字一个令牌，其他字符约每4个一个令牌"""
+    cjk = sum(1 for char in text if ord(char) > 0x2e80)
+    return cjk + (len(text) - cjk) // 4
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """
+    估算一次请求计入TPM的令牌数（提示词 + max_tokens）
+    
+    不需要精确，只用于预留限流额度。
+    """
+    tokens = images = 0
+    for message in messages:
+        content = message.get('content')
+        parts = content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]
+        for part in parts:
+            if part.get('type') == 'image_url':
+                images += 1
+                continue
+            tokens += count_text_tokens(part.get('text') or '')
+    return tokens + images * IMAGE_TOKEN_ESTIMATE + max_tokens
+
+
+class TokenBucket:
+    """
+    令牌桶
+    
+    以预留方式工作：reserve()立即扣除额度并返回需要等待的时间，
+    额度可以透支，后来的请求依次排在后面，保证整体速率不超过上限。
+    """
+    
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute: 每分钟补充的额度
+            capacity: 桶容量，即允许的突发量（默认为每分钟额度）
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self, amount: float = 1) -> float:
+        """
+        预留额度
+        
+        Args:
+            amount: 需要的额度（超过桶容量时按桶容量计算，否则永远无法满足）
+        
+        Returns:
+            需要等待的秒数（0表示无需等待）
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD自适应并发限制
+    
+    每次成功将上限增加 1/上限（约每轮并发增加1），被限流时将上限乘以decrease（同一冷却时间内只降一次）。
+    同步调用方用acquire()，异步调用方用acquire_async()，两者共享同一个上限。
+    """
+    
+    def __init__(
+        self,
+        initial: int,
+        max_limit: int,
+        min_limit: int = 1,
+        decrease: float = 0.5,
+        cooldown: float = 1.0
+    ):
+        """
+        Args:
+            initial: 初始并发上限
+            max_limit: 并发上限的最大值
+            min_limit: 并发上限的最小值
+            decrease: 被限流时的缩减系数
+            cooldown: 两次缩减之间的最短间隔（秒），同一波429只缩减一次
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        # 等待者：threading.Event（同步）或 (事件循环, Future)（异步）
+        self._waiters: deque = deque()
+    
+    def acquire(self):
+        """获取一个并发名额（阻塞当前线程）"""
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                event = threading.Event()
+                self._waiters.append(event)
+            event.wait()
+    
+    async def acquire_async(self):
+        """获取一个并发名额（不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 被取消的等待者可能已经收到唤醒，转交给下一个等待者
+                with self._lock:
+                    self._wake()
+                raise
+    
+    def release(self, success: bool = True, throttled: bool = False):
+        """
+        归还并发名额并调整上限
+        
+        Args:
+            success: 请求是否成功
+            throttled: 请求是否被限流
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    logger.info(f"触发限流，并发上限降至 {int(self.limit)}")
+            elif success:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._wake()
+    
+    def _wake(self):
+        """按空闲名额数唤醒等待者（调用方需持有锁）"""
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                if future.done():
+                    continue
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            free -= 1
+
+
+class RateLimiter:
+    """单个模型的限流器"""
+    
+    def __init__(
+        self,
+        name: str,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 16,
+        initial_concurrency: Optional[int] = None
+    ):
+        """
+        Args:
+            name: 模型名称
+            rpm: 每分钟请求数上限（0表示不限制）
+            tpm: 每分钟令牌数上限（0表示不限制）
+            max_concurrency: 最大并发请求数
+            initial_concurrency: 初始并发上限（默认为最大并发数的一半）
+        """
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=initial_concurrency or max(1, max_concurrency // 2),
+            max_limit=max_concurrency
+        )
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._throttled = 0
+        self._requests = 0
+    
+    def reserve(self, estimated_tokens: int = 0) -> float:
+        """预留一次请求的额度，返回需要等待的秒数"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and estimated_tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        with self._lock:
+            self._requests += 1
+            wait = max(wait, self._paused_until - time.monotonic())
+        return wait
+    
+    def pause(self, seconds: float):
+        """暂停该模型的所有新请求（服务端要求等待时调用）"""
+        with self._lock:
+            self._throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def stats(self) -> Dict[str, Any]:
+        """限流统计：请求数、被限流次数、当前并发上限和进行中的请求数"""
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'throttled': self._throttled,
+                'concurrency_limit': int(self.concurrency.limit),
+                'in_flight': self.concurrency.in_flight,
+            }
+    
+    def call(self, func, estimated_tokens: int = 0):
+        """在限流控制下执行一次同步请求（不含重试）"""
+        self.concurrency.acquire()
+        success = throttled = False
+        try:
+            wait = self.reserve(estimated_tokens)
+            if wait > 0:
+                time.sleep(wait)
+            result = func()
+            success = True
+            return result
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            self.concurrency.release(success=success, throttled=throttled)
+    
+    async def call_async(self, func, estimated_tokens: int = 0):
+        """在限流控制下执行一次异步请求（不含重试）"""
+        await self.concurrency.acquire_async()
+        success = throttled = False
+        try:
+            wait = self.reserve(estimated_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            result = await func()
+            success = True
+            return result
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            self.concurrency.release(success=success, throttled=throttled)
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """获取进程内共享的模型限流器（按配置中rate_limits的模型设置创建，未配置的模型使用默认设置）"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is None:
+            config = dict(settings.rate_limit_default)
+            config.update(settings.rate_limits.get(model, {}))
+            limiter = RateLimiter(
+                model,
+                rpm=int(config.get('rpm') or 0),
+                tpm=int(config.get('tpm') or 0),
+                max_concurrency=int(config.get('max_concurrency') or 16),
+                initial_concurrency=config.get('initial_concurrency')
+            )
+            _rate_limiters[model] = limiter
+        return limiter
+
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """全部已使用模型的限流统计"""
+    with _rate_limiters_lock:
+        limiters = list(_rate_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -0,0 +1,477 @@
+"""
+AI推荐结果缓存模块
+
+按请求内容（提示词、上下文、模型、数量及图片内容哈希）计算缓存键，
+相同请求直接返回已缓存的结果，不再调用AI接口。
+缓存由多级存储组成：进程内LRU缓存和基于SQLite的磁盘缓存。
+启用语义缓存时，换了说法的相似请求也会复用已缓存的结果（见utils/semantic_cache.py）。
+"""
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from config.settings import settings
+from utils.ai_client import AIClient, PoemStream, result_to_poems, poems_to_result
+from utils.image_processor import hash_file
+from utils.tracing import record_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    """规范化文本：去除首尾空白并合并连续空白"""
+    if not text:
+        return ''
+    return ' '.join(text.split())
+
+
+def build_cache_key(
+    model_name: str,
+    positive_prompt: Optional[str] = None,
+    negative_prompt: Optional[str] = None,
+    image_path: Optional[str] = None,
+    image_description: Optional[str] = None,
+    context: Optional[str] = None,
+    count: int = 1
+) -> str:
+    """
+    构建缓存键
+    
+    Args:
+        model_name: 模型名称
+        positive_prompt: 正向提示词
+        negative_prompt: 负向提示词
+        image_path: 图片路径（按图片内容哈希参与计算，与文件名无关）
+        image_description: 图片描述
+        context: 上下文信息
+        count: 推荐数量
+    
+    Returns:
+        缓存键（SHA-256十六进制字符串）
+    """
+    payload = {
+        'model': model_name,
+        'positive_prompt': _normalize_text(positive_prompt),
+        'negative_prompt': _normalize_text(negative_prompt),
+        'image': hash_file(image_path) if image_path else '',
+        'image_description': _normalize_text(image_description),
+        'context': _normalize_text(context),
+        'count': count,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def is_complete(result: Dict[str, Any], count: int) -> bool:
+    """
+    结果中的诗词是否达到请求的数量（只缓存完整的结果）
+    
+    输出达到max_tokens被截断、流式连接中断时诗词数不足，缓存后每次命中都会返回不完整的结果。
+    """
+    return len(result_to_poems(result)) >= count
+
+
+def build_cache_request(
+    positive_prompt: Optional[str] = None,
+    negative_prompt: Optional[str] = None,
+    image_path: Optional[str] = None,
+    image_description: Optional[str] = None,
+    context: Optional[str] = None,
+    count: int = 1
+) -> Dict[str, Any]:
+    """汇总参与缓存匹配的请求参数（语义缓存据此计算向量和分区）"""
+    return {
+        'positive_prompt': positive_prompt,
+        'negative_prompt': negative_prompt,
+        'image_path': image_path,
+        'image_description': image_description,
+        'context': context,
+        'count': count,
+    }
+
+
+class CacheBackend:
+    """缓存存储基类，自定义存储实现get/set/clear即可接入ResponseCache"""
+    
+    name = 'backend'
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def set(self, key: str, value: Dict[str, Any]):
+        raise NotImplementedError
+    
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """进程内LRU缓存"""
+    
+    name = 'memory'
+    
+    def __init__(self, max_entries: int = 256, ttl: int = 0):
+        """
+        Args:
+            max_entries: 最大缓存条数，超出时淘汰最久未使用的条目
+            ttl: 过期时间（秒），0表示不过期
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return copy.deepcopy(value)
+    
+    def set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._data[key] = (time.time(), copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache(CacheBackend):
+    """基于SQLite的磁盘缓存，进程重启后依然有效"""
+    
+    name = 'disk'
+    
+    def __init__(self, path: str, max_entries: int = 10000, ttl: int = 0):
+        """
+        Args:
+            path: SQLite数据库文件路径
+            max_entries: 最大缓存条数，超出时淘汰最久未访问的条目
+            ttl: 过期时间（秒），0表示不过期
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_response_cache_accessed_at ON response_cache (accessed_at)'
+        )
+        self._conn.commit()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+        return json.loads(value)
+    
+    def set(self, key: str, value: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+    
+    def _evict(self, now: float):
+        """淘汰过期条目，并在超出容量时淘汰最久未访问的条目"""
+        if self.ttl:
+            self._conn.execute('DELETE FROM response_cache WHERE created_at < ?', (now - self.ttl,))
+        (total,) = self._conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()
+        if total > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM response_cache WHERE key IN ('
+                'SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)',
+                (total - self.max_entries,)
+            )
+    
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM response_cache')
+            self._conn.commit()
+
+
+class ResponseCache:
+    """多级推荐结果缓存"""
+    
+    def __init__(self, backends: List[CacheBackend], semantic=None):
+        """
+        Args:
+            backends: 缓存存储列表，按顺序查找（应从快到慢排列），
+                      命中较慢的存储时会回填到前面的存储
+            semantic: 语义缓存索引（SemanticCache），为None时只做精确匹配
+        """
+        self.backends = backends
+        self.semantic = semantic
+        self._lock = threading.Lock()
+        self._hits = {backend.name: 0 for backend in backends}
+        if semantic is not None:
+            self._hits['semantic'] = 0
+        self._misses = 0
+    
+    def get(
+        self,
+        key: str,
+        model_name: Optional[str] = None,
+        request: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存，未命中返回None
+        
+        Args:
+            key: 缓存键
+            model_name: 模型名称（用于语义缓存）
+            request: 请求参数（用于语义缓存）；提供时精确缓存未命中后查找相似请求的结果
+        """
+        value, source = self._read(key)
+        if value is None and self.semantic is not None and request is not None:
+            value = self._read_similar(model_name, request)
+            source = 'semantic' if value is not None else None
+        with self._lock:
+            if source is None:
+                self._misses += 1
+            else:
+                self._hits[source] += 1
+        record_cache(source or 'miss')
+        return value
+    
+    def _read(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """按顺序查找各存储，返回(缓存值, 命中的存储名称)"""
+        for index, backend in enumerate(self.backends):
+            try:
+                value = backend.get(key)
+            except Exception as e:
+                logger.warning(f"读取缓存失败 ({backend.name}): {e}")
+                continue
+            if value is not None:
+                for faster in self.backends[:index]:
+                    faster.set(key, value)
+                return value, backend.name
+        return None, None
+    
+    def _read_similar(self, model_name: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """查找相似请求的缓存结果"""
+        try:
+            match = self.semantic.lookup(model_name, request)
+        except Exception as e:
+            logger.warning(f"读取语义缓存失败: {e}")
+            return None
+        if match is None:
+            return None
+        similar_key, score = match
+        value, _ = self._read(similar_key)
+        if value is None:
+            # 相似请求的结果已过期或被淘汰
+            self.semantic.discard(similar_key)
+            return None
+        logger.info(f"命中语义缓存: {similar_key[:12]}（相似度 {score:.2f}）")
+        return value
+    
+    def set(
+        self,
+        key: str,
+        value: Dict[str, Any],
+        model_name: Optional[str] = None,
+        request: Optional[Dict[str, Any]] = None
+    ):
+        """写入所有缓存存储，提供请求参数时同时记录到语义缓存"""
+        for backend in self.backends:
+            try:
+                backend.set(key, value)
+            except Exception as e:
+                logger.warning(f"写入缓存失败 ({backend.name}): {e}")
+        if self.semantic is not None and request is not None:
+            try:
+                self.semantic.add(key, model_name, request)
+            except Exception as e:
+                logger.warning(f"写入语义缓存失败: {e}")
+    
+    def clear(self):
+        """清空所有缓存存储"""
+        for backend in self.backends:
+            backend.clear()
+        if self.semantic is not None:
+            self.semantic.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存命中统计
+        
+        Returns:
+            统计字典：hits（按存储分别统计的命中次数，语义缓存命中计入semantic）、misses、hit_rate；
+            启用语义缓存时另有semantic（语义缓存的条数和查找统计）
+        """
+        with self._lock:
+            hits = dict(self._hits)
+            misses = self._misses
+        total = sum(hits.values()) + misses
+        stats = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': sum(hits.values()) / total if total else 0.0
+        }
+        if self.semantic is not None:
+            stats['semantic'] = self.semantic.stats()
+        return stats
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """获取进程内共享的推荐结果缓存（按配置创建）"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache([
+                MemoryCache(settings.cache_memory_size, settings.cache_ttl),
+                SQLiteCache(settings.cache_path, settings.cache_max_entries, settings.cache_ttl),
+            ], semantic=_create_semantic_cache())
+        return _response_cache
+
+
+def _create_semantic_cache():
+    """按配置创建语义缓存索引，未启用或缺少NumPy时返回None"""
+    if not settings.semantic_cache_enabled:
+        return None
+    try:
+        from utils.semantic_cache import SemanticCache
+    except ImportError as e:
+        logger.warning(f"语义缓存不可用（{e}），只使用精确缓存")
+        return None
+    return SemanticCache(settings.cache_path, settings.semantic_cache_threshold, settings.cache_max_entries)
+
+
+class CachedAIClient(AIClient):
+    """带结果缓存的AI客户端，包装任意AIClient"""
+    
+    def __init__(self, client: AIClient, model_name: str, cache: Optional[ResponseCache] = None):
+        """
+        Args:
+            client: 实际调用AI接口的客户端
+            model_name: 模型名称（参与缓存键计算）
+            cache: 缓存实例（默认使用进程内共享缓存）
+        """
+        super().__init__(client.api_key, client.base_url)
+        self.client = client
+        self.model_name = model_name
+        self.cache = cache or get_response_cache()
+    
+    def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐，命中缓存时直接返回缓存结果"""
+        request = build_cache_request(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        key = build_cache_key(self.model_name, **request)
+        
+        result = self.cache.get(key, self.model_name, request)
+        if result is not None:
+            logger.info(f"命中推荐结果缓存: {key[:12]}")
+            return result
+        
+        result = self.client.generate_poetry_recommendation(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        if is_complete(result, count):
+            self.cache.set(key, result, self.model_name, request)
+        return result
+    
+    def stream_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> PoemStream:
+        """流式生成诗词推荐，命中缓存时直接逐首返回缓存结果，完整接收后写入缓存"""
+        request = build_cache_request(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        key = build_cache_key(self.model_name, **request)
+        
+        result = self.cache.get(key, self.model_name, request)
+        if result is not None:
+            logger.info(f"命中推荐结果缓存: {key[:12]}")
+            return PoemStream(iter(result_to_poems(result)), result.get('image_description'))
+        
+        stream = self.client.stream_poetry_recommendation(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        
+        def _iter_and_cache():
+            poems = []
+            for poem in stream:
+                poems.append(poem)
+                yield poem
+            # 流正常结束且诗词数足够时才缓存（中途出错或调用方提前停止读取时不会执行到这里）
+            if len(poems) >= count:
+                self.cache.set(key, poems_to_result(poems, count, stream.image_description), self.model_name, request)
+        
+        return PoemStream(_iter_and_cache(), stream.image_description)
@@ -0,0 +1,362 @@
+"""
+多服务商路由客户端
+
+在配置的多个后端模型之间路由请求：按最近请求的延迟选择最快的健康后端，
+错误率过高的后端暂停使用一段时间；主后端的响应时间超过其p95延迟时，
+向次优后端发送一个对冲请求，先返回的结果生效，另一个请求被取消。
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, List
+
+from config.settings import settings
+from utils.ai_client import AIClient, PoemStream
+from utils.json_extract import ResponseParseError
+from utils.tracing import in_context
+
+logger = logging.getLogger(__name__)
+
+# 计算延迟分位数和错误率所需的最少样本数
+MIN_SAMPLES = 5
+
+
+class BackendStats:
+    """单个后端的滚动统计：最近window次请求的延迟和成败"""
+    
+    def __init__(self, name: str, window: int = 100):
+        self.name = name
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._unhealthy_until = 0.0
+    
+    def record(self, latency: float, ok: bool):
+        """记录一次请求结果；错误率超过阈值时暂停使用该后端"""
+        with self._lock:
+            self._samples.append((latency, ok))
+            if len(self._samples) < MIN_SAMPLES:
+                return
+            errors = sum(1 for _, success in self._samples if not success)
+            if errors / len(self._samples) > settings.router_error_threshold:
+                self._unhealthy_until = time.monotonic() + settings.router_cooldown
+                # 暂停结束后重新统计，避免旧的错误让后端立即再次被暂停
+                self._samples.clear()
+                logger.warning(f"后端 {self.name} 错误率过高，暂停使用 {settings.router_cooldown:.0f} 秒")
+    
+    def healthy(self) -> bool:
+        with self._lock:
+            return time.monotonic() >= self._unhealthy_until
+    
+    def latency_quantile(self, q: float) -> Optional[float]:
+        """成功请求延迟的分位数（秒），样本不足时返回None"""
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._samples if ok)
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = len(self._samples)
+            errors = sum(1 for _, ok in self._samples if not ok)
+            unhealthy_for = max(0.0, self._unhealthy_until - time.monotonic())
+        return {
+            'samples': total,
+            'error_rate': errors / total if total else 0.0,
+            'p50': self.latency_quantile(0.5),
+            'p95': self.latency_quantile(0.95),
+            'unhealthy_for': unhealthy_for,
+        }
+
+
+_backend_stats: Dict[str, BackendStats] = {}
+_backend_stats_lock = threading.Lock()
+
+
+def get_backend_stats(name: str) -> BackendStats:
+    """获取进程内共享的后端统计（同步和异步路由客户端共用）"""
+    with _backend_stats_lock:
+        stats = _backend_stats.get(name)
+        if stats is None:
+            stats = BackendStats(name, settings.router_window)
+            _backend_stats[name] = stats
+        return stats
+
+
+def router_stats() -> Dict[str, Dict[str, Any]]:
+    """全部后端的统计快照"""
+    with _backend_stats_lock:
+        stats = list(_backend_stats.values())
+    return {item.name: item.snapshot() for item in stats}
+
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """同步路由客户端执行后端请求的线程池"""
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix='router')
+        return _hedge_executor
+
+
+class _RoutingPolicy:
+    """后端排序和对冲等待时间的计算，同步和异步路由客户端共用"""
+    
+    backends: Dict[str, Any]
+    hedge: bool
+    
+    def _ranked_backends(self) -> List[str]:
+        """
+        按优先级排列后端
+        
+        健康的后端按p50延迟从低到高排列（样本不足的后端按对冲等待时间估算，保持配置顺序）；
+        全部后端都不健康时仍按同样的顺序尝试。
+        """
+        names = list(self.backends)
+        
+        def _score(name: str) -> float:
+            p50 = get_backend_stats(name).latency_quantile(0.5)
+            return p50 if p50 is not None else settings.router_hedge_delay
+        
+        healthy = [name for name in names if get_backend_stats(name).healthy()]
+        return sorted(healthy or names, key=_score)
+    
+    @staticmethod
+    def _hedge_delay(name: str) -> float:
+        """主后端超过该时间（其p95延迟）仍未返回时发送对冲请求"""
+        p95 = get_backend_stats(name).latency_quantile(0.95)
+        return p95 if p95 is not None else settings.router_hedge_delay
+
+
+class RouterClient(_RoutingPolicy, AIClient):
+    """同步路由客户端"""
+    
+    def __init__(self, backends: Dict[str, AIClient], hedge: Optional[bool] = None):
+        """
+        Args:
+            backends: 模型名称 -> 该模型的客户端
+            hedge: 是否发送对冲请求（默认使用配置中的router.hedge）
+        """
+        if not backends:
+            raise ValueError("路由客户端至少需要一个后端")
+        super().__init__()
+        self.backends = backends
+        self.hedge = settings.router_hedge if hedge is None else hedge
+    
+    def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐：主后端失败时依次改用其他后端，响应过慢时发送对冲请求"""
+        request = dict(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        executor = _get_hedge_executor()
+        candidates = self._ranked_backends()
+        pending = {}
+        last_error: Optional[Exception] = None
+        
+        def _start(name: str):
+            pending[executor.submit(in_context(self._call_backend), name, request)] = name
+            return time.monotonic()
+        
+        primary = candidates.pop(0)
+        started = _start(primary)
+        hedged = False
+        
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and candidates:
+                timeout = max(0.0, started + self._hedge_delay(primary) - time.monotonic())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                backend = candidates.pop(0)
+                logger.info(f"后端 {primary} 响应超过 {self._hedge_delay(primary):.2f} 秒，向 {backend} 发送对冲请求")
+                _start(backend)
+                hedged = True
+                continue
+            
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"后端 {name} 请求失败: {e}")
+                    if isinstance(e, ResponseParseError):
+                        # 响应无法解析时不再向其他后端重新请求，解析失败不额外消耗API调用
+                        candidates.clear()
+                    continue
+                for loser, loser_name in pending.items():
+                    # 未开始的请求直接取消；已在执行的同步请求无法中断，其结果会被丢弃
+                    loser.cancel()
+                    logger.debug(f"放弃后端 {loser_name} 的请求")
+                return result
+            
+            if not pending and candidates:
+                # 当前请求全部失败，改用下一个后端（重新计算对冲时间）
+                primary = candidates.pop(0)
+                started = _start(primary)
+                hedged = False
+        
+        raise last_error
+    
+    def stream_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> PoemStream:
+        """流式生成诗词推荐：使用最优后端，建立连接失败时依次改用其他后端（流式请求不对冲）"""
+        last_error: Optional[Exception] = None
+        for name in self._ranked_backends():
+            start = time.monotonic()
+            try:
+                return self.backends[name].stream_poetry_recommendation(
+                    positive_prompt=positive_prompt,
+                    negative_prompt=negative_prompt,
+                    image_path=image_path,
+                    image_description=image_description,
+                    context=context,
+                    count=count
+                )
+            except Exception as e:
+                get_backend_stats(name).record(time.monotonic() - start, False)
+                last_error = e
+                logger.warning(f"后端 {name} 请求失败: {e}")
+        raise last_error
+    
+    def _call_backend(self, name: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """调用单个后端并记录延迟"""
+        start = time.monotonic()
+        try:
+            result = self.backends[name].generate_poetry_recommendation(**request)
+        except Exception:
+            get_backend_stats(name).record(time.monotonic() - start, False)
+            raise
+        get_backend_stats(name).record(time.monotonic() - start, True)
+        return result
+    
+    def close(self):
+        for backend in self.backends.values():
+            backend.close()
+
+
+class AsyncRouterClient(_RoutingPolicy):
+    """异步路由客户端：落后的请求会被真正取消（断开HTTP连接）"""
+    
+    def __init__(self, backends: Dict[str, Any], hedge: Optional[bool] = None):
+        """
+        Args:
+            backends: 模型名称 -> 该模型的异步客户端
+            hedge: 是否发送对冲请求（默认使用配置中的router.hedge）
+        """
+        if not backends:
+            raise ValueError("路由客户端至少需要一个后端")
+        self.api_key = None
+        self.base_url = None
+        self.backends = backends
+        self.hedge = settings.router_hedge if hedge is None else hedge
+    
+    async def generate_poetry_recommendation(
+        self,
+        positive_prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        image_description: Optional[str] = None,
+        context: Optional[str] = None,
+        count: int = 1
+    ) -> Dict[str, Any]:
+        """生成诗词推荐（路由策略同RouterClient）"""
+        request = dict(
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            image_path=image_path,
+            image_description=image_description,
+            context=context,
+            count=count
+        )
+        candidates = self._ranked_backends()
+        pending: Dict[asyncio.Task, str] = {}
+        last_error: Optional[Exception] = None
+        
+        def _start(name: str):
+            pending[asyncio.ensure_future(self._call_backend(name, request))] = name
+            return time.monotonic()
+        
+        primary = candidates.pop(0)
+        started = _start(primary)
+        hedged = False
+        
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and candidates:
+                    timeout = max(0.0, started + self._hedge_delay(primary) - time.monotonic())
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    backend = candidates.pop(0)
+                    logger.info(f"后端 {primary} 响应超过 {self._hedge_delay(primary):.2f} 秒，向 {backend} 发送对冲请求")
+                    _start(backend)
+                    hedged = True
+                    continue
+                
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f"后端 {name} 请求失败: {e}")
+                        if isinstance(e, ResponseParseError):
+                            candidates.clear()
+                
+                if not pending and candidates:
+                    primary = candidates.pop(0)
+                    started = _start(primary)
+                    hedged = False
+        finally:
+            # 取消落后的请求（包括调用方被取消的情况）
+            for task in pending:
+                task.cancel()
+        
+        raise last_error
+    
+    async def _call_backend(self, name: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """调用单个后端并记录延迟（被取消的请求不计入统计）"""
+        start = time.monotonic()
+        try:
+            result = await self.backends[name].generate_poetry_recommendation(**request)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            get_backend_stats(name).record(time.monotonic() - start, False)
+            raise
+        get_backend_stats(name).record(time.monotonic() - start, True)
+        return result
+    
+    async def close(self):
+        for backend in self.backends.values():
+            await backend.close()
@@ -0,0 +1,333 @@
+"""
+语义缓存模块
+
+精确缓存只能命中完全相同的请求，"推荐一首关于春天的诗"和"来首春天的古诗"这类换了说法的请求
+会再次调用AI接口。语义缓存把提示词、负向提示词和上下文编码为向量（汉字n-gram哈希后按TF-IDF加权，
+只依赖NumPy，在CPU上计算），与以往成功请求的向量计算余弦相似度，超过阈值时复用其缓存结果。
+
+模型、数量、图片和请求的体裁（诗、词、曲、绝句、律诗）必须完全相同，这些字段组成分区，只在同一分区内比较。
+向量以float16存放在按需扩容的矩阵中，同时追加写入SQLite，进程重启后重新加载。
+"""
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+from utils.image_processor import hash_file
+from utils.poem_index import MODERN_TERMS, NEGATIVE_STOPWORDS, QUERY_STOPWORDS, ngrams
+
+logger = logging.getLogger(__name__)
+
+# 向量维度（n-gram哈希桶数）
+DIMENSIONS = 1024
+
+# 各字段的权重：负向提示词和上下文的差异对结果的影响小于正向提示词
+FIELD_WEIGHTS = {
+    'positive_prompt': 1.0,
+    'negative_prompt': 0.7,
+    'context': 0.5,
+}
+
+# 计算相似度时每次转换为float32的行数，限制临时内存占用
+CHUNK_ROWS = 4096
+
+_WORD = re.compile(r'[A-Za-z0-9]+')
+
+# 体裁词 -> 体裁（按长度从长到短匹配）。QUERY_STOPWORDS把"诗""词"当作泛指去除，语义特征中不包含体裁，
+# 而"推荐一首春天的词"不能复用"推荐一首春天的诗"的结果，体裁改为计入分区键
+FORM_WORDS = {
+    '绝句': '绝句', '律诗': '律诗', '元曲': '曲', '散曲': '曲', '曲子': '曲', '诗': '诗', '词': '词',
+}
+
+# 不表示体裁的含"诗""词"的词语，匹配体裁前去除（"古诗"表示诗，不在此列）
+GENERIC_FORM_WORDS = sorted([
+    '诗词', '诗歌', '诗句', '诗人', '词人', '诗意', '诗情', '歌词', '台词',
+], key=len, reverse=True)
+
+
+def _field_text(field: str, text: Optional[str]) -> str:
+    """去除不表达诗词特征的指令性词语（负向提示词还去除否定词）"""
+    if not text:
+        return ''
+    for modern, classical in MODERN_TERMS.items():
+        text = text.replace(modern, classical)
+    stopwords = NEGATIVE_STOPWORDS if field == 'negative_prompt' else QUERY_STOPWORDS
+    for word in stopwords:
+        text = text.replace(word, ' ')
+    return text
+
+
+def _term_counts(request: Dict[str, Any]) -> Dict[int, float]:
+    """
+    提取请求中各字段的n-gram并哈希到向量维度
+    
+    Returns:
+        维度 -> 带符号的加权词频（1 + log(tf)）；同一n-gram在不同字段中哈希到不同维度
+    """
+    counts: Dict[Tuple[str, str], int] = {}
+    for field in FIELD_WEIGHTS:
+        text = _field_text(field, request.get(field))
+        grams = list(ngrams(text)) + [word.lower() for word in _WORD.findall(text)]
+        for gram in grams:
+            counts[(field, gram)] = counts.get((field, gram), 0) + 1
+    
+    weights: Dict[int, float] = {}
+    for (field, gram), tf in counts.items():
+        digest = zlib.crc32(f"{field}:{gram}".encode('utf-8'))
+        dimension = digest % DIMENSIONS
+        # 用哈希的另一位决定符号，哈希冲突的n-gram相互抵消而不是累加
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        weight = sign * FIELD_WEIGHTS[field] * (1.0 + np.log(tf))
+        weights[dimension] = weights.get(dimension, 0.0) + weight
+    return weights
+
+
+def request_forms(request: Dict[str, Any]) -> str:
+    """请求指定的体裁（负向提示词中的体裁加"-"前缀），多个体裁按名称排序，未指定时为空字符串"""
+    forms = set()
+    for field, prefix in (('positive_prompt', ''), ('context', ''), ('negative_prompt', '-')):
+        text = request.get(field) or ''
+        for word in GENERIC_FORM_WORDS:
+            text = text.replace(word, ' ')
+        for word, form in FORM_WORDS.items():
+            if word in text:
+                forms.add(prefix + form)
+                text = text.replace(word, ' ')
+    return ','.join(sorted(forms))
+
+
+def request_partition(model_name: str, request: Dict[str, Any]) -> str:
+    """分区键：模型、数量、图片内容、图片描述和体裁都相同的请求才参与相似度比较"""
+    image_path = request.get('image_path')
+    raw = '\n'.join((
+        model_name,
+        str(request.get('count', 1)),
+        hash_file(image_path) if image_path else '',
+        ' '.join((request.get('image_description') or '').split()),
+        request_forms(request),
+    ))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SemanticCache:
+    """
+    语义缓存索引：只保存请求向量和对应的精确缓存键，结果本身仍由ResponseCache保存
+    
+    文档频率随写入增量更新，已保存的向量使用写入时的IDF权重，不再重新计算。
+    """
+    
+    def __init__(self, path: str, threshold: float = 0.9, max_entries: int = 10000):
+        """
+        Args:
+            path: SQLite数据库文件路径（可与精确缓存共用同一文件）
+            threshold: 判定为相同请求的最低余弦相似度
+            max_entries: 最多保存的请求数，超出时淘汰最早写入的请求
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        
+        self._vectors = np.zeros((0, DIMENSIONS), dtype=np.float16)
+        self._partitions = np.zeros(0, dtype=np.int32)
+        self._keys: List[Optional[str]] = []
+        self._positions: Dict[str, int] = {}
+        self._partition_ids: Dict[str, int] = {}
+        self._size = 0
+        self._removed = 0
+        self._document_frequency = np.zeros(DIMENSIONS, dtype=np.float32)
+        self._documents = 0
+        
+        self._lookups = 0
+        self._hits = 0
+        
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS semantic_cache ('
+            'key TEXT PRIMARY KEY, partition TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+        self._load()
+    
+    def _load(self):
+        rows = self._conn.execute(
+            'SELECT key, partition, vector FROM semantic_cache ORDER BY created_at DESC LIMIT ?',
+            (self.max_entries,)
+        ).fetchall()
+        for key, partition, blob in reversed(rows):
+            vector = np.frombuffer(blob, dtype=np.float16)
+            if vector.shape[0] != DIMENSIONS:
+                continue
+            self._append(key, partition, vector)
+            # 文档频率按已保存向量中非零的维度重新累计
+            self._document_frequency[np.flatnonzero(vector)] += 1
+            self._documents += 1
+        if rows:
+            logger.debug(f"已加载语义缓存 {self._size} 条")
+    
+    def lookup(self, model_name: str, request: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        """
+        查找相似的已缓存请求
+        
+        Args:
+            model_name: 模型名称
+            request: 请求参数（positive_prompt、negative_prompt、context、image_path、image_description、count）
+        
+        Returns:
+            (相似请求的精确缓存键, 相似度)；没有超过阈值的请求时返回None
+        """
+        partition = request_partition(model_name, request)
+        with self._lock:
+            self._lookups += 1
+            partition_id = self._partition_ids.get(partition)
+            if partition_id is None or self._size == 0:
+                return None
+            query = self._embed(_term_counts(request))
+            if query is None:
+                return None
+            
+            # 请求向量很稀疏，只取查询向量非零的列计算点积
+            dimensions = np.flatnonzero(query)
+            weights = query[dimensions]
+            best_position, best_score = -1, -1.0
+            for start in range(0, self._size, CHUNK_ROWS):
+                end = min(start + CHUNK_ROWS, self._size)
+                scores = self._vectors[start:end, dimensions].astype(np.float32) @ weights
+                scores[self._partitions[start:end] != partition_id] = -1.0
+                position = int(np.argmax(scores))
+                if scores[position] > best_score:
+                    best_position, best_score = start + position, float(scores[position])
+            
+            if best_score < self.threshold:
+                return None
+            self._hits += 1
+            return self._keys[best_position], best_score
+    
+    def add(self, key: str, model_name: str, request: Dict[str, Any]):
+        """记录一个已缓存的请求（同一缓存键只保存一次）"""
+        partition = request_partition(model_name, request)
+        counts = _term_counts(request)
+        if not counts:
+            return
+        with self._lock:
+            if key in self._positions:
+                return
+            # 先更新文档频率，本请求自身也计入IDF
+            dimensions = np.fromiter(counts.keys(), dtype=np.int64)
+            self._document_frequency[dimensions] += 1
+            self._documents += 1
+            vector = self._embed(counts)
+            if vector is None:
+                return
+            vector = vector.astype(np.float16)
+            self._append(key, partition, vector)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO semantic_cache (key, partition, vector, created_at) VALUES (?, ?, ?, ?)',
+                (key, partition, vector.tobytes(), time.time())
+            )
+            if self._size - self._removed > self.max_entries:
+                self._evict_oldest(self._size - self._removed - self.max_entries)
+            self._conn.commit()
+    
+    def discard(self, key: str):
+        """移除请求（对应的精确缓存已过期或被淘汰时调用）"""
+        with self._lock:
+            self._remove(key)
+            self._conn.execute('DELETE FROM semantic_cache WHERE key = ?', (key,))
+            self._conn.commit()
+    
+    def clear(self):
+        with self._lock:
+            self._vectors = np.zeros((0, DIMENSIONS), dtype=np.float16)
+            self._partitions = np.zeros(0, dtype=np.int32)
+            self._keys = []
+            self._positions = {}
+            self._partition_ids = {}
+            self._size = 0
+            self._removed = 0
+            self._document_frequency[:] = 0
+            self._documents = 0
+            self._conn.execute('DELETE FROM semantic_cache')
+            self._conn.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取语义缓存统计
+        
+        Returns:
+            统计字典：entries（保存的请求数）、lookups（精确缓存未命中后的查找次数）、hits、hit_rate
+        """
+        with self._lock:
+            return {
+                'entries': self._size - self._removed,
+                'lookups': self._lookups,
+                'hits': self._hits,
+                'hit_rate': self._hits / self._lookups if self._lookups else 0.0,
+            }
+    
+    def _embed(self, counts: Dict[int, float]) -> Optional[np.ndarray]:
+        """TF-IDF加权并归一化为单位向量（调用方需持有锁）"""
+        if not counts:
+            return None
+        vector = np.zeros(DIMENSIONS, dtype=np.float32)
+        dimensions = np.fromiter(counts.keys(), dtype=np.int64)
+        vector[dimensions] = np.fromiter(counts.values(), dtype=np.float32)
+        idf = np.log((1.0 + self._documents) / (1.0 + self._document_frequency)) + 1.0
+        vector *= idf
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+    
+    def _append(self, key: str, partition: str, vector: np.ndarray):
+        """加入向量矩阵，容量不足时按倍数扩容（调用方需持有锁）"""
+        if self._size == self._vectors.shape[0]:
+            capacity = max(64, self._vectors.shape[0] * 2)
+            vectors = np.zeros((capacity, DIMENSIONS), dtype=np.float16)
+            vectors[:self._size] = self._vectors[:self._size]
+            partitions = np.full(capacity, -1, dtype=np.int32)
+            partitions[:self._size] = self._partitions[:self._size]
+            self._vectors, self._partitions = vectors, partitions
+        
+        partition_id = self._partition_ids.setdefault(partition, len(self._partition_ids))
+        self._vectors[self._size] = vector
+        self._partitions[self._size] = partition_id
+        self._keys.append(key)
+        self._positions[key] = self._size
+        self._size += 1
+    
+    def _remove(self, key: str):
+        """标记移除，移除的行过多时压缩矩阵（调用方需持有锁）"""
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        self._partitions[position] = -1
+        self._keys[position] = None
+        self._removed += 1
+        if self._removed > self._size // 4:
+            self._compact()
+    
+    def _evict_oldest(self, count: int):
+        """淘汰最早写入的请求（调用方需持有锁）"""
+        evicted = [key for key in self._keys if key is not None][:count]
+        for key in evicted:
+            self._remove(key)
+        self._conn.executemany('DELETE FROM semantic_cache WHERE key = ?', [(key,) for key in evicted])
+    
+    def _compact(self):
+        """删除已移除的行（调用方需持有锁）"""
+        keep = np.flatnonzero(self._partitions[:self._size] >= 0)
+        self._vectors = self._vectors[keep].copy()
+        self._partitions = self._partitions[keep].copy()
+        self._keys = [self._keys[i] for i in keep]
+        self._positions = {key: i for i, key in enumerate(self._keys)}
+        self._size = len(self._keys)
+        self._removed = 0
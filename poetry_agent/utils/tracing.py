@@ -0,0 +1,184 @@
+"""
+请求耗时追踪模块
+
+PoetryAgent.execute 为每个推荐任务创建一个RequestTrace，保存在contextvars中；
+图片处理、AI接口调用（每次重试单独计时）和数据库写入等阶段用span()计时，
+同时记录重试次数、令牌用量和缓存命中情况，最终写入推荐记录并汇总到监控指标（见utils/metrics.py）。
+没有进行中的任务时span()只更新监控指标。
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Callable
+
+from utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+_registry = get_metrics_registry()
+
+REQUESTS = _registry.counter('poetry_requests_total', '推荐任务数', ('mode', 'exit_code'))
+REQUEST_SECONDS = _registry.histogram('poetry_request_duration_seconds', '推荐任务总耗时（秒）', ('mode',))
+STAGE_SECONDS = _registry.histogram('poetry_stage_duration_seconds', '各阶段耗时（秒）', ('stage',))
+API_RETRIES = _registry.counter('poetry_api_retries_total', 'AI接口请求的重试次数', ('model',))
+TOKENS = _registry.counter('poetry_tokens_total', 'AI接口返回的令牌用量', ('model', 'kind'))
+CACHE_LOOKUPS = _registry.counter('poetry_cache_lookups_total', '推荐结果缓存查找次数（按命中的存储）', ('outcome',))
+FANOUT_FAILURES = _registry.counter('poetry_fanout_failures_total', '拆分的子请求失败次数（缺少的诗词由补充请求补齐）')
+
+_current_trace: contextvars.ContextVar[Optional['RequestTrace']] = contextvars.ContextVar('request_trace', default=None)
+
+
+class RequestTrace:
+    """单个推荐任务的耗时和用量记录（拆分的子请求在其他线程中记录到同一对象）"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.retries = 0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cache_status: Optional[str] = None
+        self._lock = threading.Lock()
+    
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            self.spans.append((name, seconds))
+    
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+    
+    def add_usage(self, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.prompt_tokens = (self.prompt_tokens or 0) + prompt_tokens
+            self.completion_tokens = (self.completion_tokens or 0) + completion_tokens
+    
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+    
+    def record_fields(self) -> Dict[str, Any]:
+        """写入推荐记录的字段：到保存时为止的耗时、重试次数、令牌用量和缓存命中情况"""
+        with self._lock:
+            return {
+                'latency_ms': int(self.elapsed * 1000),
+                'retry_count': self.retries,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cache_status': self.cache_status,
+            }
+    
+    def summary(self) -> str:
+        """按阶段汇总的耗时，如 "总耗时 1.32s（api_attempt 1.20s×2，db_write 0.01s）" """
+        totals: Dict[str, List[float]] = {}
+        with self._lock:
+            for name, seconds in self.spans:
+                entry = totals.setdefault(name, [0.0, 0])
+                entry[0] += seconds
+                entry[1] += 1
+        parts = [
+            f"{name} {seconds:.2f}s" + (f"×{count}" if count > 1 else '')
+            for name, (seconds, count) in sorted(totals.items(), key=lambda item: -item[1][0])
+        ]
+        detail = f"（{'，'.join(parts)}）" if parts else ''
+        return f"总耗时 {self.elapsed:.2f}s{detail}"
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """当前推荐任务的记录，不在任务中时返回None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def request_trace() -> Iterator[RequestTrace]:
+    """为一个推荐任务开始记录"""
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """记录一个阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, seconds)
+
+
+def traced(name: str) -> Callable:
+    """把函数的每次调用记录为一个阶段"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def in_context(func: Callable) -> Callable:
+    """
+    绑定当前上下文（含进行中的任务记录），用于提交到线程池的函数
+    
+    线程池中的线程不会继承提交方的contextvars；每次调用in_context都会复制一份上下文，
+    返回的函数只能执行一次。
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def record_retry(model: Optional[str]):
+    """记录一次AI接口请求的重试"""
+    API_RETRIES.inc(model=model or '')
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_retry()
+
+
+def record_usage(usage: Any, model: Optional[str]):
+    """记录AI接口响应中的令牌用量（usage为SDK对象或字典，没有用量信息时忽略）"""
+    if usage is None:
+        return
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get('prompt_tokens')
+        completion_tokens = usage.get('completion_tokens')
+    else:
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+    prompt_tokens = prompt_tokens or 0
+    completion_tokens = completion_tokens or 0
+    TOKENS.inc(prompt_tokens, model=model or '', kind='prompt')
+    TOKENS.inc(completion_tokens, model=model or '', kind='completion')
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_usage(prompt_tokens, completion_tokens)
+
+
+def record_cache(outcome: str):
+    """记录推荐结果缓存的查找结果（命中的存储名称，或miss）"""
+    CACHE_LOOKUPS.inc(outcome=outcome)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.cache_status = outcome
+
+
+def record_fanout_failure():
+    """记录一次失败的拆分子请求"""
+    FANOUT_FAILURES.inc()
+
+
+def record_request(trace: RequestTrace, mode: str, exit_code: int):
+    """任务结束时汇总到监控指标"""
+    REQUESTS.inc(mode=mode, exit_code=str(exit_code))
+    REQUEST_SECONDS.observe(trace.elapsed, mode=mode)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+队列worker
+
+常驻进程，从task_logs任务队列中领取任务并通过PoetryAgent执行，记录任务状态变化。
+可以在多台主机上同时运行多个worker消费同一个队列。
+
+用法:
+    python poetry_agent.py worker [--concurrency N] [--exit-when-empty]
+
+配置了metrics.port时通过 http://127.0.0.1:<port>/metrics 提供Prometheus格式的监控指标，
+配置了metrics.file时定期写入指标文件。
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Optional, Dict, Any, TYPE_CHECKING
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.logger import setup_logger
+from config.settings import settings
+
+if TYPE_CHECKING:
+    from models.task_queue import TaskQueue
+
+logger = setup_logger()
+
+# 可重试的状态码：AI调用失败、数据库错误、其他运行时错误；参数错误(1)重试也不会成功。
+# 写入推荐记录与租约检查在同一事务中（见models/task_queue.check_leases），已写入记录的任务不再重试
+RETRYABLE_EXIT_CODES = (2, 3, 4)
+
+
+class Worker:
+    """队列worker"""
+    
+    def __init__(
+        self,
+        agent,
+        queue: 'TaskQueue',
+        concurrency: int = 4,
+        poll_interval: float = 2.0,
+        worker_id: Optional[str] = None
+    ):
+        """
+        Args:
+            agent: 执行任务的PoetryAgent实例
+            queue: 任务队列
+            concurrency: 同时执行的最大任务数
+            poll_interval: 队列为空时的轮询间隔（秒）
+            worker_id: worker标识（默认由主机名、进程号和随机串组成）
+        """
+        self.agent = agent
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._running: Dict[int, Dict[str, Any]] = {}
+        self._running_lock = threading.Lock()
+        self.processed = 0
+    
+    def stop(self):
+        """停止领取新任务，执行中的任务完成后退出"""
+        if not self._stop.is_set():
+            logger.info("worker正在停止，等待执行中的任务完成...")
+        self._stop.set()
+    
+    def run(self, exit_when_empty: bool = False) -> int:
+        """
+        运行worker，直到调用stop()或收到SIGINT/SIGTERM
+        
+        Args:
+            exit_when_empty: 队列中没有可领取的任务且没有执行中的任务时退出
+        
+        Returns:
+            状态码（0: 正常退出）
+        """
+        self._install_signal_handlers()
+        logger.info(f"worker {self.worker_id} 已启动，并发数 {self.concurrency}")
+        
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='worker-heartbeat', daemon=True)
+        heartbeat.start()
+        
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self._stop.is_set():
+                free = self.concurrency - len(in_flight)
+                tasks = []
+                if free > 0:
+                    try:
+                        tasks = self.queue.claim(self.worker_id, free)
+                    except Exception as e:
+                        logger.error(f"领取任务失败: {e}")
+                
+                for task in tasks:
+                    with self._running_lock:
+                        self._running[task['id']] = task
+                    in_flight.add(executor.submit(self._process, task))
+                
+                if not in_flight:
+                    if exit_when_empty:
+                        break
+                    self._stop.wait(self.poll_interval)
+                    continue
+                
+                # 有空闲并发时只短暂等待，以便尽快补充任务
+                timeout = self.poll_interval if len(in_flight) >= self.concurrency or not tasks else 0
+                _, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            wait(in_flight)
+        
+        self._stop.set()
+        heartbeat.join()
+        logger.info(f"worker {self.worker_id} 已退出，共处理 {self.processed} 个任务")
+        return 0
+    
+    def _process(self, task: Dict[str, Any]):
+        """执行单个任务并记录结果"""
+        task_id = task['id']
+        logger.info(f"开始执行任务 {task_id}（第 {task['attempts']} 次）")
+        start = time.monotonic()
+        
+        try:
+            # 上次执行已写入推荐记录、但未能标记完成（如worker在写入后崩溃）时，直接使用已有的记录
+            record_ids = self.queue.find_records(task_id) if task['attempts'] > 1 else []
+            if record_ids:
+                logger.info(f"任务 {task_id} 已有推荐记录 {record_ids}，不再重复执行")
+                outcome = {'exit_code': 0, 'record_ids': record_ids, 'error': None}
+            else:
+                outcome = self.agent.execute(
+                    positive_prompt=task['positive_prompt'],
+                    negative_prompt=task['negative_prompt'],
+                    image_path=task['image_path'],
+                    user_id=task['user_id'],
+                    context=task['context'],
+                    model=task['model_name'],
+                    count=task['count'] or 1,
+                    type=task['task_type'] or '推荐',
+                    task_id=task_id,
+                    lease_owner=self.worker_id,
+                    # 会重试的失败只记录在任务中，最后一次执行失败时才保存失败记录
+                    save_failure=task['attempts'] >= self.queue.max_attempts
+                )
+        except Exception as e:
+            logger.error(f"任务 {task_id} 执行异常: {e}", exc_info=True)
+            outcome = {'exit_code': 4, 'record_ids': [], 'error': f"执行失败: {e}"}
+        
+        execution_time = int((time.monotonic() - start) * 1000)
+        with self._running_lock:
+            self._running.pop(task_id, None)
+        
+        try:
+            if outcome['exit_code'] == 0:
+                if self.queue.complete(self.worker_id, task_id, outcome['record_ids'], execution_time):
+                    logger.info(f"任务 {task_id} 执行成功，耗时 {execution_time}ms")
+            else:
+                # 已写入推荐记录的任务（如流式输出中途失败）重试会重复写入
+                retry = outcome['exit_code'] in RETRYABLE_EXIT_CODES and not outcome['record_ids']
+                if self.queue.fail(
+                    self.worker_id,
+                    task_id,
+                    outcome['exit_code'],
+                    outcome['error'],
+                    execution_time,
+                    retry=retry
+                ):
+                    logger.warning(f"任务 {task_id} 执行失败: {outcome['error']}")
+        except Exception as e:
+            # 状态未能写入时租约会自然过期，任务将被重新领取（已写入的推荐记录不会重复写入）
+            logger.error(f"更新任务 {task_id} 状态失败: {e}")
+        
+        with self._running_lock:
+            self.processed += 1
+    
+    def _heartbeat_loop(self):
+        """定期为执行中的任务续约（间隔为租约时长的三分之一）"""
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            self._renew_leases()
+        # 停止后仍需为尚未完成的任务续约
+        while True:
+            with self._running_lock:
+                if not self._running:
+                    return
+            self._renew_leases()
+            time.sleep(min(interval, 1.0))
+    
+    def _renew_leases(self):
+        with self._running_lock:
+            task_ids = list(self._running)
+        if not task_ids:
+            return
+        try:
+            renewed = set(self.queue.heartbeat(self.worker_id, task_ids))
+        except Exception as e:
+            logger.warning(f"任务续约失败: {e}")
+            return
+        with self._running_lock:
+            # 续约期间已完成的任务不算丢失；丢失的任务不再续约
+            lost = [task_id for task_id in task_ids if task_id not in renewed and self._running.pop(task_id, None)]
+        if lost:
+            logger.warning(f"任务 {lost} 的租约已丢失，执行结果将被忽略")
+    
+    def _install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop())
+
+
+def main(argv=None) -> int:
+    """worker命令行入口"""
+    parser = argparse.ArgumentParser(
+        prog='poetry_agent.py worker',
+        description='AI诗词推荐Agent - 队列worker，从task_logs表中领取并执行任务'
+    )
+    parser.add_argument('-f', '--config', type=str, help='配置文件路径（可选）')
+    parser.add_argument('--concurrency', type=int, help='同时执行的最大任务数（可选，有默认值）')
+    parser.add_argument('--lease', type=int, help='任务租约时长，单位秒（可选，有默认值）')
+    parser.add_argument('--poll-interval', type=float, help='队列为空时的轮询间隔，单位秒（可选，有默认值）')
+    parser.add_argument('--worker-id', type=str, help='worker标识（可选，默认由主机名和进程号生成）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用推荐结果缓存（可选）')
+    parser.add_argument('--exit-when-empty', action='store_true', help='队列中没有任务时退出（可选）')
+    parser.add_argument('-v', '--verbose', action='store_true', help='详细输出模式（可选）')
+    args = parser.parse_args(argv)
+    
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    
+    from poetry_agent import PoetryAgent
+    from models.task_queue import TaskQueue
+    from utils.metrics import MetricsExporter
+    
+    settings.load(args.config)
+    agent = PoetryAgent(config_file=args.config, use_cache=False if args.no_cache else None)
+    queue = TaskQueue(
+        lease_seconds=args.lease or settings.worker_lease_seconds,
+        max_attempts=settings.worker_max_attempts
+    )
+    worker = Worker(
+        agent,
+        queue,
+        concurrency=args.concurrency or settings.worker_concurrency,
+        poll_interval=args.poll_interval or settings.worker_poll_interval,
+        worker_id=args.worker_id
+    )
+    # 配置了metrics.file或metrics.port时导出监控指标
+    with MetricsExporter(
+        path=settings.metrics_file,
+        port=settings.metrics_port,
+        host=settings.metrics_host,
+        interval=settings.metrics_interval
+    ):
+        return worker.run(exit_when_empty=args.exit_when_empty)
+
+
+if __name__ == '__main__':
+    sys.exit(main())